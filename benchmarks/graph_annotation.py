@@ -0,0 +1,108 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+"""Measures how the features-calculator annotation pass scales with the graph size, comparing
+the single-pass topological engine with the original BFS traversal.
+
+Usage: python -m benchmarks.graph_annotation [--sizes N [N ...]] [--legacy-max N]
+"""
+import argparse
+import time
+import torch
+import torch.nn as nn
+import torch.fx as fx
+from plinio.graph.annotation import add_node_properties, propagate_annotation, \
+    _features_calculator
+from plinio.graph.index import GraphIndex
+from plinio.graph.inspection import get_graph_inputs, all_output_nodes
+from plinio.graph.tracing import trace_and_annotate
+
+
+class DeepResidual(nn.Module):
+    """A stack of Conv1d-ReLU blocks, each closed by a residual add (3 graph nodes per block)"""
+    def __init__(self, n_blocks: int, ch: int = 4):
+        super().__init__()
+        self.convs = nn.ModuleList([nn.Conv1d(ch, ch, 1) for _ in range(n_blocks)])
+
+    def forward(self, x):
+        for conv in self.convs:
+            x = x + torch.relu(conv(x))
+        return x
+
+
+def legacy_propagate(g: fx.Graph, key: str, rule):
+    """The BFS traversal used by add_features_calculator before the topological engine"""
+    queue = get_graph_inputs(g)
+    visited = []
+    while queue:
+        n = queue.pop(0)
+        if n in visited:
+            continue
+        if any([key not in _.meta for _ in n.all_input_nodes]):
+            continue
+        value = rule(n)
+        if value is None:
+            continue
+        n.meta[key] = value
+        for succ in all_output_nodes(n):
+            queue.append(succ)
+        visited.append(n)
+
+
+def clear(g: fx.Graph, key: str):
+    for n in g.nodes:
+        n.meta.pop(key, None)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 2500, 5000, 10000])
+    parser.add_argument('--legacy-max', type=int, default=5000,
+                        help='largest graph on which the (quadratic) legacy pass is run')
+    args = parser.parse_args()
+    key = 'features_calculator'
+    for size in args.sizes:
+        net = DeepResidual(size // 3)
+        mod = trace_and_annotate(net, torch.empty(1, 4, 8, device='meta'), fx.Tracer,
+                                 [add_node_properties])
+
+        def rule(n):
+            return _features_calculator(n, mod, [])
+
+        n_nodes = len(mod.graph.nodes)
+        t = time.perf_counter()
+        index = GraphIndex(mod.graph)
+        t_index = time.perf_counter() - t
+        t = time.perf_counter()
+        propagate_annotation(mod.graph, key, rule, index)
+        t_new = time.perf_counter() - t
+        new = [type(n.meta.get(key)) for n in mod.graph.nodes]
+        line = (f"{n_nodes:6d} nodes: index {t_index * 1e3:8.2f} ms | "
+                f"topological {t_new * 1e3:8.2f} ms")
+        if n_nodes <= args.legacy_max:
+            clear(mod.graph, key)
+            t = time.perf_counter()
+            legacy_propagate(mod.graph, key, rule)
+            t_old = time.perf_counter() - t
+            assert new == [type(n.meta.get(key)) for n in mod.graph.nodes]
+            line += f" | legacy {t_old * 1e3:10.2f} ms | speedup {t_old / t_new:7.1f}x"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
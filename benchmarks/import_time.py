@@ -0,0 +1,73 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+"""Measures the time needed to import plinio and some of its entry points, each in a fresh
+interpreter, and lists which heavy optional dependencies each import loads.
+
+Usage: python -m benchmarks.import_time [--repeat N]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+STATEMENTS = [
+    'import torch',
+    'import plinio',
+    'import plinio.methods',
+    'import plinio.cost',
+    'from plinio.cost import params',
+    'from plinio.methods import PIT',
+    'from plinio.methods import MPS',
+    'from plinio.methods.mps.quant.backends.match import MATCHExporter',
+]
+
+HEAVY_MODULES = ['torch', 'numpy', 'onnx', 'networkx']
+
+_PROBE = """
+import json, sys, time
+t = time.perf_counter()
+exec({stmt!r})
+t = time.perf_counter() - t
+print(json.dumps([t, [m for m in {heavy!r} if m in sys.modules]]))
+"""
+
+
+def measure(stmt: str):
+    probe = _PROBE.format(stmt=stmt, heavy=HEAVY_MODULES)
+    out = subprocess.run([sys.executable, '-c', probe], check=True, capture_output=True,
+                         text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    for stmt in STATEMENTS:
+        times = []
+        for _ in range(args.repeat):
+            t, loaded = measure(stmt)
+            times.append(t)
+        print(f"{stmt:<70s} {statistics.median(times) * 1e3:8.1f} ms  loads: "
+              f"{', '.join(loaded) or '-'}")
+
+
+if __name__ == '__main__':
+    main()
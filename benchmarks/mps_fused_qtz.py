@@ -0,0 +1,112 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+"""Compares the memory saved for backward and the training step time of MPS models with the
+fused mixed-precision quantizers (`FusedMPSQtz`) and with the previous implementation, which
+stacks the per-precision quantized tensors before summing them.
+
+Usage: python -m benchmarks.mps_fused_qtz [--model {tc_resnet_14,dscnn}] [--batch-size N]
+       [--iters N]
+"""
+import argparse
+import time
+from contextlib import contextmanager
+from unittest import mock
+import torch
+from plinio.methods import MPS
+from plinio.methods.mps import get_default_qinfo
+from plinio.methods.mps.nn.qtz import MPSPerChannelQtz, MPSPerLayerQtz
+from unit_test.models import TCResNet14, DSCNN
+from .pit_sparse_conv import TC_RESNET_14_CONFIG
+
+INPUT_SHAPES = {'tc_resnet_14': (6, 50), 'dscnn': (1, 49, 10)}
+
+
+def stacked_forward(self, input: torch.Tensor) -> torch.Tensor:
+    """The non-fused forward of MPSPerChannelQtz and MPSPerLayerQtz"""
+    self.sample_alpha()
+    y = []
+    for i, quantizer in enumerate(self.qtz_funcs):
+        theta_alpha_i = self.theta_alpha[i]
+        if theta_alpha_i.dim() > 0:
+            theta_alpha_i = theta_alpha_i.view((-1,) + (1,) * len(input.shape[1:]))
+        y.append(theta_alpha_i * quantizer(input))
+    return torch.stack(y, dim=0).sum(dim=0)
+
+
+@contextmanager
+def stacked():
+    with mock.patch.object(MPSPerChannelQtz, 'forward', stacked_forward), \
+            mock.patch.object(MPSPerLayerQtz, 'forward', stacked_forward):
+        yield
+
+
+def saved_bytes(model: MPS, x: torch.Tensor) -> int:
+    """Total size of the (distinct) tensors saved by autograd in a forward pass"""
+    storages = {}
+
+    def pack(t: torch.Tensor) -> torch.Tensor:
+        s = t.untyped_storage()
+        storages[s.data_ptr()] = s.nbytes()
+        return t
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        loss = model(x).sum() + 1e-6 * model.cost
+    del loss
+    return sum(storages.values())
+
+
+def step_time(model: MPS, x: torch.Tensor, iters: int) -> float:
+    """Average time of a forward and backward pass"""
+    for i in range(iters + 2):
+        if i == 2:
+            start = time.perf_counter()
+        task_loss = model(x).sum()
+        loss = task_loss + 1e-6 * model.cost + model.single_path_loss(task_loss)
+        model.zero_grad()
+        loss.backward()
+    return (time.perf_counter() - start) / iters
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', choices=tuple(INPUT_SHAPES), default='tc_resnet_14')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--iters', type=int, default=10)
+    args = parser.parse_args()
+    print(f"{'precisions':>12} | {'stacked':>18} | {'fused':>18} | memory")
+    for prec in ((2, 4, 8), (0, 2, 4, 8)):
+        torch.manual_seed(0)
+        seed = TCResNet14(TC_RESNET_14_CONFIG) if args.model == 'tc_resnet_14' else DSCNN()
+        model = MPS(seed, input_shape=INPUT_SHAPES[args.model],
+                    qinfo=get_default_qinfo(w_precision=prec))
+        x = torch.rand((args.batch_size,) + INPUT_SHAPES[args.model])
+        results = []
+        for fused in (False, True):
+            if fused:
+                results.append((saved_bytes(model, x), step_time(model, x, args.iters)))
+            else:
+                with stacked():
+                    results.append((saved_bytes(model, x), step_time(model, x, args.iters)))
+        (m_s, t_s), (m_f, t_f) = results
+        print(f"{str(prec):>12} | {m_s / 2**20:>6.1f} MB {t_s * 1e3:>6.1f} ms | "
+              f"{m_f / 2**20:>6.1f} MB {t_f * 1e3:>6.1f} ms | {m_s / m_f:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+"""Compares the greedy NE16 precision reassignment of `optimize_prec_assignment()` with
+the multi-choice knapsack solver of `optimal_prec_assignment()`, using the cost of the
+greedy solution as budget, and reports some points of the cost/score Pareto curve.
+
+Usage: python -m benchmarks.mps_prec_assignment [--seed N]
+"""
+import argparse
+import contextlib
+import io
+import time
+from typing import List
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from plinio.cost import ne16_latency
+from plinio.methods import MPS
+from plinio.methods.mps import get_default_qinfo, MPSType
+from plinio.methods.mps.utils import optimize_prec_assignment, optimal_prec_assignment, \
+    prec_pareto_curve, _weight_quantizers
+
+
+def make_model(seed: int) -> MPS:
+    """Random MPS model, with only layers supported by the NE16 cost model"""
+    torch.manual_seed(seed)
+    net = nn.Sequential(
+        nn.Conv2d(3, 32, 3, padding=1), nn.BatchNorm2d(32), nn.ReLU(),
+        nn.Conv2d(32, 64, 3, padding=1, stride=2), nn.BatchNorm2d(64), nn.ReLU(),
+        nn.Conv2d(64, 64, 1), nn.BatchNorm2d(64), nn.ReLU(),
+        nn.Conv2d(64, 128, 3, padding=1, stride=2), nn.BatchNorm2d(128), nn.ReLU(),
+        nn.AdaptiveAvgPool2d(1), nn.Flatten(), nn.Linear(128, 10))
+    model = MPS(net, input_shape=(3, 32, 32), cost={'ne16': ne16_latency},
+                w_search_type=MPSType.PER_CHANNEL,
+                qinfo=get_default_qinfo(w_precision=(2, 4, 8), a_precision=(8,)))
+    for p in model.nas_parameters():
+        p.data.normal_()
+    return model
+
+
+def scores(model: MPS) -> List[torch.Tensor]:
+    return [F.log_softmax(q.alpha.detach() / q.temperature, dim=0)
+            for q in _weight_quantizers(model)[1]]
+
+
+def score(model: MPS, log_p: List[torch.Tensor]) -> float:
+    """Score of the (binary) weights precision assignment of the model"""
+    qtz = _weight_quantizers(model)[1]
+    return sum(float(lp.gather(0, q.alpha.argmax(dim=0, keepdim=True)).sum())
+               for q, lp in zip(qtz, log_p))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    greedy = make_model(args.seed)
+    log_p = scores(greedy)
+    greedy.update_softmax_options(hard=True)
+    greedy(greedy._dummy_input())
+    greedy_cost = float(greedy.get_cost('ne16').detach())
+    print(f"argmax   | cost {greedy_cost:>9.0f} | score {score(greedy, log_p):.2f}")
+    t = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        optimize_prec_assignment(greedy, 'ne16')
+    t = time.perf_counter() - t
+    budget = float(greedy.get_cost('ne16').detach())
+    print(f"greedy   | cost {budget:>9.0f} | score {score(greedy, log_p):.2f} | "
+          f"{t * 1e3:.0f} ms")
+    knapsack = make_model(args.seed)
+    t = time.perf_counter()
+    optimal_prec_assignment(knapsack, budget, 'ne16')
+    t = time.perf_counter() - t
+    print(f"knapsack | cost {float(knapsack.get_cost('ne16').detach()):>9.0f} | "
+          f"score {score(knapsack, log_p):.2f} | {t * 1e3:.0f} ms")
+    curve = prec_pareto_curve(make_model(args.seed), 'ne16')
+    print(f"Pareto curve: {len(curve)} points")
+    for k in torch.linspace(0, len(curve) - 1, 5).long().tolist():
+        print(f"  cost {curve.cost[k]:>9.0f} | score {curve.score[k]:.2f}")
+
+
+if __name__ == '__main__':
+    main()
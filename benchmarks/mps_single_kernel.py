@@ -0,0 +1,67 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+"""Compares the inference time of MPS models with per-channel weight precisions, exported
+as one layer per precision (`QuantList`), and as single layers with channels grouped by
+precision (`export(single_kernel=True)`).
+
+Usage: python -m benchmarks.mps_single_kernel [--iters N]
+"""
+import argparse
+import time
+import torch
+import torch.nn as nn
+from .mps_prec_assignment import make_model
+
+
+def inference_time(model: nn.Module, x: torch.Tensor, iters: int) -> float:
+    """Average inference time, in seconds"""
+    with torch.no_grad():
+        for _ in range(3):
+            model(x)
+        t = time.perf_counter()
+        for _ in range(iters):
+            model(x)
+    return (time.perf_counter() - t) / iters
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iters', type=int, default=100)
+    args = parser.parse_args()
+    model = make_model(0)
+    model.update_softmax_options(hard=True)
+    model.eval()
+    with torch.no_grad():
+        model(model._dummy_input())
+    quant_list = model.export().eval()
+    single = model.export(single_kernel=True).eval()
+    n_list = sum(isinstance(m, (nn.Conv2d, nn.Linear)) for m in quant_list.modules())
+    n_single = sum(isinstance(m, (nn.Conv2d, nn.Linear)) for m in single.modules())
+    print(f"kernels: {n_list} (QuantList) vs {n_single} (single kernel)")
+    print(f"{'batch':>5} | {'QuantList':>9} | {'single':>9} | speedup")
+    for batch_size in (1, 16, 128):
+        x = torch.rand((batch_size, 3, 32, 32))
+        t_l = inference_time(quant_list, x, args.iters)
+        t_s = inference_time(single, x, args.iters)
+        print(f"{batch_size:>5} | {t_l * 1e3:>6.2f} ms | {t_s * 1e3:>6.2f} ms | "
+              f"{t_l / t_s:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
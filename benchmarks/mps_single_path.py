@@ -0,0 +1,57 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+"""Compares the training step time of MPS models with the default (SoftMax) sampling of the
+precisions, which runs all quantizers, and with single-path sampling, which only runs the
+sampled one.
+
+Usage: python -m benchmarks.mps_single_path [--model {tc_resnet_14,dscnn}] [--batch-size N]
+       [--iters N]
+"""
+import argparse
+import torch
+from plinio.methods import MPS
+from plinio.methods.mps import get_default_qinfo
+from unit_test.models import TCResNet14, DSCNN
+from .pit_sparse_conv import TC_RESNET_14_CONFIG
+from .mps_fused_qtz import INPUT_SHAPES, step_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', choices=tuple(INPUT_SHAPES), default='tc_resnet_14')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--iters', type=int, default=10)
+    args = parser.parse_args()
+    print(f"{'precisions':>12} | {'softmax':>9} | {'single-path':>11} | speedup")
+    for prec in ((2, 4, 8), (0, 2, 4, 8)):
+        torch.manual_seed(0)
+        seed = TCResNet14(TC_RESNET_14_CONFIG) if args.model == 'tc_resnet_14' else DSCNN()
+        model = MPS(seed, input_shape=INPUT_SHAPES[args.model],
+                    qinfo=get_default_qinfo(w_precision=prec))
+        x = torch.rand((args.batch_size,) + INPUT_SHAPES[args.model])
+        times = []
+        for single_path in (False, True):
+            model.update_softmax_options(single_path=single_path)
+            times.append(step_time(model, x, args.iters))
+        print(f"{str(prec):>12} | {times[0] * 1e3:>6.1f} ms | {times[1] * 1e3:>8.1f} ms | "
+              f"{times[0] / times[1]:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
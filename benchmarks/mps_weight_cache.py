@@ -0,0 +1,61 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+"""Compares the training step time of MPS models in the architecture-only phase
+(`train_nas_only()`), with and without the cache of the quantized weights of the MPS
+quantizers.
+
+Usage: python -m benchmarks.mps_weight_cache [--model {tc_resnet_14,dscnn}] [--iters N]
+"""
+import argparse
+from unittest import mock
+import torch
+from plinio.methods import MPS
+from plinio.methods.mps import get_default_qinfo
+from plinio.methods.mps.nn.qtz import MPSBaseQtz
+from unit_test.models import TCResNet14, DSCNN
+from .pit_sparse_conv import TC_RESNET_14_CONFIG
+from .mps_fused_qtz import INPUT_SHAPES, step_time
+
+
+def uncached_quantize(self, i: int, input: torch.Tensor) -> torch.Tensor:
+    return self.qtz_funcs[i](input)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', choices=tuple(INPUT_SHAPES), default='tc_resnet_14')
+    parser.add_argument('--iters', type=int, default=30)
+    args = parser.parse_args()
+    torch.manual_seed(0)
+    seed = TCResNet14(TC_RESNET_14_CONFIG) if args.model == 'tc_resnet_14' else DSCNN()
+    model = MPS(seed, input_shape=INPUT_SHAPES[args.model],
+                qinfo=get_default_qinfo(w_precision=(0, 2, 4, 8)))
+    model.train_nas_only()
+    print(f"{'batch':>5} | {'uncached':>9} | {'cached':>9} | speedup")
+    for batch_size in (1, 8, 64):
+        x = torch.rand((batch_size,) + INPUT_SHAPES[args.model])
+        with mock.patch.object(MPSBaseQtz, '_quantize', uncached_quantize):
+            t_u = step_time(model, x, args.iters)
+        t_c = step_time(model, x, args.iters)
+        print(f"{batch_size:>5} | {t_u * 1e3:>6.1f} ms | {t_c * 1e3:>6.1f} ms | "
+              f"{t_u / t_c:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+"""Compares the batched PIT cost engine with the original per-layer cost loop.
+
+Usage: python -m benchmarks.pit_cost [--layers N] [--iters N]
+"""
+import argparse
+import timeit
+import torch
+import torch.nn as nn
+from plinio.methods import PIT
+from plinio.methods.pit.nn.module import PITModule
+from plinio.cost import params, ops, gap8_latency
+from plinio.graph.inspection import shapes_dict
+
+
+class DeepCNN(nn.Module):
+    """A plain stack of Conv2d-BN-ReLU blocks with a linear classifier"""
+    def __init__(self, n_layers: int, ch: int = 32):
+        super().__init__()
+        layers = [nn.Conv2d(3, ch, 3, padding=1)]
+        for i in range(n_layers - 1):
+            k = 3 if i % 2 == 0 else 1
+            layers += [nn.BatchNorm2d(ch), nn.ReLU(), nn.Conv2d(ch, ch, k, padding=k // 2)]
+        self.features = nn.Sequential(*layers)
+        self.pool = nn.AdaptiveAvgPool2d(1)
+        self.fc = nn.Linear(ch, 10)
+
+    def forward(self, x):
+        return self.fc(torch.flatten(self.pool(self.features(x)), 1))
+
+
+def loop_cost(model: PIT, name: str) -> torch.Tensor:
+    """The per-layer cost loop used by PIT before the batched engine"""
+    cost_spec = model.cost_specification[name]
+    cost_fn_map = model._cost_fn_map[name]
+    cost = torch.tensor(0, dtype=torch.float32)
+    target_list = model._unique_leaf_modules if cost_spec.shared else model._leaf_modules
+    for lname, node, layer in target_list:
+        if isinstance(layer, PITModule):
+            v = layer.get_modified_vars()
+            v.update(shapes_dict(node))
+            cost = cost + cost_fn_map[lname](v)
+        elif model.full_cost:
+            v = dict(vars(layer))
+            v.update(shapes_dict(node))
+            cost = cost + cost_fn_map[lname](v)
+    return cost
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--layers', type=int, default=300)
+    parser.add_argument('--iters', type=int, default=50)
+    args = parser.parse_args()
+    net = DeepCNN(args.layers)
+    model = PIT(net, input_shape=(3, 16, 16),
+                cost={'params': params, 'ops': ops, 'gap8': gap8_latency}, full_cost=True)
+    for name in ('params', 'ops', 'gap8'):
+        ref = loop_cost(model, name)
+        res = model.get_cost(name)
+        assert torch.allclose(ref, res, rtol=1e-5), f"Mismatch on {name}: {ref} vs {res}"
+        t_loop = timeit.timeit(lambda: loop_cost(model, name), number=args.iters) / args.iters
+        t_eng = timeit.timeit(lambda: model.get_cost(name), number=args.iters) / args.iters
+        print(f"{name:>7s}: loop {t_loop * 1e3:8.3f} ms | batched {t_eng * 1e3:8.3f} ms | "
+              f"speedup {t_loop / t_eng:5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+"""Measures the training step time and size of a PIT model before and after physically
+removing the masked channels and timesteps with a PITShrinker.
+
+Usage: python -m benchmarks.pit_shrinking [--layers N] [--pruned F] [--iters N]
+"""
+import argparse
+import time
+import torch
+import torch.nn as nn
+from plinio.methods import PIT
+from plinio.methods.pit import PITShrinker
+
+
+class DeepTCN(nn.Module):
+    """A stack of Conv1d-BN-ReLU blocks with a linear classifier"""
+    def __init__(self, n_layers: int, ch: int = 64, k: int = 9):
+        super().__init__()
+        layers = [nn.Conv1d(8, ch, k, padding='same')]
+        for _ in range(n_layers - 1):
+            layers += [nn.BatchNorm1d(ch), nn.ReLU(), nn.Conv1d(ch, ch, k, padding='same')]
+        self.features = nn.Sequential(*layers)
+        self.pool = nn.AdaptiveAvgPool1d(1)
+        self.fc = nn.Linear(ch, 10)
+
+    def forward(self, x):
+        return self.fc(torch.flatten(self.pool(self.features(x)), 1))
+
+
+def step_time(model: PIT, optimizer: torch.optim.Optimizer, x: torch.Tensor,
+              iters: int) -> float:
+    """Average time of a training step (forward, backward and update)"""
+    for i in range(iters + 2):
+        if i == 2:
+            start = time.perf_counter()
+        loss = model(x).sum() + 1e-6 * model.cost
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+    return (time.perf_counter() - start) / iters
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--layers', type=int, default=8)
+    parser.add_argument('--pruned', type=float, default=0.5,
+                        help='fraction of channels (and of receptive field) to mask')
+    parser.add_argument('--iters', type=int, default=20)
+    args = parser.parse_args()
+    torch.manual_seed(0)
+    model = PIT(DeepTCN(args.layers), input_shape=(8, 128))
+    x = torch.rand(32, 8, 128)
+    # mask the requested fraction of channels and of the oldest timesteps in each layer
+    with torch.no_grad():
+        for name, p in model.named_nas_parameters():
+            if 'alpha' in name:
+                p[:int(p.numel() * args.pruned)] = 0.
+            elif 'beta' in name:
+                p[:int(p.numel() * args.pruned)] = 0.
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-5)
+    n_before = sum(p.numel() for p in model.parameters())
+    t_before = step_time(model, optimizer, x, args.iters)
+    model.eval()
+    with torch.no_grad():
+        ref = model(x)
+    shrinker = PITShrinker(model, patience=1)
+    shrinker.step(optimizer)
+    with torch.no_grad():
+        err = (model(x) - ref).abs().max().item()
+    model.train()
+    n_after = sum(p.numel() for p in model.parameters())
+    t_after = step_time(model, optimizer, x, args.iters)
+    print(f"params: {n_before} -> {n_after} | step: {t_before * 1e3:.2f} ms -> "
+          f"{t_after * 1e3:.2f} ms ({t_before / t_after:.2f}x) | max output diff {err:.2e}")
+
+
+if __name__ == '__main__':
+    main()
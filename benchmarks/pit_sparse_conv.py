@@ -0,0 +1,98 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+"""Compares the training step time of PIT models with the dense (multiply-by-mask) and the
+sparse (compute only the active channels) forward paths of convolutional layers, for
+different fractions of active channels. On the small tc_resnet_14 and dscnn models, the
+step time on CPU is dominated by per-layer overheads, and the sparse path only pays off when
+the masks are frozen; deep_tcn (see `benchmarks.pit_shrinking`) shows the effect on larger
+layers.
+
+Usage: python -m benchmarks.pit_sparse_conv [--model {tc_resnet_14,dscnn,deep_tcn}]
+       [--batch-size N] [--iters N]
+"""
+import argparse
+import time
+import torch
+from plinio.methods import PIT
+from unit_test.models import TCResNet14, DSCNN
+from .pit_shrinking import DeepTCN
+
+TC_RESNET_14_CONFIG = {
+    'input_channels': 6, 'output_size': 12, 'num_channels': [24, 36, 36, 48, 48, 72, 72],
+    'kernel_size': 9, 'dropout': 0.5, 'grad_clip': -1, 'use_bias': True, 'use_dilation': True,
+    'avg_pool': True,
+}
+
+
+INPUT_SHAPES = {'tc_resnet_14': (6, 50), 'dscnn': (1, 49, 10), 'deep_tcn': (8, 256)}
+
+
+def build(name: str) -> PIT:
+    if name == 'tc_resnet_14':
+        seed = TCResNet14(TC_RESNET_14_CONFIG)
+    elif name == 'dscnn':
+        seed = DSCNN()
+    else:
+        seed = DeepTCN(8, ch=128)
+    return PIT(seed, input_shape=INPUT_SHAPES[name])
+
+
+def step_time(model: PIT, x: torch.Tensor, iters: int) -> float:
+    """Average time of a forward and backward pass"""
+    for i in range(iters + 2):
+        if i == 2:
+            start = time.perf_counter()
+        loss = model(x).sum() + 1e-6 * model.cost
+        model.zero_grad()
+        loss.backward()
+    return (time.perf_counter() - start) / iters
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', choices=tuple(INPUT_SHAPES), default='tc_resnet_14')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--iters', type=int, default=20)
+    args = parser.parse_args()
+    torch.manual_seed(0)
+    model = build(args.model)
+    x = torch.rand((args.batch_size,) + INPUT_SHAPES[args.model])
+    print(f"{'active':>6} | {'phase':>8} | {'dense':>9} | {'sparse':>9} | speedup")
+    for density in (1.0, 0.75, 0.5, 0.25, 0.1):
+        # keep the requested fraction of channels in each layer
+        with torch.no_grad():
+            for name, p in model.named_nas_parameters():
+                if 'alpha' in name:
+                    p.fill_(1.)
+                    p[:p.numel() - max(1, round(p.numel() * density))] = 0.
+        for phase in ('search', 'net_only'):
+            if phase == 'search':
+                model.train_net_and_nas()
+            else:
+                model.train_net_only()
+            times = []
+            for threshold in (0., 1.):
+                model.sparse_threshold = threshold
+                times.append(step_time(model, x, args.iters))
+            print(f"{density:>6.2f} | {phase:>8} | {times[0] * 1e3:>6.2f} ms | "
+                  f"{times[1] * 1e3:>6.2f} ms | {times[0] / times[1]:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -16,20 +16,51 @@
 # *                                                                            *
 # * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
 # *----------------------------------------------------------------------------*
-from .cost_spec import CostFn, CostSpec, PatternSpec
-from .params import params
-from .params_no_bias import params_no_bias
-from .params_bit import params_bit
-from .ops import ops
-from .ops_no_bias import ops_no_bias
-from .ops_bit import ops_bit
-from .diana_latency import diana_latency
-from .gap8_latency import gap8_latency
-from .mpic_latency import mpic_latency
-from .mpic_energy import mpic_energy
-from .ne16_latency import ne16_latency
+from typing import TYPE_CHECKING
+from plinio.lazy import make_lazy
+
+if TYPE_CHECKING:
+    from .cost_spec import CostFn, CostSpec, PatternSpec
+    from .params import params
+    from .params_no_bias import params_no_bias
+    from .params_bit import params_bit
+    from .ops import ops
+    from .ops_no_bias import ops_no_bias
+    from .ops_bit import ops_bit
+    from .diana_latency import diana_latency
+    from .gap8_latency import gap8_latency, gap8_tiled_latency
+    from .mpic_latency import mpic_latency
+    from .mpic_energy import mpic_energy
+    from .ne16_latency import ne16_latency
+    from .host_latency import host_latency
+    from .peak_memory import PeakMemorySpec, peak_memory
+
+# cost models are imported on first access, so that using one of them does not require
+# loading all the others (and their dependencies)
+make_lazy(__name__, {
+    'CostFn': '.cost_spec',
+    'CostSpec': '.cost_spec',
+    'PatternSpec': '.cost_spec',
+    'params': '.params',
+    'params_no_bias': '.params_no_bias',
+    'params_bit': '.params_bit',
+    'ops': '.ops',
+    'ops_no_bias': '.ops_no_bias',
+    'ops_bit': '.ops_bit',
+    'diana_latency': '.diana_latency',
+    'gap8_latency': '.gap8_latency',
+    'gap8_tiled_latency': '.gap8_latency',
+    'mpic_latency': '.mpic_latency',
+    'mpic_energy': '.mpic_energy',
+    'ne16_latency': '.ne16_latency',
+    'host_latency': '.host_latency',
+    'PeakMemorySpec': '.peak_memory',
+    'peak_memory': '.peak_memory',
+})
 
 __all__ = ['CostFn', 'CostSpec', 'PatternSpec',
            'params', 'params_no_bias', 'params_bit',
            'ops', 'ops_no_bias', 'ops_bit', 'diana_latency', 'gap8_latency',
-           'mpic_latency', 'mpic_energy', 'ne16_latency']
+           'gap8_tiled_latency',
+           'mpic_latency', 'mpic_energy', 'ne16_latency', 'host_latency',
+           'PeakMemorySpec', 'peak_memory']
@@ -0,0 +1,293 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import itertools
+import torch
+from .cost_spec import CostFn, cost_spec_zero_fn
+from .pattern import PatternSpec
+
+# PatternSpec entries that are stacked along a new "layers" axis when a cost function is
+# evaluated on a group of layers at once. All other entries are taken from the first layer of
+# the group, and must therefore be identical for all its members (see `_group_signature`)
+BATCHED_KEYS = ('in_channels', 'out_channels', 'in_features', 'out_features', 'num_features',
+                'kernel_size', 'output_shape', 'groups')
+
+# a function returning the PatternSpec entries that change during a search (e.g. the effective
+# number of output channels of a NAS-able layer). None for layers whose cost is constant
+DynamicVarsFn = Optional[Callable[[], Dict[str, Any]]]
+
+# a single layer to be evaluated by the engine: (cost function, static spec, dynamic vars fn)
+CostEntry = Tuple[CostFn, PatternSpec, DynamicVarsFn]
+
+
+def _is_static_value(v: Any) -> bool:
+    """True for plain Python values on which a cost function could branch"""
+    if isinstance(v, (bool, int, float, str, type(None))):
+        return True
+    if isinstance(v, tuple):
+        return all(_is_static_value(e) for e in v)
+    return False
+
+
+def _group_signature(cost_fn: CostFn, spec: PatternSpec, dyn: Dict[str, Any]) -> Tuple:
+    """Hashable key that identifies layers that can be evaluated with a single batched call"""
+    sig = []
+    for k, v in spec.items():
+        if k in dyn:
+            continue
+        if k in BATCHED_KEYS:
+            # batched tuples (e.g. kernel_size) must have the same length within a group
+            sig.append((k, len(v) if isinstance(v, (tuple, list)) else -1))
+        elif k == '_parameters':
+            # cost models check the presence of biases with `is not None`
+            sig.append((k, tuple((n, p is None) for n, p in v.items())))
+        elif _is_static_value(v):
+            sig.append((k, v))
+    for k, v in dyn.items():
+        sig.append(('dyn_' + k, len(v) if isinstance(v, (tuple, list)) else
+                    (None if v is None else -1)))
+    return (cost_fn, tuple(sorted(sig, key=lambda x: x[0])))
+
+
+def _stack(values: Sequence[Any]) -> Any:
+    """Stacks a list of per-layer spec values (scalars, tensors or tuples) into tensors"""
+    first = values[0]
+    if first is None:
+        return None
+    if isinstance(first, (tuple, list)):
+        return tuple(_stack([v[i] for v in values]) for i in range(len(first)))
+    return torch.stack([torch.as_tensor(v, dtype=torch.float32) for v in values])
+
+
+def _to(value: Any, device: torch.device) -> Any:
+    """Moves a (possibly nested) stacked spec value to a device"""
+    if value is None:
+        return None
+    if isinstance(value, tuple):
+        return tuple(_to(v, device) for v in value)
+    return value.to(device)
+
+
+class _CostGroup:
+    """A set of layers sharing the same cost function and the same non-batched spec entries.
+
+    :param cost_fn: the cost function shared by all layers in the group
+    :type cost_fn: CostFn
+    :param specs: the static spec of each layer
+    :type specs: List[PatternSpec]
+    :param dynamic_fns: the dynamic vars function of each layer (all None or all not None)
+    :type dynamic_fns: List[DynamicVarsFn]
+    """
+    def __init__(self, cost_fn: CostFn, specs: List[PatternSpec],
+                 dynamic_fns: List[DynamicVarsFn]):
+        self.cost_fn = cost_fn
+        self.specs = specs
+        self.dynamic_fns = dynamic_fns
+        self.batched = True
+        dyn = dynamic_fns[0]() if dynamic_fns[0] is not None else {}
+        self.dynamic_keys = tuple(dyn.keys())
+        self.base = dict(specs[0])
+        self._static = {}
+        for k in BATCHED_KEYS:
+            if k in self.base and k not in dyn:
+                self._static[k] = _stack([s[k] for s in specs])
+        self._static_device = torch.device('cpu')
+
+    def _static_on(self, device: torch.device) -> Dict[str, Any]:
+        if device != self._static_device:
+            self._static = {k: _to(v, device) for k, v in self._static.items()}
+            self._static_device = device
+        return self._static
+
+    def _eval_batched(self) -> torch.Tensor:
+        spec = dict(self.base)
+        dyn_values = [f() for f in self.dynamic_fns] if self.dynamic_keys else []
+        for k in self.dynamic_keys:
+            spec[k] = _stack([d[k] for d in dyn_values])
+        device = self._device(dyn_values)
+        spec.update(self._static_on(device))
+        cost = torch.as_tensor(self.cost_fn(spec), dtype=torch.float32, device=device)
+        # cost functions that do not depend on batched entries return a scalar
+        return torch.broadcast_to(cost, (len(self.specs),)).sum()
+
+    def _eval_loop(self) -> torch.Tensor:
+        cost = torch.tensor(0, dtype=torch.float32)
+        for spec, dyn_fn in zip(self.specs, self.dynamic_fns):
+            if dyn_fn is not None:
+                spec = dict(spec)
+                spec.update(dyn_fn())
+            cost = cost + self.cost_fn(spec)
+        return cost
+
+    @staticmethod
+    def _device(dyn_values: List[Dict[str, Any]]) -> torch.device:
+        for d in dyn_values:
+            for v in d.values():
+                if isinstance(v, torch.Tensor):
+                    return v.device
+        return torch.device('cpu')
+
+    def verify(self):
+        """Checks that the batched evaluation matches the per-layer one, and falls back to the
+        latter if it does not (e.g., for cost functions with Python-level branches on the
+        batched entries)"""
+        with torch.no_grad():
+            ref = self._eval_loop()
+            try:
+                res = self._eval_batched()
+                self.batched = bool(torch.allclose(res.cpu(), torch.as_tensor(ref).float().cpu(),
+                                                   rtol=1e-5))
+            except Exception:
+                self.batched = False
+
+    def __call__(self) -> torch.Tensor:
+        if self.batched:
+            return self._eval_batched()
+        return self._eval_loop()
+
+
+class BatchedCostEngine:
+    """Evaluates a cost function on a whole network with one batched call per group of
+    similar layers, rather than with one scalar call per layer.
+
+    Layers are grouped by cost function and by the value of all spec entries that are not
+    batched (e.g. presence of bias, stride). Batched entries (channels, kernel sizes, output
+    shapes) are stacked into tensors once at construction time, except for those returned by
+    each layer's dynamic vars function, which are re-collected at every evaluation. Groups
+    whose cost function cannot be evaluated in batched form transparently fall back to a
+    per-layer loop. The cost of layers without a dynamic vars function is constant, and it is
+    therefore computed only once, at construction time.
+
+    :param entries: the list of (cost function, static spec, dynamic vars function) tuples
+    :type entries: List[CostEntry]
+    """
+    def __init__(self, entries: List[CostEntry]):
+        groups: Dict[Tuple, Tuple[List[PatternSpec], List[DynamicVarsFn]]] = {}
+        for cost_fn, spec, dyn_fn in entries:
+            if cost_fn is cost_spec_zero_fn:
+                continue
+            dyn = dyn_fn() if dyn_fn is not None else {}
+            key = _group_signature(cost_fn, spec, dyn)
+            if key not in groups:
+                groups[key] = ([], [])
+            groups[key][0].append(spec)
+            groups[key][1].append(dyn_fn)
+        self.groups = []
+        self.constant = torch.tensor(0, dtype=torch.float32)
+        for k, (s, d) in groups.items():
+            g = _CostGroup(k[0], s, d)
+            g.verify()
+            if any(f is not None for f in d):
+                self.groups.append(g)
+            else:
+                with torch.no_grad():
+                    self.constant = self.constant + g().cpu()
+
+    def __call__(self) -> torch.Tensor:
+        """Computes the total cost of all layers
+
+        :return: a scalar tensor with the cost value
+        :rtype: torch.Tensor
+        """
+        cost = self.constant
+        for g in self.groups:
+            cost = cost + g()
+        return cost
+
+
+class PrecisionGridCost:
+    """Evaluates a cost function on a whole grid of precision assignments (e.g., all
+    combinations of input and weight bit-widths of a mixed-precision layer) with a single
+    broadcasted call.
+
+    Grid entries are passed as tensors that broadcast to the grid shape (e.g., input
+    precisions with shape (N_in, 1) and weight precisions with shape (1, N_w)). Scalar cost
+    functions that do not support broadcasting (e.g., because they branch on the precision
+    value) are transparently evaluated with a per-cell loop. Whether a cost function
+    supports broadcasting is checked against the loop on its first call, and memoized.
+    The same first call also raises a ValueError if the cost is undefined (NaN) for some
+    grid point, e.g. an unsupported precision pair, which cost functions cannot detect on
+    device-resident grids without a host-device sync.
+    """
+    def __init__(self):
+        self._broadcastable: Dict[CostFn, bool] = {}
+
+    @staticmethod
+    def _eval_broadcast(cost_fn: CostFn, spec: PatternSpec,
+                        grid: Dict[str, torch.Tensor], shape: torch.Size) -> torch.Tensor:
+        v = dict(spec)
+        v.update(grid)
+        return torch.broadcast_to(torch.as_tensor(cost_fn(v)), shape)
+
+    @staticmethod
+    def _eval_loop(cost_fn: CostFn, spec: PatternSpec,
+                   grid: Dict[str, torch.Tensor], shape: torch.Size) -> torch.Tensor:
+        full = {k: torch.broadcast_to(g, shape) for k, g in grid.items()}
+        costs = []
+        for idx in itertools.product(*[range(s) for s in shape]):
+            v = dict(spec)
+            for k, g in full.items():
+                v[k] = g[idx]
+            costs.append(torch.as_tensor(cost_fn(v), dtype=torch.float32))
+        return torch.stack(costs).reshape(shape)
+
+    @staticmethod
+    def _check_defined(cost: torch.Tensor, grid: Dict[str, torch.Tensor],
+                       shape: torch.Size):
+        nan = torch.isnan(cost)
+        if not bool(torch.any(nan)):
+            return
+        idx = tuple(torch.nonzero(nan)[0].tolist())
+        point = ', '.join(f'{k}={torch.broadcast_to(g, shape)[idx].item():g}'
+                          for k, g in grid.items())
+        raise ValueError(f'Cost undefined (NaN) for {point}')
+
+    def __call__(self, cost_fn: CostFn, spec: PatternSpec,
+                 grid: Dict[str, torch.Tensor]) -> torch.Tensor:
+        """Computes the cost for each point of the grid
+
+        :param cost_fn: the (scalar) cost function
+        :type cost_fn: CostFn
+        :param spec: the grid-independent part of the layer spec
+        :type spec: PatternSpec
+        :param grid: the grid-dependent spec entries, as mutually broadcastable tensors
+        :type grid: Dict[str, torch.Tensor]
+        :return: a tensor with the cost of each grid point
+        :rtype: torch.Tensor
+        """
+        shape = torch.broadcast_shapes(*[g.shape for g in grid.values()])
+        broadcastable = self._broadcastable.get(cost_fn)
+        if broadcastable is False:
+            return self._eval_loop(cost_fn, spec, grid, shape)
+        try:
+            cost = self._eval_broadcast(cost_fn, spec, grid, shape)
+        except Exception:
+            cost = None
+        if broadcastable is None:
+            ref = self._eval_loop(cost_fn, spec, grid, shape)
+            self._check_defined(ref, grid, shape)
+            broadcastable = cost is not None and bool(torch.allclose(
+                cost.detach().float(), ref.detach().to(cost.device), rtol=1e-5))
+            self._broadcastable[cost_fn] = broadcastable
+            if not broadcastable:
+                return ref
+        elif cost is None:
+            # should never happen after a successful check, but the loop is always safe
+            return self._eval_loop(cost_fn, spec, grid, shape)
+        return cost
@@ -16,14 +16,20 @@
 # *                                                                            *
 # * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
 # *----------------------------------------------------------------------------*
-from typing import Callable, Tuple
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple, cast
 from collections import UserDict
+import weakref
 import torch
-from .pattern import Constraint, Pattern, PatternSpec
+import torch.fx as fx
+from .pattern import Constraint, FusedPattern, Pattern, PatternSpec
+from .fusion import FusedMatches, KindFn, match_fused_patterns
 
 
 CostFn = Callable[[PatternSpec], torch.Tensor]
 
+# FusedMatches, with nodes replaced by their names
+_NamedMatches = Dict[str, Tuple[Callable, List[str]]]
+
 
 def cost_spec_zero_fn(_):
     return torch.tensor(0.0)
@@ -33,6 +39,55 @@ def cost_spec_fail_fn(x):
     raise KeyError(f"Cannot find cost model for pattern {x}")
 
 
+class _RecordingSpec(dict):
+    """A PatternSpec copy that records which entries are read by constraint functions"""
+    def __init__(self, spec: PatternSpec):
+        super(_RecordingSpec, self).__init__(spec)
+        self.accessed: Set[str] = set()
+
+    def __getitem__(self, key: str) -> Any:
+        self.accessed.add(key)
+        return super(_RecordingSpec, self).__getitem__(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        self.accessed.add(key)
+        return super(_RecordingSpec, self).get(key, default)
+
+    def __contains__(self, key: object) -> bool:
+        self.accessed.add(cast(str, key))
+        return super(_RecordingSpec, self).__contains__(key)
+
+    # constraints that iterate on the spec are conservatively assumed to read all entries
+    def __iter__(self):
+        self.accessed.update(super(_RecordingSpec, self).keys())
+        return super(_RecordingSpec, self).__iter__()
+
+    def keys(self):
+        self.accessed.update(super(_RecordingSpec, self).keys())
+        return super(_RecordingSpec, self).keys()
+
+    def values(self):
+        self.accessed.update(super(_RecordingSpec, self).keys())
+        return super(_RecordingSpec, self).values()
+
+    def items(self):
+        self.accessed.update(super(_RecordingSpec, self).keys())
+        return super(_RecordingSpec, self).items()
+
+
+def _is_hashable_value(v: Any) -> bool:
+    """True for plain Python values that can be safely used as cache keys"""
+    if isinstance(v, (bool, int, float, str, type, type(None))):
+        return True
+    if isinstance(v, tuple):
+        return all(_is_hashable_value(e) for e in v)
+    return False
+
+
+# placeholder for PatternSpec entries read by a constraint but missing in another spec
+_MISSING = object()
+
+
 class CostSpec(UserDict):
     """Class to wrap a PLiNIO Cost Specification
 
@@ -43,16 +98,38 @@ class CostSpec(UserDict):
             - shared: True if the cost of a layer should be evaluated once for the whole NN
             (e.g. Params), False if the cost model should be evaluated once for each time the
             layer is invoked during a forward pass (e.g. MACs)
+            - features_granularity: the number of features (channels) by which the cost of a
+            layer changes on the target hardware (e.g. the number of channels processed in
+            parallel), used by NAS tools to only explore channel counts that differ by
+            multiples of this value. Defaults to 1
+
+    Pattern resolution (i.e., finding the cost function associated to a given layer) is
+    memoized, using as key the pattern and the values of the spec entries that are actually
+    read by the constraint functions registered for that pattern.
+
+    Patterns can also be chains of layers executed as a single fused kernel
+    (`FusedPattern`), whose cost replaces the sum of the per-layer costs. Fused patterns are
+    matched on the traced graph with `match()`, giving priority to the longest ones.
 
     Documentation TBD!
     """
     def __init__(
             self,
             shared: bool = True,
-            default_behavior: str = 'zero'
+            default_behavior: str = 'zero',
+            features_granularity: int = 1
     ):
+        # {pattern: names of the spec entries read by the constraints of that pattern}
+        self._constraint_keys: Dict[Pattern, Set[str]] = {}
+        # {(pattern, signature): cost_fn}
+        self._resolution_cache: Dict[Tuple[Pattern, Hashable], CostFn] = {}
+        # {graph: {node kinds: fused pattern matches, by node name}}. Node names rather than
+        # nodes are stored, since nodes reference their graph, which would never be collected
+        self._match_cache: 'weakref.WeakKeyDictionary[fx.Graph, Dict[Hashable, _NamedMatches]]' \
+            = weakref.WeakKeyDictionary()
         super(CostSpec, self).__init__()
         self.shared = shared
+        self.features_granularity = features_granularity
         if default_behavior == 'zero':
             self.default = cost_spec_zero_fn
         elif default_behavior == 'fail':
@@ -67,19 +144,126 @@ class CostSpec(UserDict):
         if key[0] not in self.data:
             self.data[key[0]] = []
         self.data[key[0]].append((key[1], cost_fn))
+        self.invalidate_cache()
 
-    def __getitem__(self, key: Tuple[Pattern, PatternSpec]):
-        """Finds the most accurate cost function for a given pattern + spec"""
+    def __delitem__(self, key: Pattern):
+        """Removes all cost functions associated to a pattern"""
+        super(CostSpec, self).__delitem__(key)
+        self.invalidate_cache()
+
+    def invalidate_cache(self):
+        """Drops all memoized pattern resolutions. Called automatically when entries are
+        added or removed, must be called explicitly after manually editing `self.data`"""
+        self._constraint_keys = {}
+        self._resolution_cache = {}
+        self._match_cache = weakref.WeakKeyDictionary()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # memoized results are not serialized (and weak references cannot be)
+        state = dict(self.__dict__)
+        for k in ('_constraint_keys', '_resolution_cache', '_match_cache'):
+            state.pop(k, None)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self.invalidate_cache()
+
+    def _signature(self, pattern: Pattern, spec: PatternSpec) -> Optional[Hashable]:
+        """Hashable signature of the entries of `spec` read by the constraints registered for
+        `pattern`, or None if the spec cannot be memoized"""
+        if not isinstance(spec, dict):
+            return None
+        sig = []
+        for k in sorted(self._constraint_keys.get(pattern, ())):
+            v = spec.get(k, _MISSING)
+            if v is not _MISSING and not _is_hashable_value(v):
+                return None
+            sig.append((k, v))
+        return tuple(sig)
+
+    def _resolve(self, pattern: Pattern, spec: PatternSpec) -> CostFn:
+        """Finds the most accurate cost function for a given pattern + spec (not memoized)"""
         best_match = self.default
         best_constr = None
-        if key[0] in self.data:
-            for constr, cost_fn in self.data[key[0]]:
-                if constr is None or constr(key[1]):
-                    if best_constr is None:
-                        best_match = cost_fn
-                        best_constr = constr
-                    else:
-                        # fail if we have two incompatible models, e.g., one for 3x3 convs
-                        # and one for DWConvs, and we are processing a DW3x3Conv.
-                        raise KeyError("Found two conflicting cost models! Terminating")
+        for constr, cost_fn in self.data[pattern]:
+            if constr is None or constr(spec):
+                if best_constr is None:
+                    best_match = cost_fn
+                    best_constr = constr
+                else:
+                    # fail if we have two incompatible models, e.g., one for 3x3 convs
+                    # and one for DWConvs, and we are processing a DW3x3Conv.
+                    raise KeyError("Found two conflicting cost models! Terminating")
         return best_match
+
+    def __getitem__(self, key: Tuple[Pattern, PatternSpec]):
+        """Finds the most accurate cost function for a given pattern + spec"""
+        pattern, spec = key
+        if pattern not in self.data:
+            return self.default
+        sig = self._signature(pattern, spec)
+        if sig is not None and (pattern, sig) in self._resolution_cache:
+            return self._resolution_cache[(pattern, sig)]
+        if not isinstance(spec, dict):
+            return self._resolve(pattern, spec)
+        rec = _RecordingSpec(spec)
+        cost_fn = self._resolve(pattern, rec)
+        keys = self._constraint_keys.setdefault(pattern, set())
+        if not rec.accessed.issubset(keys):
+            # signatures computed on the old set of keys are no longer valid
+            keys.update(rec.accessed)
+            self._resolution_cache = {k: v for k, v in self._resolution_cache.items()
+                                      if k[0] != pattern}
+        sig = self._signature(pattern, spec)
+        if sig is not None:
+            self._resolution_cache[(pattern, sig)] = cost_fn
+        return cost_fn
+
+    def resolve_all(self, layers: Iterable[Tuple[Pattern, PatternSpec]]) -> List[CostFn]:
+        """Finds the most accurate cost function for each of a list of pattern + spec pairs
+
+        :param layers: the (pattern, spec) pairs to be resolved
+        :type layers: Iterable[Tuple[Pattern, PatternSpec]]
+        :return: the list of cost functions, in the same order as `layers`
+        :rtype: List[CostFn]
+        """
+        return [self[key] for key in layers]
+
+    @property
+    def fused_patterns(self) -> List[FusedPattern]:
+        """Returns the fused (multi-layer) patterns included in the specification"""
+        return [p for p in self.data.keys() if isinstance(p, FusedPattern)]
+
+    def match(self, graph: fx.Graph, kind_fn: KindFn,
+              spec_fn: Callable[[fx.Node], PatternSpec]) -> FusedMatches:
+        """Finds the chains of nodes of a graph that match one of the fused patterns of the
+        specification, with longest-match priority. Results are cached for each graph and set
+        of node kinds, until the specification is changed
+
+        :param graph: the target graph
+        :type graph: fx.Graph
+        :param kind_fn: the function returning the kind (e.g. original layer type) of a node
+        :type kind_fn: KindFn
+        :param spec_fn: the function returning the spec of the first node of a chain, used
+        to check the pattern constraints
+        :type spec_fn: Callable[[fx.Node], PatternSpec]
+        :return: the cost function and the list of nodes of each match, indexed by the first
+        node of the chain
+        :rtype: FusedMatches
+        """
+        # different NAS methods may assign different kinds to the nodes of the same graph
+        kinds = tuple((n.name, kind_fn(n)) for n in graph.nodes)
+        graph_cache = self._match_cache.setdefault(graph, {})
+        cached = graph_cache.get(kinds)
+        if cached is None:
+            def resolve(pattern: FusedPattern, n: fx.Node) -> Optional[CostFn]:
+                cost_fn = self[(pattern, spec_fn(n))]
+                return None if cost_fn is self.default else cost_fn
+            matches = match_fused_patterns(graph, self.fused_patterns, kind_fn, resolve)
+            graph_cache[kinds] = {a.name: (cost_fn, [n.name for n in chain])
+                                  for a, (cost_fn, chain) in matches.items()}
+            return matches
+        nodes = {n.name: n for n in graph.nodes}
+        return {nodes[a]: (cost_fn, [nodes[n] for n in chain])
+                for a, (cost_fn, chain) in cached.items()}
@@ -16,11 +16,14 @@
 # *                                                                            *
 # * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
 # *----------------------------------------------------------------------------*
-import math
 import torch
 
 from . import CostSpec
 from .pattern import Conv2dGeneric, LinearGeneric
+from .utils import DeviceTable, is_host_value
+
+# candidate ox unrolling factors of the analog accelerator, in increasing order
+_OX_UNROLL = DeviceTable([1, 2, 4, 8], dtype=torch.long)
 
 
 class ComputeOxUnrollSTE(torch.autograd.Function):
@@ -28,14 +31,15 @@ class ComputeOxUnrollSTE(torch.autograd.Function):
     @staticmethod
     def forward(ctx, ch_eff, ch_in, k_x, k_y):
         device = ch_eff.device
-        ox_unroll_list = [1, 2, 4, 8]
-        ox_unroll = torch.as_tensor(ox_unroll_list, device=device)
-        ch_in_unroll = max(64, ch_in)
-        mask_out = ox_unroll * ch_eff <= 512
-        mask_in = (ox_unroll + k_x - 1) * ch_in_unroll * k_y <= 1152
+        ox_unroll = _OX_UNROLL.on(device)
+        ch_in_unroll = torch.clamp(torch.as_tensor(ch_in, device=device), min=64)
+        mask_out = ox_unroll * ch_eff.unsqueeze(-1) <= 512
+        mask_in = (ox_unroll + k_x - 1) * ch_in_unroll.unsqueeze(-1) * k_y <= 1152
         mask = torch.logical_and(mask_out, mask_in)
-        mask[0] = True
-        return ox_unroll[mask][-1]
+        mask[..., 0] = True
+        # the largest allowed unrolling, computed without boolean indexing (which would
+        # require a host-device sync)
+        return (ox_unroll * mask).amax(dim=-1)
 
     @staticmethod
     def backward(ctx, grad_output):
@@ -55,23 +59,24 @@ class FloorSTE(torch.autograd.Function):
 
 def _floor(ch, N):
     """Same function without the autograd wrapper"""
-    return math.floor((ch + N - 1) / N)
+    return (ch + N - 1) // N
 
 
 class GateSTE(torch.autograd.Function):
     """Torch autograd function that gates the number of channels of a layer based on a threshold"""
     @staticmethod
     def forward(ctx, ch, th):
-        ctx.save_for_backward(ch, torch.tensor(th))
+        ctx.save_for_backward(ch)
+        ctx.th = th
         return (ch >= th).float()
 
     @staticmethod
     def backward(ctx, grad_output):
-        ch, th = ctx.saved_tensors
+        ch, = ctx.saved_tensors
         grad = grad_output.clone()
         grad = 1 / (grad + 1)  # smooth step grad with log derivative
         grad.masked_fill_(ch.le(0), 0)
-        grad.masked_fill_(ch.ge(th.data), 0)
+        grad.masked_fill_(ch.ge(ctx.th), 0)
         return grad, None
 
 
@@ -122,12 +127,51 @@ def _diana_latency_conv2d_generic(spec):
     # but in the DNAS, the ternary quantizer is treated as a 2-bit one
     # also, the activations are actually on 7-bit, but we use 8-bit during the search, as
     # explained in the paper
-    if spec['w_precision'] == 2 and spec['a_precision'] == 8:
-        return _analog_cycles(spec)
-    elif spec['w_precision'] == 8 and spec['a_precision'] == 8:
-        return _digital_cycles(spec)
+    w_prec = spec['w_precision']
+    a_prec = spec['a_precision']
+    if _is_host_scalar(w_prec) and _is_host_scalar(a_prec):
+        if w_prec == 2 and a_prec == 8:
+            return _analog_cycles(spec)
+        elif w_prec == 8 and a_prec == 8:
+            return _digital_cycles(spec)
+        else:
+            raise ValueError(f'Unsupported weights/activations precision: {w_prec} / {a_prec}')
+    # device-resident precisions or grids of precisions: both accelerators are evaluated and
+    # the result is selected with masks, rather than by branching on the precision values
+    digital = _digital_cycles(spec)
+    is_analog = torch.logical_and(w_prec == 2, a_prec == 8)
+    is_digital = torch.logical_and(w_prec == 8, a_prec == 8)
+    if spec['groups'] != 1:
+        # the analog accelerator supports only groups=1
+        supported, cost = is_digital, digital
+        msg_suffix = f" with groups={spec['groups']}"
     else:
-        raise ValueError(f'Unsupported weights/activations precision: {spec["w_precision"]} / {spec["a_precision"]}')
+        supported = torch.logical_or(is_analog, is_digital)
+        cost = torch.where(is_analog, _analog_cycles(spec), digital)
+        msg_suffix = ''
+    if is_host_value(w_prec) and is_host_value(a_prec):
+        _check_precisions(w_prec, a_prec, supported, msg_suffix)
+    # unsupported device-resident precisions cannot be detected here without a host-device
+    # sync, so they get a NaN cost. MPS checks for NaNs once, the first time that the cost of
+    # each layer is evaluated on its grid of candidate precisions (see PrecisionGridCost)
+    return torch.where(supported, cost, torch.full_like(cost, float('nan')))
+
+
+def _is_host_scalar(value):
+    """True if a precision can be used in an if statement without a host-device sync"""
+    return is_host_value(value) and (not isinstance(value, torch.Tensor) or value.numel() == 1)
+
+
+def _check_precisions(w_prec, a_prec, supported, msg_suffix=''):
+    """Raises a ValueError naming the first unsupported weights/activations precision pair,
+    for host-resident grids of precisions"""
+    if bool(torch.all(supported)):
+        return
+    w_prec, a_prec, supported = torch.broadcast_tensors(
+        torch.as_tensor(w_prec), torch.as_tensor(a_prec), supported)
+    idx = tuple(torch.nonzero(~supported)[0].tolist())
+    raise ValueError('Unsupported weights/activations precision: '
+                     f'{w_prec[idx].item():g} / {a_prec[idx].item():g}{msg_suffix}')
 
 
 def _diana_latency_linear(spec):
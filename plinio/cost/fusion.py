@@ -0,0 +1,125 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import collections
+import torch.nn as nn
+import torch.fx as fx
+from .pattern import FusedPattern
+
+# returns the "kind" of a node, i.e. the (original) nn.Module type for call_module nodes, the
+# target function for call_function ones, and None for all other nodes
+KindFn = Callable[[fx.Node], Any]
+
+# returns the cost function of a fused pattern whose first layer is a given node, or None if
+# the pattern constraints are not satisfied
+ResolveFn = Callable[[FusedPattern, fx.Node], Optional[Callable]]
+
+# {first node of the chain: (cost function, all nodes of the chain)}
+FusedMatches = Dict[fx.Node, Tuple[Callable, List[fx.Node]]]
+
+# node kinds that do not correspond to an actual kernel at inference time (e.g. dropout) and
+# can be absorbed in a chain. NAS methods that insert additional modules in the graph, such as
+# MPS activation quantizers, should map them to one of these kinds
+TRANSPARENT_KINDS = (nn.Identity, nn.Dropout, nn.Dropout1d, nn.Dropout2d)
+
+
+def _is_transparent(kind: Any) -> bool:
+    return isinstance(kind, type) and kind in TRANSPARENT_KINDS
+
+
+def _kind_matches(element: Any, kind: Any) -> bool:
+    """Checks if a node kind matches a FusedPattern element"""
+    if isinstance(element, tuple):
+        return any(_kind_matches(e, kind) for e in element)
+    if isinstance(element, type):
+        return isinstance(kind, type) and issubclass(kind, element)
+    return kind is element
+
+
+def _match_chain(start: fx.Node, pattern: FusedPattern, kind_fn: KindFn,
+                 fusable: Callable[[fx.Node], bool]) -> Optional[List[fx.Node]]:
+    """Tries to match a fused pattern on the chain of nodes starting at `start`"""
+    if not fusable(start) or not _kind_matches(pattern[0], kind_fn(start)):
+        return None
+    nodes = [start]
+    n = start
+    for element in pattern[1:]:
+        while True:
+            # intermediate results must not be used outside of the fused kernel
+            if len(n.users) != 1:
+                return None
+            n = next(iter(n.users))
+            if not fusable(n):
+                return None
+            if _kind_matches(element, kind_fn(n)):
+                break
+            # absorbed nodes must not merge other tensors in the chain (e.g. a residual add)
+            if not _is_transparent(kind_fn(n)) or len(n.all_input_nodes) != 1:
+                return None
+            nodes.append(n)
+        nodes.append(n)
+    return nodes
+
+
+def match_fused_patterns(graph: fx.Graph, patterns: Iterable[FusedPattern],
+                         kind_fn: KindFn, resolve_fn: ResolveFn) -> FusedMatches:
+    """Finds non-overlapping chains of nodes matching a set of fused patterns.
+
+    Nodes are visited in topological order, and for each of them the longest matching
+    pattern (whose constraints are satisfied) is selected. Nodes that are part of a match
+    cannot be used in another one. Modules that are invoked more than once in the graph are
+    never fused, since their cost function is shared by all invocations.
+
+    :param graph: the target graph
+    :type graph: fx.Graph
+    :param patterns: the fused patterns to be matched
+    :type patterns: Iterable[FusedPattern]
+    :param kind_fn: the function returning the kind of each node
+    :type kind_fn: KindFn
+    :param resolve_fn: the function returning the cost function of a pattern match
+    :type resolve_fn: ResolveFn
+    :return: the matched chains, indexed by their first node
+    :rtype: FusedMatches
+    """
+    patterns = sorted(patterns, key=len, reverse=True)
+    invocations = collections.Counter(n.target for n in graph.nodes if n.op == 'call_module')
+    consumed = set()
+
+    def fusable(n: fx.Node) -> bool:
+        if n in consumed:
+            return False
+        if n.op == 'call_module':
+            return invocations[n.target] == 1
+        return n.op in ('call_function', 'call_method')
+
+    matches: FusedMatches = {}
+    for n in graph.nodes:
+        if n.op != 'call_module':
+            continue
+        for pattern in patterns:
+            chain = _match_chain(n, pattern, kind_fn, fusable)
+            if chain is None:
+                continue
+            cost_fn = resolve_fn(pattern, n)
+            if cost_fn is None:
+                continue
+            matches[n] = (cost_fn, chain)
+            consumed.update(chain)
+            break
+    return matches
@@ -16,7 +16,8 @@
 # *                                                                            *
 # * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
 # *----------------------------------------------------------------------------*
-import math
+from typing import Tuple
+import functools
 import torch
 
 from . import CostSpec
@@ -35,8 +36,9 @@ class FloorSTE(torch.autograd.Function):
         return grad_output, None
 
 def _floor(ch, N):
-    """Same function without the autograd wrapper"""
-    return math.floor((ch + N - 1) / N)
+    """Same function without the autograd wrapper. Written with an integer division so that it
+    also applies element-wise to (non-differentiable) tensors of sizes"""
+    return (ch + N - 1) // N
 
 def _gap8_latency_conv2d_generic(spec):
     """conv2d layers latency model for GAP8. Parallelization is on output width."""
@@ -68,7 +70,118 @@ def _gap8_latency_linear(spec):
     _latency = FloorSTE.apply(ch_in, 2) * FloorSTE.apply(ch_out, 4)
     return _latency
 
-gap8_latency = CostSpec(shared=True, default_behavior='zero')
+gap8_latency = CostSpec(shared=True, default_behavior='zero', features_granularity=4)
 gap8_latency[Conv2dGeneric] = _gap8_latency_conv2d_generic
 gap8_latency[Conv2dDW] = _gap8_latency_conv2d_dw
-gap8_latency[LinearGeneric] = _gap8_latency_linear
\ No newline at end of file
+gap8_latency[LinearGeneric] = _gap8_latency_linear
+
+
+# Tiling and DMA parameters for GAP8. Activations and weights are assumed to be 8-bit
+# L1 memory (bytes) available for the double-buffered tiles of a layer
+GAP8_L1_BUDGET = 48000
+# throughput of the cluster DMA (bytes per cycle)
+GAP8_DMA_BYTES_PER_CYCLE = 8
+# cycles spent to program and wait for the DMA transfers of a tile
+GAP8_DMA_SETUP_CYCLES = 100
+
+
+def _to_int(v) -> int:
+    """Converts a (possibly differentiable) size to a Python int. Requires a sync for device
+    tensors, but tile solutions only depend on the rounded sizes and are memoized"""
+    return max(1, int(round(float(torch.as_tensor(v).detach()))))
+
+
+@functools.lru_cache(maxsize=4096)
+def _gap8_solve_tiling(c_in: int, c_out: int, h_out: int, w_out: int, w_in: int,
+                       kh: int, kw: int, sh: int, dh: int, dw: bool) -> Tuple[int, int]:
+    """Finds the L1 tiling of a layer that minimizes the DMA cycles.
+
+    Layers are tiled along output channels (outer loop, in multiples of 4 to match the
+    compute kernels) and output rows (inner loop), assuming that weights are kept in L1 for
+    all the rows of a channel tile, and that input rows are re-loaded for each channel tile
+    (except for depthwise layers, which only need the corresponding input channels). All
+    buffers are double-buffered unless the whole layer fits in a single tile. If no tiling
+    fits in L1, the smallest one is returned.
+
+    :return: the number of output channels and of output rows of each tile
+    :rtype: Tuple[int, int]
+    """
+    c_cand = torch.arange(4, c_out + 4, 4).clamp(max=c_out).unique()
+    h_cand = torch.arange(1, h_out + 1)
+    c_t, h_t = torch.meshgrid(c_cand, h_cand, indexing='ij')
+    n_c = (c_out + c_t - 1) // c_t
+    n_h = (h_out + h_t - 1) // h_t
+    n_tiles = n_c * n_h
+    h_in_t = (h_t - 1) * sh + dh * (kh - 1) + 1
+    cin_t = c_t if dw else torch.full_like(c_t, c_in)
+    mem = (h_in_t * w_in * cin_t + c_t * (1 if dw else c_in) * kh * kw + c_t * h_t * w_out)
+    mem = torch.where(n_tiles > 1, 2 * mem, mem)
+    in_bytes = n_h * h_in_t * w_in * (c_out if dw else n_c * c_in)
+    cycles = (in_bytes.double() / GAP8_DMA_BYTES_PER_CYCLE +
+              n_tiles * GAP8_DMA_SETUP_CYCLES)
+    # unfeasible tilings are only selected if nothing fits, preferring the smallest
+    cycles = torch.where(mem <= GAP8_L1_BUDGET, cycles, float('inf'))
+    if bool(torch.isinf(cycles).all()):
+        return int(c_cand[0]), 1
+    best = int(torch.argmin(cycles))
+    return int(c_t.flatten()[best]), int(h_t.flatten()[best])
+
+
+def _gap8_tiled_latency(compute, c_in, c_out, h_out, w_out, w_in, kh, kw, sh, dh, dw):
+    """Combines the compute latency of a layer with the DMA cycles of its L1 tiling, assuming
+    that the transfers of each tile are overlapped with the computation of the previous
+    one. The tile sizes are constant, but the transferred bytes are differentiable
+    functions of the channels"""
+    c_t, h_t = _gap8_solve_tiling(_to_int(c_in), _to_int(c_out), int(h_out), int(w_out),
+                                  int(w_in), int(kh), int(kw), int(sh), int(dh), dw)
+    n_c = -(-_to_int(c_out) // c_t)
+    n_h = -(-int(h_out) // h_t)
+    n_tiles = n_c * n_h
+    h_in_t = (h_t - 1) * sh + dh * (kh - 1) + 1
+    in_bytes = n_h * h_in_t * w_in * (c_out if dw else n_c * c_in)
+    w_bytes = c_out * (1 if dw else c_in) * kh * kw
+    out_bytes = c_out * h_out * w_out
+    dma = (in_bytes + w_bytes + out_bytes) / GAP8_DMA_BYTES_PER_CYCLE + \
+        n_tiles * GAP8_DMA_SETUP_CYCLES
+    # the first tile transfer is never overlapped
+    overlapped = torch.as_tensor(dma * (n_tiles - 1) / n_tiles)
+    return torch.maximum(torch.as_tensor(compute), overlapped) + dma / n_tiles
+
+
+def _gap8_conv2d_tiling_args(spec):
+    _, _, h_out, w_out = spec['output_shape']
+    kh, kw = spec['kernel_size']
+    sh, sw = spec.get('stride', (1, 1))
+    dh, dw_ = spec.get('dilation', (1, 1))
+    w_in = (w_out - 1) * sw + dw_ * (kw - 1) + 1
+    return h_out, w_out, w_in, kh, kw, sh, dh
+
+
+def _gap8_tiled_latency_conv2d_generic(spec):
+    """conv2d layers latency model for GAP8, including L1 tiling DMA transfers"""
+    compute = _gap8_latency_conv2d_generic(spec)
+    h_out, w_out, w_in, kh, kw, sh, dh = _gap8_conv2d_tiling_args(spec)
+    return _gap8_tiled_latency(compute, spec['in_channels'], spec['out_channels'],
+                               h_out, w_out, w_in, kh, kw, sh, dh, False)
+
+
+def _gap8_tiled_latency_conv2d_dw(spec):
+    """conv2d depthwise layers latency model for GAP8, including L1 tiling DMA transfers"""
+    compute = _gap8_latency_conv2d_dw(spec)
+    h_out, w_out, w_in, kh, kw, sh, dh = _gap8_conv2d_tiling_args(spec)
+    return _gap8_tiled_latency(compute, spec['in_channels'], spec['out_channels'],
+                               h_out, w_out, w_in, kh, kw, sh, dh, True)
+
+
+def _gap8_tiled_latency_linear(spec):
+    """linear layers latency model for GAP8, including L1 tiling DMA transfers"""
+    compute = _gap8_latency_linear(spec)
+    return _gap8_tiled_latency(compute, spec['in_features'], spec['out_features'],
+                               1, 1, 1, 1, 1, 1, 1, False)
+
+
+gap8_tiled_latency = CostSpec(shared=False, default_behavior='zero',
+                              features_granularity=4)
+gap8_tiled_latency[Conv2dGeneric] = _gap8_tiled_latency_conv2d_generic
+gap8_tiled_latency[Conv2dDW] = _gap8_tiled_latency_conv2d_dw
+gap8_tiled_latency[LinearGeneric] = _gap8_tiled_latency_linear
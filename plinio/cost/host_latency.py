@@ -0,0 +1,245 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+from typing import Any, Callable, Dict, Optional, Tuple
+import json
+import os
+import platform
+import statistics
+import time
+import weakref
+import torch
+import torch.nn as nn
+
+from . import CostSpec
+from .pattern import Conv1dGeneric, Conv2dGeneric, LinearGeneric, PatternSpec
+
+# default location of the on-disk measurements cache
+DEFAULT_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'plinio',
+                                  'host_latency.json')
+
+
+def _benchmark(layer: nn.Module, x: torch.Tensor, num_threads: int,
+               warmup: int, repeats: int) -> float:
+    """Measures the median latency (in seconds) of a forward pass of `layer` on the host CPU"""
+    prev_threads = torch.get_num_threads()
+    torch.set_num_threads(num_threads)
+    try:
+        with torch.no_grad():
+            for _ in range(warmup):
+                layer(x)
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                layer(x)
+                times.append(time.perf_counter() - start)
+    finally:
+        torch.set_num_threads(prev_threads)
+    return statistics.median(times)
+
+
+def _to_int(v: Any) -> int:
+    """Reads a (possibly tensor) hyper-parameter as a Python int"""
+    return int(round(float(v)))
+
+
+def _bracket(c: Any, step: int) -> Tuple[int, int, Any]:
+    """Finds the two points of the channels grid {1, step, 2*step, ...} surrounding `c`,
+    and the (differentiable) interpolation weight of the upper one"""
+    lo = int(float(c) // step) * step
+    if lo < 1:
+        lo, hi = 1, max(step, 2)
+    else:
+        hi = lo + step
+    return lo, hi, (c - lo) / (hi - lo)
+
+
+def _cpu_id() -> str:
+    """Identifies the host CPU, so that cached measurements are not re-used on other machines"""
+    model = platform.processor()
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    model = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return f"{model or platform.machine()}|cores={os.cpu_count()}"
+
+
+def _write_cache(cache_file: Optional[str], data: Dict[str, float], new_keys: set):
+    """Adds the new measurements to the on-disk cache, merging them with the current file
+    content (which may have been updated by other processes)"""
+    if cache_file is None or not new_keys:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+    file_data = {}
+    if os.path.exists(cache_file):
+        with open(cache_file, 'r') as f:
+            file_data = json.load(f)
+    file_data.update({k: data[k] for k in new_keys})
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(file_data, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, cache_file)
+    new_keys.clear()
+
+
+class _HostLatencyTable:
+    """Lazily measured, on-disk cached table of layer latencies on the host CPU. New
+    measurements are written to disk all at once, when the table is deleted or at exit"""
+    def __init__(self, cache_file: Optional[str], num_threads: int, warmup: int, repeats: int):
+        self.cache_file = cache_file
+        self.num_threads = num_threads
+        self.warmup = warmup
+        self.repeats = repeats
+        self.cpu = _cpu_id()
+        self.data: Dict[str, float] = {}
+        self._new_keys = set()
+        if cache_file is not None and os.path.exists(cache_file):
+            with open(cache_file, 'r') as f:
+                self.data = json.load(f)
+        # runs when the table is garbage collected or at interpreter exit
+        self._finalizer = weakref.finalize(self, _write_cache, cache_file, self.data,
+                                           self._new_keys)
+
+    def get(self, key: str, builder: Callable[[], Tuple[nn.Module, torch.Tensor]]) -> float:
+        """Returns the latency of the layer identified by `key`, measuring it (on the layer and
+        input generated by `builder`) if not found in the cache"""
+        key = f"{key}|cpu={self.cpu}|threads={self.num_threads}"
+        if key not in self.data:
+            layer, x = builder()
+            self.data[key] = _benchmark(layer, x, self.num_threads, self.warmup, self.repeats)
+            self._new_keys.add(key)
+        return self.data[key]
+
+
+def _interpolate(lat: Callable[[int, int], float], c_in: Any, c_out: Any, step: int) -> Any:
+    """Bilinear interpolation of the measured latencies over input and output channels"""
+    in_lo, in_hi, t_in = _bracket(c_in, step)
+    out_lo, out_hi, t_out = _bracket(c_out, step)
+    return ((1 - t_in) * (1 - t_out) * lat(in_lo, out_lo) +
+            t_in * (1 - t_out) * lat(in_hi, out_lo) +
+            (1 - t_in) * t_out * lat(in_lo, out_hi) +
+            t_in * t_out * lat(in_hi, out_hi))
+
+
+def _interpolate_1d(lat: Callable[[int], float], c: Any, step: int) -> Any:
+    """Linear interpolation of the measured latencies over channels (for depthwise convs)"""
+    lo, hi, t = _bracket(c, step)
+    return (1 - t) * lat(lo) + t * lat(hi)
+
+
+def _conv_cost_fn(table: _HostLatencyTable, conv_type: type, channel_step: int):
+    """Creates the cost function for a 1D or 2D convolution"""
+    def _cost(spec: PatternSpec):
+        n_dims = 1 if conv_type is nn.Conv1d else 2
+        k = tuple(_to_int(ki) for ki in spec['kernel_size'])
+        stride = tuple(spec['stride'])
+        # None for NAS-able layers in which the "current" dilation is unknown
+        dilation = tuple(spec['dilation']) if spec['dilation'] is not None else (1,) * n_dims
+        groups = spec['groups']
+        bias = spec['_parameters'].get('bias') is not None
+        out_shape = tuple(_to_int(s) for s in spec['output_shape'])
+        # equivalent unpadded input size, which gives the same output size and MACs
+        in_size = tuple((o - 1) * s + d * (ki - 1) + 1
+                        for o, s, d, ki in zip(out_shape[2:], stride, dilation, k))
+        c_in, c_out = float(spec['in_channels']), float(spec['out_channels'])
+        # NAS-able depthwise layers may have less (effective) channels than groups
+        depthwise = groups > 1 and c_in == c_out and c_out <= groups
+
+        def lat(c_in, c_out, g):
+            key = (f"{conv_type.__name__}|cin={c_in}|cout={c_out}|k={k}|s={stride}|"
+                   f"d={dilation}|g={g}|bias={bias}|in={(out_shape[0],) + in_size}")
+
+            def builder():
+                layer = conv_type(c_in, c_out, k, stride=stride, dilation=dilation,
+                                  groups=g, bias=bias)
+                return layer, torch.rand((out_shape[0], c_in) + in_size)
+            return table.get(key, builder)
+
+        if depthwise:
+            # the number of channels changes together with the number of groups
+            return _interpolate_1d(lambda c: lat(c, c, c), spec['out_channels'], channel_step)
+        if groups > 1:
+            # other grouped convolutions are measured as they are (not differentiable)
+            return lat(_to_int(c_in), _to_int(c_out), groups)
+        return _interpolate(lambda ci, co: lat(ci, co, 1), spec['in_channels'],
+                            spec['out_channels'], channel_step)
+    return _cost
+
+
+def _linear_cost_fn(table: _HostLatencyTable, channel_step: int):
+    """Creates the cost function for a linear layer"""
+    def _cost(spec: PatternSpec):
+        bias = spec['_parameters'].get('bias') is not None
+        batch_shape = tuple(_to_int(s) for s in spec['output_shape'][:-1])
+
+        def lat(c_in, c_out):
+            key = f"Linear|cin={c_in}|cout={c_out}|bias={bias}|batch={batch_shape}"
+
+            def builder():
+                layer = nn.Linear(c_in, c_out, bias=bias)
+                return layer, torch.rand(batch_shape + (c_in,))
+            return table.get(key, builder)
+
+        return _interpolate(lat, spec['in_features'], spec['out_features'], channel_step)
+    return _cost
+
+
+def host_latency(cache_file: Optional[str] = DEFAULT_CACHE_FILE,
+                 num_threads: Optional[int] = None,
+                 channel_step: int = 8,
+                 warmup: int = 5,
+                 repeats: int = 20) -> CostSpec:
+    """Creates a CostSpec that models the latency (in seconds) of each layer on the host CPU,
+    based on actual measurements.
+
+    Each layer configuration (type, shape and number of channels) is micro-benchmarked the
+    first time that it is seen, and the result is stored in an on-disk cache, keyed by shape,
+    host CPU and number of threads. New measurements are written to the cache all at once,
+    when the cost specification is deleted or at exit. Latencies are measured only on a grid
+    of channel counts (multiples of `channel_step`) and bilinearly interpolated in between, so
+    that the cost is differentiable with respect to the number of input and output channels,
+    as required by PIT and SuperNet. Other hyper-parameters (e.g., kernel sizes) are rounded.
+
+    Note that, since measurements are taken on the host, the cost functions read the current
+    number of channels as Python values.
+
+    :param cache_file: the path of the measurements cache (None for an in-memory cache)
+    :type cache_file: Optional[str]
+    :param num_threads: the number of CPU threads used for the measurements (default: the
+    current number of torch threads)
+    :type num_threads: Optional[int]
+    :param channel_step: the spacing of the channels grid
+    :type channel_step: int
+    :param warmup: the number of warmup runs before each measurement
+    :type warmup: int
+    :param repeats: the number of timed runs for each measurement (the median is used)
+    :type repeats: int
+    :return: the host latency cost specification
+    :rtype: CostSpec
+    """
+    num_threads = num_threads if num_threads is not None else torch.get_num_threads()
+    table = _HostLatencyTable(cache_file, num_threads, warmup, repeats)
+    cs = CostSpec(shared=False, default_behavior='zero')
+    cs[Conv1dGeneric] = _conv_cost_fn(table, nn.Conv1d, channel_step)
+    cs[Conv2dGeneric] = _conv_cost_fn(table, nn.Conv2d, channel_step)
+    cs[LinearGeneric] = _linear_cost_fn(table, channel_step)
+    return cs
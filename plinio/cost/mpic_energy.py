@@ -24,6 +24,10 @@ from .mpic_latency import _mpic_latency_conv1d_generic, _mpic_latency_conv2d_gen
 from .pattern import Conv1dGeneric, Conv2dGeneric, LinearGeneric, \
         Conv1dDW, Conv2dDW
 
+# computed once, rather than at each cost evaluation
+_FREQUENCY = 250 * 1e+6
+_MEAN_POWER = float(torch.tensor([5.30, 5.39, 5.46, 5.38]).mean()) * 1e-3
+
 
 def _energy_from_cycles_mpic(cycles):
     """Compute the energy consumption according to the MPIC model.
@@ -36,9 +40,6 @@ def _energy_from_cycles_mpic(cycles):
     ------
     - energy consumption in J"""
 
-    _FREQUENCY = 250 * 1e+6
-    _MEAN_POWER = torch.tensor([5.30, 5.39, 5.46, 5.38]).mean() * 1e-3
-
     return (cycles / _FREQUENCY) * _MEAN_POWER
 
 
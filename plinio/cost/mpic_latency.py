@@ -16,11 +16,23 @@
 # *                                                                            *
 # * Author:  Beatrice Alessandra Motetti <beatrice.motetti@polito.it>          *
 # *----------------------------------------------------------------------------*
+import torch
+
 from . import CostSpec
 from .ops import _ops_conv1d_generic, _ops_conv2d_generic, _ops_conv1d_dw, \
         _ops_conv2d_dw, _ops_linear_generic
 from .pattern import Conv1dGeneric, Conv2dGeneric, LinearGeneric, \
         Conv1dDW, Conv2dDW
+from .utils import DeviceTable, device_of, is_host_value
+
+
+# rows: activation precisions, columns: weight precisions
+_MPIC_A_BITS = DeviceTable([2, 4, 8])
+_MPIC_W_BITS = DeviceTable([0, 2, 4, 8])
+_MPIC_LUT = DeviceTable([
+    [0., 1/6.5, 1/4.0, 1/2.2],
+    [0., 1/3.9, 1/3.5, 1/2.1],
+    [0., 1/2.5, 1/2.3, 1/2.1]])
 
 
 def _mpic_lut(a_bit, w_bit):
@@ -29,31 +41,37 @@ def _mpic_lut(a_bit, w_bit):
     Reference: "A Mixed-Precision RISC-V Processor for Extreme-Edge DNN Inference",
     Ottavi et al. (https://arxiv.org/pdf/2010.04073.pdf)
 
+    The LUT is indexed with one-hot masks rather than with Python values, so that precisions
+    can be (broadcastable) tensors on any device, without host-device syncs.
+
     Parameters
     ----------
-    - a_bit [`int`]: input activation precision
-    - w_bit [`int`]: weight precision
+    - a_bit [`int` or `torch.Tensor`]: input activation precision
+    - w_bit [`int` or `torch.Tensor`]: weight precision
 
     Output
     ------
-    - `float`: number of cycles/MAC"""
-
-    assert (a_bit in [2,4,8]) and (w_bit in [0,2,4,8]), \
-        "MPIC model defined only for activation precisions {2,4,8} and weight precisions {0,2,4,8}"
-
-    _MPIC_LUT = {
-    2: {0: 0., 2: 1/6.5, 4: 1/4.0, 8: 1/2.2},
-    4: {0: 0., 2: 1/3.9, 4: 1/3.5, 8: 1/2.1},
-    8: {0: 0., 2: 1/2.5, 4: 1/2.3, 8: 1/2.1}}
-
-    return _MPIC_LUT[a_bit][w_bit]
+    - `torch.Tensor`: number of cycles/MAC"""
+
+    device = device_of(a_bit, w_bit)
+    a_bit = torch.as_tensor(a_bit, dtype=torch.float32, device=device)
+    w_bit = torch.as_tensor(w_bit, dtype=torch.float32, device=device)
+    a_onehot = (a_bit.unsqueeze(-1) == _MPIC_A_BITS.on(device)).float()
+    w_onehot = (w_bit.unsqueeze(-1) == _MPIC_W_BITS.on(device)).float()
+    # validity can only be checked without a sync for host values
+    if is_host_value(a_bit) and is_host_value(w_bit):
+        assert bool(a_onehot.sum(-1).all()) and bool(w_onehot.sum(-1).all()), \
+            "MPIC model defined only for activation precisions {2,4,8} and weight " \
+            "precisions {0,2,4,8}"
+    lut = _MPIC_LUT.on(device)
+    return (a_onehot.unsqueeze(-1) * lut * w_onehot.unsqueeze(-2)).sum(dim=(-2, -1))
 
 
 def _mpic_latency_conv1d_generic(spec):
     w_prec = spec['w_precision']
     in_prec = spec['in_precision']
     macs = _ops_conv1d_generic(spec)
-    cost = macs * _mpic_lut(in_prec.item(), w_prec.item())
+    cost = macs * _mpic_lut(in_prec, w_prec)
     return cost
 
 
@@ -61,7 +79,7 @@ def _mpic_latency_conv2d_generic(spec):
     w_prec = spec['w_precision']
     in_prec = spec['in_precision']
     macs = _ops_conv2d_generic(spec)
-    cost = macs * _mpic_lut(in_prec.item(), w_prec.item())
+    cost = macs * _mpic_lut(in_prec, w_prec)
     return cost
 
 
@@ -73,7 +91,7 @@ def _mpic_latency_conv1d_dw(spec):
     # The correct thing is using cout, but this is leaking information from the NAS
     # internals to the cost model. So this should be probably fixed (TODO)
     macs = _ops_conv1d_dw(spec)
-    cost = macs * _mpic_lut(in_prec.item(), w_prec.item())
+    cost = macs * _mpic_lut(in_prec, w_prec)
     return cost
 
 
@@ -85,7 +103,7 @@ def _mpic_latency_conv2d_dw(spec):
     # The correct thing is using cout, but this is leaking information from the NAS
     # internals to the cost model. So this should be probably fixed (TODO)
     macs = _ops_conv2d_dw(spec)
-    cost = macs * _mpic_lut(in_prec.item(), w_prec.item())
+    cost = macs * _mpic_lut(in_prec, w_prec)
     return cost
 
 
@@ -96,7 +114,7 @@ def _mpic_latency_linear(spec):
     # in_format = spec['in_format']
     # assert w_format == int and in_format == int, "Model only supports integer quantization"
     macs = _ops_linear_generic(spec)
-    cost =  macs * _mpic_lut(in_prec.item(), w_prec.item())
+    cost = macs * _mpic_lut(in_prec, w_prec)
     return cost
 
 
@@ -17,10 +17,12 @@
 # * Author:  Beatrice Alessandra Motetti <beatrice.motetti@polito.it>          *
 # *----------------------------------------------------------------------------*
 from numpy import prod
+import functools
 import torch
 
 from . import CostSpec
 from .pattern import Conv2dGeneric, LinearGeneric, Conv2dDW
+from .utils import is_host_value
 
 
 class FloorDivideSTE(torch.autograd.Function):
@@ -69,24 +71,111 @@ def Ne16PerfModel_generalized(name, ks, depthwise, weights_bitwidth, layer):
     - `float`: total latency
     - `float`: total number of operations
     - `float`: ratio between operations and latency"""
+    total_latency, total_ops = ne16_latency_batched(ks, depthwise, weights_bitwidth, layer)
+    return total_latency, total_ops, total_ops/total_latency
+
 
+# Constants of the default Ne16PerfModel configuration (no subtiling, no normquant shift and
+# bias, 32-bit normquant scale, 8-bit activations)
+_NE16_IN_K = 16   # INPUT_BUFFER_SHAPE[2]
+_NE16_OUT_HW = (3, 3)                  # OUTPUT_BUFFER_SHAPE[:2]
+_NE16_OUT_K = 32                       # OUTPUT_BUFFER_SHAPE[2]
+_NE16_FIFO_LATENCY = 6
+_NE16_UPDATE_IDX_LATENCY = 2
+# (3 + Ho_buf * Wo_buf * ceil(K_out_buf * 8 / 256) + 1)
+_NE16_STREAMOUT_LATENCY = 13
+# 1x1: (10 + Ho_buf * Wo_buf * ceil(K_in_buf * 8 / 256)), else: (6 + Hi_buf * Wi_buf * ...)
+_NE16_LOAD_LATENCY_1X1 = 19
+_NE16_LOAD_LATENCY = 31
+
+
+def _is_hashable_int(v):
+    return isinstance(v, int) and not isinstance(v, bool)
+
+
+@functools.lru_cache(maxsize=4096)
+def _ne16_shape_terms_cached(h_out, w_out, k_in):
+    return _ne16_shape_terms_impl(h_out, w_out, k_in)
+
+
+def _ne16_shape_terms_impl(h_out, w_out, k_in):
+    n_in = DivAndCeilSTE.apply(k_in, _NE16_IN_K)
+    n_spatial = (DivAndCeilSTE.apply(h_out, _NE16_OUT_HW[0]) *
+                 DivAndCeilSTE.apply(w_out, _NE16_OUT_HW[1]))
+    return n_in, n_spatial
+
+
+def _ne16_shape_terms(h_out, w_out, k_in):
+    """Number of input channel tiles and of spatial tiles of a layer. Only depend on the layer
+    shape, and are therefore memoized for Python int shapes"""
+    if _is_hashable_int(h_out) and _is_hashable_int(w_out) and _is_hashable_int(k_in):
+        return _ne16_shape_terms_cached(h_out, w_out, k_in)
+    return _ne16_shape_terms_impl(h_out, w_out, k_in)
+
+
+def _ne16_normquant_latency(k):
+    # nq_scale only, with nq_bits=32: 9 + ceil(k * 4 / 4)
+    return 9 + DivAndCeilSTE.apply(k * 4, 4)
+
+
+def _ne16_kernel_latency(layer, w_bits, is_1x1, is_dw):
+    """Latency of a layer executed with a single NE16 kernel type (same as
+    `Ne16PerfModel.latency`), computed with (broadcastable) tensor arithmetic"""
+    h_out, w_out, k_out, k_in = layer
+    k_out_body = _NE16_IN_K if is_dw else _NE16_OUT_K
+    n_out_body = FloorDivideSTE.apply(k_out, k_out_body)
+    k_out_rem = ModuloSTE.apply(k_out, k_out_body)
+    # the remainder iteration is masked out when not needed, rather than skipped with an
+    # if, which would require a sync for device tensors
+    has_rem = k_out_rem != 0
+    n_in, n_spatial = _ne16_shape_terms(h_out, w_out, k_in)
+    load = _NE16_LOAD_LATENCY_1X1 if is_1x1 else _NE16_LOAD_LATENCY
+
+    def iteration_latency(k):
+        matrixvec = _NE16_FIFO_LATENCY + (k if is_1x1 else k * w_bits)
+        tail = _ne16_normquant_latency(k) + _NE16_STREAMOUT_LATENCY
+        if is_dw:
+            weight_offset = _NE16_FIFO_LATENCY + k
+            return load + weight_offset + matrixvec + _NE16_UPDATE_IDX_LATENCY + tail
+        return (n_in * (load + _NE16_FIFO_LATENCY + matrixvec + _NE16_UPDATE_IDX_LATENCY) +
+                tail)
+
+    return n_spatial * (n_out_body * iteration_latency(k_out_body) +
+                        (iteration_latency(k_out_rem) * has_rem))
+
+
+def ne16_latency_batched(ks, depthwise, weights_bitwidth, layer):
+    """Vectorized NE16 latency model. Computes the same latency and n. of operations of
+    `Ne16PerfModel`, decomposing the kernel in 3x3 and 1x1 sub-kernels, without building
+    Python model objects. All numerical inputs (kernel sizes, bit-widths and layer shape
+    entries) can be scalars or mutually broadcastable tensors, e.g. to evaluate multiple
+    layers or precisions with a single call.
+
+    :param ks: the kernel size
+    :type ks: Tuple
+    :param depthwise: True in the case of a depthwise convolution
+    :type depthwise: bool
+    :param weights_bitwidth: the weights precision
+    :type weights_bitwidth: Any
+    :param layer: the layer shape (H_out, W_out, K_out, K_in)
+    :type layer: Tuple
+    :return: the total latency and number of operations
+    :rtype: Tuple
+    """
     n_3x3 = FloorDivideSTE.apply(ks[0], 3) * FloorDivideSTE.apply(ks[1], 3)
     n_1x1 = (ModuloSTE.apply(ks[0], 3) * ks[1] +
              ModuloSTE.apply(ks[1], 3) * ks[0] -
              ModuloSTE.apply(ks[0], 3) * ModuloSTE.apply(ks[1], 3))
-    total_latency = 0
-    total_ops = 0
-    if n_3x3 > 0:
-        ne16 = Ne16PerfModel(name, (3,3), depthwise=depthwise, weights_bitwidth=weights_bitwidth)
-        ne16.set_layer(layer)
-        total_ops += (ne16.ops * n_3x3)
-        total_latency += (ne16.latency * n_3x3)
-    if n_1x1 > 0:
-        ne16 = Ne16PerfModel(name, (1,1), depthwise=depthwise, weights_bitwidth=weights_bitwidth)
-        ne16.set_layer(layer)
-        total_ops += (ne16.ops * n_1x1)
-        total_latency += (ne16.latency  * n_1x1)
-    return total_latency, total_ops, total_ops/total_latency
+    # both decompositions are always evaluated and weighted by their count (possibly 0),
+    # rather than branching on the counts, which would require a sync for device tensors.
+    # Note that a depthwise 1x1 sub-kernel is neither modeled as a 1x1 nor as a DW kernel
+    lat_3x3 = _ne16_kernel_latency(layer, weights_bitwidth, is_1x1=False, is_dw=depthwise)
+    lat_1x1 = _ne16_kernel_latency(layer, weights_bitwidth, is_1x1=not depthwise, is_dw=False)
+    h_out, w_out, k_out, k_in = layer
+    ops = k_in * h_out * w_out * (k_out if not depthwise else 1)
+    total_ops = 9 * ops * n_3x3 + ops * n_1x1
+    total_latency = lat_3x3 * n_3x3 + lat_1x1 * n_1x1
+    return total_latency, total_ops
 
 
 class Ne16PerfModel:
@@ -195,6 +284,9 @@ class Ne16PerfModel:
         k_out_body = self.INPUT_BUFFER_SHAPE[2] if self.is_dw else self.OUTPUT_BUFFER_SHAPE[2]
         n_out_body = FloorDivideSTE.apply(self.layer[2], k_out_body)
         k_out_rem = ModuloSTE.apply(self.layer[2], k_out_body)
+        # the remainder iteration is masked out when not needed, rather than skipped with an
+        # if, which would require a sync for device tensors
+        has_rem = k_out_rem != 0
 
         # nothing depends on k_in so no need for remainder
         n_in = DivAndCeilSTE.apply(self.layer[3], self.INPUT_BUFFER_SHAPE[2])
@@ -215,44 +307,44 @@ class Ne16PerfModel:
                                 self.normquant_latency(k) + self.streamout_latency)
 
         total_latency = n_spatial * (n_out_body * iteration_latency(k_out_body) +
-                                     (iteration_latency(k_out_rem) if k_out_rem != 0 else 0))
+                                     (iteration_latency(k_out_rem) * has_rem))
 
         if self.is_dw:
             total_weight_offset_latency = (
                 n_spatial * (n_out_body * self.weight_offset_latency(k_out_body) +
-                             (self.weight_offset_latency(k_out_rem) if k_out_rem != 0 else 0)))
+                             (self.weight_offset_latency(k_out_rem) * has_rem)))
             total_matrixvec_latency = (
                 n_spatial * (n_out_body * self.matrixvec_latency(k_out_body) +
-                             (self.matrixvec_latency(k_out_rem) if k_out_rem != 0 else 0)))
+                             (self.matrixvec_latency(k_out_rem) * has_rem)))
             total_load_latency = (
-                n_spatial * (n_out_body + (1 if k_out_rem != 0 else 0)) * self.load_latency)
+                n_spatial * (n_out_body + has_rem) * self.load_latency)
             total_update_idx_latency = (
-                n_spatial * (n_out_body + (1 if k_out_rem != 0 else 0)) * self.update_idx_latency)
+                n_spatial * (n_out_body + has_rem) * self.update_idx_latency)
 
             total_normquant_latency = (
                 n_spatial * (n_out_body * self.normquant_latency(k_out_body) +
-                             (self.normquant_latency(k_out_rem) if k_out_rem != 0 else 0)))
+                             (self.normquant_latency(k_out_rem) * has_rem)))
             total_streamout_latency = (
-                n_spatial * (n_out_body + (1 if k_out_rem != 0 else 0)) * self.streamout_latency)
+                n_spatial * (n_out_body + has_rem) * self.streamout_latency)
         else:
             total_weight_offset_latency = (
                 n_spatial * (
                     n_out_body * n_in * self.weight_offset_latency(k_out_body) +
-                    ((n_in * self.weight_offset_latency(k_out_rem))) if k_out_rem != 0 else 0))
+                    (n_in * self.weight_offset_latency(k_out_rem) * has_rem)))
             total_matrixvec_latency = (
                 n_spatial * (
                     n_out_body * n_in * self.matrixvec_latency(k_out_body) +
-                    ((n_in * self.matrixvec_latency(k_out_rem)) if k_out_rem != 0 else 0)))
+                    (n_in * self.matrixvec_latency(k_out_rem) * has_rem)))
             total_load_latency = (
-                n_spatial * (n_out_body + (1 if k_out_rem != 0 else 0)) * n_in * self.load_latency)
-            total_update_idx_latency = (n_spatial * (n_out_body + (1 if k_out_rem != 0 else 0)) *
+                n_spatial * (n_out_body + has_rem) * n_in * self.load_latency)
+            total_update_idx_latency = (n_spatial * (n_out_body + has_rem) *
                                         n_in * self.update_idx_latency)
 
             total_normquant_latency = (
                 n_spatial * (n_out_body * self.normquant_latency(k_out_body) +
-                             (self.normquant_latency(k_out_rem) if k_out_rem != 0 else 0)))
+                             (self.normquant_latency(k_out_rem) * has_rem)))
             total_streamout_latency = (
-                n_spatial * (n_out_body + (1 if k_out_rem != 0 else 0)) * self.streamout_latency)
+                n_spatial * (n_out_body + has_rem) * self.streamout_latency)
 
         total_component_wise_latency = (total_weight_offset_latency +
                                         total_matrixvec_latency +
@@ -364,21 +456,59 @@ class Ne16PerfModel:
         return (mem / bandwidth) * dma_stall
 
 
+def _ne16_pruned(spec):
+    """True for layers with 0-bit weights or a null theta_alpha. A bool tensor (rather than a
+    Python bool that would require a sync) if any of those entries is a tensor"""
+    return (spec['w_precision'] == 0) | (spec['w_theta_alpha'] == 0)
+
+
+def _ne16_unpruned_theta_alpha(spec, pruned):
+    """Returns w_theta_alpha with pruned entries replaced by 1, to avoid divisions by zero"""
+    if isinstance(pruned, torch.Tensor):
+        return torch.where(pruned, 1., spec['w_theta_alpha'])
+    return spec['w_theta_alpha']
+
+
+def _ne16_mask_pruned(cost, pruned):
+    """Sets the cost of pruned layers to 0"""
+    if isinstance(pruned, torch.Tensor):
+        return torch.where(pruned, 0., cost)
+    return cost
+
+
+def _ne16_check_in_precision(spec):
+    # only checked for host values, since it would require a sync for device tensors
+    if is_host_value(spec['in_precision']):
+        assert bool(torch.all(torch.as_tensor(spec['in_precision']) == 8)), \
+            "NE16 model only supports 8-bit quantization for the activations"
+
+
+def _ne16_check_kernel_size(k, allowed, msg):
+    # works both on a single layer and on stacked kernel sizes of multiple layers
+    if is_host_value(k[0]) and is_host_value(k[1]):
+        k0, k1 = torch.as_tensor(k[0]), torch.as_tensor(k[1])
+        ok = torch.zeros_like(k0, dtype=torch.bool)
+        for a in allowed:
+            ok = ok | ((k0 == a[0]) & (k1 == a[1]))
+        assert bool(torch.all(ok)), msg
+
+
 def _ne16_latency_conv2d_generic(spec):
-    if (spec['w_precision'] == 0) or (spec['w_theta_alpha'] == 0):
+    pruned = _ne16_pruned(spec)
+    if not isinstance(pruned, torch.Tensor) and pruned:
         return 0.
+    w_theta_alpha = _ne16_unpruned_theta_alpha(spec, pruned)
     cin = spec['in_channels']
     cout = spec['out_channels']
     k = spec['kernel_size']
     out_shape = spec['output_shape']
     w_prec = spec['w_precision']
-    w_theta_alpha_sum = spec['w_theta_alpha'] * cout
+    w_theta_alpha_sum = w_theta_alpha * cout
     is_depthwise = False
 
-    assert spec['in_precision'] == 8, \
-        "NE16 model only supports 8-bit quantization for the activations"
-    assert ((k[0] == 3) and (k[1] == 3)) or ((k[0] == 1) and (k[1] == 1)), \
-        "NE16 model only supports 3x3 or 1x1 convolutions"
+    _ne16_check_in_precision(spec)
+    _ne16_check_kernel_size(k, ((3, 3), (1, 1)),
+                            "NE16 model only supports 3x3 or 1x1 convolutions")
 
     layer_params = (
         out_shape[2],
@@ -386,31 +516,31 @@ def _ne16_latency_conv2d_generic(spec):
         w_theta_alpha_sum,
         cin)
 
-    latency, _, _ = Ne16PerfModel_generalized(
-        name='conv',
+    latency, _ = ne16_latency_batched(
         ks=k,
         depthwise=is_depthwise,
         weights_bitwidth=w_prec,
         layer=layer_params)
-    cost = latency / spec['w_theta_alpha'] # division due to the product in the calling function
-    return cost
+    cost = latency / w_theta_alpha # division due to the product in the calling function
+    return _ne16_mask_pruned(cost, pruned)
 
 
 def _ne16_latency_conv2d_dw(spec):
-    if (spec['w_precision'] == 0) or (spec['w_theta_alpha'] == 0):
+    pruned = _ne16_pruned(spec)
+    if not isinstance(pruned, torch.Tensor) and pruned:
         return 0.
+    w_theta_alpha = _ne16_unpruned_theta_alpha(spec, pruned)
     cin = spec['in_channels']
     cout = spec['out_channels']
     k = spec['kernel_size']
     out_shape = spec['output_shape']
     w_prec = spec['w_precision']
-    w_theta_alpha_sum = spec['w_theta_alpha'] * cout
+    w_theta_alpha_sum = w_theta_alpha * cout
     is_depthwise = True
 
-    assert spec['in_precision'] == 8, \
-        "NE16 model only supports 8-bit quantization for the activations"
-    assert ((k[0] == 3) and (k[1] == 3)), \
-        "NE16 model only supports 3x3 depthwise convolutions"
+    _ne16_check_in_precision(spec)
+    _ne16_check_kernel_size(k, ((3, 3),),
+                            "NE16 model only supports 3x3 depthwise convolutions")
 
     layer_params = (
         out_shape[2],
@@ -418,28 +548,28 @@ def _ne16_latency_conv2d_dw(spec):
         w_theta_alpha_sum,
         cin)
 
-    latency, _, _ = Ne16PerfModel_generalized(
-        name='conv',
+    latency, _ = ne16_latency_batched(
         ks=k,
         depthwise=is_depthwise,
         weights_bitwidth=w_prec,
         layer=layer_params)
-    cost = latency / spec['w_theta_alpha']
-    return cost
+    cost = latency / w_theta_alpha
+    return _ne16_mask_pruned(cost, pruned)
 
 
 def _ne16_latency_linear(spec):
-    if (spec['w_precision'] == 0) or (spec['w_theta_alpha'] == 0):
+    pruned = _ne16_pruned(spec)
+    if not isinstance(pruned, torch.Tensor) and pruned:
         return 0.
+    w_theta_alpha = _ne16_unpruned_theta_alpha(spec, pruned)
     cin = spec['in_features']
     cout = spec['out_features']
     kernel_size = (1, 1)
     w_prec = spec['w_precision']
-    w_theta_alpha_sum = spec['w_theta_alpha'] * cout
+    w_theta_alpha_sum = w_theta_alpha * cout
     is_depthwise = False
 
-    assert spec['in_precision'] == 8, \
-        "NE16 model only supports 8-bit quantization for the activations"
+    _ne16_check_in_precision(spec)
 
     layer_params = (
         1,
@@ -447,17 +577,16 @@ def _ne16_latency_linear(spec):
         w_theta_alpha_sum,  # division due to the product in the calling function
         cin)  # TODO: check detach
 
-    latency, _, _ = Ne16PerfModel_generalized(
-                name='conv',
-                ks=kernel_size,
-                depthwise=is_depthwise,
-                weights_bitwidth=w_prec,
-                layer=layer_params)
-    cost = latency / spec['w_theta_alpha']
-    return cost
+    latency, _ = ne16_latency_batched(
+        ks=kernel_size,
+        depthwise=is_depthwise,
+        weights_bitwidth=w_prec,
+        layer=layer_params)
+    cost = latency / w_theta_alpha
+    return _ne16_mask_pruned(cost, pruned)
 
 
-ne16_latency = CostSpec(shared=False, default_behavior='zero')
+ne16_latency = CostSpec(shared=False, default_behavior='zero', features_granularity=16)
 ne16_latency[Conv2dGeneric] = _ne16_latency_conv2d_generic
 ne16_latency[Conv2dDW] = _ne16_latency_conv2d_dw
 ne16_latency[LinearGeneric] = _ne16_latency_linear
@@ -16,7 +16,9 @@
 # *                                                                            *
 # * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
 # *----------------------------------------------------------------------------*
-from typing import Any, Callable, Dict, Optional, Type
+from typing import Any, Callable, Dict, Optional, Type, Union
+import operator
+import torch
 import torch.nn as nn
 
 # example = {'in_channels': 32, 'out_channels': 64}
@@ -29,8 +31,32 @@ import torch.nn as nn
 # tensor
 PatternSpec = Dict[str, Any]
 
-# later can become a real pattern, for now a single layer
-Pattern = Type[nn.Module]
+
+class FusedPattern(tuple):
+    """A chain of layers/operations executed as a single fused kernel (e.g., Conv-BN-ReLU).
+
+    Each element is either a nn.Module type (matching call_module nodes of that type or of a
+    subclass), a function (matching call_function nodes with that target), or a tuple of
+    alternatives. A chain matches a sequence of graph nodes in which each node is the only
+    user of the previous one, so that intermediate results never leave the fused kernel. The
+    cost function associated to a fused pattern is evaluated on the spec of the first layer
+    of the chain, and replaces the cost of all layers in it.
+    """
+    def __new__(cls, *elements: Any):
+        assert len(elements) > 1, "A FusedPattern must include at least two elements"
+        assert isinstance(elements[0], type) and issubclass(elements[0], nn.Module), \
+            "The first element of a FusedPattern must be a nn.Module type"
+        return super(FusedPattern, cls).__new__(cls, elements)
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+    def __repr__(self) -> str:
+        return f"FusedPattern{super(FusedPattern, self).__repr__()}"
+
+
+# a single layer, or a chain of fused layers
+Pattern = Union[Type[nn.Module], FusedPattern]
 
 
 Constraint = Optional[Callable[[PatternSpec], bool]]
@@ -55,3 +81,12 @@ Conv1dDW = (nn.Conv1d, conv_dw_constraint)
 Conv2dDW = (nn.Conv2d, conv_dw_constraint)
 Conv1d3 = (nn.Conv1d, conv_3_constraint)
 Conv2d3x3 = (nn.Conv2d, conv_3_constraint)
+
+# Fused patterns/constraints pairs definition (constraints apply to the first layer)
+Add = (operator.add, torch.add)
+Conv1dReLU = (FusedPattern(nn.Conv1d, nn.ReLU), None)
+Conv2dReLU = (FusedPattern(nn.Conv2d, nn.ReLU), None)
+Conv1dBNReLU = (FusedPattern(nn.Conv1d, nn.BatchNorm1d, nn.ReLU), None)
+Conv2dBNReLU = (FusedPattern(nn.Conv2d, nn.BatchNorm2d, nn.ReLU), None)
+Conv1dAdd = (FusedPattern(nn.Conv1d, Add), None)
+Conv2dAdd = (FusedPattern(nn.Conv2d, Add), None)
@@ -0,0 +1,85 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+from typing import Callable, Dict, List, Optional
+import math
+import torch
+import torch.fx as fx
+from .cost_spec import CostSpec
+
+# a function returning the (possibly differentiable) bit-width of the activation produced by a
+# node, or None if the node does not define it (e.g. non-quantized layers)
+ActivationBitsFn = Callable[[fx.Node], Optional[torch.Tensor]]
+
+
+class PeakMemorySpec(CostSpec):
+    """Cost specification for the peak activation memory (in bytes) required by an inference.
+
+    Differently from other cost models, this metric is not the sum of per-layer costs, since
+    it depends on which activations are simultaneously alive. It is therefore evaluated over
+    the whole traced graph, using an `ActivationLiveness` analysis. The size of each
+    activation buffer is derived from its shape, with the number of channels given by the
+    node's features calculator (and hence differentiable w.r.t. the PIT masks), and with the
+    bit-width optionally provided by the NAS (e.g., differentiable w.r.t. the MPS
+    theta_alpha).
+
+    :param default_bits: bit-width of activations whose precision is not set by the NAS
+    :type default_bits: int
+    """
+    def __init__(self, default_bits: int = 8):
+        super(PeakMemorySpec, self).__init__(shared=False, default_behavior='zero')
+        self.default_bits = default_bits
+
+    @staticmethod
+    def _elements(n: fx.Node) -> torch.Tensor:
+        """Number of (effective) elements of the activation produced by a node"""
+        shape = n.meta['tensor_meta'].shape
+        fc = n.meta.get('features_calculator')
+        if len(shape) < 2 or fc is None:
+            return torch.tensor(float(math.prod(shape)))
+        features = torch.as_tensor(fc.features, dtype=torch.float32)
+        return features * (math.prod(shape) / shape[1])
+
+    def buffer_bytes(self, mod: fx.GraphModule, buffers: List[fx.Node],
+                     bits_fn: ActivationBitsFn) -> torch.Tensor:
+        """Computes the size in bytes of a list of activation buffers
+
+        :param mod: the traced module
+        :type mod: fx.GraphModule
+        :param buffers: the nodes that produce the buffers
+        :type buffers: List[fx.Node]
+        :param bits_fn: the function returning the NAS-defined bit-width of a node, if any
+        :type bits_fn: ActivationBitsFn
+        :return: a tensor with the size of each buffer
+        :rtype: torch.Tensor
+        """
+        # nodes without an explicit bit-width inherit the one of their first input
+        bits: Dict[fx.Node, torch.Tensor] = {}
+        default = torch.tensor(float(self.default_bits))
+        for n in mod.graph.nodes:
+            b = bits_fn(n)
+            if b is None:
+                inputs = [i for i in n.all_input_nodes if i in bits]
+                b = bits[inputs[0]] if len(inputs) > 0 else default
+            bits[n] = torch.as_tensor(b, dtype=torch.float32)
+        sizes = [self._elements(n) * bits[n] / 8 for n in buffers]
+        device = next((s.device for s in sizes if s.device.type != 'cpu'), torch.device('cpu'))
+        return torch.stack([s.to(device) for s in sizes])
+
+
+peak_memory = PeakMemorySpec()
@@ -0,0 +1,61 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+from typing import Any, Dict, Optional, Sequence
+import torch
+
+
+class DeviceTable:
+    """A constant tensor (e.g., a look-up table) used by a cost model, with one cached copy
+    per device, so that cost functions never need to re-create or transfer it during training.
+
+    :param data: the table content
+    :type data: Sequence[Any]
+    :param dtype: the table dtype
+    :type dtype: torch.dtype
+    """
+    def __init__(self, data: Sequence[Any], dtype: torch.dtype = torch.float32):
+        cpu = torch.tensor(data, dtype=dtype)
+        self._copies: Dict[torch.device, torch.Tensor] = {cpu.device: cpu}
+
+    def on(self, device: Optional[torch.device]) -> torch.Tensor:
+        """Returns the table on a given device (default: cpu)
+
+        :param device: the target device
+        :type device: Optional[torch.device]
+        :return: the table
+        :rtype: torch.Tensor
+        """
+        device = torch.device('cpu') if device is None else device
+        if device not in self._copies:
+            self._copies[device] = self._copies[torch.device('cpu')].to(device)
+        return self._copies[device]
+
+
+def device_of(*values: Any) -> Optional[torch.device]:
+    """Returns the device of the first tensor found among `values`, or None"""
+    for v in values:
+        if isinstance(v, torch.Tensor):
+            return v.device
+    return None
+
+
+def is_host_value(value: Any) -> bool:
+    """True if a spec entry can be inspected from Python without a host-device sync, i.e.,
+    if it is a plain Python value or a CPU tensor"""
+    return not isinstance(value, torch.Tensor) or value.device.type == 'cpu'
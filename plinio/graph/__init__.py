@@ -17,7 +17,8 @@
 # * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
 # *----------------------------------------------------------------------------*
 from .annotation import add_node_properties, add_features_calculator, \
-        associate_input_features
+        associate_input_features, propagate_annotation
+from .index import GraphIndex
 
 from .inspection import get_graph_inputs, get_graph_outputs
 
@@ -27,6 +28,8 @@ __all__ = [
         'add_node_properties',
         'add_features_calculator',
         'associate_input_features',
+        'propagate_annotation',
+        'GraphIndex',
         'get_graph_inputs',
         'get_graph_outputs',
         'replace_node_module',
@@ -16,16 +16,17 @@
 # *                                                                            *
 # * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
 # *----------------------------------------------------------------------------*
-from typing import List, Callable
+from typing import Any, List, Callable, Optional
 import math
 import torch.fx as fx
-from .features_calculation import FlattenFeaturesCalculator, ConcatFeaturesCalculator, \
-    ConstFeaturesCalculator
+from .features_calculation import FeaturesCalculator, FlattenFeaturesCalculator, \
+    ConcatFeaturesCalculator, ConstFeaturesCalculator
+from .index import GraphIndex
 from .utils import try_get_args
 from .inspection import is_features_propagating_op, is_features_defining_op, \
     is_shared_input_features_op, is_flatten, is_squeeze, is_unsqueeze, \
     is_features_concatenate, is_non_tensor_op, \
-    is_untouchable_op, is_zero_or_one_input_op, get_graph_inputs, all_output_nodes
+    is_untouchable_op, is_zero_or_one_input_op
 
 
 def add_node_properties(mod: fx.GraphModule):
@@ -52,7 +53,43 @@ def add_single_node_properties(n: fx.Node, mod: fx.GraphModule):
     n.meta['non_tensor_op'] = is_non_tensor_op(n)
 
 
-def add_features_calculator(mod: fx.GraphModule, extra_rules: List[Callable] = []):
+def propagate_annotation(g: fx.Graph, key: str, rule: Callable[[fx.Node], Any],
+                         index: Optional[GraphIndex] = None):
+    """Annotates the nodes of a graph in a single pass in topological order, with values that
+    depend on the annotations of their predecessors, e.g. features calculators.
+
+    The annotation starts from the graph inputs. Each other node is annotated only when all its
+    predecessors have a `key` entry in their meta dict and at least one of them was annotated
+    during this pass. Nodes for which `rule` returns None are left un-annotated, and so are
+    (transitively) their successors. The pass is O(V+E).
+
+    :param g: the graph
+    :type g: fx.Graph
+    :param key: the key of the annotation in the nodes meta dict
+    :type key: str
+    :param rule: a function that computes the annotation of a node
+    :type rule: Callable[[fx.Node], Any]
+    :param index: an adjacency index of the graph, built if not provided
+    :type index: Optional[GraphIndex]
+    """
+    index = index if index is not None else GraphIndex(g)
+    nodes = index.nodes
+    done = bytearray(len(nodes))
+    for i, n in enumerate(nodes):
+        preds = index.pred_ids(i)
+        if n.op != 'placeholder':
+            # skip nodes not reached from the inputs, or whose predecessors are not annotated
+            if not any(done[j] for j in preds) or any(key not in nodes[j].meta for j in preds):
+                continue
+        value = rule(n)
+        if value is None:
+            continue
+        n.meta[key] = value
+        done[i] = 1
+
+
+def add_features_calculator(mod: fx.GraphModule, extra_rules: List[Callable] = [],
+                            index: Optional[GraphIndex] = None):
     """Adds a different feature calculator object in the 'meta' dict of each node of the graph
     depending on the node properties
 
@@ -60,180 +97,166 @@ def add_features_calculator(mod: fx.GraphModule, extra_rules: List[Callable] = [
     :type mod: fx.GraphModule
     :param extra_rules: list of callable returning NAS specific features calculator
     :type extra_rules: List[Callable]
+    :param index: an adjacency index of the graph, built if not provided
+    :type index: Optional[GraphIndex]
     :raises ValueError: for unsupported nodes
     """
-    g = mod.graph
-    queue = get_graph_inputs(g)
-    visited = []
-    while queue:
-        n = queue.pop(0)
-        if n in visited:
-            continue
-        # skip nodes for which predecessors have not yet been processed completely
-        if any(['features_calculator' not in _.meta for _ in n.all_input_nodes]):
-            continue
+    propagate_annotation(mod.graph, 'features_calculator',
+                         lambda n: _features_calculator(n, mod, extra_rules), index)
 
-        # handle extra rules
-        fc = None
-        for rule in extra_rules:
-            fc = rule(n, mod)
-            if fc:
-                break
+
+def _features_calculator(n: fx.Node, mod: fx.GraphModule,
+                         extra_rules: List[Callable]) -> Optional[FeaturesCalculator]:
+    """Returns the features calculator of a node, whose predecessors have already been
+    annotated, or None for non-tensor ops"""
+    # handle extra rules
+    for rule in extra_rules:
+        fc = rule(n, mod)
         if fc:
-            n.meta['features_calculator'] = fc
-        # handle default rules
-        elif n.meta['non_tensor_op']:
-            # assume no one will ever need to compute output features for non-tensor ops
-            continue
-        elif n.meta['flatten']:
-            # For flatten ops, the output features are computed as: input_features * spatial_size
-            # note that this is NOT simply equal to the output shape if the preceding layer is a
-            # NAS-able one, for which some features # could be de-activated
-            ifc = n.all_input_nodes[0].meta['features_calculator']
-            input_shape = n.all_input_nodes[0].meta['tensor_meta'].shape
-            start_dim = try_get_args(n, mod, 1, 'start_dim', 0)
-            end_dim = try_get_args(n, mod, 2, 'end_dim', -1)
-            assert start_dim != 0 and len(input_shape) - start_dim != 0, \
-                "Flattening the batch not supported"
-            # if flatten includes the channels
-            if start_dim == 1 or len(input_shape) - start_dim == 1:
-                flattened_size = math.prod(input_shape[2:end_dim if end_dim != -1 else None])
-                n.meta['features_calculator'] = FlattenFeaturesCalculator(ifc, int(flattened_size))
-            else:
-                n.meta['features_calculator'] = ifc  # just propagate the features
-        elif n.meta['unsqueeze']:
-            ifc = n.all_input_nodes[0].meta['features_calculator']
-            input_shape = n.all_input_nodes[0].meta['tensor_meta'].shape
-            dim = try_get_args(n, mod, 1, 'dim', None)
-            # TODO: add support for no dim by looking at which dimensions are 1
-            if dim is None:
-                raise ValueError("Squeeze without dim not supported")
-            if dim == 0:  # batch size
-                batch_size = input_shape[0]
-                n.meta['features_calculator'] = ConstFeaturesCalculator(batch_size)
-            elif dim == 1:  # feauteres
-                n.meta['features_calculator'] = ConstFeaturesCalculator(1)
-            else:  # anyother dim
-                n.meta['features_calculator'] = ifc  # just propagate the features
-        elif n.meta['squeeze']:
-            # Squeeze is similar to flatten but the pytorch operation is slightly different
-            ifc = n.all_input_nodes[0].meta['features_calculator']
-            input_shape = n.all_input_nodes[0].meta['tensor_meta'].shape
-            dim = try_get_args(n, mod, 1, 'dim', None)
-            # TODO: add support for no dim by looking at which dimensions are 1
-            if dim is None:
-                raise ValueError("Squeeze without dim not supported")
-            assert dim != 0 and len(input_shape) - dim != 0, \
-                "Squeezing the batch is not supported"
-            if dim == 1 or len(input_shape) - dim == 1:
-                flattened_size = input_shape[2]
-                n.meta['features_calculator'] = FlattenFeaturesCalculator(ifc, flattened_size)
-            else:
-                n.meta['features_calculator'] = ifc  # just propagate the features
-        elif n.meta['features_concatenate']:
-            # for concatenation over the features axis the number of output features is the sum
-            # of the output features of preceding layers as for flatten, this is NOT equal to the
-            # input shape of this layer, when one or more predecessors are NAS-able
-            ifc = ConcatFeaturesCalculator(
-                [prev.meta['features_calculator'] for prev in n.all_input_nodes]
-            )
-            n.meta['features_calculator'] = ifc
-        elif n.meta['shared_input_features']:
-            # for nodes that require identical number of features in all their inputs (e.g., add)
-            # we simply assume that we can take any of the output features calculators from
-            # predecessors
-            # this is enforced for NAS-able layers by the use of shared maskers
-            n.meta['features_calculator'] = n.all_input_nodes[0].meta['features_calculator']
-        elif n.meta['features_defining']:
-            # these are "static" (i.e., non NAS-able) nodes that alter the number of output
-            # features, and hence the number of input features of subsequent layers
-            # the min() here handles the case of scalar values (e.g. flags) sometimes present
-            # in complex models such as YoLo versions
-            n.meta['features_calculator'] = ConstFeaturesCalculator(n.meta['tensor_meta'].shape[
-                min(1, len(n.meta['tensor_meta'].shape) - 1)])
-        elif n.meta['features_propagating']:
-            # these are nodes that have a single input and n. output features == n. input features
-            # so, we just propagate forward the features calculator of the input
-            # this also includes PITBatchNorm1d and PITBatchNorm2d
-            n.meta['features_calculator'] = n.all_input_nodes[0].meta['features_calculator']
+            return fc
+    # handle default rules
+    if n.meta['non_tensor_op']:
+        # assume no one will ever need to compute output features for non-tensor ops
+        return None
+    if n.meta['flatten']:
+        # For flatten ops, the output features are computed as: input_features * spatial_size
+        # note that this is NOT simply equal to the output shape if the preceding layer is a
+        # NAS-able one, for which some features # could be de-activated
+        ifc = n.all_input_nodes[0].meta['features_calculator']
+        input_shape = n.all_input_nodes[0].meta['tensor_meta'].shape
+        start_dim = try_get_args(n, mod, 1, 'start_dim', 0)
+        end_dim = try_get_args(n, mod, 2, 'end_dim', -1)
+        assert start_dim != 0 and len(input_shape) - start_dim != 0, \
+            "Flattening the batch not supported"
+        # if flatten includes the channels
+        if start_dim == 1 or len(input_shape) - start_dim == 1:
+            flattened_size = math.prod(input_shape[2:end_dim if end_dim != -1 else None])
+            return FlattenFeaturesCalculator(ifc, int(flattened_size))
         else:
-            raise ValueError("Unsupported node {} (op: {}, target: {})".format(n, n.op, n.target))
-
-        for succ in all_output_nodes(n):
-            queue.append(succ)
-        visited.append(n)
+            return ifc  # just propagate the features
+    elif n.meta['unsqueeze']:
+        ifc = n.all_input_nodes[0].meta['features_calculator']
+        input_shape = n.all_input_nodes[0].meta['tensor_meta'].shape
+        dim = try_get_args(n, mod, 1, 'dim', None)
+        # TODO: add support for no dim by looking at which dimensions are 1
+        if dim is None:
+            raise ValueError("Squeeze without dim not supported")
+        if dim == 0:  # batch size
+            batch_size = input_shape[0]
+            return ConstFeaturesCalculator(batch_size)
+        elif dim == 1:  # feauteres
+            return ConstFeaturesCalculator(1)
+        else:  # anyother dim
+            return ifc  # just propagate the features
+    elif n.meta['squeeze']:
+        # Squeeze is similar to flatten but the pytorch operation is slightly different
+        ifc = n.all_input_nodes[0].meta['features_calculator']
+        input_shape = n.all_input_nodes[0].meta['tensor_meta'].shape
+        dim = try_get_args(n, mod, 1, 'dim', None)
+        # TODO: add support for no dim by looking at which dimensions are 1
+        if dim is None:
+            raise ValueError("Squeeze without dim not supported")
+        assert dim != 0 and len(input_shape) - dim != 0, \
+            "Squeezing the batch is not supported"
+        if dim == 1 or len(input_shape) - dim == 1:
+            flattened_size = input_shape[2]
+            return FlattenFeaturesCalculator(ifc, flattened_size)
+        else:
+            return ifc  # just propagate the features
+    elif n.meta['features_concatenate']:
+        # for concatenation over the features axis the number of output features is the sum
+        # of the output features of preceding layers as for flatten, this is NOT equal to the
+        # input shape of this layer, when one or more predecessors are NAS-able
+        ifc = ConcatFeaturesCalculator(
+            [prev.meta['features_calculator'] for prev in n.all_input_nodes]
+        )
+        return ifc
+    elif n.meta['shared_input_features']:
+        # for nodes that require identical number of features in all their inputs (e.g., add)
+        # we simply assume that we can take any of the output features calculators from
+        # predecessors
+        # this is enforced for NAS-able layers by the use of shared maskers
+        return n.all_input_nodes[0].meta['features_calculator']
+    elif n.meta['features_defining']:
+        # these are "static" (i.e., non NAS-able) nodes that alter the number of output
+        # features, and hence the number of input features of subsequent layers
+        # the min() here handles the case of scalar values (e.g. flags) sometimes present
+        # in complex models such as YoLo versions
+        return ConstFeaturesCalculator(n.meta['tensor_meta'].shape[
+            min(1, len(n.meta['tensor_meta'].shape) - 1)])
+    elif n.meta['features_propagating']:
+        # these are nodes that have a single input and n. output features == n. input features
+        # so, we just propagate forward the features calculator of the input
+        # this also includes PITBatchNorm1d and PITBatchNorm2d
+        return n.all_input_nodes[0].meta['features_calculator']
+    else:
+        raise ValueError("Unsupported node {} (op: {}, target: {})".format(n, n.op, n.target))
 
 
-def associate_input_features(mod: fx.GraphModule):
+def associate_input_features(mod: fx.GraphModule, index: Optional[GraphIndex] = None):
     """Associates to each node a reference to the node that sets its features
 
     :param mod: module
     :type mod: fx.GraphModule
+    :param index: an adjacency index of the graph, built if not provided
+    :type index: Optional[GraphIndex]
     :raises ValueError: for unsupported nodes
     """
-    g = mod.graph
-    queue = get_graph_inputs(g)
-    visited = []
-    while queue:
-        n = queue.pop(0)
-        if n in visited:
-            continue
-        # skip nodes for which predecessors have not yet been processed completely
-        if any(['input_features_set_by' not in _.meta for _ in n.all_input_nodes]):
-            continue
+    propagate_annotation(mod.graph, 'input_features_set_by',
+                         lambda n: _input_features_set_by(n, mod), index)
 
-        prev = n if len(n.all_input_nodes) == 0 else n.all_input_nodes[0]
 
-        if n.meta['non_tensor_op']:
-            # assume no one will ever need to compute output features for non-tensor ops
-            continue
-        elif len(n.all_input_nodes) == 0:  # input node
-            n.meta['input_features_set_by'] = n
-        elif n.meta['features_concatenate']:
-            n.meta['input_features_set_by'] = n.all_input_nodes
-        elif prev.meta['flatten']:
-            input_shape = prev.all_input_nodes[0].meta['tensor_meta'].shape
-            start_dim = try_get_args(prev, mod, 1, 'start_dim', 0)
-            assert start_dim != 0 and len(input_shape) - start_dim != 0, \
-                "Flattening the batch not supported"
-            # if flatten includes the channels
-            if start_dim == 1 or len(input_shape) - start_dim == 1:
-                n.meta['input_features_set_by'] = prev
-            else:
-                n.meta['input_features_set_by'] = prev.meta['input_features_set_by']
-        elif prev.meta['unsqueeze']:
-            input_shape = prev.all_input_nodes[0].meta['tensor_meta'].shape
-            dim = try_get_args(prev, mod, 1, 'dim', None)
-            if dim is None:
-                raise ValueError("Unsqueeze without dim not supported")
-            if dim == 0 or dim == 1:
-                n.meta['input_features_set_by'] = prev
-            else:
-                n.meta['input_features_set_by'] = prev.meta['input_features_set_by']
-        elif prev.meta['squeeze']:
-            input_shape = prev.all_input_nodes[0].meta['tensor_meta'].shape
-            dim = try_get_args(prev, mod, 1, 'dim', None)
-            if dim is None:
-                raise ValueError("Squeeze without dim not supported")
-            assert dim != 0 and len(input_shape) - dim != 0, \
-                "Squeezing the batch is not supported"
-            if dim == 1 or len(input_shape) - dim == 1:
-                n.meta['input_features_set_by'] = prev
-            else:
-                n.meta['input_features_set_by'] = prev.meta['input_features_set_by']
-        elif prev.meta['features_concatenate']:
-            n.meta['input_features_set_by'] = prev
-        elif prev.meta['features_defining']:
-            n.meta['input_features_set_by'] = prev
-        elif prev.meta['features_propagating']:
-            n.meta['input_features_set_by'] = prev.meta['input_features_set_by']
-        else:
-            raise ValueError("Unsupported node {} (op: {}, target: {})"
-                             .format(n, n.op, n.target))
+def _input_features_set_by(n: fx.Node, mod: fx.GraphModule) -> Any:
+    """Returns the node (or list of nodes) that sets the input features of a node, whose
+    predecessors have already been annotated, or None for non-tensor ops"""
+    prev = n if len(n.all_input_nodes) == 0 else n.all_input_nodes[0]
 
-        for succ in all_output_nodes(n):
-            queue.append(succ)
-        visited.append(n)
+    if n.meta['non_tensor_op']:
+        # assume no one will ever need to compute output features for non-tensor ops
+        return None
+    elif len(n.all_input_nodes) == 0:  # input node
+        return n
+    elif n.meta['features_concatenate']:
+        return n.all_input_nodes
+    elif prev.meta['flatten']:
+        input_shape = prev.all_input_nodes[0].meta['tensor_meta'].shape
+        start_dim = try_get_args(prev, mod, 1, 'start_dim', 0)
+        assert start_dim != 0 and len(input_shape) - start_dim != 0, \
+            "Flattening the batch not supported"
+        # if flatten includes the channels
+        if start_dim == 1 or len(input_shape) - start_dim == 1:
+            return prev
+        else:
+            return prev.meta['input_features_set_by']
+    elif prev.meta['unsqueeze']:
+        input_shape = prev.all_input_nodes[0].meta['tensor_meta'].shape
+        dim = try_get_args(prev, mod, 1, 'dim', None)
+        if dim is None:
+            raise ValueError("Unsqueeze without dim not supported")
+        if dim == 0 or dim == 1:
+            return prev
+        else:
+            return prev.meta['input_features_set_by']
+    elif prev.meta['squeeze']:
+        input_shape = prev.all_input_nodes[0].meta['tensor_meta'].shape
+        dim = try_get_args(prev, mod, 1, 'dim', None)
+        if dim is None:
+            raise ValueError("Squeeze without dim not supported")
+        assert dim != 0 and len(input_shape) - dim != 0, \
+            "Squeezing the batch is not supported"
+        if dim == 1 or len(input_shape) - dim == 1:
+            return prev
+        else:
+            return prev.meta['input_features_set_by']
+    elif prev.meta['features_concatenate']:
+        return prev
+    elif prev.meta['features_defining']:
+        return prev
+    elif prev.meta['features_propagating']:
+        return prev.meta['input_features_set_by']
+    else:
+        raise ValueError("Unsupported node {} (op: {}, target: {})"
+                         .format(n, n.op, n.target))
 
 
 def clean_up_propagated_shapes(mod: fx.GraphModule):
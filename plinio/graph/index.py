@@ -0,0 +1,161 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+from array import array
+from collections import deque
+from itertools import accumulate, chain
+from typing import Callable, Collection, Dict, Iterable, List, Optional, Tuple
+import torch.fx as fx
+
+
+def _csr(adj: List[List[int]]) -> Tuple[array, array]:
+    """Packs an adjacency list into compressed sparse row (pointers, indices) arrays"""
+    ptr = array('l', [0])
+    ptr.extend(accumulate(map(len, adj)))
+    idx = array('l', chain.from_iterable(adj))
+    return ptr, idx
+
+
+class GraphIndex:
+    """A compact adjacency index over the nodes of a `torch.fx.Graph`, built in O(V+E).
+
+    Nodes are stored in topological order (fx graphs are always topologically sorted), and
+    identified by their position in that order. Predecessors and successors are stored in
+    compressed sparse row (CSR) form, i.e. as flat integer arrays of neighbor ids plus one
+    array of offsets per direction, so that graph passes can use plain integer bookkeeping.
+    The index is a snapshot: it must be rebuilt after adding or removing nodes.
+
+    :param fx_graph: the graph to be indexed
+    :type fx_graph: fx.Graph
+    """
+    def __init__(self, fx_graph: fx.Graph):
+        self.nodes: List[fx.Node] = list(fx_graph.nodes)
+        self.position: Dict[fx.Node, int] = {n: i for i, n in enumerate(self.nodes)}
+        preds = [[self.position[i] for i in n.all_input_nodes] for n in self.nodes]
+        succs: List[List[int]] = [[] for _ in self.nodes]
+        for i, p in enumerate(preds):
+            for j in p:
+                succs[j].append(i)
+        self.pred_ptr, self.pred_idx = _csr(preds)
+        self.succ_ptr, self.succ_idx = _csr(succs)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def pred_ids(self, i: int) -> array:
+        """Returns the ids of the input nodes of node `i`, in the order of `all_input_nodes`"""
+        return self.pred_idx[self.pred_ptr[i]:self.pred_ptr[i + 1]]
+
+    def succ_ids(self, i: int) -> array:
+        """Returns the ids of the users of node `i`, in topological order"""
+        return self.succ_idx[self.succ_ptr[i]:self.succ_ptr[i + 1]]
+
+    def degree(self, i: int) -> int:
+        """Returns the total number of (input and output) edges of node `i`"""
+        return (self.pred_ptr[i + 1] - self.pred_ptr[i] +
+                self.succ_ptr[i + 1] - self.succ_ptr[i])
+
+    def predecessors(self, n: fx.Node) -> List[fx.Node]:
+        """Returns the input nodes of `n`, in the order of `n.all_input_nodes`"""
+        return [self.nodes[i] for i in self.pred_ids(self.position[n])]
+
+    def successors(self, n: fx.Node) -> List[fx.Node]:
+        """Returns the users of `n`, in topological order"""
+        return [self.nodes[i] for i in self.succ_ids(self.position[n])]
+
+    def bfs(self, sources: Iterable[fx.Node], reverse: bool = False) -> List[fx.Node]:
+        """Returns the nodes reachable from a set of sources, in breadth-first order
+
+        :param sources: the starting nodes
+        :type sources: Iterable[fx.Node]
+        :param reverse: if True, follow edges backwards (from users to inputs)
+        :type reverse: bool
+        :return: the visited nodes, in visiting order
+        :rtype: List[fx.Node]
+        """
+        ptr, idx = (self.pred_ptr, self.pred_idx) if reverse else (self.succ_ptr, self.succ_idx)
+        seen = bytearray(len(self.nodes))
+        queue = deque()
+        for n in sources:
+            i = self.position[n]
+            if not seen[i]:
+                seen[i] = 1
+                queue.append(i)
+        order = []
+        while queue:
+            i = queue.popleft()
+            order.append(self.nodes[i])
+            for j in idx[ptr[i]:ptr[i + 1]]:
+                if not seen[j]:
+                    seen[j] = 1
+                    queue.append(j)
+        return order
+
+    def weakly_connected_components(
+            self,
+            cut_inputs: Optional[Callable[[fx.Node], bool]] = None,
+            exclude: Collection[fx.Node] = ()) -> List[List[fx.Node]]:
+        """Returns the weakly connected components of the graph, optionally after removing all
+        incoming edges of some nodes (e.g. those whose output features do not depend on the
+        input ones) and some nodes entirely.
+
+        As in a graph built from the list of edges, nodes without any edge in the original graph
+        are not part of any component. Nodes isolated by the removals form singleton components.
+        Components are returned in the topological order of their first node, and the nodes of
+        each component are also sorted topologically.
+
+        :param cut_inputs: a function returning True for nodes whose incoming edges are removed
+        :type cut_inputs: Optional[Callable[[fx.Node], bool]]
+        :param exclude: nodes removed from the graph, together with all their edges
+        :type exclude: Collection[fx.Node]
+        :return: the list of components
+        :rtype: List[List[fx.Node]]
+        """
+        n_nodes = len(self.nodes)
+        excluded = bytearray(n_nodes)
+        for n in exclude:
+            excluded[self.position[n]] = 1
+        pred_ptr, pred_idx, succ_ptr = self.pred_ptr, self.pred_idx, self.succ_ptr
+        # union-find, always using the lowest id as root. Since nodes are visited in
+        # topological order, the trees stay shallow
+        parent = list(range(n_nodes))
+        for i, n in enumerate(self.nodes):
+            if excluded[i] or (cut_inputs is not None and cut_inputs(n)):
+                continue
+            for k in range(pred_ptr[i], pred_ptr[i + 1]):
+                j = pred_idx[k]
+                if excluded[j]:
+                    continue
+                ri = i
+                while parent[ri] != ri:
+                    ri = parent[ri]
+                rj = j
+                while parent[rj] != rj:
+                    rj = parent[rj]
+                if ri != rj:
+                    parent[max(ri, rj)] = min(ri, rj)
+        components: Dict[int, List[fx.Node]] = {}
+        for i, n in enumerate(self.nodes):
+            if excluded[i] or (pred_ptr[i] == pred_ptr[i + 1] and succ_ptr[i] == succ_ptr[i + 1]):
+                continue
+            r = i
+            while parent[r] != r:
+                r = parent[r]
+            parent[i] = r
+            components.setdefault(r, []).append(n)
+        return list(components.values())
@@ -22,7 +22,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.fx as fx
-from .utils import try_get_args, fx_to_nx_graph, NamedLeafModules
+from .utils import try_get_args, NamedLeafModules
 
 
 def all_output_nodes(n: fx.Node) -> List[fx.Node]:
@@ -456,9 +456,9 @@ def named_leaf_modules(mod: fx.GraphModule) -> List[Tuple[str, fx.Node, nn.Modul
     """Returns a list of leaf modules in the graph, used for NAS cost computation.
     Precisely, it returns a list of tuples (module name, fx.Node, nn.Module)"""
     res = []
-    g = fx_to_nx_graph(mod.graph)
-    for n in g.nodes:
-        if n.op == 'call_module':
+    for n in mod.graph.nodes:
+        # nodes without any input or user are not part of the network
+        if n.op == 'call_module' and (n.all_input_nodes or n.users):
             res.append((str(n.target), n, mod.get_submodule(str(n.target))))
     return res
 
@@ -0,0 +1,129 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+from typing import Dict, List
+import torch
+import torch.nn as nn
+import torch.fx as fx
+
+# tensor methods whose output shares the memory of their (first) input
+ALIAS_METHODS = ('view', 'view_as', 'reshape', 'flatten', 'squeeze', 'unsqueeze', 'expand',
+                 'permute', 'transpose', 'contiguous', 'detach')
+
+# modules whose output shares the memory of their input. Checked by exact type, since
+# subclasses (e.g. quantizers derived from nn.Identity) may produce a new tensor
+ALIAS_MODULES = (nn.Identity, nn.Dropout, nn.Dropout1d, nn.Dropout2d, nn.Flatten)
+
+
+def is_alias_op(n: fx.Node, parent: fx.GraphModule) -> bool:
+    """Checks if a `torch.fx.Node` produces a tensor that shares the memory of its first input
+    (e.g. a view, a flatten or an in-place activation), rather than allocating a new one.
+
+    :param n: the target node
+    :type n: fx.Node
+    :param parent: the parent sub-module
+    :type parent: fx.GraphModule
+    :return: `True` if `n` does not allocate a new activation buffer
+    :rtype: bool
+    """
+    if len(n.all_input_nodes) == 0:
+        return False
+    if n.meta.get('flatten', False) or n.meta.get('squeeze', False) or \
+            n.meta.get('unsqueeze', False):
+        return True
+    if n.op == 'call_method' and n.target in ALIAS_METHODS:
+        return True
+    if n.op == 'call_module':
+        submodule = parent.get_submodule(str(n.target))
+        if type(submodule) in ALIAS_MODULES:
+            return True
+        if getattr(submodule, 'inplace', False) is True:
+            return True
+    if n.op == 'call_function' and n.kwargs.get('inplace', False) is True:
+        return True
+    return False
+
+
+def _produces_buffer(n: fx.Node) -> bool:
+    """True for nodes whose output is a single tensor"""
+    if n.op in ('output', 'get_attr'):
+        return False
+    if n.meta.get('non_tensor_op', False):
+        return False
+    return 'tensor_meta' in n.meta and hasattr(n.meta['tensor_meta'], 'shape')
+
+
+class ActivationLiveness:
+    """Liveness analysis of the activation buffers of a `torch.fx.GraphModule`, assuming
+    that nodes are executed in graph order and that each buffer is freed right after its
+    last use.
+
+    The result is stored as a (steps x buffers) 0/1 matrix, so that the memory occupation at
+    each execution step, given the size of each buffer, is obtained with a single
+    matrix-vector product. Since the matrix only depends on the graph topology, it can be
+    computed once and re-used with differentiable buffer sizes.
+
+    :param mod: the traced module, with `tensor_meta` annotations (i.e., after ShapeProp)
+    :type mod: fx.GraphModule
+    """
+    def __init__(self, mod: fx.GraphModule):
+        nodes = list(mod.graph.nodes)
+        step = {n: i for i, n in enumerate(nodes)}
+        # maps each node to the node that allocated its output buffer
+        root: Dict[fx.Node, fx.Node] = {}
+        self.buffers: List[fx.Node] = []
+        for n in nodes:
+            if not _produces_buffer(n):
+                continue
+            if is_alias_op(n, mod) and n.all_input_nodes[0] in root:
+                root[n] = root[n.all_input_nodes[0]]
+            else:
+                root[n] = n
+                self.buffers.append(n)
+        index = {b: i for i, b in enumerate(self.buffers)}
+        birth = [step[b] for b in self.buffers]
+        death = list(birth)
+        for n, r in root.items():
+            b = index[r]
+            for u in n.users:
+                # graph outputs are kept alive until the end of the inference
+                last = len(nodes) - 1 if u.op == 'output' else step[u]
+                death[b] = max(death[b], last)
+        self.matrix = torch.zeros(len(nodes), len(self.buffers))
+        for b, (s, e) in enumerate(zip(birth, death)):
+            self.matrix[s:e + 1, b] = 1.
+
+    def occupation(self, sizes: torch.Tensor) -> torch.Tensor:
+        """Computes the total size of live buffers at each execution step
+
+        :param sizes: the size of each buffer, in the order of `self.buffers`
+        :type sizes: torch.Tensor
+        :return: a tensor with the occupation at each step
+        :rtype: torch.Tensor
+        """
+        return self.matrix.to(sizes.device, sizes.dtype) @ sizes
+
+    def peak(self, sizes: torch.Tensor) -> torch.Tensor:
+        """Computes the peak total size of simultaneously live buffers
+
+        :param sizes: the size of each buffer, in the order of `self.buffers`
+        :type sizes: torch.Tensor
+        :return: a scalar tensor with the peak occupation
+        :rtype: torch.Tensor
+        """
+        return torch.max(self.occupation(sizes))
@@ -0,0 +1,319 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+from typing import Any, Callable, Hashable, Optional, Sequence, Type
+from collections import OrderedDict
+from contextlib import contextmanager
+import copy
+import torch
+import torch.nn as nn
+import torch.fx as fx
+from torch.fx.node import map_aggregate
+from torch.fx.passes.shape_prop import ShapeProp, _extract_tensor_metadata
+from .inspection import get_graph_inputs
+
+# maximum number of traced graphs kept in the cache
+TRACE_CACHE_SIZE = 32
+
+# {structural key: annotated graph template}
+_trace_cache: 'OrderedDict[Hashable, fx.Graph]' = OrderedDict()
+
+# a graph annotation pass (e.g. add_node_properties), applied after shape propagation
+AnnotationFn = Callable[[fx.GraphModule], None]
+
+
+def clear_trace_cache():
+    """Drops all the graphs cached by `trace_and_annotate`"""
+    _trace_cache.clear()
+
+
+def _plain_value(v: Any) -> Optional[Hashable]:
+    """Returns a hashable version of a plain Python module attribute, or None for attributes
+    that are not considered part of the module structure"""
+    if isinstance(v, (bool, int, float, str, type(None))):
+        return v
+    if isinstance(v, (tuple, list)):
+        items = tuple(_plain_value(e) for e in v)
+        return items if all(i is not None or e is None for i, e in zip(items, v)) else None
+    return None
+
+
+# marks module attributes that cannot be part of a structural key
+_UNKEYABLE = object()
+
+# module attributes already covered by the other fields of the structural key
+_SKIPPED_ATTRS = ('_parameters', '_buffers', '_modules')
+
+
+def _attr_key(v: Any) -> Any:
+    """Returns a hashable version of a module attribute, or _UNKEYABLE. Plain values and
+    tensors are compared by value and signature, respectively. Other objects (e.g. functions
+    stored as attributes, such as an activation) are compared by equality, which defaults to
+    identity. Since the objects themselves are stored in the key, their id() cannot be re-used
+    while the key is alive"""
+    if isinstance(v, (bool, int, float, str, type(None))):
+        return v
+    if isinstance(v, torch.Tensor):
+        return ('tensor',) + _tensor_signature(v)
+    if isinstance(v, (tuple, list, set, frozenset, dict)):
+        items = list(v.items()) if isinstance(v, dict) else list(v)
+        keys = tuple(_attr_key(e) for e in items)
+        if any(k is _UNKEYABLE for k in keys):
+            return _UNKEYABLE
+        if isinstance(v, (set, frozenset)):
+            keys = frozenset(keys)
+        return (type(v).__name__, keys)
+    try:
+        hash(v)
+    except TypeError:
+        return _UNKEYABLE
+    return v
+
+
+def _tensor_signature(t: torch.Tensor) -> Hashable:
+    return (tuple(t.shape), t.dtype, t.requires_grad)
+
+
+def _input_signature(x: Any) -> Hashable:
+    if isinstance(x, torch.Tensor):
+        return _tensor_signature(x)
+    if isinstance(x, (tuple, list)):
+        return (type(x).__name__,) + tuple(_input_signature(e) for e in x)
+    if isinstance(x, dict):
+        return ('dict',) + tuple((k, _input_signature(v)) for k, v in sorted(x.items()))
+    return (type(x).__name__, _plain_value(x))
+
+
+def structural_key(model: nn.Module, input_example: Any) -> Optional[Hashable]:
+    """Computes a hashable key that identifies the traced graph and the propagated shapes of a
+    model, i.e., the type, attributes and tensor shapes of all its sub-modules, the
+    generated code of fx.GraphModules, and the signature of the input
+
+    :param model: the model
+    :type model: nn.Module
+    :param input_example: the input used for shape propagation
+    :type input_example: Any
+    :return: the key, or None if some module attributes cannot be part of a key (e.g.,
+    unhashable objects)
+    :rtype: Optional[Hashable]
+    """
+    modules = []
+    for name, m in model.named_modules():
+        attrs = []
+        for k, v in sorted(vars(m).items()):
+            if k in _SKIPPED_ATTRS:
+                continue
+            ak = _attr_key(v)
+            if ak is _UNKEYABLE:
+                return None
+            attrs.append((k, ak))
+        tensors = tuple((n, _tensor_signature(t)) for n, t in
+                        list(m.named_parameters(recurse=False)) +
+                        list(m.named_buffers(recurse=False)) if t is not None)
+        code = m.code if isinstance(m, fx.GraphModule) else None
+        modules.append((name, type(m), tuple(attrs), tensors, code))
+    return (tuple(modules), _input_signature(input_example))
+
+
+def is_meta_input(x: Any) -> bool:
+    """True if an input example contains meta tensors, i.e., tensors without data"""
+    if isinstance(x, torch.Tensor):
+        return x.is_meta
+    if isinstance(x, (tuple, list)):
+        return any(is_meta_input(e) for e in x)
+    if isinstance(x, dict):
+        return any(is_meta_input(e) for e in x.values())
+    return False
+
+
+def materialize_input(x: Any, device: Optional[torch.device] = None) -> Any:
+    """Replaces the meta tensors of an input example with random tensors of the same shape and
+    type, allocated on a given device. Real tensors are returned unchanged
+
+    :param x: the input example
+    :type x: Any
+    :param device: the device of the new tensors (default: cpu)
+    :type device: Optional[torch.device]
+    :return: the materialized input example
+    :rtype: Any
+    """
+    if isinstance(x, torch.Tensor):
+        if not x.is_meta:
+            return x
+        if x.dtype.is_floating_point:
+            return torch.rand(x.shape, dtype=x.dtype, device=device)
+        return torch.zeros(x.shape, dtype=x.dtype, device=device)
+    if isinstance(x, (tuple, list)):
+        return type(x)(materialize_input(e, device) for e in x)
+    if isinstance(x, dict):
+        return {k: materialize_input(v, device) for k, v in x.items()}
+    return x
+
+
+def module_device(model: nn.Module) -> torch.device:
+    """Returns the device of the first parameter (or buffer) of a module, or cpu"""
+    for t in model.parameters():
+        return t.device
+    for t in model.buffers():
+        return t.device
+    return torch.device('cpu')
+
+
+class _FakeShapeProp(fx.Interpreter):
+    """Same as ShapeProp, but runs the graph on fake tensors, i.e., without allocating
+    activations or performing any actual computation. The parameters of the module are
+    converted to fake tensors on-the-fly, without copies"""
+    def run_node(self, n: fx.Node) -> Any:
+        result = super().run_node(n)
+        found_tensor = False
+
+        def extract_tensor_meta(obj: Any) -> Any:
+            nonlocal found_tensor
+            if isinstance(obj, torch.Tensor):
+                found_tensor = True
+                return _extract_tensor_metadata(obj)
+            return obj
+
+        meta = map_aggregate(result, extract_tensor_meta)
+        if found_tensor:
+            n.meta['tensor_meta'] = meta
+        n.meta['type'] = type(result)
+        return result
+
+
+@contextmanager
+def _preserved_module_state(mod: nn.Module):
+    """Restores the attributes, parameters and buffers of all sub-modules on exit, so that
+    fake tensors created during a forward pass (e.g. cached intermediate values) do not leak
+    into the model"""
+    saved = [(m, dict(vars(m)), dict(m._parameters), dict(m._buffers)) for m in mod.modules()]
+    try:
+        yield
+    finally:
+        for m, attrs, params, buffers in saved:
+            vars(m).clear()
+            vars(m).update(attrs)
+            m._parameters.clear()
+            m._parameters.update(params)
+            m._buffers.clear()
+            m._buffers.update(buffers)
+
+
+def _fake_inputs(x: Any, device: torch.device) -> Any:
+    """Converts meta tensors to (fake) empty tensors on a given device. Must be called within a
+    FakeTensorMode context"""
+    if isinstance(x, torch.Tensor):
+        return torch.empty(x.shape, dtype=x.dtype, device=device)
+    if isinstance(x, (tuple, list)):
+        return type(x)(_fake_inputs(e, device) for e in x)
+    if isinstance(x, dict):
+        return {k: _fake_inputs(v, device) for k, v in x.items()}
+    return x
+
+
+def propagate_shapes(mod: fx.GraphModule, input_example: Any):
+    """Annotates each node of a graph with the shape and type of its output ('tensor_meta').
+
+    When the input example contains meta tensors, the propagation is performed on fake
+    tensors, and therefore costs no memory or computation for activations. If the model
+    contains operations that cannot be executed on fake tensors (e.g., data-dependent control
+    flow), it falls back to a standard propagation with random inputs
+
+    :param mod: the module to be annotated
+    :type mod: fx.GraphModule
+    :param input_example: the input example (a tuple for multi-input models)
+    :type input_example: Any
+    """
+    multi_input = len(get_graph_inputs(mod.graph)) > 1
+    if is_meta_input(input_example):
+        # lazy import to avoid loading torch internals when not needed
+        from torch._subclasses.fake_tensor import FakeTensorMode
+        try:
+            with _preserved_module_state(mod), FakeTensorMode(allow_non_fake_inputs=True):
+                x = _fake_inputs(input_example, module_device(mod))
+                if multi_input:
+                    _FakeShapeProp(mod).run(*x)
+                else:
+                    _FakeShapeProp(mod).run(x)
+            return
+        except Exception:
+            input_example = materialize_input(input_example, module_device(mod))
+    if multi_input:
+        ShapeProp(mod).propagate(*input_example)
+    else:
+        ShapeProp(mod).propagate(input_example)
+
+
+def _copy_graph(graph: fx.Graph) -> fx.Graph:
+    """Copies a graph, including (a shallow copy of) the metadata of each node"""
+    new_graph = fx.Graph()
+    val_map = {}
+    out, old_output = new_graph.graph_copy(graph, val_map, return_output_node=True)
+    new_output = new_graph.output(out, old_output.type)
+    new_output.meta = copy.copy(old_output.meta)
+    return new_graph
+
+
+def trace_and_annotate(model: nn.Module, input_example: Any, tracer_cls: Type[fx.Tracer],
+                       annotations: Sequence[AnnotationFn] = ()) -> fx.GraphModule:
+    """Symbolically traces a model with a given tracer, propagates tensor shapes through
+    the traced graph and applies a sequence of annotation passes. The model is set in eval
+    mode before tracing.
+
+    The annotated graph is cached, using as key the structure of the model and the input
+    signature (see `structural_key`), so that repeated conversions of the same architecture
+    (e.g. multiple exports) only need to copy it. Models with attributes that cannot be part
+    of the key are traced every time. The returned fx.GraphModule always owns a
+    fresh copy of the graph, and can therefore be transformed freely.
+
+    :param model: the model to be traced
+    :type model: nn.Module
+    :param input_example: an input used for shape propagation (a tuple for multi-input models).
+    Meta tensors can be used to propagate shapes without computation (see `propagate_shapes`)
+    :type input_example: Any
+    :param tracer_cls: the fx.Tracer sub-class used for tracing
+    :type tracer_cls: Type[fx.Tracer]
+    :param annotations: the annotation passes applied after shape propagation
+    :type annotations: Sequence[AnnotationFn]
+    :return: the traced and annotated module
+    :rtype: fx.GraphModule
+    """
+    model = model.eval()
+    name = model.__class__.__name__
+    skey = structural_key(model, input_example)
+    key = (tracer_cls, tuple(annotations), skey)
+    template = _trace_cache.get(key) if skey is not None else None
+    if template is not None:
+        _trace_cache.move_to_end(key)
+        try:
+            return fx.GraphModule(model, _copy_graph(template), name)
+        except AttributeError:
+            # the graph references attributes created on the root by the tracer (e.g.
+            # tensor constants), which are not present in this instance of the model
+            del _trace_cache[key]
+    tracer = tracer_cls()
+    graph = tracer.trace(model)
+    mod = fx.GraphModule(tracer.root, graph, name)
+    propagate_shapes(mod, input_example)
+    for annotate in annotations:
+        annotate(mod)
+    if TRACE_CACHE_SIZE > 0 and skey is not None:
+        _trace_cache[key] = _copy_graph(mod.graph)
+        while len(_trace_cache) > TRACE_CACHE_SIZE:
+            _trace_cache.popitem(last=False)
+    return mod
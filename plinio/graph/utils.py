@@ -16,22 +16,32 @@
 # *                                                                            *
 # * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
 # *----------------------------------------------------------------------------*
-from typing import Any, List, Tuple
+from typing import Any, List, Tuple, TYPE_CHECKING
 import torch.nn as nn
 import torch.fx as fx
-import networkx as nx
+
+if TYPE_CHECKING:
+    import networkx as nx
 
 # type alias for brevity
 NamedLeafModules = List[Tuple[str, fx.Node, nn.Module]]
 
 
-def fx_to_nx_graph(fx_graph: fx.Graph) -> nx.DiGraph:
+def fx_to_nx_graph(fx_graph: fx.Graph) -> 'nx.DiGraph':
     """Transforms a `torch.fx.Graph` into an equivalent `networkx.DiGraph` for easier analysis.
+    Requires the optional networkx dependency. Internal passes use the lighter
+    `plinio.graph.index.GraphIndex` instead.
+
     :param fx_graph: the `torch.fx.Graph` instance.
     :type fx_graph: fx.Graph
+    :raises ImportError: if networkx is not installed
     :return: the corresponding `networkx.DiGraph`
     :rtype: nx.DiGraph
     """
+    try:
+        import networkx as nx
+    except ImportError:
+        raise ImportError("fx_to_nx_graph requires networkx (pip install networkx)")
     nx_graph = nx.DiGraph()
     for n in fx_graph.nodes:
         for i in n.all_input_nodes:
@@ -0,0 +1,66 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+from typing import Any, Dict, List
+import importlib
+import sys
+import types
+
+
+class LazyModule(types.ModuleType):
+    """A package module whose public objects are imported from their sub-modules only on first
+    access (PEP 562), so that importing the package itself is cheap.
+
+    The import system binds each loaded sub-module as an attribute of its package. When a
+    sub-module has the same name as the object it exports (e.g., `plinio.cost.params`), the
+    binding is redirected to the object, consistently with an eager `from .params import params`.
+    """
+    _lazy_attrs: Dict[str, str]
+
+    def __getattr__(self, name: str) -> Any:
+        submodule = self._lazy_attrs.get(name)
+        if submodule is None:
+            raise AttributeError(f"module {self.__name__!r} has no attribute {name!r}")
+        value = getattr(importlib.import_module(submodule, self.__name__), name)
+        setattr(self, name, value)
+        return value
+
+    def __setattr__(self, name: str, value: Any):
+        if (isinstance(value, types.ModuleType) and
+                self._lazy_attrs.get(name) == '.' + name and
+                value.__name__ == self.__name__ + '.' + name):
+            value = getattr(value, name)
+        super().__setattr__(name, value)
+
+    def __dir__(self) -> List[str]:
+        return sorted(set(super().__dir__()) | set(self._lazy_attrs))
+
+
+def make_lazy(module_name: str, lazy_attrs: Dict[str, str]):
+    """Turns an already imported package into a `LazyModule`
+
+    :param module_name: the name of the package (i.e., `__name__` in its `__init__.py`)
+    :type module_name: str
+    :param lazy_attrs: a map from each lazily loaded object to the (relative) name of the
+    sub-module that defines it
+    :type lazy_attrs: Dict[str, str]
+    """
+    module = sys.modules[module_name]
+    # must be set before changing the class, since __setattr__ depends on it
+    module.__dict__['_lazy_attrs'] = lazy_attrs
+    module.__class__ = LazyModule
@@ -16,10 +16,23 @@
 # *                                                                            *
 # * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
 # *----------------------------------------------------------------------------*
-from .dnas_base import DNAS
-from .pit import PIT
-from .supernet import SuperNet
-from .mps import MPS
-from .odimo_mps import ODiMO_MPS
+from typing import TYPE_CHECKING
+from plinio.lazy import make_lazy
+
+if TYPE_CHECKING:
+    from .dnas_base import DNAS
+    from .pit import PIT
+    from .supernet import SuperNet
+    from .mps import MPS
+    from .odimo_mps import ODiMO_MPS
+
+# NAS methods are imported on first access, to keep `import plinio.methods` cheap
+make_lazy(__name__, {
+    'DNAS': '.dnas_base',
+    'PIT': '.pit',
+    'SuperNet': '.supernet',
+    'MPS': '.mps',
+    'ODiMO_MPS': '.odimo_mps',
+})
 
 __all__ = ['DNAS', 'PIT', 'SuperNet', 'MPS', 'ODiMO_MPS']
@@ -18,10 +18,16 @@
 # *----------------------------------------------------------------------------*
 
 from abc import abstractmethod
-from typing import Any, Dict, Iterator, Optional, Tuple, Union, cast
-from plinio.cost import CostSpec, CostFn
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, Union, cast
+from plinio.cost import CostSpec, CostFn, PeakMemorySpec
+from plinio.cost.cost_spec import cost_spec_zero_fn
+from plinio.cost.pattern import Pattern
+from plinio.graph.utils import NamedLeafModules
+from plinio.graph.liveness import ActivationLiveness
+from plinio.graph.tracing import materialize_input
 import torch
 import torch.nn as nn
+import torch.fx as fx
 from warnings import warn
 
 
@@ -36,7 +42,8 @@ class DNAS(nn.Module):
     for symbolic tracing (default: None)
     :type input_example: Optional[Any]
     :param input_shape: the shape of an input tensor, without batch size, used as an
-    alternative to input_example to generate a random input for symbolic tracing (default: None)
+    alternative to input_example for symbolic tracing. Shapes are then propagated on meta
+    tensors, i.e. without allocating activations or performing any computation (default: None)
     :type input_shape: Optional[Tuple[int, ...]]
     """
     @abstractmethod
@@ -51,6 +58,8 @@ class DNAS(nn.Module):
         self._cost_specification = cost
         self._input_example = self._resolve_input_example(input_example, input_shape)
         self._cost_fn_map = {}
+        self._cost_cache = {}
+        self._full_cost = False
 
     @abstractmethod
     def forward(self, *args: Any) -> torch.Tensor:
@@ -69,6 +78,46 @@ class DNAS(nn.Module):
     @cost_specification.setter
     def cost_specification(self, cs: Union[CostSpec, Dict[str, CostSpec]]):
         self._cost_specification = cs
+        self._invalidate_cost_cache()
+
+    @property
+    def full_cost(self) -> bool:
+        """Returns True if the cost model is applied to the entire network, rather than just to
+        the NAS-able layers
+
+        :return: True if the cost model is applied to the entire network
+        :rtype: bool
+        """
+        return self._full_cost
+
+    @full_cost.setter
+    def full_cost(self, value: bool):
+        """Set to True to apply the cost model to the entire network, rather than just to
+        the NAS-able layers
+
+        :param value: True to apply the cost model to the entire network
+        :type value: bool
+        """
+        self._full_cost = value
+        self._invalidate_cost_cache()
+
+    @property
+    def _leaf_modules(self) -> NamedLeafModules:
+        return self._named_leaf_modules
+
+    @_leaf_modules.setter
+    def _leaf_modules(self, nlf: NamedLeafModules):
+        self._named_leaf_modules = nlf
+        self._invalidate_cost_cache()
+
+    @property
+    def _unique_leaf_modules(self) -> NamedLeafModules:
+        return self._named_unique_leaf_modules
+
+    @_unique_leaf_modules.setter
+    def _unique_leaf_modules(self, ulf: NamedLeafModules):
+        self._named_unique_leaf_modules = ulf
+        self._invalidate_cost_cache()
 
     @property
     def cost(self) -> torch.Tensor:
@@ -119,6 +168,8 @@ class DNAS(nn.Module):
             cost_fn_map = self._cost_fn_map[name]
         cost_spec = cast(CostSpec, cost_spec)
         cost_fn_map = cast(Dict[str, CostFn], cost_fn_map)
+        if isinstance(cost_spec, PeakMemorySpec):
+            return self._get_peak_memory(cost_spec, cost_fn_map)
         return self._get_single_cost(cost_spec, cost_fn_map)
 
     @abstractmethod
@@ -132,6 +183,62 @@ class DNAS(nn.Module):
         """
         raise NotImplementedError("Trying to compute cost on base DNAS class")
 
+    def _get_peak_memory(self, cost_spec: PeakMemorySpec,
+                         cost_fn_map: Dict[str, CostFn]) -> torch.Tensor:
+        """Computes the peak activation memory of the current architecture. The liveness
+        analysis only depends on the graph topology and is therefore cached
+
+        :param cost_spec: the peak memory cost specification
+        :type cost_spec: PeakMemorySpec
+        :param cost_fn_map: the {layer name, cost function} map for the cost specification
+        :type cost_fn_map: Dict[str, CostFn]
+        :return: a scalar tensor with the peak memory in bytes
+        :rtype: torch.Tensor
+        """
+        seed = cast(fx.GraphModule, getattr(self, 'seed'))
+        liveness = self._cached_cost_data(
+            cost_spec, cost_fn_map, lambda *_: ActivationLiveness(seed))
+        sizes = cost_spec.buffer_bytes(seed, liveness.buffers, self._activation_bits)
+        return liveness.peak(sizes)
+
+    def _activation_bits(self, n: fx.Node) -> Optional[torch.Tensor]:
+        """NAS-specific bit-width of the activation produced by a node, used by the peak
+        memory cost. None if the bit-width is not set by the NAS
+
+        :param n: the target node
+        :type n: fx.Node
+        :return: the (possibly differentiable) bit-width, or None
+        :rtype: Optional[torch.Tensor]
+        """
+        return None
+
+    def _invalidate_cost_cache(self):
+        """Drops all pre-computed cost data. Must be called whenever the cost specification,
+        the full_cost flag or the lists of leaf modules change"""
+        self._cost_cache = {}
+
+    def _cached_cost_data(self, cost_spec: CostSpec, cost_fn_map: Dict[str, CostFn],
+                          builder: Callable[[CostSpec, Dict[str, CostFn]], Any]) -> Any:
+        """Returns NAS-specific pre-computed data for a cost metric (e.g. the constant cost of
+        non NAS-able layers), calling `builder` to generate them if not found in the cache
+
+        :param cost_spec: the cost specification
+        :type cost_spec: CostSpec
+        :param cost_fn_map: the {layer name, cost function} map for the cost specification
+        :type cost_fn_map: Dict[str, CostFn]
+        :param builder: the function that generates the data on a cache miss
+        :type builder: Callable[[CostSpec, Dict[str, CostFn]], Any]
+        :return: the cached data
+        :rtype: Any
+        """
+        key = (id(cost_fn_map), cost_spec.shared)
+        cached = self._cost_cache.get(key)
+        # the map is stored in the cache to make sure that its id() is not re-used
+        if cached is None or cached[0] is not cost_fn_map:
+            cached = (cost_fn_map, builder(cost_spec, cost_fn_map))
+            self._cost_cache[key] = cached
+        return cached[1]
+
     def _create_cost_fn_map(self) -> Union[Dict[str, CostFn], Dict[str, Dict[str, CostFn]]]:
         """Private method to define a map from layers to cost value(s)"""
         if isinstance(self._cost_specification, dict):
@@ -142,6 +249,44 @@ class DNAS(nn.Module):
             cost_fn_maps = self._single_cost_fn_map(self._cost_specification)
         return cost_fn_maps
 
+    def _apply_fused_patterns(self, c: CostSpec, cost_fn_map: Dict[str, CostFn],
+                              layer_types: Dict[str, Pattern]) -> Dict[str, CostFn]:
+        """Updates a {layer name, cost function} map with the fused patterns of a CostSpec.
+        The first layer of each matched chain gets the fused cost function, while the others
+        get a zero cost, since they are executed within the same kernel
+
+        :param c: the cost specification
+        :type c: CostSpec
+        :param cost_fn_map: the per-layer {layer name, cost function} map
+        :type cost_fn_map: Dict[str, CostFn]
+        :param layer_types: the original (i.e. non-NAS) type of each layer
+        :type layer_types: Dict[str, Pattern]
+        :return: the updated map
+        :rtype: Dict[str, CostFn]
+        """
+        if len(c.fused_patterns) == 0:
+            return cost_fn_map
+        seed = cast(fx.GraphModule, getattr(self, 'seed'))
+
+        def kind(n: fx.Node) -> Any:
+            if n.op == 'call_module':
+                return layer_types.get(str(n.target), type(seed.get_submodule(str(n.target))))
+            if n.op in ('call_function', 'call_method'):
+                return n.target
+            return None
+
+        def spec(n: fx.Node) -> Dict[str, Any]:
+            return vars(seed.get_submodule(str(n.target)))
+
+        for anchor, (cost_fn, chain) in c.match(seed.graph, kind, spec).items():
+            if str(anchor.target) not in cost_fn_map:
+                continue
+            cost_fn_map[str(anchor.target)] = cost_fn
+            for n in chain[1:]:
+                if n.op == 'call_module' and str(n.target) in cost_fn_map:
+                    cost_fn_map[str(n.target)] = cost_spec_zero_fn
+        return cost_fn_map
+
     @abstractmethod
     def _single_cost_fn_map(self, c: CostSpec) -> Dict[str, CostFn]:
         """NAS-specific creator of {layertype, cost_fn} maps based on a CostSpec.
@@ -228,6 +373,11 @@ class DNAS(nn.Module):
         for _, param in self.named_net_parameters(recurse=recurse):
             yield param
 
+    def _dummy_input(self) -> Any:
+        """Returns an input example that can be used for an actual forward pass, replacing
+        the meta tensors generated from `input_shape` with random ones"""
+        return materialize_input(self._input_example, self._device)
+
     def _resolve_input_example(self, example, shape):
         """Selects between using input_example and input_shape, with sanity checks"""
         if example is None and shape is None:
@@ -241,8 +391,9 @@ class DNAS(nn.Module):
             return example
         if shape is not None:
             try:
-                # create a "fake" minibatch of 1 input for shape prop
-                example = torch.stack([torch.rand(shape)] * 1, 0).to(self._device)
+                # create a "fake" minibatch of 1 input for shape prop. Meta tensors have no
+                # data, so that shapes are propagated without any actual computation
+                example = torch.empty((1,) + tuple(shape), device='meta')
                 return example
             except TypeError:
                 msg = ('If the provided `input_shape` is not a simple tuple '
@@ -19,12 +19,11 @@
 
 import copy
 import operator
-from typing import cast, Iterable, Type, Tuple, Optional, Dict, Callable, Any, Union
-import networkx as nx
+from collections import Counter
+from typing import cast, Iterable, Type, Tuple, Optional, Dict, Callable, Any, Union, List
 import torch
 import torch.nn as nn
 import torch.fx as fx
-from torch.fx.passes.shape_prop import ShapeProp
 
 from plinio.methods.mps.nn import MPSLinear, MPSConv1d, MPSConv2d, MPSIdentity, \
     MPSModule, MPSAdd
@@ -34,9 +33,12 @@ from plinio.graph.inspection import is_layer, get_graph_outputs, is_inherited_la
     get_graph_inputs, is_function, named_leaf_modules, uniquify_leaf_modules
 from plinio.graph.transformation import fuse_consecutive_layers
 from plinio.graph.features_calculation import ModAttrFeaturesCalculator
-from plinio.graph.utils import fx_to_nx_graph, NamedLeafModules
+from plinio.graph.tracing import trace_and_annotate, materialize_input, module_device
+from plinio.graph.index import GraphIndex
+from plinio.graph.utils import NamedLeafModules
 from .nn.qtz import MPSType, MPSPerLayerQtz, MPSPerChannelQtz, MPSBiasQtz
-from .quant.quantizers import DummyQuantizer
+from .quant.quantizers import DummyQuantizer, MixPrecWeight
+from .quant.nn import QuantConv1d, QuantConv2d, QuantLinear, QuantIdentity
 
 # add new supported layers here:
 mps_layer_map: Dict[Type[nn.Module], Type[MPSModule]] = {
@@ -70,7 +72,8 @@ def convert(model: nn.Module,
             qinfo: Dict = {},
             exclude_names: Iterable[str] = (),
             exclude_types: Iterable[Type[nn.Module]] = (),
-            disable_shared_quantizers: bool = False
+            disable_shared_quantizers: bool = False,
+            single_kernel: bool = False
             ) -> Tuple[nn.Module, NamedLeafModules, NamedLeafModules]:
     """Converts a nn.Module, to/from "NAS-able" format for the mixed-precision search method
 
@@ -98,6 +101,9 @@ def convert(model: nn.Module,
     :param disable_shared_quantizers: a boolean to indicate whether to disable the quantizers
     sharing. It can be useful if precision '0' is in not in the search options.
     :type disable_shared_quantizers: bool
+    :param single_kernel: whether to export layers with per-channel precisions as a single
+    layer, with output channels grouped by precision. Used only in 'export' mode.
+    :type single_kernel: bool
     :raises ValueError: for unsupported conversion types
     :return: the converted model, and two lists of all (or all unique) leaf modules for
     the NAS
@@ -106,26 +112,22 @@ def convert(model: nn.Module,
     if conversion_type not in ('import', 'autoimport', 'export'):
         raise ValueError("Unsupported conversion type {}".format(conversion_type))
 
-    # Symbolic Tracing
-    tracer = MPSTracer()
-    graph = tracer.trace(model.eval())
-    name = model.__class__.__name__
-    mod = fx.GraphModule(tracer.root, graph, name)
-    if len(get_graph_inputs(mod.graph)) > 1:
-        ShapeProp(mod).propagate(*input_example)
-    else:
-        ShapeProp(mod).propagate(input_example)
-    add_node_properties(mod)
+    # Symbolic Tracing (cached)
+    mod = trace_and_annotate(model, input_example, MPSTracer, [add_node_properties])
     if conversion_type in ('autoimport', 'import'):
         fuse_mps_modules(mod)
     # Dictionary of shared quantizers. Used only in 'autoimport' mode.
     sq_dict = {} if conversion_type != 'autoimport' else build_shared_mps_qtz_map(
             mod, w_search_type, qinfo, disable_shared_quantizers)
-    convert_layers(mod, conversion_type, qinfo, sq_dict, exclude_names, exclude_types)
+    convert_layers(mod, conversion_type, qinfo, sq_dict, exclude_names, exclude_types,
+                   single_kernel)
+    if conversion_type == 'export' and single_kernel:
+        group_mixprec_channels(mod)
     if conversion_type in ('autoimport', 'import'):
         add_input_quantizer(mod, qinfo)
-        add_features_calculator(mod, [mps_features_calc])
-        associate_input_features(mod)
+        index = GraphIndex(mod.graph)
+        add_features_calculator(mod, [mps_features_calc], index)
+        associate_input_features(mod, index)
         register_input_features(mod)
         register_in_mps_quantizers(mod)
     mod.graph.lint()
@@ -134,10 +136,11 @@ def convert(model: nn.Module,
     ulf = uniquify_leaf_modules(nlf)
     # Final dummy inference needed to update eventually quantizers' parameters
     with torch.no_grad():
+        x = materialize_input(input_example, module_device(model))
         if len(get_graph_inputs(mod.graph)) > 1:
-            mod.to(input_example[0].device)(*input_example)
+            mod.to(x[0].device)(*x)
         else:
-            mod.to(input_example.device)(input_example)
+            mod.to(x.device)(x)
     return mod, nlf, ulf
 
 
@@ -147,6 +150,7 @@ def convert_layers(mod: fx.GraphModule,
                    sq_dict: Dict,
                    exclude_names: Iterable[str],
                    exclude_types: Iterable[Type[nn.Module]],
+                   single_kernel: bool = False
                    ):
     """Replaces target layers with their NAS-able version, or vice versa. Layer conversion
     is implemented as a reverse BFS on the model graph.
@@ -165,21 +169,15 @@ def convert_layers(mod: fx.GraphModule,
     :type exclude_names: Iterable[str], optional
     :param exclude_types: the types of `model` submodules that should be ignored by the NAS
     :type exclude_types: Iterable[Type[nn.Module]], optional
+    :param single_kernel: whether to export layers with per-channel precisions as a single layer
+    :type single_kernel: bool
     """
     g = mod.graph
-    queue = get_graph_outputs(g)
-    visited = []
-    while queue:
-        n = queue.pop(0)
-        if n in visited:
-            continue
+    for n in GraphIndex(g).bfs(get_graph_outputs(g), reverse=True):
         if conversion_type == 'autoimport':
             autoimport_node(n, mod, qinfo, sq_dict, exclude_names, exclude_types)
         if conversion_type == 'export':
-            export_node(n, mod, exclude_names, exclude_types)
-        for pred in n.all_input_nodes:
-            queue.append(pred)
-        visited.append(n)
+            export_node(n, mod, exclude_names, exclude_types, single_kernel)
     return
 
 
@@ -211,18 +209,15 @@ def build_shared_mps_qtz_map(mod: fx.GraphModule,
     # build a compatibility graph ("sharing graph") with paths between all nodes that must share
     # the same features masker. This is obtained by taking the original NN graph and removing
     # incoming edges to nodes whose output features are not dependent on the input features
-    sharing_graph = fx_to_nx_graph(mod.graph)
-    for n in sharing_graph.nodes:
-        n = cast(fx.Node, n)
-        if n.meta['untouchable'] or n.meta['features_defining']:
-            # remove all incoming edges to this node from the "shared features graph"
-            pred = list(sharing_graph.predecessors(n))
-            for i in pred:
-                sharing_graph.remove_edge(i, n)
+    index = GraphIndex(mod.graph)
+    outputs = set(get_graph_outputs(mod.graph))
+
+    def cut_inputs(n: fx.Node) -> bool:
+        return n.meta['untouchable'] or n.meta['features_defining']
 
     # each weakly connected component of the sharing graph must share the same quantizers
     sq_dict = {}
-    for c in nx.weakly_connected_components(sharing_graph):
+    for c in index.weakly_connected_components(cut_inputs):
         sq_a = None
         sq_w = None
         # This ensures to work at every iteration with a 'fresh' dict
@@ -258,7 +253,7 @@ def build_shared_mps_qtz_map(mod: fx.GraphModule,
                        sq_w = MPSPerChannelQtz(w_mps_precision,
                                                w_quantizer,
                                                w_quantizer_kwargs)
-            if n in get_graph_outputs(mod.graph):
+            if n in outputs:
                 # distinguish the case in which the number of features must "frozen"
                 # i.e., the case of input-connected or output-connected components,
                 # this may overwrite previously set "sq_w" and "sq_a"
@@ -396,7 +391,8 @@ def autoimport_node(n: fx.Node,
 
 def export_node(n: fx.Node, mod: fx.GraphModule,
                 exclude_names: Iterable[str],
-                exclude_types: Iterable[Type[nn.Module]]):
+                exclude_types: Iterable[Type[nn.Module]],
+                single_kernel: bool = False):
     """Rewrites a fx.GraphModule node replacing a sub-module instance corresponding to a NAS-able
     layer with its corresponder quant.nn counterpart
 
@@ -409,12 +405,85 @@ def export_node(n: fx.Node, mod: fx.GraphModule,
     :type exclude_names: Iterable[str], optional
     :param exclude_types: the types of `model` submodules that should be ignored by the NAS
     :type exclude_types: Iterable[Type[nn.Module]], optional
+    :param single_kernel: whether to export layers with per-channel precisions as a single layer
+    :type single_kernel: bool
     """
     if is_inherited_layer(n, mod, (MPSModule,)):
         if exclude(n, mod, exclude_names, exclude_types):
             return
         layer = cast(MPSModule, mod.get_submodule(str(n.target)))
-        layer.export(n, mod)
+        layer.export(n, mod, single_kernel)
+
+
+def group_mixprec_channels(mod: fx.GraphModule):
+    """Permutes the output channels of the exported layers with a channel-wise mixed-precision
+    weight quantizer, so that channels with the same precision are contiguous, and the input
+    channels of the following layers accordingly.
+
+    Grouped (e.g., depthwise) convolutions, and layers whose outputs reach an operation other
+    than single-input, features-propagating ones (activations, pooling, etc.), flatten or a
+    (non-grouped) quantized conv/linear layer, e.g. an addition or the network output, keep
+    their original channels order.
+
+    :param mod: the exported module
+    :type mod: fx.GraphModule
+    """
+    targets = Counter(str(n.target) for n in mod.graph.nodes if n.op == 'call_module')
+    for n in mod.graph.nodes:
+        if n.op != 'call_module' or targets[str(n.target)] > 1:
+            continue
+        layer = mod.get_submodule(str(n.target))
+        if not isinstance(layer, (QuantConv1d, QuantConv2d, QuantLinear)) or \
+                not isinstance(layer.w_quantizer, MixPrecWeight):
+            continue
+        # in grouped convolutions, output channels are tied to input ones
+        if getattr(layer, 'groups', 1) != 1:
+            continue
+        perm = torch.sort(torch.tensor(layer.w_quantizer.precision), stable=True).indices
+        if torch.equal(perm, torch.arange(len(perm))):
+            continue
+        consumers = _permuted_consumers(n, mod, perm, targets)
+        if consumers is None:
+            continue
+        with torch.no_grad():
+            layer.weight.data = layer.weight.data[perm.to(layer.weight.device)]
+            if layer.bias is not None:
+                layer.bias.data = layer.bias.data[perm.to(layer.bias.device)]
+            layer.w_quantizer.permute(perm)
+            for consumer, p in consumers:
+                consumer.weight.data = consumer.weight.data[:, p.to(consumer.weight.device)]
+
+
+def _permuted_consumers(n: fx.Node, mod: fx.GraphModule, perm: torch.Tensor,
+                        targets: Counter) -> Optional[List[Tuple[nn.Module, torch.Tensor]]]:
+    """Returns the layers consuming the output channels of `n`, with the permutation of their
+    input features corresponding to `perm`, or None if it cannot be propagated"""
+    consumers = []
+    queue = [(u, perm) for u in n.users]
+    while queue:
+        m, p = queue.pop(0)
+        if m.op == 'output' or len(m.all_input_nodes) != 1:
+            return None
+        sub = mod.get_submodule(str(m.target)) if m.op == 'call_module' else None
+        if sub is not None and targets[str(m.target)] > 1:
+            return None
+        in_shape = m.all_input_nodes[0].meta['tensor_meta'].shape
+        if isinstance(sub, (QuantConv1d, QuantConv2d)) and sub.groups == 1 or \
+                isinstance(sub, QuantLinear) and len(in_shape) == 2:
+            consumers.append((sub, p))
+        elif m.meta['flatten']:
+            size = int(torch.tensor(in_shape[2:], dtype=torch.long).prod())
+            if m.meta['tensor_meta'].shape[1:] != (len(p) * size,):
+                return None
+            p = (p.unsqueeze(1) * size + torch.arange(size)).flatten()
+            queue.extend((u, p) for u in m.users)
+        elif isinstance(sub, QuantIdentity) or (
+                m.meta['features_propagating'] and not m.meta['squeeze'] and
+                not isinstance(sub, (nn.BatchNorm1d, nn.BatchNorm2d, nn.Conv1d, nn.Conv2d))):
+            queue.extend((u, p) for u in m.users)
+        else:
+            return None
+    return consumers
 
 
 def add_input_quantizer(mod: fx.GraphModule,
@@ -22,15 +22,17 @@ from typing import Any, Tuple, Type, Iterable, Dict, Iterator, Union, Optional,
 import copy
 import torch
 import torch.nn as nn
+import torch.fx as fx
 
 from plinio.methods.dnas_base import DNAS
 from plinio.cost import CostSpec, CostFn, params_bit
 from plinio.graph.inspection import shapes_dict
 from .graph import convert, mps_layer_map
 from .nn.module import MPSModule
-from .nn.qtz import MPSType
+from .nn.identity import MPSIdentity
+from .nn.qtz import MPSType, MPSBaseQtz
 
-from .quant.quantizers import PACTAct, MinMaxWeight, QuantizerBias
+from .quant.quantizers import PACTAct, MinMaxWeight, QuantizerBias, DummyQuantizer
 
 """Data structure including quantizer information for each layer/input, as well as defaults
 for all other layers/inputs"""
@@ -163,6 +165,10 @@ class MPS(DNAS):
             disable_shared_quantizers)
         self._cost_reduction_fn = cost_reduction_fn
         self._cost_fn_map = self._create_cost_fn_map()
+        # moving average of the loss and number of steps, used by `single_path_loss`
+        self._sp_loss_avg = torch.tensor(0.)
+        self._sp_steps = 0
+        self._single_path = False
         self.update_softmax_options(temperature, hard_softmax, gumbel_softmax, disable_sampling)
         if not hard_softmax:
             self.compensate_weights_values()
@@ -182,6 +188,8 @@ class MPS(DNAS):
         :return: the output tensor
         :rtype: torch.Tensor
         """
+        if self._single_path:
+            self._check_single_path_loss()
         return self.seed.forward(*args)
 
     @property
@@ -192,13 +200,15 @@ class MPS(DNAS):
     def cost_specification(self, cs: Union[CostSpec, Dict[str, CostSpec]]):
         self._cost_specification = cs
         self._cost_fn_map = self._create_cost_fn_map()
+        self._invalidate_cost_cache()
 
     def update_softmax_options(
             self,
             temperature: Optional[float] = None,
             hard: Optional[bool] = None,
             gumbel: Optional[bool] = None,
-            disable_sampling: Optional[bool] = None):
+            disable_sampling: Optional[bool] = None,
+            single_path: Optional[bool] = None):
         """Set the flags to choose between the softmax, the hard and soft Gumbel-softmax
         and the sampling disabling of the architectural coefficients in the quantizers
 
@@ -211,10 +221,74 @@ class MPS(DNAS):
         :param disable_sampling: disable the sampling of the architectural coefficients in the
         forward pass
         :type disable_sampling: Optional[bool]
+        :param single_path: sample a single precision (per layer or per channel) at each training
+        step, and only run the corresponding quantizer. This requires a change in the training
+        loop: the forward pass no longer propagates the task loss gradient to the alpha
+        parameters, which is obtained by adding `single_path_loss(loss)` to the loss of each
+        step. A training forward pass raises a RuntimeError if the previous one was not
+        followed by a call to `single_path_loss`
+        :type single_path: Optional[bool]
         """
         for _, _, layer in self._unique_leaf_modules:
             if isinstance(layer, MPSModule):
-                layer.update_softmax_options(temperature, hard, gumbel, disable_sampling)
+                layer.update_softmax_options(
+                    temperature, hard, gumbel, disable_sampling, single_path)
+        self._single_path = bool(single_path) and not disable_sampling
+
+    def single_path_loss(self, loss: torch.Tensor, baseline_decay: float = 0.9) -> torch.Tensor:
+        """Returns the surrogate loss that provides the gradient of the alpha parameters w.r.t.
+        `loss` in single-path training, where the forward pass only runs the sampled
+        quantizers, and therefore does not propagate gradients to alpha.
+
+        The gradient is the score-function (REINFORCE) estimate (L - b) * grad(log P(sample)),
+        which is unbiased for any (non-linear) loss L. The baseline b is a moving average of
+        the previous losses, which reduces the variance of the estimate without biasing it.
+        The surrogate is 0, so that it can be added to the loss without changing its value.
+        The log-probabilities of the samples of the last forward pass are consumed, so this
+        method must be called once per training step. Outside of single-path training, a
+        constant 0 is returned.
+
+        Example: `loss = task_loss + strength * model.cost`, followed by
+        `(loss + model.single_path_loss(task_loss)).backward()`.
+
+        :param loss: the (task) loss of the current step
+        :type loss: torch.Tensor
+        :param baseline_decay: the decay factor of the baseline moving average
+        :type baseline_decay: float
+        :return: the surrogate loss
+        :rtype: torch.Tensor
+        """
+        log_prob = []
+        for m in self._sp_quantizers():
+            if m.training and m.sp_log_prob is not None:
+                log_prob.append(m.sp_log_prob)
+            m.sp_log_prob = None
+        if len(log_prob) == 0:
+            return torch.zeros((), device=loss.device)
+        log_prob = torch.stack(log_prob).sum()
+        loss = loss.detach()
+        # the baseline only depends on previous steps, so that the estimate is unbiased.
+        # The moving average is bias-corrected, as it is initialized to 0
+        loss_avg = self._sp_loss_avg.to(loss.device)
+        baseline = loss_avg / (1 - baseline_decay ** self._sp_steps) if self._sp_steps > 0 \
+            else torch.zeros_like(loss)
+        self._sp_loss_avg = baseline_decay * loss_avg + (1 - baseline_decay) * loss
+        self._sp_steps += 1
+        return (loss - baseline) * (log_prob - log_prob.detach())
+
+    def _sp_quantizers(self) -> Iterator[MPSBaseQtz]:
+        """Returns an iterator over the quantizers that use single-path sampling"""
+        for m in self.seed.modules():
+            if isinstance(m, MPSBaseQtz) and m.single_path:
+                yield m
+
+    def _check_single_path_loss(self):
+        """Raises a RuntimeError if the samples of the previous training step were not consumed
+        by `single_path_loss`, in which case alpha would only be trained by the cost"""
+        if any(m.sp_log_prob is not None for m in self._sp_quantizers()):
+            raise RuntimeError(
+                "Single-path sampling requires adding `single_path_loss(loss)` to the loss of "
+                "each training step, but it was not called after the previous forward pass")
 
     def compensate_weights_values(self):
         """Modify the initial weight values of MPSModules compensating the possible presence of
@@ -223,16 +297,22 @@ class MPS(DNAS):
             if isinstance(layer, MPSModule):
                 layer.compensate_weights_values()
 
-    def export(self):
+    def export(self, single_kernel: bool = False):
         """Export the architecture found by the NAS as a `quant.nn` module
 
         The returned model will have the trained weights found during the search filled in, but
         should be fine-tuned for optimal results.
 
+        :param single_kernel: whether to export layers with per-channel weight precisions as a
+        single layer with a channel-wise mixed-precision weight quantizer, instead of one layer
+        per precision. When possible, output channels are grouped by precision, and the input
+        channels of the following layers are permuted accordingly
+        :type single_kernel: bool
         :return: the precision-assignement found by the NAS
         :rtype: Dict[str, Dict[str, Any]]
         """
-        mod, _, _ = convert(self.seed, self._input_example, 'export')
+        mod, _, _ = convert(self.seed, self._input_example, 'export',
+                            single_kernel=single_kernel)
         return mod
 
     def summary(self) -> Dict[str, Dict[str, Any]]:
@@ -316,23 +396,48 @@ class MPS(DNAS):
     def _get_single_cost(self, cost_spec: CostSpec,
                          cost_fn_map: Dict[str, CostFn]) -> torch.Tensor:
         """Private method to compute a single cost value"""
-        cost = torch.tensor(0, dtype=torch.float32)
+        cost = self._cached_cost_data(cost_spec, cost_fn_map, self._constant_cost)
         target_list = self._unique_leaf_modules if cost_spec.shared else self._leaf_modules
         for lname, node, layer in target_list:
             if isinstance(layer, MPSModule):
                 l_cost = layer.get_cost(cost_fn_map[lname], shapes_dict(node))
                 cost = cost + self._cost_reduction_fn(l_cost)
-            elif self.full_cost:
-                # TODO: this is constant and can be pre-computed for efficiency
-                # TODO: should we add default bitwidth and format for non-MPS layers or not?
-                v = vars(layer)
-                v.update(shapes_dict(node))
-                cost = cost + cost_fn_map[lname](v)
         return cost
 
+    def _constant_cost(self, cost_spec: CostSpec,
+                       cost_fn_map: Dict[str, CostFn]) -> torch.Tensor:
+        """Private method to compute the (constant) cost of non-MPS layers, only included
+        when full_cost is True"""
+        cost = torch.tensor(0, dtype=torch.float32)
+        if not self.full_cost:
+            return cost
+        target_list = self._unique_leaf_modules if cost_spec.shared else self._leaf_modules
+        with torch.no_grad():
+            for lname, node, layer in target_list:
+                if not isinstance(layer, MPSModule):
+                    # TODO: should we add default bitwidth and format for non-MPS layers or not?
+                    v = dict(vars(layer))
+                    v.update(shapes_dict(node))
+                    cost = cost + cost_fn_map[lname](v)
+        return cost
+
+    def _activation_bits(self, n: fx.Node) -> Optional[torch.Tensor]:
+        """Private method returning the effective (differentiable) bit-width of the
+        activation produced by a MPS layer, used by the peak memory cost"""
+        if n.op != 'call_module':
+            return None
+        layer = self.seed.get_submodule(str(n.target))
+        qtz = getattr(layer, 'out_mps_quantizer', None)
+        if not isinstance(layer, MPSModule) or qtz is None:
+            return None
+        if all(isinstance(q, DummyQuantizer) for q in qtz.qtz_funcs):
+            # non-quantized output (e.g. last layer)
+            return torch.tensor(32.)
+        return qtz.effective_precision
+
     def _single_cost_fn_map(self, c: CostSpec) -> Dict[str, CostFn]:
         """MPS-specific creator of {layertype, cost_fn} maps based on a CostSpec."""
-        cost_fn_map = {}
+        names, keys = [], []
         for lname, _, layer in self._unique_leaf_modules:
             if isinstance(layer, MPSModule):
                 # get original layer type from MPSModule type
@@ -352,8 +457,15 @@ class MPS(DNAS):
                     t = nn.Module
             else:
                 t = type(layer)
-            cost_fn_map[lname] = c[(t, vars(layer))]
-        return cost_fn_map
+            names.append(lname)
+            keys.append((t, vars(layer)))
+        types = dict(zip(names, [k[0] for k in keys]))
+        # activation quantizers (including the ones after an add) are not separate kernels at
+        # inference time, so they should not break fused patterns
+        for lname, _, layer in self._unique_leaf_modules:
+            if isinstance(layer, MPSIdentity):
+                types[lname] = nn.Identity
+        return self._apply_fused_patterns(c, dict(zip(names, c.resolve_all(keys))), types)
 
     def __str__(self):
         """Prints the precision-assignent found by the NAS to screen
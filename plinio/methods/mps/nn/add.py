@@ -81,7 +81,7 @@ class MPSAdd(MPSIdentity):
             new_node.replace_input_with(new_node, n)
 
     @staticmethod
-    def export(n: fx.Node, mod: fx.GraphModule):
+    def export(n: fx.Node, mod: fx.GraphModule, single_kernel: bool = False):
         """Replaces a fx.Node corresponding to a MPSAdd layer,
         with the selected fake-quantized addition layer within a fx.GraphModule
 
@@ -89,6 +89,8 @@ class MPSAdd(MPSIdentity):
         :type n: fx.Node
         :param mod: the parent module, where the new node has to be inserted
         :type mod: fx.GraphModule
+        :param single_kernel: kept for uniformity with the other MPS layers, unused
+        :type single_kernel: bool
         """
         submodule = mod.get_submodule(str(n.target))
         if type(submodule) != MPSAdd:
@@ -111,22 +113,14 @@ class MPSAdd(MPSIdentity):
         :return: the layer cost for each combination of precision
         :rtype: torch.Tensor
         """
-
-        def vect_fn(in_prec, in_theta_alpha):
-            v = vars(self)
-            v.update(out_shape)
-            v['in_precision'] = in_prec
-            v['in_format'] = int
-            # TODO: detach to be double-checked
-            v['in_channels'] = self.input_features_calculator.features.detach()
-            # TODO: verify that it's correct to use out_features_eff here, differently from
-            # conv/linear
-            v['out_channels'] = self.out_features_eff
-            return in_theta_alpha * cost_fn(v)
-
-        vect_fn = torch.vmap(vect_fn)
-        cost = vect_fn(
-                self.in_mps_quantizer.precision,
-                self.in_mps_quantizer.theta_alpha
-                )
-        return cost
+        v = dict(vars(self))
+        v.update(out_shape)
+        v['in_format'] = int
+        # TODO: detach to be double-checked
+        v['in_channels'] = self.input_features_calculator.features.detach()
+        # TODO: verify that it's correct to use out_features_eff here, differently from
+        # conv/linear
+        v['out_channels'] = self.out_features_eff
+        grid = {'in_precision': self.in_mps_quantizer.precision}
+        cost = self._precision_grid_cost(cost_fn, v, grid)
+        return self.in_mps_quantizer.theta_alpha * cost
@@ -0,0 +1,98 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2022 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Matteo Risso <matteo.risso@polito.it>                             *
+# *----------------------------------------------------------------------------*
+from typing import Any, Callable, Optional, Sequence, Tuple
+import torch
+
+
+class FusedMPSQtz(torch.autograd.Function):
+    """A torch autograd function computing the weighted sum of the outputs of a set of
+    quantizers (one per candidate precision), with memory independent from the number of
+    quantizers.
+
+    The forward accumulates `theta[i] * quantize(i, input)` in place, and only saves the input,
+    while the backward recomputes each quantization, one at a time. The result is bit-exact
+    with summing the stacked per-precision terms. `theta` has one element per quantizer
+    (per-layer search) or one row of `cout` elements per quantizer (per-channel search), and
+    `params` must contain all the parameters of the quantizers, so that they receive gradients.
+    Only the quantizers listed in `active` are run: the `theta` elements of the other ones must
+    be constant zeros (e.g., in single-path sampling), and receive a 0 gradient.
+    """
+
+    @staticmethod
+    def _theta(theta: torch.Tensor, i: int, ndim: int) -> torch.Tensor:
+        if theta.dim() == 1:
+            return theta[i]
+        return theta[i].view((theta.size(dim=1),) + (1,) * (ndim - 1))
+
+    @staticmethod
+    def forward(ctx: Any, input: torch.Tensor, theta: torch.Tensor,
+                quantize: Callable[[int, torch.Tensor], torch.Tensor], active: Sequence[int],
+                *params: torch.Tensor) -> torch.Tensor:
+        y: Optional[torch.Tensor] = None
+        for i in active:
+            # quantizers may store differentiable attributes (e.g. the scale factor) used by
+            # other layers, so they are run with autograd enabled. Their output graph is
+            # dropped at the end of each iteration
+            with torch.enable_grad():
+                q = quantize(i, input)
+            term = FusedMPSQtz._theta(theta, i, input.dim()) * q.detach()
+            y = term if y is None else y.add_(term)
+        ctx.quantize = quantize
+        ctx.active = active
+        ctx.save_for_backward(input, theta, *params)
+        return y
+
+    @staticmethod
+    def backward(ctx: Any, *grad_outputs: Any) -> Tuple[Optional[torch.Tensor], ...]:
+        grad_output = grad_outputs[0]
+        input, theta, *params = ctx.saved_tensors
+        need_input, need_theta = ctx.needs_input_grad[0], ctx.needs_input_grad[1]
+        grad_params = [None] * len(params)
+        grad_input = torch.zeros_like(input) if need_input else None
+        grad_theta = torch.zeros_like(theta) if need_theta else None
+        # the original input is used when possible, so that cached quantizations are re-used
+        x = input.detach().requires_grad_() if need_input else input
+        targets = ([x] if need_input else []) + [p for p in params if p.requires_grad]
+        for i in ctx.active:
+            with torch.enable_grad():
+                q = ctx.quantize(i, x)
+            if need_theta:
+                gq = grad_output * q.detach()
+                if theta.dim() == 1:
+                    grad_theta[i] = gq.sum()
+                else:
+                    grad_theta[i] = gq.sum(dim=tuple(range(1, gq.dim())))
+            if len(targets) == 0 or not q.requires_grad:
+                continue
+            theta_i = FusedMPSQtz._theta(theta.detach(), i, input.dim())
+            grads = torch.autograd.grad(q, targets, grad_output * theta_i, allow_unused=True)
+            grads = list(grads)
+            if need_input:
+                g = grads.pop(0)
+                if g is not None:
+                    grad_input.add_(g)
+            j = 0
+            for k, p in enumerate(params):
+                if not p.requires_grad:
+                    continue
+                g = grads[j]
+                j += 1
+                if g is not None:
+                    grad_params[k] = g if grad_params[k] is None else grad_params[k] + g
+        return (grad_input, grad_theta, None, None, *grad_params)
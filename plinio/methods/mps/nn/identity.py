@@ -87,7 +87,7 @@ class MPSIdentity(nn.Identity, MPSModule):
         mod.add_submodule(str(n.target), new_submodule)
 
     @staticmethod
-    def export(n: fx.Node, mod: fx.GraphModule):
+    def export(n: fx.Node, mod: fx.GraphModule, single_kernel: bool = False):
         """Replaces a fx.Node corresponding to a MPSIdentity layer,
         with the selected fake-quantized nn.Identity layer within a fx.GraphModule
 
@@ -95,6 +95,8 @@ class MPSIdentity(nn.Identity, MPSModule):
         :type n: fx.Node
         :param mod: the parent module, where the new node has to be inserted
         :type mod: fx.GraphModule
+        :param single_kernel: kept for uniformity with the other MPS layers, unused
+        :type single_kernel: bool
         """
         submodule = mod.get_submodule(str(n.target))
         if type(submodule) != MPSIdentity:
@@ -109,7 +111,8 @@ class MPSIdentity(nn.Identity, MPSModule):
             temperature: Optional[float] = None,
             hard: Optional[bool] = None,
             gumbel: Optional[bool] = None,
-            disable_sampling: Optional[bool] = None):
+            disable_sampling: Optional[bool] = None,
+            single_path: Optional[bool] = None):
         """Set the flags to choose between the softmax, the hard and soft Gumbel-softmax
         and the sampling disabling of the architectural coefficients in the quantizers
 
@@ -122,9 +125,12 @@ class MPSIdentity(nn.Identity, MPSModule):
         :param disable_sampling: disable the sampling of the architectural coefficients in the
         forward pass
         :type disable_sampling: Optional[bool]
+        :param single_path: sample a single precision (per layer or per channel) at each training
+        step, and only run the corresponding quantizer
+        :type single_path: Optional[bool]
         """
         self.out_mps_quantizer.update_softmax_options(
-                temperature, hard, gumbel, disable_sampling)
+                temperature, hard, gumbel, disable_sampling, single_path)
 
     def summary(self) -> Dict[str, Any]:
         """Export a dictionary with the optimized layer hyperparameters
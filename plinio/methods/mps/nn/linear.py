@@ -22,7 +22,7 @@ import torch
 import torch.fx as fx
 import torch.nn as nn
 import torch.nn.functional as F
-from ..quant.quantizers import Quantizer, DummyQuantizer
+from ..quant.quantizers import Quantizer, DummyQuantizer, MixPrecWeight
 from ..quant.nn import QuantLinear, QuantList
 from .module import MPSModule
 from .qtz import MPSType, MPSPerLayerQtz, MPSPerChannelQtz, MPSBiasQtz, MPSBaseQtz
@@ -127,7 +127,7 @@ class MPSLinear(nn.Linear, MPSModule):
         mod.add_submodule(str(n.target), new_submodule)
 
     @staticmethod
-    def export(n: fx.Node, mod: fx.GraphModule):
+    def export(n: fx.Node, mod: fx.GraphModule, single_kernel: bool = False):
         """Replaces a fx.Node corresponding to a MPSLinear layer,
         with the selected fake-quantized nn.Linear layer within a fx.GraphModule
 
@@ -135,6 +135,10 @@ class MPSLinear(nn.Linear, MPSModule):
         :type n: fx.Node
         :param mod: the parent module, where the new node has to be inserted
         :type mod: fx.GraphModule
+        :param single_kernel: whether to export a per-channel search as a single `nn.Linear`
+        with a channel-wise mixed-precision weight quantizer, rather than as a `QuantList`
+        of layers (one for each precision)
+        :type single_kernel: bool
         """
         submodule = mod.get_submodule(str(n.target))
         if type(submodule) != MPSLinear:
@@ -153,6 +157,19 @@ class MPSLinear(nn.Linear, MPSModule):
                                         submodule.selected_out_quantizer,
                                         cast(Quantizer, submodule.selected_w_quantizer),
                                         b_quantizer)
+        # per-channel search, single kernel => mixed-precision weight quantizer
+        elif isinstance(submodule.w_mps_quantizer, MPSPerChannelQtz) and single_kernel:
+            if submodule.bias is not None:
+                b_quantizer = cast(Quantizer, submodule.b_mps_quantizer.qtz_func)
+            else:
+                b_quantizer = None
+            w_quantizer = MixPrecWeight(list(submodule.w_mps_quantizer.qtz_funcs),
+                                        torch.argmax(submodule.w_mps_quantizer.alpha, dim=0))
+            new_submodule = QuantLinear(submodule,
+                                        submodule.selected_in_quantizer,
+                                        submodule.selected_out_quantizer,
+                                        w_quantizer,
+                                        b_quantizer)
         # per-channel search => multiple precision/quantizers
         elif isinstance(submodule.w_mps_quantizer, MPSPerChannelQtz):
             selected_w_precision = cast(List[int], submodule.selected_w_precision)
@@ -199,7 +216,8 @@ class MPSLinear(nn.Linear, MPSModule):
             temperature: Optional[float] = None,
             hard: Optional[bool] = None,
             gumbel: Optional[bool] = None,
-            disable_sampling: Optional[bool] = None):
+            disable_sampling: Optional[bool] = None,
+            single_path: Optional[bool] = None):
         """Set the flags to choose between the softmax, the hard and soft Gumbel-softmax
         and the sampling disabling of the architectural coefficients in the quantizers
 
@@ -212,12 +230,15 @@ class MPSLinear(nn.Linear, MPSModule):
         :param disable_sampling: disable the sampling of the architectural coefficients in the
         forward pass
         :type disable_sampling: Optional[bool]
+        :param single_path: sample a single precision (per layer or per channel) at each training
+        step, and only run the corresponding quantizer
+        :type single_path: Optional[bool]
         """
         if isinstance(self.out_mps_quantizer, MPSBaseQtz):
             self.out_mps_quantizer.update_softmax_options(
-                    temperature, hard, gumbel, disable_sampling)
+                    temperature, hard, gumbel, disable_sampling, single_path)
         self.w_mps_quantizer.update_softmax_options(
-                temperature, hard, gumbel, disable_sampling)
+                temperature, hard, gumbel, disable_sampling, single_path)
 
     def compensate_weights_values(self):
         """Modify the initial weight values of MPSModules compensating the possible presence of
@@ -298,19 +319,18 @@ class MPSLinear(nn.Linear, MPSModule):
             msg = f'Supported mixed-precision types: {list(MPSType)}'
             raise ValueError(msg)
 
-        cost = torch.zeros(size=(len(self.in_mps_quantizer.precision), len(self.w_mps_quantizer.precision)),
-                           device=self.in_mps_quantizer.precision.device)
-        for i, (in_prec, in_theta_alpha) in enumerate(zip(self.in_mps_quantizer.precision, self.in_mps_quantizer.theta_alpha)):
-            for j, (w_prec, w_theta_alpha) in enumerate(zip(self.w_mps_quantizer.precision, w_theta_alpha_array)):
-                v = self.get_modified_vars()
-                v.update(out_shape)
-                v['in_format'] = int
-                v['w_format'] = int
-                v['in_precision'] = in_prec
-                v['w_precision'] = w_prec
-                v['w_theta_alpha'] = w_theta_alpha
-                cost[i][j] = in_theta_alpha * w_theta_alpha * cost_fn(v)
-        return cost
+        v = self.get_modified_vars()
+        v.update(out_shape)
+        v['in_format'] = int
+        v['w_format'] = int
+        # (n_in_prec, 1) x (1, n_w_prec) grid
+        grid = {
+            'in_precision': self.in_mps_quantizer.precision.unsqueeze(1),
+            'w_precision': self.w_mps_quantizer.precision.unsqueeze(0),
+            'w_theta_alpha': w_theta_alpha_array.unsqueeze(0),
+        }
+        theta_alpha = self.in_mps_quantizer.theta_alpha.unsqueeze(1) * grid['w_theta_alpha']
+        return theta_alpha * self._precision_grid_cost(cost_fn, v, grid)
 
     def named_nas_parameters(
             self, prefix: str = '', recurse: bool = False) -> Iterator[Tuple[str, nn.Parameter]]:
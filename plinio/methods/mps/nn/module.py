@@ -25,6 +25,7 @@ import torch.nn as nn
 from .qtz import MPSPerLayerQtz, MPSPerChannelQtz, MPSBiasQtz
 from plinio.graph.features_calculation import FeaturesCalculator
 from plinio.cost import CostFn
+from plinio.cost.batched import PrecisionGridCost
 
 
 class MPSModule:
@@ -39,7 +40,8 @@ class MPSModule:
             temperature: Optional[float] = None,
             hard: Optional[bool] = None,
             gumbel: Optional[bool] = None,
-            disable_sampling: Optional[bool] = None):
+            disable_sampling: Optional[bool] = None,
+            single_path: Optional[bool] = None):
         """Set the flags to choose between the softmax, the hard and soft Gumbel-softmax
         and the sampling disabling of the architectural coefficients in the quantizers
 
@@ -52,6 +54,9 @@ class MPSModule:
         :param disable_sampling: disable the sampling of the architectural coefficients in the
         forward pass
         :type disable_sampling: Optional[bool]
+        :param single_path: sample a single precision (per layer or per channel) at each training
+        step, and only run the corresponding quantizer
+        :type single_path: Optional[bool]
         """
         # does nothing on the base class (overridden by sub-classes)
         return
@@ -113,7 +118,7 @@ class MPSModule:
 
     @staticmethod
     @abstractmethod
-    def export(n: fx.Node, mod: fx.GraphModule):
+    def export(n: fx.Node, mod: fx.GraphModule, single_kernel: bool = False):
         """Replaces a fx.Node corresponding to a MPSModule, with a standard nn.Module layer
         within a fx.GraphModule
 
@@ -121,6 +126,9 @@ class MPSModule:
         :type n: fx.Node
         :param mod: the parent module, where the new node has to be inserted
         :type mod: fx.GraphModule
+        :param single_kernel: whether to export layers with per-channel precisions as a single
+        layer, rather than as a `QuantList` of layers (one for each precision)
+        :type single_kernel: bool
         """
         raise NotImplementedError("Trying to export layer using the base abstract class")
 
@@ -161,6 +169,26 @@ class MPSModule:
         """
         raise NotImplementedError("Calling get_modified_vars on base abstract MPSModule class")
 
+    def _precision_grid_cost(self, cost_fn: CostFn, spec: Dict[str, Any],
+                             grid: Dict[str, torch.Tensor]) -> torch.Tensor:
+        """Evaluates a cost function on all the precision combinations supported by this layer
+        with a single broadcasted call (or with a per-combination loop, for cost functions
+        that do not support broadcasting)
+
+        :param cost_fn: the scalar cost function for a single w/a prec combination
+        :type cost_fn: CostFn
+        :param spec: the precision-independent layer hyperparameters
+        :type spec: Dict[str, Any]
+        :param grid: the precision-dependent hyperparameters, as broadcastable tensors
+        :type grid: Dict[str, torch.Tensor]
+        :return: the layer cost for each combination of precision
+        :rtype: torch.Tensor
+        """
+        # lazily created, since sub-classes do not call MPSModule.__init__()
+        if '_grid_cost' not in self.__dict__:
+            self.__dict__['_grid_cost'] = PrecisionGridCost()
+        return self.__dict__['_grid_cost'](cost_fn, spec, grid)
+
     @abstractmethod
     def named_nas_parameters(
             self, prefix: str = '', recurse: bool = False) -> Iterator[Tuple[str, nn.Parameter]]:
@@ -18,12 +18,14 @@
 
 from abc import abstractmethod
 from enum import Enum, auto
-from typing import Dict, Tuple, Type, cast, Optional
+from typing import Dict, List, Tuple, Type, cast, Optional
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch._subclasses.fake_tensor import FakeTensor
 from ..quant.quantizers import Quantizer
 from .ste_argmax import STEArgmax
+from .fused_qtz import FusedMPSQtz
 
 
 class MPSType(Enum):
@@ -71,6 +73,11 @@ class MPSBaseQtz(nn.Module):
             qtz = quantizer(p, **quantizer_kwargs)
             qtz = cast(nn.Module, qtz)
             self.qtz_funcs.append(qtz)
+        # indexes of the quantizers run in the last forward pass
+        self._active_qtz = list(range(len(precision)))
+        # one-hot sample and its log-probability, in single-path training
+        self.sp_sample: Optional[torch.Tensor] = None
+        self.sp_log_prob: Optional[torch.Tensor] = None
         # create buffer for temperature tensor
         self.register_buffer('temperature', torch.tensor(softmax_temperature, dtype=torch.float))
         # set the sampling options
@@ -96,6 +103,57 @@ class MPSBaseQtz(nn.Module):
         """
         raise NotImplementedError("Trying to call forward on the base MPS quantizer class")
 
+    def _quantize(self, i: int, input: torch.Tensor) -> torch.Tensor:
+        """Returns the output of the i-th quantizer, re-using the previously computed one if the
+        input is a frozen parameter (requires_grad=False, e.g. weights after `train_nas_only()`),
+        the quantizer parameters are frozen too, and none of them has changed since then.
+
+        Changes are tracked through the version counters and identity of the tensors, as in
+        `PITModule._frozen_mask`. In-place updates through `.data` are not tracked, and require
+        calling `clear_qtz_cache()`. Entries are kept separately for each input, as quantizers
+        may be shared among layers, together with the tensors derived by the quantizer from its
+        input (e.g., the scale factor), which are restored on a hit.
+
+        :param i: the index of the quantizer
+        :type i: int
+        :param input: the input float tensor
+        :type input: torch.Tensor
+        :return: the fake-quantized tensor at the i-th precision
+        :rtype: torch.Tensor
+        """
+        quantizer = cast(nn.Module, self.qtz_funcs[i])
+        tensors = (input,) + tuple(quantizer.parameters())
+        if not isinstance(input, nn.Parameter) or isinstance(input, FakeTensor):
+            return quantizer(input)
+        cache = self.__dict__.get('_qtz_cache', {})
+        if any(t.requires_grad for t in tensors):
+            if (i, id(input)) in cache:
+                # drop the entry as soon as it can no longer be re-used
+                cache = dict(cache)
+                del cache[(i, id(input))]
+                self.__dict__['_qtz_cache'] = cache
+            return quantizer(input)
+        key = (quantizer.precision, quantizer.dequantize,
+               tuple((t._version, t.data_ptr()) for t in tensors))
+        entry = cache.get((i, id(input)))
+        # tensors are stored in the entry and compared by identity, so that they are kept
+        # alive and their ids are never re-used while the entry exists
+        if entry is not None and entry[1] == key and len(entry[0]) == len(tensors) and \
+                all(a is b for a, b in zip(entry[0], tensors)):
+            quantizer.__dict__.update(entry[3])
+            return entry[2]
+        q = quantizer(input)
+        state = {k: v for k, v in quantizer.__dict__.items() if isinstance(v, torch.Tensor)}
+        # copy-on-write, as in `PITModule._frozen_mask`
+        cache = dict(cache)
+        cache[(i, id(input))] = (tensors, key, q.detach(), state)
+        self.__dict__['_qtz_cache'] = cache
+        return q
+
+    def clear_qtz_cache(self):
+        """Drops the quantized tensors cached for frozen inputs (see `_quantize`)"""
+        self.__dict__.pop('_qtz_cache', None)
+
     def sample_alpha_sm(self):
         """
         Samples the alpha coefficients using a standard SoftMax (with temperature).
@@ -120,6 +178,55 @@ class MPSBaseQtz(nn.Module):
         else:
             self.sample_alpha_sm()
 
+    def sample_alpha_sp(self):
+        """
+        Samples a single precision (per layer or per channel) from the SoftMax (with temperature)
+        of the alpha coefficients. The one-hot sample is stored in the sp_sample attribute, and
+        only the sampled quantizers are run in the forward pass, which therefore does not
+        propagate gradients to alpha. The theta_alpha buffer is set to the SoftMax
+        probabilities, as in `sample_alpha_sm`, so that the cost models are differentiable.
+        The log-probability of the sample (sp_log_prob) is used by the score-function estimator
+        of the alpha gradient (see `MPS.single_path_loss`). When the quantizer is called more
+        than once before the estimator consumes it, the log-probabilities of all samples are
+        summed. Samples drawn with gradients disabled are not recorded.
+        """
+        if not self.training:
+            self.sp_sample = self.sp_log_prob = None
+            self.sample_alpha_sm()
+            return
+        log_p = F.log_softmax(cast(torch.Tensor, self.alpha) / self.temperature.item(), dim=0)
+        with torch.no_grad():
+            # Gumbel-max sampling
+            gumbels = -torch.empty_like(log_p).exponential_().log()
+            idx = torch.argmax(log_p + gumbels, dim=0, keepdim=True)
+            self.sp_sample = torch.zeros_like(log_p).scatter_(0, idx, 1.)
+        if torch.is_grad_enabled():
+            log_prob = torch.gather(log_p, 0, idx).sum()
+            self.sp_log_prob = log_prob if self.sp_log_prob is None \
+                else self.sp_log_prob + log_prob
+        self.theta_alpha = log_p.exp()
+
+    @property
+    def sampled_theta_alpha(self) -> torch.Tensor:
+        """Return the coefficients of the quantizers outputs in the forward pass, i.e., the
+        one-hot sample in single-path training, and theta_alpha otherwise
+
+        :return: the coefficients of the quantizers outputs
+        :rtype: torch.Tensor
+        """
+        if self.single_path and self.training and self.sp_sample is not None:
+            return self.sp_sample
+        return self.theta_alpha
+
+    def _active_quantizers(self) -> List[int]:
+        """Returns the indexes of the quantizers to be run in the forward pass, i.e., all of them,
+        except during single-path training, where only the sampled ones are run"""
+        n = len(self.qtz_funcs)
+        if not (self.single_path and self.training):
+            return list(range(n))
+        sampled = self.sampled_theta_alpha.reshape(n, -1).ne(0).any(dim=1)
+        return sampled.nonzero().flatten().tolist()
+
     def sample_alpha_none(self):
         """Sample the previous alpha architectural coefficients. Used to change the alpha
         coefficients at each iteration"""
@@ -130,7 +237,8 @@ class MPSBaseQtz(nn.Module):
             temperature: Optional[float] = None,
             hard: Optional[bool] = None,
             gumbel: Optional[bool] = None,
-            disable_sampling: Optional[bool] = None):
+            disable_sampling: Optional[bool] = None,
+            single_path: Optional[bool] = None):
         """Set the flags to choose between the softmax, the hard and soft Gumbel-softmax
         and the sampling disabling of the architectural coefficients in the quantizers
 
@@ -143,6 +251,9 @@ class MPSBaseQtz(nn.Module):
         :param disable_sampling: disable the sampling of the architectural coefficients in the
         forward pass
         :type disable_sampling: Optional[bool]
+        :param single_path: sample a single precision (per layer or per channel) at each training
+        step, and only run the corresponding quantizer
+        :type single_path: Optional[bool]
         """
         if temperature is not None:
             self.temperature = torch.tensor(temperature, dtype=torch.float32)
@@ -150,10 +261,15 @@ class MPSBaseQtz(nn.Module):
             self.hard_softmax = hard
         if disable_sampling is not None and disable_sampling:
             self.sample_alpha = self.sample_alpha_none
+        elif single_path is not None and single_path:
+            self.sample_alpha = self.sample_alpha_sp
         elif gumbel is not None and gumbel:
             self.sample_alpha = self.sample_alpha_gs
         else:
             self.sample_alpha = self.sample_alpha_sm
+        self.single_path = self.sample_alpha == self.sample_alpha_sp
+        if not self.single_path:
+            self.sp_sample = self.sp_log_prob = None
 
     @property
     def effective_scale(self) -> torch.Tensor:
@@ -166,8 +282,10 @@ class MPSBaseQtz(nn.Module):
         :raises: NotImplementedError on the base class
         """
         scale = torch.tensor(0, dtype=torch.float32)
-        for i, qtz in enumerate(self.qtz_funcs):
-            scale = scale + (self.theta_alpha[i] * qtz.scale)
+        # quantizers not run in the last forward (single-path sampling) have a null weight
+        theta_alpha = self.sampled_theta_alpha
+        for i in self._active_qtz:
+            scale = scale + (theta_alpha[i] * self.qtz_funcs[i].scale)
         return scale
 
     @property
@@ -239,7 +357,8 @@ class MPSPerChannelQtz(MPSBaseQtz):
 
         In a nutshell, it computes the different quantized representations of `mix_qtz`
         and combines them weighting the different terms channel-wise by means of
-        softmax-ed `alpha` trainable parameters.
+        softmax-ed `alpha` trainable parameters. The combination is computed by `FusedMPSQtz`,
+        so that memory does not grow with the number of precisions.
 
         :param input: the input float tensor
         :type input: torch.Tensor
@@ -247,13 +366,11 @@ class MPSPerChannelQtz(MPSBaseQtz):
         :rtype: torch.Tensor
         """
         self.sample_alpha()
-        y = []
-        for i, quantizer in enumerate(self.qtz_funcs):
-            theta_alpha_i = self.theta_alpha[i].view((self.theta_alpha.size(dim=1),) +
-                                                     (1,) * len(input.shape[1:]))
-            y.append(theta_alpha_i * quantizer(input))
-        y = torch.stack(y, dim=0).sum(dim=0)
-        return y
+        # the per-precision terms are accumulated in place, and re-computed in backward
+        self._active_qtz = self._active_quantizers()
+        y = FusedMPSQtz.apply(input, self.sampled_theta_alpha, self._quantize, self._active_qtz,
+                              *self.qtz_funcs.parameters())
+        return cast(torch.Tensor, y)
 
     @property
     def features_mask(self) -> torch.Tensor:
@@ -343,7 +460,8 @@ class MPSPerLayerQtz(MPSBaseQtz):
 
         In a nutshell, it computes the different quantized representations of `mix_qtz`
         and combines them weighting the different terms by means of softmax-ed
-        `alpha` trainable parameters.
+        `alpha` trainable parameters. The combination is computed by `FusedMPSQtz`,
+        so that memory does not grow with the number of precisions.
 
         :param input: the input float tensor
         :type input: torch.Tensor
@@ -351,11 +469,11 @@ class MPSPerLayerQtz(MPSBaseQtz):
         :rtype: torch.Tensor
         """
         self.sample_alpha()
-        y = []
-        for i, quantizer in enumerate(self.qtz_funcs):
-            y.append(self.theta_alpha[i] * quantizer(input))
-        y = torch.stack(y, dim=0).sum(dim=0)
-        return y
+        # the per-precision terms are accumulated in place, and re-computed in backward
+        self._active_qtz = self._active_quantizers()
+        y = FusedMPSQtz.apply(input, self.sampled_theta_alpha, self._quantize, self._active_qtz,
+                              *self.qtz_funcs.parameters())
+        return cast(torch.Tensor, y)
 
     @property
     def effective_precision(self) -> torch.Tensor:
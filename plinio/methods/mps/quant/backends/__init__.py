@@ -17,7 +17,17 @@
 # * Author:  Matteo Risso <matteo.risso@polito.it>                             *
 # *----------------------------------------------------------------------------*
 
-from .base import Backend, backend_factory, integerize_arch
+from typing import TYPE_CHECKING
+from plinio.lazy import make_lazy
+
+if TYPE_CHECKING:
+    from .base import Backend, backend_factory, integerize_arch
+
+make_lazy(__name__, {
+    'Backend': '.base',
+    'backend_factory': '.base',
+    'integerize_arch': '.base',
+})
 
 __all__ = [
     'Backend', 'backend_factory', 'integerize_arch',
@@ -17,7 +17,15 @@
 # * Author:  Matteo Risso <matteo.risso@polito.it>                             *
 # *----------------------------------------------------------------------------*
 
-from .exporter import MATCHExporter
+from typing import TYPE_CHECKING
+from plinio.lazy import make_lazy
+
+if TYPE_CHECKING:
+    from .exporter import MATCHExporter
+
+make_lazy(__name__, {
+    'MATCHExporter': '.exporter',
+})
 
 __all__ = [
     'MATCHExporter',
@@ -21,12 +21,14 @@
 # https://github.com/pulp-platform/quantlib/blob/main/backends/dory/onnxannotator.py
 
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import numpy as np
-import onnx
-from onnx import helper as onnx_helper
 import torch.nn as nn
 
+if TYPE_CHECKING:
+    import onnx
+
 
 class MATCHAnnotator:
     """Class to annotate MATCH-compliant onnx model"""
@@ -40,6 +42,9 @@ class MATCHAnnotator:
         """This part will be common to every backend, while _annotate is the actual
         backend-specific annotation.
         """
+        # onnx is imported here, so that it is only needed when actually exporting a model
+        import onnx
+
         # Load onnx
         onnxproto = onnx.load(str(onnxfilepath))
 
@@ -51,11 +56,12 @@ class MATCHAnnotator:
 
     def _annotate(self,
                   network: nn.Module,
-                  onnxproto: onnx.ModelProto):
+                  onnxproto: 'onnx.ModelProto'):
         """Backend-specific annotation function"""
+        from onnx import helper as onnx_helper
 
-        def get_onnxnode_attr_by_name(node: onnx.NodeProto,
-                                      name: str) -> onnx.AttributeProto:
+        def get_onnxnode_attr_by_name(node: 'onnx.NodeProto',
+                                      name: str) -> 'onnx.AttributeProto':
             return next(iter(filter(lambda a: (a.name == name), node.attribute)))
 
         # Define backend-specific supported ONNX nodes. The nodes belonging to
@@ -112,6 +118,13 @@ class MATCHAnnotator:
                 if isinstance(pytorch_module, (nn.Linear, nn.Conv1d, nn.Conv2d, nn.Conv3d)):
                     weight_bits = pytorch_module.w_quantizer.precision
                     bias_bits = pytorch_module.b_quantizer.precision
+                    if isinstance(weight_bits, list):
+                        # channel-wise mixed-precision weights (MixPrecWeight): the integer
+                        # weights are stored with the largest precision, and the precision
+                        # of each output channel is annotated separately
+                        annotations.append(onnx_helper.make_attribute(
+                            key='weight_bits_per_channel', value=weight_bits))
+                        weight_bits = max(weight_bits)
                     annotations.append(onnx_helper.make_attribute(key='weight_bits',
                                                                   value=weight_bits))
                     annotations.append(onnx_helper.make_attribute(key='bias_bits',
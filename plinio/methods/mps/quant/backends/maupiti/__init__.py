@@ -17,7 +17,15 @@
 # * Author:  Matteo Risso <matteo.risso@polito.it>                             *
 # *----------------------------------------------------------------------------*
 
-from .exporter import MAUPITIExporter
+from typing import TYPE_CHECKING
+from plinio.lazy import make_lazy
+
+if TYPE_CHECKING:
+    from .exporter import MAUPITIExporter
+
+make_lazy(__name__, {
+    'MAUPITIExporter': '.exporter',
+})
 
 __all__ = [
     'MAUPITIExporter',
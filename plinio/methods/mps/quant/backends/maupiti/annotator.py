@@ -21,12 +21,14 @@
 # https://github.com/pulp-platform/quantlib/blob/main/backends/dory/onnxannotator.py
 
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import numpy as np
-import onnx
-from onnx import helper as onnx_helper
 import torch.nn as nn
 
+if TYPE_CHECKING:
+    import onnx
+
 
 class MAUPITIAnnotator:
     """Class to annotate MAUPITI-compliant onnx model"""
@@ -40,6 +42,9 @@ class MAUPITIAnnotator:
         """This part will be common to every backend, while _annotate is the actual
         backend-specific annotation.
         """
+        # onnx is imported here, so that it is only needed when actually exporting a model
+        import onnx
+
         # Load onnx
         onnxproto = onnx.load(str(onnxfilepath))
 
@@ -51,11 +56,12 @@ class MAUPITIAnnotator:
 
     def _annotate(self,
                   network: nn.Module,
-                  onnxproto: onnx.ModelProto):
+                  onnxproto: 'onnx.ModelProto'):
         """Backend-specific annotation function"""
+        from onnx import helper as onnx_helper
 
-        def get_onnxnode_attr_by_name(node: onnx.NodeProto,
-                                      name: str) -> onnx.AttributeProto:
+        def get_onnxnode_attr_by_name(node: 'onnx.NodeProto',
+                                      name: str) -> 'onnx.AttributeProto':
             return next(iter(filter(lambda a: (a.name == name), node.attribute)))
 
         # Define backend-specific supported ONNX nodes. The nodes belonging to
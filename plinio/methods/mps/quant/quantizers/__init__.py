@@ -21,10 +21,11 @@ from .quantizer import Quantizer
 from .dummy import DummyQuantizer
 from .fq_weight import FQWeight
 from .minmax_weight import MinMaxWeight
+from .mixprec_weight import MixPrecWeight
 from .pact_act import PACTAct, PACTActSigned
 from .qtz_bias import QuantizerBias
 
 __all__ = [
     'Quantizer', 'DummyQuantizer', 'FQWeight', 'MinMaxWeight', 'PACTAct', 'QuantizerBias',
-    'PACTActSigned'
+    'PACTActSigned', 'MixPrecWeight'
 ]
@@ -0,0 +1,163 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2022 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Matteo Risso <matteo.risso@polito.it>                             *
+# *----------------------------------------------------------------------------*
+from typing import Dict, Any, List, Iterator, Tuple
+import torch
+import torch.nn as nn
+from .quantizer import Quantizer
+
+
+class MixPrecWeight(Quantizer):
+    """A nn.Module implementing a channel-wise mixed-precision weight quantizer, which
+    applies a different quantizer (and precision) to each output channel, so that a
+    layer with per-channel precisions can be computed as a single kernel.
+
+    The output channels of the layer can be permuted (e.g., to obtain contiguous groups of
+    channels with the same precision) with `permute()`. The quantizers are always applied
+    to the weights in the original channels order, so that their per-channel parameters
+    do not need to be modified.
+
+    :param quantizers: the weight quantizers, one for each precision
+    :type quantizers: List[Quantizer]
+    :param channel_qtz: the index of the quantizer of each output channel
+    :type channel_qtz: torch.Tensor
+    :param dequantize: whether the output should be fake-quantized or not
+    :type dequantize: bool
+    """
+    def __init__(self,
+                 quantizers: List[Quantizer],
+                 channel_qtz: torch.Tensor,
+                 dequantize: bool = True):
+        # keep only the quantizers actually used by some channel
+        used, channel_qtz = torch.unique(channel_qtz, return_inverse=True)
+        super(MixPrecWeight, self).__init__(0, dequantize)
+        self.qtz_funcs = nn.ModuleList([quantizers[int(i)] for i in used])
+        self.register_buffer('channel_qtz', channel_qtz.long())
+        self.register_buffer('perm', torch.arange(len(channel_qtz)))
+        self.register_buffer('inv_perm', torch.arange(len(channel_qtz)))
+
+    def forward(self, input: torch.Tensor) -> torch.Tensor:
+        """The forward function of the mixed-precision weight quantizer.
+
+        Quantizes the weights (in their original channels order) with the quantizer of
+        each output channel, and permutes the result
+
+        :param input: the input float weights tensor, with permuted output channels
+        :type input: torch.Tensor
+        :return: the output fake-quantized weights tensor
+        :rtype: torch.Tensor
+        """
+        input = input[self.inv_perm]
+        mask_shape = (-1,) + (1,) * len(input.shape[1:])
+        output = self.qtz_funcs[0](input)
+        for i, qtz in enumerate(self.qtz_funcs[1:], start=1):
+            mask = (self.channel_qtz == i).view(mask_shape)
+            output = torch.where(mask, qtz(input), output)
+        return output[self.perm]
+
+    def permute(self, perm: torch.Tensor):
+        """Permutes the output channels of the quantized weights
+
+        :param perm: the new order of the (currently ordered) output channels
+        :type perm: torch.Tensor
+        """
+        self.perm = self.perm[perm.to(self.perm.device)]
+        self.inv_perm = torch.argsort(self.perm)
+
+    def summary(self) -> Dict[str, Any]:
+        """Export a dictionary with the optimized layer quantization hyperparameters
+
+        :return: a dictionary containing the optimized layer quantization hyperparameter values
+        :rtype: Dict[str, Any]
+        """
+        return {
+            'precision': self.precision,
+            'scale_factor': self.scale,
+        }
+
+    def named_quant_parameters(
+            self, prefix: str = '', recurse: bool = False) -> Iterator[Tuple[str, nn.Parameter]]:
+        """Returns an iterator over the quantization parameters of this layer, yielding
+        both the name of the parameter as well as the parameter itself
+
+        :param prefix: prefix to prepend to all parameter names.
+        :type prefix: str
+        :param recurse: recurse to sub-modules
+        :type recurse: bool
+        :return: an iterator over the quantization parameters of this layer
+        :rtype: Iterator[nn.Parameter]
+        """
+        prfx = prefix
+        prfx += "." if len(prefix) > 0 else ""
+        for i, qtz in enumerate(self.qtz_funcs):
+            for name, param in qtz.named_quant_parameters(prfx + f"qtz_funcs.{i}", recurse):
+                yield name, param
+
+    @property
+    def precision(self) -> List[int]:
+        """Return the precision of each (permuted) output channel
+
+        :return: the channels precisions
+        :rtype: List[int]
+        """
+        precision = [int(qtz.precision) for qtz in self.qtz_funcs]
+        return [precision[int(i)] for i in self.channel_qtz[self.perm]]
+
+    @precision.setter
+    def precision(self, val: int):
+        # the precisions are defined by the inner quantizers
+        pass
+
+    @property
+    def dequantize(self) -> bool:
+        return self._dequantize
+
+    @dequantize.setter
+    def dequantize(self, val: bool):
+        self._dequantize = val
+        for qtz in self.qtz_funcs:
+            qtz.dequantize = val
+
+    @property
+    def scale(self) -> torch.Tensor:
+        """Return the scale factor of each (permuted) output channel, computed by the
+        corresponding quantizer
+
+        :return: the scale factor
+        :rtype: torch.Tensor
+        """
+        scale = None
+        n_ch = len(self.channel_qtz)
+        for i, qtz in enumerate(self.qtz_funcs):
+            s = qtz.scale
+            if s.numel() == 1:
+                s = s.reshape(1).expand(n_ch)
+            if scale is None:
+                scale = s
+            else:
+                mask = (self.channel_qtz == i).to(s.device).view((-1,) + (1,) * (s.dim() - 1))
+                scale = torch.where(mask, s, scale)
+        return scale[self.perm]
+
+    def __repr__(self):
+        msg = (
+            f'{self.__class__.__name__}'
+            f'(precision={self.precision}, '
+            f'qtz_funcs={[qtz.__class__.__name__ for qtz in self.qtz_funcs]})'
+        )
+        return msg
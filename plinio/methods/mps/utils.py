@@ -18,16 +18,17 @@
 # *----------------------------------------------------------------------------*
 
 import copy
-from typing import Dict, cast
+from typing import Dict, List, Optional, Tuple, cast
 
 import torch
+import torch.nn.functional as F
 
 from plinio.cost.cost_spec import CostFn, CostSpec
 from plinio.graph.inspection import shapes_dict
 from plinio.methods.mps.mps import MPS
 from plinio.methods.mps.nn.identity import MPSIdentity
 from plinio.methods.mps.nn.module import MPSModule
-from plinio.methods.mps.nn.qtz import MPSPerChannelQtz, MPSPerLayerQtz
+from plinio.methods.mps.nn.qtz import MPSBaseQtz, MPSPerChannelQtz, MPSPerLayerQtz
 
 
 def optimize_prec_assignment(model: MPS,
@@ -47,7 +48,7 @@ def optimize_prec_assignment(model: MPS,
     # Modify the sampling strategy to be argmax before the precisions reassignment.
     # Perform a dummy forward pass to ensure the theta alpha values are updated.
     model.update_softmax_options(hard=True)
-    model(model._input_example)
+    model(model._dummy_input())
 
     with torch.no_grad():
         # Retrieve the cost function and the cost specification
@@ -153,7 +154,7 @@ def optimize_prec_assignment(model: MPS,
                 base_model_cost = base_model_cost + cost_fn_map[lname](v)
 
     # Update the theta_alpha parameters with a dummy forward pass
-    model(model._input_example)
+    model(model._dummy_input())
     print("Model cost decreased from {} to {}".format(base_model_cost.item(), best_model_cost.item()))
 
     return model
@@ -243,4 +244,287 @@ def _reassign_precisions(best, scores):
         assigned_prec = new_assignment[channel]
         if assigned_prec != -1:  # Only assign if the channel has been reassigned
             binary_matrix[assigned_prec, channel] = 1
-    return binary_matrix
\ No newline at end of file
+    return binary_matrix
+
+
+class PrecisionParetoCurve:
+    """Cost/score Pareto curve of the weights precision assignments of a MPS model,
+    as computed by `prec_pareto_curve()`.
+
+    The score of an assignment is the sum of the log-probabilities (from the NAS parameters)
+    of the precisions selected for each layer (per-layer quantizers) or channel
+    (per-channel quantizers). `cost` and `score` are both increasing along the curve.
+
+    :param names: the name of the (first) layer using each weight quantizer
+    :type names: List[str]
+    :param quantizers: the weight quantizers, each one being a decision group
+    :type quantizers: List[MPSBaseQtz]
+    :param start: the precision index of each channel in the minimum cost assignment
+    :type start: List[torch.Tensor]
+    :param steps: the (group, channel, precision index) of each step of the curve
+    :type steps: torch.Tensor
+    :param cost: the estimated cost of each point of the curve
+    :type cost: torch.Tensor
+    :param score: the score of each point of the curve
+    :type score: torch.Tensor
+    """
+    def __init__(self,
+                 names: List[str],
+                 quantizers: List[MPSBaseQtz],
+                 start: List[torch.Tensor],
+                 steps: torch.Tensor,
+                 cost: torch.Tensor,
+                 score: torch.Tensor):
+        self.names = names
+        self.quantizers = quantizers
+        self.start = start
+        self.steps = steps
+        self.cost = cost
+        self.score = score
+
+    def __len__(self) -> int:
+        return len(self.cost)
+
+    def index(self, budget: float) -> int:
+        """Returns the index of the highest score point of the curve within the budget
+
+        :param budget: the maximum (estimated) cost
+        :type budget: float
+        :return: the index of the point in the curve
+        :rtype: int
+        """
+        k = int(torch.searchsorted(self.cost, torch.tensor([float(budget)],
+                                   dtype=self.cost.dtype), right=True)) - 1
+        if k < 0:
+            raise ValueError("The budget {} is lower than the minimum cost {}".format(
+                budget, self.cost[0].item()))
+        return k
+
+    def assignment(self, budget: float) -> Dict[str, torch.Tensor]:
+        """Returns the precision indexes selected within the budget, for each decision group.
+        The indexes are a scalar for per-layer quantizers, and one per channel otherwise.
+
+        :param budget: the maximum (estimated) cost
+        :type budget: float
+        :return: the precision indexes for each group, keyed by layer name
+        :rtype: Dict[str, torch.Tensor]
+        """
+        return self._assignment(self.index(budget))
+
+    def _assignment(self, k: int) -> Dict[str, torch.Tensor]:
+        """Returns the precision indexes of the k-th point of the curve"""
+        if len(self.start) == 0:
+            return {}
+        sizes = [len(s) for s in self.start]
+        idx = torch.cat(self.start)
+        offset = torch.tensor([0] + sizes[:-1], dtype=torch.long).cumsum(0)
+        steps = self.steps[:k]
+        # the last step taken by each channel gives its precision
+        flat = offset[steps[:, 0]] + steps[:, 1]
+        last = torch.full_like(idx, -1).scatter_reduce(0, flat, torch.arange(k), 'amax')
+        taken = last >= 0
+        idx[taken] = steps[last[taken], 2]
+        idx = list(idx.split(sizes))
+        return {n: i if isinstance(q, MPSPerChannelQtz) else i[0]
+                for n, q, i in zip(self.names, self.quantizers, idx)}
+
+    def precisions(self, budget: float) -> Dict[str, torch.Tensor]:
+        """Returns the precision values selected within the budget, for each decision group
+
+        :param budget: the maximum (estimated) cost
+        :type budget: float
+        :return: the precisions for each group, keyed by layer name
+        :rtype: Dict[str, torch.Tensor]
+        """
+        return self._precisions(self.assignment(budget))
+
+    def _precisions(self, assign: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        """Converts precision indexes to precision values"""
+        return {n: q.precision[assign[n]] for n, q in zip(self.names, self.quantizers)}
+
+    def apply(self, budget: float):
+        """Sets the alpha of the weight quantizers to the binary assignment selected within
+        the budget. A forward pass is needed to update the theta_alpha values.
+
+        :param budget: the maximum (estimated) cost
+        :type budget: float
+        """
+        self._apply(self.assignment(budget))
+
+    def _apply(self, assign: Dict[str, torch.Tensor]):
+        """Sets the alpha of the weight quantizers to the given binary assignment"""
+        with torch.no_grad():
+            for n, q in zip(self.names, self.quantizers):
+                q.alpha.data = _one_hot(assign[n], len(q.precision), q.alpha)
+
+
+def prec_pareto_curve(model: MPS, name: Optional[str] = None) -> PrecisionParetoCurve:
+    """Computes the Pareto curve of the weights precision assignments of the model,
+    trading the cost metric `name` against the precision scores found by the NAS.
+
+    Each weight quantizer (possibly shared among layers) is a group of a multi-choice
+    knapsack, with one choice for each channel (per-channel quantizers) or a single
+    one (per-layer quantizers). The problem is solved with a Lagrangian relaxation:
+    the upper convex hull of each choice is built, and its steps are taken in order of
+    decreasing score/cost efficiency, so that the whole curve is obtained with a
+    single sort.
+
+    The cost of each option is measured with the model cost metric, as the variation
+    obtained moving a single channel to that option from the argmax assignment (where
+    all quantizers, including the activation ones, which are kept fixed, use their
+    argmax precision). Hence, any cost specification is supported, but the curve costs
+    are a first-order estimate around the argmax assignment, which is exact only for
+    cost models linear in the number of channels of each precision (e.g., params and
+    ops-based ones without 0-bit pruning).
+
+    :param model: the MPS model
+    :type model: MPS
+    :param name: the cost metric name, if the model has more than one
+    :type name: Optional[str]
+    :return: the Pareto curve
+    :rtype: PrecisionParetoCurve
+    """
+    names, quantizers = _weight_quantizers(model)
+    summary = model.nas_parameters_summary()
+    saved = {q: q.theta_alpha for q in model.modules() if isinstance(q, MPSBaseQtz)}
+    try:
+        with torch.no_grad():
+            for q in saved:
+                q.theta_alpha = _one_hot(q.alpha.argmax(dim=0), len(q.precision), q.alpha)
+            base_cost = model.get_cost(name).detach().double()
+            offset = base_cost
+
+            scores, costs, start = [], [], []
+            for n, q in zip(names, quantizers):
+                alpha = summary[n]['w_params'].reshape(len(q.precision), -1)
+                score = F.log_softmax(alpha.double() / q.temperature, dim=0)
+                # unit cost of each option, i.e. the cost variation obtained moving a single
+                # channel from the most common argmax precision to that option
+                base = alpha.argmax(dim=0)
+                ref = int(base.bincount(minlength=len(q.precision)).argmax())
+                ch = int((base == ref).nonzero()[0])
+                cost = torch.zeros(len(q.precision), dtype=torch.float64)
+                for j in range(len(q.precision)):
+                    if j != ref:
+                        idx = base.clone()
+                        idx[ch] = j
+                        q.theta_alpha = _one_hot(idx, len(q.precision), q.alpha)
+                        cost[j] = model.get_cost(name).detach().double() - base_cost
+                q.theta_alpha = _one_hot(base, len(q.precision), q.alpha)
+                # remove the cost of the argmax assignment of this group
+                offset = offset - cost[base].sum()
+                scores.append(score)
+                costs.append(cost)
+                # start from the cheapest option, breaking ties by score
+                min_cost = (cost == cost.min()).unsqueeze(1)
+                start.append(score.masked_fill(~min_cost, -float('inf')).argmax(dim=0))
+    finally:
+        for q, theta in saved.items():
+            q.theta_alpha = theta
+
+    steps, eff, d_cost, d_score = [], [], [], []
+    for g, (score, cost, cur) in enumerate(zip(scores, costs, start)):
+        cur = cur.clone()
+        ch = torch.arange(score.shape[1])
+        for _ in range(len(cost)):
+            dc = cost.unsqueeze(1) - cost[cur].unsqueeze(0)
+            ds = score - score[cur, ch].unsqueeze(0)
+            e = torch.where(dc > 0, ds / dc, torch.full_like(ds, -float('inf')))
+            best, nxt = e.max(dim=0)
+            valid = best > 0
+            if not valid.any():
+                break
+            steps.append(torch.stack([torch.full_like(ch[valid], g), ch[valid], nxt[valid]], dim=1))
+            eff.append(best[valid])
+            d_cost.append(dc[nxt, ch][valid])
+            d_score.append(ds[nxt, ch][valid])
+            cur = torch.where(valid, nxt, cur)
+
+    cost0 = offset + sum(c[s].sum() for c, s in zip(costs, start))
+    score0 = sum(sc[s, torch.arange(sc.shape[1])].sum() for sc, s in zip(scores, start))
+    if len(steps) > 0:
+        # stable, so that the steps of each channel keep their (decreasing efficiency) order
+        order = torch.sort(torch.cat(eff), descending=True, stable=True).indices
+        all_steps = torch.cat(steps)[order]
+        cost = torch.cat([cost0.view(1), cost0 + torch.cat(d_cost)[order].cumsum(0)])
+        score = torch.cat([torch.as_tensor(score0, dtype=torch.float64).view(1),
+                           score0 + torch.cat(d_score)[order].cumsum(0)])
+    else:
+        all_steps = torch.zeros((0, 3), dtype=torch.long)
+        cost = cost0.view(1)
+        score = torch.as_tensor(score0, dtype=torch.float64).view(1)
+    return PrecisionParetoCurve(names, quantizers, start, all_steps, cost, score)
+
+
+def optimal_prec_assignment(model: MPS,
+                            budget: float,
+                            name: Optional[str] = None) -> Dict[str, torch.Tensor]:
+    """Assigns to the weights of the MPS layers the precisions with the highest score whose
+    cost fits in the budget, solving a multi-choice knapsack problem (see
+    `prec_pareto_curve()`). Since the curve costs are an estimate for non-linear cost
+    models, the selected point is the last one whose actual model cost fits in the
+    budget, found by bisection. The sampling is switched to argmax, as in
+    `optimize_prec_assignment()`.
+
+    :param model: the MPS model
+    :type model: MPS
+    :param budget: the maximum cost
+    :type budget: float
+    :param name: the cost metric name, if the model has more than one
+    :type name: Optional[str]
+    :return: the selected precisions for each weight quantizer, keyed by layer name
+    :rtype: Dict[str, torch.Tensor]
+    """
+    curve = prec_pareto_curve(model, name)
+    lo, hi = -1, len(curve) - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if _assignment_cost(model, curve, curve._assignment(mid), name) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    if lo < 0:
+        raise ValueError("The budget {} is lower than the minimum cost {}".format(
+            budget, _assignment_cost(model, curve, curve._assignment(0), name)))
+    assign = curve._assignment(lo)
+    curve._apply(assign)
+    model.update_softmax_options(hard=True)
+    model(model._dummy_input())
+    return curve._precisions(assign)
+
+
+def _assignment_cost(model: MPS, curve: PrecisionParetoCurve,
+                     assign: Dict[str, torch.Tensor], name: Optional[str]) -> float:
+    """Computes the model cost with the given weights precision assignment, and all other
+    quantizers at their argmax precision"""
+    saved = {q: q.theta_alpha for q in model.modules() if isinstance(q, MPSBaseQtz)}
+    try:
+        with torch.no_grad():
+            for q in saved:
+                q.theta_alpha = _one_hot(q.alpha.argmax(dim=0), len(q.precision), q.alpha)
+            for n, q in zip(curve.names, curve.quantizers):
+                q.theta_alpha = _one_hot(assign[n], len(q.precision), q.alpha)
+            return float(model.get_cost(name))
+    finally:
+        for q, theta in saved.items():
+            q.theta_alpha = theta
+
+
+def _weight_quantizers(model: MPS) -> Tuple[List[str], List[MPSBaseQtz]]:
+    """Returns the (deduplicated) weight quantizers of the model with more than one
+    precision, and the name of the first layer using each of them"""
+    names, quantizers = [], []
+    for lname, _, layer in model._unique_leaf_modules:
+        q = getattr(layer, 'w_mps_quantizer', None)
+        if isinstance(layer, MPSModule) and isinstance(q, MPSBaseQtz) and \
+                len(q.precision) > 1 and all(q is not x for x in quantizers):
+            names.append(lname)
+            quantizers.append(q)
+    return names, quantizers
+
+
+def _one_hot(idx: torch.Tensor, n: int, like: torch.Tensor) -> torch.Tensor:
+    """Binary (n, ...) matrix with a one in position `idx` along the first dimension,
+    with the shape, dtype and device of `like`"""
+    out = F.one_hot(idx.reshape(-1), n).t().to(like)
+    return out.reshape(like.shape)
@@ -17,5 +17,6 @@
 # * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
 # *----------------------------------------------------------------------------*
 from .pit import PIT
+from .shrinking import PITShrinker
 
-__all__ = ['PIT']
+__all__ = ['PIT', 'PITShrinker']
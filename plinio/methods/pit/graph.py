@@ -19,11 +19,10 @@
 from typing import cast, Iterable, Type, Tuple, Optional, Dict, Any
 
 import copy
-import networkx as nx
+import math
 import torch
 import torch.nn as nn
 import torch.fx as fx
-from torch.fx.passes.shape_prop import ShapeProp
 
 from .nn.conv1d import PITConv1d
 from .nn.conv2d import PITConv2d
@@ -38,7 +37,9 @@ from plinio.graph.inspection import is_layer, get_graph_outputs, is_inherited_la
     get_graph_inputs, named_leaf_modules, uniquify_leaf_modules
 from plinio.graph.transformation import fuse_consecutive_layers
 from plinio.graph.features_calculation import ModAttrFeaturesCalculator
-from plinio.graph.utils import fx_to_nx_graph, NamedLeafModules
+from plinio.graph.tracing import trace_and_annotate
+from plinio.graph.index import GraphIndex
+from plinio.graph.utils import NamedLeafModules
 
 # add new supported layers here:
 pit_layer_map: Dict[Type[nn.Module], Type[PITModule]] = {
@@ -65,6 +66,7 @@ def convert(model: nn.Module, input_example: Any, conversion_type: str,
             exclude_names: Iterable[str] = (),
             exclude_types: Iterable[Type[nn.Module]] = (),
             fold_bn: bool = False,
+            features_group_size: Optional[Dict[str, int]] = None,
             ) -> Tuple[nn.Module, NamedLeafModules, NamedLeafModules]:
     """Converts a nn.Module, to/from "NAS-able" PIT format
 
@@ -80,6 +82,11 @@ def convert(model: nn.Module, input_example: Any, conversion_type: str,
     :type exclude_names: Iterable[str], optional
     :param exclude_types: the types of `model` submodules that should be ignored by the NAS
     :type exclude_types: Iterable[Type[nn.Module]], optional
+    :param fold_bn: flag to fold the bn layer into the linear/conv layer
+    :type fold_bn: bool, optional
+    :param features_group_size: the number of output features controlled by each mask element,
+    for each submodule name (1 for missing names). Used only in 'autoimport' mode
+    :type features_group_size: Optional[Dict[str, int]], optional
     :raises ValueError: for unsupported conversion types
     :return: the converted model, and two lists of all (or all unique) leaf modules for
     the NAS
@@ -89,24 +96,18 @@ def convert(model: nn.Module, input_example: Any, conversion_type: str,
     if conversion_type not in ('import', 'autoimport', 'export'):
         raise ValueError("Unsupported conversion type {}".format(conversion_type))
 
-    tracer = PITTracer()
-    graph = tracer.trace(model.eval())
-    name = model.__class__.__name__
-    mod = fx.GraphModule(tracer.root, graph, name)
-    if len(get_graph_inputs(mod.graph)) > 1:
-        ShapeProp(mod).propagate(*input_example)
-    else:
-        ShapeProp(mod).propagate(input_example)
-    clean_up_propagated_shapes(mod)
-    add_node_properties(mod)
+    mod = trace_and_annotate(model, input_example, PITTracer,
+                             [clean_up_propagated_shapes, add_node_properties])
     if conversion_type in ('autoimport', 'export'):
         # dictionary of shared feature maskers. Used only in 'autoimport' mode.
-        sm_dict = {} if conversion_type != 'autoimport' else build_shared_features_map(mod)
+        sm_dict = {} if conversion_type != 'autoimport' else \
+            build_shared_features_map(mod, features_group_size)
         convert_layers(mod, conversion_type, sm_dict, exclude_names, exclude_types, fold_bn)
     if conversion_type in ('autoimport', 'import'):
         fuse_pit_modules(mod, fold_bn)
-        add_features_calculator(mod, [pit_features_calc])
-        associate_input_features(mod)
+        index = GraphIndex(mod.graph)
+        add_features_calculator(mod, [pit_features_calc], index)
+        associate_input_features(mod, index)
         register_input_features(mod)
     mod.graph.lint()
     mod.recompile()
@@ -140,62 +141,59 @@ def convert_layers(mod: fx.GraphModule,
     :type fold_bn: bool
     """
     g = mod.graph
-    queue = get_graph_outputs(g)
-    visited = []
-    while queue:
-        n = queue.pop(0)
-        if n in visited:
-            continue
+    for n in GraphIndex(g).bfs(get_graph_outputs(g), reverse=True):
         if conversion_type == 'autoimport':
             autoimport_node(n, mod, sm_dict, exclude_names, exclude_types, fold_bn)
         if conversion_type == 'export':
             export_node(n, mod, exclude_names, exclude_types)
-        for pred in n.all_input_nodes:
-            queue.append(pred)
-        visited.append(n)
     return
 
 
-def build_shared_features_map(mod: fx.GraphModule) -> Dict[fx.Node, PITFeaturesMasker]:
+def build_shared_features_map(mod: fx.GraphModule,
+                              group_size: Optional[Dict[str, int]] = None
+                              ) -> Dict[fx.Node, PITFeaturesMasker]:
     """Create a map from fx.Node instances to instances of PITFeaturesMasker to be used by PIT
     to optimize the number of features of that node. Handles the sharing of masks among
     multiple nodes.
 
+    Shared maskers group features with the least common multiple of the group sizes requested
+    for the layers that use them.
+
     :param mod: the fx-converted GraphModule
     :type mod: fx.GraphModule
+    :param group_size: the number of features controlled by each mask element, for each
+    submodule name (1 for missing names)
+    :type group_size: Optional[Dict[str, int]]
     :return: a map (node -> feature masker)
     :rtype: Dict[fx.Node, PITFeaturesMasker]
     """
     # build a compatibility graph ("sharing graph") with paths between all nodes that must share
     # the same features masker. This is obtained by taking the original NN graph and removing
     # incoming edges to nodes whose output features are not dependent on the input features
-    sharing_graph = fx_to_nx_graph(mod.graph)
-    for n in sharing_graph.nodes:
-        n = cast(fx.Node, n)
-        if n.meta['untouchable'] or n.meta['features_concatenate'] or n.meta['features_defining']:
-            # remove all incoming edges to this node from the "shared features graph"
-            pred = list(sharing_graph.predecessors(n))
-            for i in pred:
-                sharing_graph.remove_edge(i, n)
+    index = GraphIndex(mod.graph)
+    inputs = set(get_graph_inputs(mod.graph))
+    outputs = set(get_graph_outputs(mod.graph))
+
+    def cut_inputs(n: fx.Node) -> bool:
+        return n.meta['untouchable'] or n.meta['features_concatenate'] or \
+            n.meta['features_defining']
 
     # handle the case of a forward function with multiple outputs (returned as a tuple or list) with
     # possibly independent shapes. In this case, the graph will contain a final output node that is
     # difficult to treat and we remove in this step, treating each single output independently.
     nodes_to_remove = []
-    for n in sharing_graph.nodes:
-        if n in get_graph_outputs(mod.graph) and len(n.meta['tensor_meta']) > 1:
-            # tag each predecessor as output-connected
-            pred = list(sharing_graph.predecessors(n))
-            for i in pred:
-                i.meta['output_connected'] = True
+    for n in outputs:
+        if index.degree(index.position[n]) > 0 and len(n.meta['tensor_meta']) > 1:
+            # tag each predecessor as output-connected (unless the edge is cut)
+            if not cut_inputs(n):
+                for i in n.all_input_nodes:
+                    i.meta['output_connected'] = True
             # add the node to the removal list
             nodes_to_remove.append(n)
-    for n in nodes_to_remove:
-        sharing_graph.remove_node(n)
 
     # each weakly connected component of the sharing graph must share the same features masker
     sm_dict = {}
-    for c in nx.weakly_connected_components(sharing_graph):
+    for c in index.weakly_connected_components(cut_inputs, nodes_to_remove):
         sm = None
         for n in c:
             # identify a node which can give us the number of features with 100% certainty
@@ -204,19 +202,30 @@ def build_shared_features_map(mod: fx.GraphModule) -> Dict[fx.Node, PITFeaturesM
                 # distinguish the case in which the number of features must "frozen"
                 # i.e. the case of input-connected or output-connected components,
                 if (
-                    any(n in get_graph_inputs(mod.graph) for n in c) or
-                    any(n in get_graph_outputs(mod.graph) for n in c) or
+                    any(n in inputs for n in c) or
+                    any(n in outputs for n in c) or
                     any(n.meta.get('output_connected', False) for n in c)
                 ):
                     sm = PITFrozenFeaturesMasker(n.meta['tensor_meta'].shape[1])
                 else:
-                    sm = PITFeaturesMasker(n.meta['tensor_meta'].shape[1])
+                    n_features = n.meta['tensor_meta'].shape[1]
+                    group = _lcm([group_size.get(str(m.target), 1) for m in c
+                                  if m.op == 'call_module']) if group_size else 1
+                    sm = PITFeaturesMasker(n_features, group_size=min(group, n_features))
                 break
         for n in c:
             sm_dict[n] = sm
     return sm_dict
 
 
+def _lcm(values: Iterable[int]) -> int:
+    """Least common multiple of a sequence of positive integers (1 if empty)"""
+    res = 1
+    for v in values:
+        res = res * v // math.gcd(res, v)
+    return res
+
+
 def exclude(n: fx.Node, mod: fx.GraphModule,
             exclude_names: Iterable[str],
             exclude_types: Iterable[Type[nn.Module]],
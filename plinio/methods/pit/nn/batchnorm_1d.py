@@ -169,14 +169,14 @@ class PITBatchNorm1d(nn.BatchNorm1d, PITModule):
         with torch.no_grad():
             return self.input_features_calculator.features_mask.bool()
 
-    def get_modified_vars(self) -> Dict[str, Any]:
-        """Method that returns the modified vars(self) dictionary for the instance, used for
-        cost computation
+    def get_modified_fields(self) -> Dict[str, Any]:
+        """Method that returns only the entries of vars(self) that are modified by the NAS,
+        used for cost computation
 
-        :return: the modified vars(self) data structure
+        :return: the NAS-modified entries of vars(self)
         :rtype: Dict[str, Any]
         """
-        v = dict(vars(self))
+        v = {}
         v['num_features'] = self.out_features_opt
         return v
 
@@ -21,13 +21,14 @@ from typing import Tuple, Dict, Any, Optional, cast, Iterator
 import torch
 import torch.fx as fx
 import torch.nn as nn
+import torch.nn.functional as F
 import itertools
 from plinio.graph.features_calculation import ConstFeaturesCalculator, FeaturesCalculator
 from .features_masker import PITFeaturesMasker
 from .timestep_masker import PITTimestepMasker, PITFrozenTimestepMasker
 from .dilation_masker import PITDilationMasker, PITFrozenDilationMasker
 from .binarizer import PITBinarizer
-from .module import PITModule
+from .module import PITModule, _batch_norm, _bn_affine, _export_bn
 
 
 class PITConv1d(nn.Conv1d, PITModule):
@@ -87,6 +88,11 @@ class PITConv1d(nn.Conv1d, PITModule):
         self.discrete_cost = discrete_cost
         self.fold_bn = fold_bn
         self.bn: Optional[nn.Module] = None
+        # re-add (rather than fold) the BatchNorm in the exported model
+        self.export_bn = True
+        # explicit (left, right) zero-padding, replacing `padding` once the kernel has been
+        # physically shrunk during the search (see `plinio.methods.pit.shrinking`)
+        self.time_padding: Optional[Tuple[int, int]] = None
         _beta_norm, _gamma_norm = self._generate_norm_constants()
         self.register_buffer('_beta_norm', _beta_norm)
         self.register_buffer('_gamma_norm', _gamma_norm)
@@ -95,29 +101,52 @@ class PITConv1d(nn.Conv1d, PITModule):
         """The forward function of the NAS-able layer.
 
         In a nutshell, uses the various maskers to generate the binarized masks, then runs
-        the convolution with the masked weights tensor.
+        the convolution with the masked weights tensor. When most output channels are masked,
+        only the active ones are computed (see `PITModule._sparse_forward`).
 
         :param input: the input activations tensor
         :type input: torch.Tensor
         :return: the output activations tensor
         :rtype: torch.Tensor
         """
-        # TODO: add support for not-folded BatchNorm also for Conv1d
-        cout_mask = self._features_mask(discrete=True)
-        time_mask = self._time_mask(discrete=True)
+        # masks are re-computed only when the NAS parameters are trainable or have changed
+        cout_mask = self._frozen_mask('features', lambda: self._features_mask(discrete=True))
+        time_mask = self._frozen_mask('time', lambda: self._time_mask(discrete=True))
+        if self.time_padding is not None:
+            # negative amounts crop the input
+            input = F.pad(input, self.time_padding)
+        if self._use_sparse(cout_mask):
+            # only compute the active output channels and, if possible, time-steps
+            taps = self._active_taps(time_mask)
+            if taps is None:
+                return self._sparse_forward(input, torch.mul(time_mask, self.weight), cout_mask)
+            idx, step, pad = taps
+            return self._sparse_forward(
+                F.pad(input, pad), self.weight.index_select(2, idx), cout_mask,
+                dilation=(self.dilation[0] * step,), padding=0)
         if self.fold_bn:
             # apply all masks to the weights
-            pruned_weight = torch.mul(self.weight, cout_mask.unsqueeze(1).unsqueeze(1))
-            pruned_weight = torch.mul(time_mask, pruned_weight)
+            weight_mask = self._frozen_mask(
+                'weight', lambda: torch.mul(cout_mask.view(-1, 1, 1), time_mask))
+            pruned_weight = torch.mul(self.weight, weight_mask)
             return self._conv_forward(input, pruned_weight, self.bias)
         else:
             # apply time mask to the weights
             pruned_weight = torch.mul(time_mask, self.weight)
+            bn = cast(Optional[nn.modules.batchnorm._BatchNorm], self.bn)
+            if bn is None:
+                y = self._conv_forward(input, pruned_weight, self.bias)
+                # ...and cout mask to the output activations
+                return torch.mul(y, cout_mask.view(1, -1, 1))
+            if not bn.training and bn.running_mean is not None:
+                # BatchNorm (with running statistics) and cout mask are a per-channel affine
+                # transformation, folded into the convolution
+                scale, shift = _bn_affine(bn, self.bias, cout_mask)
+                return self._conv_forward(
+                    input, torch.mul(pruned_weight, scale.view(-1, 1, 1)), shift)
             y = self._conv_forward(input, pruned_weight, self.bias)
-            if self.bn is not None:
-                y = self.bn(y)
-            # ...and cout mask to the output activations
-            return torch.mul(y, cout_mask.view(1, -1, 1))
+            # ...and cout mask to the BatchNorm affine parameters
+            return _batch_norm(bn, y, mask=cout_mask)
 
 
     @staticmethod
@@ -201,7 +230,23 @@ class PITConv1d(nn.Conv1d, PITModule):
                 cast(nn.parameter.Parameter, new_submodule.bias).copy_(submodule.bias[cout_mask])
         mod.add_submodule(str(n.target), new_submodule)
         # Adjust Padding
-        if submodule.padding in ('valid', 0, (0,)):
+        if submodule.time_padding is not None:
+            # the kernel has been shrunk during the search: keep the explicit padding, minus the
+            # amount corresponding to the leading and trailing taps that are masked
+            taps = time_mask.nonzero().flatten()
+            left = submodule.time_padding[0] - int(taps[0]) * submodule.dilation[0]
+            right = submodule.time_padding[1] - \
+                (submodule.kernel_size[0] - 1 - int(taps[-1])) * submodule.dilation[0]
+            if left == right and left >= 0:
+                new_submodule.padding = (left,)
+            else:
+                new_pad = nn.ConstantPad1d(padding=(left, right), value=0)
+                mod.add_submodule(str(n.target) + "_pad", new_pad)
+                inp = cast(fx.Node, n.args[0])
+                with mod.graph.inserting_before(n):
+                    new_node = mod.graph.call_module(str(n.target) + "_pad", args=(inp,))
+                n.replace_input_with(inp, new_node)
+        elif submodule.padding in ('valid', 0, (0,)):
             pad_amount = (submodule.kernel_size_opt[0] - 1) * submodule.dilation_opt[0]
             new_pad = nn.ConstantPad1d(
                 padding=(pad_amount, 0),
@@ -221,26 +266,9 @@ class PITConv1d(nn.Conv1d, PITModule):
                     new_node = mod.graph.call_module(
                         str(n.target) + "_pad",
                         args=n.args)
-        # unfuse the BatchNorm
+        # unfuse (or fold) the BatchNorm
         if submodule.bn is not None and not submodule.fold_bn:
-            new_bn = nn.BatchNorm1d(
-                submodule.out_features_opt,
-                eps=submodule.bn.eps,
-                momentum=submodule.bn.momentum,
-                affine=submodule.bn.affine,
-                track_running_stats=submodule.bn.track_running_stats
-            )
-            mod.add_submodule(str(n.target) + "_exported_bn", new_bn)
-            # add the batchnorm just after the conv in the graph
-            with mod.graph.inserting_after(n):
-                new_node = mod.graph.call_module(
-                    str(n.target) + "_exported_bn",
-                    args=(n,)
-                )
-                n.replace_all_uses_with(new_node)
-                # The previous line replaces also the input to the BN with the BN itself.
-                # The following line fixes it. Not sure if there's a cleaner way to do this?
-                new_node.replace_input_with(new_node, n)
+            _export_bn(n, mod, submodule, new_submodule, cout_mask, nn.BatchNorm1d)
         return
 
     def summary(self) -> Dict[str, Any]:
@@ -360,14 +388,14 @@ class PITConv1d(nn.Conv1d, PITModule):
         with torch.no_grad():
             return self._time_mask(discrete=True)
 
-    def get_modified_vars(self) -> Dict[str, Any]:
-        """Method that returns the modified vars(self) dictionary for the instance, used for
-        cost computation
+    def get_modified_fields(self) -> Dict[str, Any]:
+        """Method that returns only the entries of vars(self) that are modified by the NAS,
+        used for cost computation
 
-        :return: the modified vars(self) data structure
+        :return: the NAS-modified entries of vars(self)
         :rtype: Dict[str, Any]
         """
-        v = dict(vars(self))
+        v = {}
         v['in_channels'] = self.input_features_calculator.features
         v['out_channels'] = self.out_features_eff
         v['kernel_size'] = (self.k_eff,)
@@ -396,6 +424,39 @@ class PITConv1d(nn.Conv1d, PITModule):
         bg_prod = torch.mul(cast(torch.Tensor, theta_gamma), cast(torch.Tensor, theta_beta))
         return bg_prod
 
+    def _explicit_padding(self) -> Tuple[int, int]:
+        """Returns the (left, right) zero-padding applied by the `padding` attribute"""
+        if isinstance(self.padding, str):
+            if self.padding == 'valid':
+                return (0, 0)
+            # 'same' puts the extra padding element (if any) on the right
+            total = self.dilation[0] * (self.kernel_size[0] - 1)
+            return (total // 2, total - total // 2)
+        return (self.padding[0], self.padding[0])
+
+    def _active_taps(self, time_mask: torch.Tensor
+                     ) -> Optional[Tuple[torch.Tensor, int, Tuple[int, int]]]:
+        """Returns the indices of the active time-steps of the kernel, the step between them,
+        and the explicit padding to use when only those are processed, or None if the whole
+        kernel should be processed (i.e., all time-steps are active, active time-steps are not
+        equally spaced, or the time mask needs a gradient)"""
+        if (torch.is_grad_enabled() and time_mask.requires_grad) or \
+                self.padding_mode != 'zeros':
+            return None
+
+        def compute() -> Optional[Tuple[torch.Tensor, int, Tuple[int, int]]]:
+            taps = torch.nonzero(time_mask).flatten().tolist()
+            rf = self.kernel_size[0]
+            steps = {b - a for a, b in zip(taps[:-1], taps[1:])}
+            if len(taps) == 0 or len(taps) == rf or len(steps) > 1:
+                return None
+            step = steps.pop() if steps else 1
+            dil = self.dilation[0]
+            left, right = self._explicit_padding()
+            pad = (left - taps[0] * dil, right - (rf - 1 - taps[-1]) * dil)
+            return torch.tensor(taps, device=time_mask.device), step, pad
+        return self._frozen_mask('taps', compute)
+
     def _generate_norm_constants(self) -> Tuple[torch.Tensor, torch.Tensor]:
         """Method called at construction time to generate the normalization constants for the
         correct evaluation of the effective kernel size.
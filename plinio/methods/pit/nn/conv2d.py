@@ -23,7 +23,7 @@ import torch.fx as fx
 from plinio.graph.features_calculation import ConstFeaturesCalculator, FeaturesCalculator
 from .features_masker import PITFeaturesMasker
 from .binarizer import PITBinarizer
-from .module import PITModule
+from .module import PITModule, _export_bn
 
 
 class PITConv2d(nn.Conv2d, PITModule):
@@ -70,6 +70,8 @@ class PITConv2d(nn.Conv2d, PITModule):
                 self.bias = None
         self.fold_bn = fold_bn
         self.bn: Optional[nn.Module] = None
+        # re-add (rather than fold) the BatchNorm in the exported model
+        self.export_bn = True
         # this will be overwritten later when we process the model graph
         self._input_features_calculator = ConstFeaturesCalculator(conv.in_channels)
         self.out_features_masker = out_features_masker
@@ -80,14 +82,19 @@ class PITConv2d(nn.Conv2d, PITModule):
         """The forward function of the NAS-able layer.
 
         In a nutshell, uses the various Maskers to generate the binarized masks, then runs
-        the convolution with the masked weights tensor.
+        the convolution with the masked weights tensor. When most output channels are masked,
+        only the active ones are computed (see `PITModule._sparse_forward`).
 
         :param input: the input activations tensor
         :type input: torch.Tensor
         :return: the output activations tensor
         :rtype: torch.Tensor
         """
-        cout_mask = self._features_mask(discrete=True)
+        # the mask is re-computed only when the NAS parameters are trainable or have changed
+        cout_mask = self._frozen_mask('features', lambda: self._features_mask(discrete=True))
+        if self._use_sparse(cout_mask):
+            # only compute the active output channels
+            return self._sparse_forward(input, self.weight, cout_mask)
         if self.fold_bn:
             # apply mask to the weights
             pruned_weight = torch.mul(self.weight, cout_mask.view(-1, 1, 1, 1))
@@ -173,26 +180,9 @@ class PITConv2d(nn.Conv2d, PITModule):
             if submodule.bias is not None:
                 cast(nn.parameter.Parameter, new_submodule.bias).copy_(submodule.bias[cout_mask])
         mod.add_submodule(str(n.target), new_submodule)
-        # unfuse the BatchNorm
+        # unfuse (or fold) the BatchNorm
         if submodule.bn is not None and not submodule.fold_bn:
-            new_bn = nn.BatchNorm2d(
-                submodule.out_features_opt,
-                eps=submodule.bn.eps,
-                momentum=submodule.bn.momentum,
-                affine=submodule.bn.affine,
-                track_running_stats=submodule.bn.track_running_stats
-            )
-            mod.add_submodule(str(n.target) + "_exported_bn", new_bn)
-            # add the batchnorm just after the conv in the graph
-            with mod.graph.inserting_after(n):
-                new_node = mod.graph.call_module(
-                    str(n.target) + "_exported_bn",
-                    args=(n,)
-                )
-                n.replace_all_uses_with(new_node)
-                # The previous line replaces also the input to the BN with the BN itself.
-                # The following line fixes it. Not sure if there's a cleaner way to do this?
-                new_node.replace_input_with(new_node, n)
+            _export_bn(n, mod, submodule, new_submodule, cout_mask, nn.BatchNorm2d)
         return
 
     def summary(self) -> Dict[str, Any]:
@@ -261,14 +251,14 @@ class PITConv2d(nn.Conv2d, PITModule):
         with torch.no_grad():
             return self._features_mask(discrete=True)
 
-    def get_modified_vars(self) -> Dict[str, Any]:
-        """Method that returns the modified vars(self) dictionary for the instance, used for
-        cost computation
+    def get_modified_fields(self) -> Dict[str, Any]:
+        """Method that returns only the entries of vars(self) that are modified by the NAS,
+        used for cost computation
 
-        :return: the modified vars(self) data structure
+        :return: the NAS-modified entries of vars(self)
         :rtype: Dict[str, Any]
         """
-        v = dict(vars(self))
+        v = {}
         v['in_channels'] = self.input_features_calculator.features
         v['out_channels'] = self.out_features_eff
         return v
@@ -26,6 +26,12 @@ from torch.nn.parameter import Parameter
 class PITFeaturesMasker(nn.Module):
     """A nn.Module implementing the creation of output channels in the layer to be masked
 
+    Channels can be masked in groups of `group_size` consecutive elements, each controlled by
+    a single mask parameter, so that the NAS only selects channel counts that differ by
+    multiples of the group size (e.g., to match the parallelism of the target hardware). When
+    the number of channels is not a multiple of the group size, the last group (which is also
+    the first to be kept alive) is smaller than the others.
+
     :param out_channels: the static (i.e., maximum) number of output channels in the mask
     :type out_channels: int
     :param trainable: should the masks be trained, defaults to True
@@ -33,19 +39,34 @@ class PITFeaturesMasker(nn.Module):
     :param keep_alive_channels: how many channels should always be kept alive (binarized at 1),
     defaults to 1
     :type keep_alive_channels: int, optional
+    :param group_size: the number of channels controlled by each mask parameter, defaults to 1
+    :type group_size: int, optional
     """
     def __init__(self,
                  out_channels: int,
                  trainable: bool = True,
-                 keep_alive_channels: int = 1):
+                 keep_alive_channels: int = 1,
+                 group_size: int = 1):
         super(PITFeaturesMasker, self).__init__()
+        if group_size < 1:
+            raise ValueError("The features group size must be positive")
         self.out_channels = out_channels
+        self.group_size = group_size
         self.alpha = Parameter(
-            torch.empty(self.out_channels, dtype=torch.float32).fill_(1.0), requires_grad=True)
+            torch.empty(self.n_groups, dtype=torch.float32).fill_(1.0), requires_grad=True)
         # this should be done after creating alpha
         self.trainable = trainable
         self.register_buffer('_keep_alive', self._generate_keep_alive_mask(keep_alive_channels))
 
+    @property
+    def n_groups(self) -> int:
+        """The number of mask parameters, i.e. of groups of channels
+
+        :return: the number of groups of channels
+        :rtype: int
+        """
+        return -(-self.out_channels // self.group_size)
+
     @property
     def theta(self) -> torch.Tensor:
         """The forward function that generates the binary masks from the trainable floating point
@@ -58,21 +79,26 @@ class PITFeaturesMasker(nn.Module):
         # using ifs
         ka = cast(torch.Tensor, self._keep_alive)
         keep_alive_alpha = torch.abs(self.alpha) * (1 - ka) + ka
+        if self.group_size > 1:
+            # one mask value per channel
+            keep_alive_alpha = torch.repeat_interleave(
+                keep_alive_alpha, self.group_size)[:self.out_channels]
         return keep_alive_alpha
 
     def _generate_keep_alive_mask(self, keep_alive_channels: int) -> torch.Tensor:
         """Method called at creation time, to generate a "keep-alive" mask vector.
 
-        This is a vector with a number of leading 1s equal to the number of channels that should
-        never be eliminated
+        This is a vector with a number of leading 1s equal to the number of channels (or groups
+        of channels) that should never be eliminated
 
         :return: a binary keep-alive mask vector, with 1s corresponding to elements that should
         never be masked
         :rtype: torch.Tensor
         """
+        keep_alive_groups = -(-keep_alive_channels // self.group_size)
         # keep alive the last channel for consistency with rf and dilation
         return torch.tensor(
-            [0.0] * (self.out_channels - keep_alive_channels) + [1.0] * keep_alive_channels,
+            [0.0] * (self.n_groups - keep_alive_groups) + [1.0] * keep_alive_groups,
             dtype=torch.float32)
 
     @property
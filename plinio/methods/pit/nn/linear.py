@@ -22,7 +22,7 @@ import torch.nn as nn
 import torch.fx as fx
 import torch.nn.functional as F
 from plinio.graph.features_calculation import ConstFeaturesCalculator, FeaturesCalculator
-from .module import PITModule
+from .module import PITModule, _export_bn
 from .features_masker import PITFeaturesMasker
 from .binarizer import PITBinarizer
 
@@ -61,6 +61,8 @@ class PITLinear(nn.Linear, PITModule):
                 self.bias = None
         self.fold_bn = fold_bn
         self.bn: Optional[nn.Module] = None
+        # re-add (rather than fold) the BatchNorm in the exported model
+        self.export_bn = True
         # this will be overwritten later when we process the model graph
         self._input_features_calculator = ConstFeaturesCalculator(linear.in_features)
         self.out_features_masker = out_features_masker
@@ -78,7 +80,8 @@ class PITLinear(nn.Linear, PITModule):
         :return: the output activations tensor
         :rtype: torch.Tensor
         """
-        cout_mask = self._features_mask(discrete=True)
+        # the mask is re-computed only when the NAS parameters are trainable or have changed
+        cout_mask = self._frozen_mask('features', lambda: self._features_mask(discrete=True))
         if self.fold_bn:
             # apply mask to the weights
             pruned_weight = torch.mul(self.weight, cout_mask.unsqueeze(1))
@@ -144,26 +147,9 @@ class PITLinear(nn.Linear, PITModule):
                 new_submodule.bias.copy_(submodule.bias[cout_mask])
         mod.add_submodule(str(n.target), new_submodule)
 
-        # unfuse the BatchNorm
+        # unfuse (or fold) the BatchNorm
         if submodule.bn is not None and not submodule.fold_bn:
-            new_bn = nn.BatchNorm1d(
-                submodule.out_features_opt,
-                eps=submodule.bn.eps,
-                momentum=submodule.bn.momentum,
-                affine=submodule.bn.affine,
-                track_running_stats=submodule.bn.track_running_stats
-            )
-            mod.add_submodule(str(n.target) + "_exported_bn", new_bn)
-            # add the batchnorm just after the conv in the graph
-            with mod.graph.inserting_after(n):
-                new_node = mod.graph.call_module(
-                    str(n.target) + "_exported_bn",
-                    args=(n,)
-                )
-                n.replace_all_uses_with(new_node)
-                # The previous line replaces also the input to the BN with the BN itself.
-                # The following line fixes it. Not sure if there's a cleaner way to do this?
-                new_node.replace_input_with(new_node, n)
+            _export_bn(n, mod, submodule, new_submodule, cout_mask, nn.BatchNorm1d)
         return
 
     def summary(self) -> Dict[str, Any]:
@@ -232,14 +218,14 @@ class PITLinear(nn.Linear, PITModule):
         with torch.no_grad():
             return self._features_mask(discrete=True)
 
-    def get_modified_vars(self) -> Dict[str, Any]:
-        """Method that returns the modified vars(self) dictionary for the instance, used for
-        cost computation
+    def get_modified_fields(self) -> Dict[str, Any]:
+        """Method that returns only the entries of vars(self) that are modified by the NAS,
+        used for cost computation
 
-        :return: the modified vars(self) data structure
+        :return: the NAS-modified entries of vars(self)
         :rtype: Dict[str, Any]
         """
-        v = dict(vars(self))
+        v = {}
         v['in_features'] = self.input_features_calculator.features
         v['out_features'] = self.out_features_eff
         return v
@@ -17,16 +17,25 @@
 # * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
 # *----------------------------------------------------------------------------*
 from abc import abstractmethod
-from typing import Dict, Any, Iterator, Tuple
+from typing import Callable, Dict, Any, Iterator, Optional, Tuple, TypeVar, cast
+import torch
 import torch.fx as fx
 import torch.nn as nn
+import torch.nn.functional as F
+from torch._subclasses.fake_tensor import FakeTensor
 from .features_masker import PITFeaturesMasker
 from plinio.graph.features_calculation import FeaturesCalculator
 
+T = TypeVar('T')
+
 
 class PITModule:
     """An abstract class representing the interface that all PIT layers should implement
     """
+    # maximum fraction of active output features for which layers that support it switch
+    # to the sparse forward path (see `_sparse_forward`). 0 disables the sparse path
+    sparse_threshold: float = 0.
+
     @abstractmethod
     def __init__(self):
         raise NotImplementedError("Calling init on base abstract PITModule class")
@@ -108,6 +117,15 @@ class PITModule:
         raise NotImplementedError("Calling arch_parameters on base abstract PITModule class")
 
     @abstractmethod
+    def get_modified_fields(self) -> Dict[str, Any]:
+        """Method that returns only the entries of vars(self) that are modified by the NAS
+        (e.g., the effective number of output channels), used for cost computation
+
+        :return: the NAS-modified entries of vars(self)
+        :rtype: Dict[str, Any]
+        """
+        raise NotImplementedError("Calling get_modified_fields on base abstract PITModule class")
+
     def get_modified_vars(self) -> Dict[str, Any]:
         """Method that returns the modified vars(self) dictionary for the instance, used for
         cost computation
@@ -115,7 +133,9 @@ class PITModule:
         :return: the modified vars(self) data structure
         :rtype: Dict[str, Any]
         """
-        raise NotImplementedError("Calling get_modified_vars on base abstract PITModule class")
+        v = dict(vars(self))
+        v.update(self.get_modified_fields())
+        return v
 
     def nas_parameters(self, recurse: bool = False) -> Iterator[nn.Parameter]:
         """Returns an iterator over the architectural parameters (masks) of this layer
@@ -127,3 +147,251 @@ class PITModule:
         """
         for name, param in self.named_nas_parameters(recurse=recurse):
             yield param
+
+    def _frozen_mask(self, name: str, compute: Callable[[], T]) -> T:
+        """Returns the mask (or any other value derived from the masks) generated by
+        `compute`, re-using the previously generated one if all the architectural parameters
+        of the layer are frozen (requires_grad=False, e.g. after `train_net_only()`) and have
+        not changed since then.
+
+        Changes are tracked through the parameters version counters (which are incremented by
+        optimizers and by in-place updates in `torch.no_grad()` mode) and identity (which
+        changes when a parameter is re-assigned). In-place updates through `.data` are not
+        tracked, and require calling `clear_mask_cache()`.
+
+        :param name: the name of the mask in the cache
+        :type name: str
+        :param compute: the function that generates the mask
+        :type compute: Callable[[], T]
+        :return: the mask
+        :rtype: T
+        """
+        params = tuple(self.nas_parameters())
+        if any(p.requires_grad for p in params):
+            return compute()
+        key = (getattr(self, 'binarization_threshold', None),
+               tuple((p._version, p.data_ptr()) for p in params))
+        cache = self.__dict__.get('_mask_cache', {})
+        entry = cache.get(name)
+        # parameters are stored in the entry and compared by identity, so that they are kept
+        # alive and their ids are never re-used while the entry exists
+        if entry is not None and entry[1] == key and \
+                all(a is b for a, b in zip(entry[0], params)) and len(entry[0]) == len(params):
+            return entry[2]
+        mask = compute()
+        # copy-on-write, so that masks computed while the module state is temporarily swapped
+        # (e.g., fake tensors during shape propagation) are dropped when the state is restored
+        cache = dict(cache)
+        cache[name] = (params, key, mask)
+        self.__dict__['_mask_cache'] = cache
+        return mask
+
+    def clear_mask_cache(self):
+        """Drops the masks cached for frozen architectural parameters (see `_frozen_mask`)"""
+        self.__dict__.pop('_mask_cache', None)
+
+    def _active_features(self, cout_mask: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Returns the indices of the active and of the masked output features"""
+        return self._frozen_mask('features_idx', lambda: (
+            torch.nonzero(cout_mask).flatten(), torch.nonzero(cout_mask == 0).flatten()))
+
+    def _use_sparse(self, cout_mask: torch.Tensor) -> bool:
+        """True if the fraction of active output features is low enough for the sparse forward
+        path to be convenient"""
+        # masks are fake tensors during shape propagation, where the dense path is enough
+        if self.sparse_threshold <= 0 or isinstance(cout_mask, FakeTensor):
+            return False
+        active, _ = self._active_features(cout_mask)
+        return active.numel() <= self.sparse_threshold * cout_mask.numel()
+
+    def _sparse_conv(self, input: torch.Tensor, weight: torch.Tensor,
+                     bias: Optional[torch.Tensor], groups: int, **kwargs) -> torch.Tensor:
+        """Runs the convolution of the layer on a subset of its output features, optionally
+        overriding its hyper-parameters (e.g. dilation) through `kwargs`"""
+        conv = F.conv1d if weight.dim() == 3 else F.conv2d
+        padding = kwargs.get('padding', self.padding)
+        if self.padding_mode != 'zeros':
+            input = F.pad(input, self._reversed_padding_repeated_twice, mode=self.padding_mode)
+            padding = 0
+        return conv(input, weight, bias, self.stride, padding,
+                    kwargs.get('dilation', self.dilation), groups)
+
+    def _sparse_forward(self, input: torch.Tensor, weight: torch.Tensor,
+                        cout_mask: torch.Tensor, **kwargs) -> torch.Tensor:
+        """Forward path of convolutional layers that only computes the active output features,
+        i.e. with a cost proportional to the mask density rather than to the seed size.
+
+        The active output features (and, for depthwise layers, the corresponding input ones)
+        are gathered with index selection, processed by a smaller convolution, and scattered
+        back into a zero tensor of the full size. The output and the gradients are those of
+        the dense path (i.e., of the multiplication by the mask). In particular, the gradient
+        of masked features w.r.t. their mask requires their (unmasked) output value: when the
+        mask is trainable, this is computed without building an autograd graph, which still
+        skips the backward computation of masked features. Otherwise, masked features are not
+        computed at all, and the running statistics of a non-folded BatchNorm are only updated
+        for the active ones.
+
+        :param input: the input activations tensor
+        :type input: torch.Tensor
+        :param weight: the weights tensor, already multiplied by all masks except `cout_mask`
+        :type weight: torch.Tensor
+        :param cout_mask: the binarized output features mask
+        :type cout_mask: torch.Tensor
+        :return: the output activations tensor
+        :rtype: torch.Tensor
+        """
+        active, masked = self._active_features(cout_mask)
+        depthwise = self.groups > 1
+        bias = None if self.fold_bn else self.bias
+        mask_grad = torch.is_grad_enabled() and cout_mask.requires_grad
+
+        def conv(idx: torch.Tensor) -> torch.Tensor:
+            x = input.index_select(1, idx) if depthwise else input
+            b = bias.index_select(0, idx) if bias is not None else None
+            return self._sparse_conv(x, weight.index_select(0, idx), b,
+                                     idx.numel() if depthwise else self.groups, **kwargs)
+
+        y_active = conv(active)
+        if not self.fold_bn and self.bn is not None and not mask_grad:
+            # masked features are not computed, and must not affect the BatchNorm statistics
+            y_active = _batch_norm(cast(nn.modules.batchnorm._BatchNorm, self.bn),
+                                   y_active, idx=active)
+        shape = (y_active.shape[0], cout_mask.numel()) + tuple(y_active.shape[2:])
+        y = y_active.new_zeros(shape).index_copy(1, active, y_active)
+        if not mask_grad:
+            # the mask is 1 for all non-zero features
+            return y if not self.fold_bn or self.bias is None else \
+                y + self.bias.view((1, -1) + (1,) * (y.dim() - 2))
+        if masked.numel() > 0:
+            with torch.no_grad():
+                y_masked = conv(masked)
+            y = y.index_copy(1, masked, y_masked)
+        mask_shape = (1, -1) + (1,) * (y.dim() - 2)
+        if self.fold_bn:
+            # the bias is not masked when the BatchNorm is folded
+            y = torch.mul(y, cout_mask.view(mask_shape))
+            return y + self.bias.view(mask_shape) if self.bias is not None else y
+        if self.bn is not None:
+            return _batch_norm(cast(nn.modules.batchnorm._BatchNorm, self.bn), y,
+                               mask=cout_mask)
+        return torch.mul(y, cout_mask.view(mask_shape))
+
+
+def _batch_norm(bn: nn.modules.batchnorm._BatchNorm, input: torch.Tensor,
+                idx: Optional[torch.Tensor] = None,
+                mask: Optional[torch.Tensor] = None) -> torch.Tensor:
+    """Applies a BatchNorm layer, optionally followed by a per-feature `mask` (folded into the
+    affine parameters, to avoid an additional pass on the output), and optionally restricted to
+    a subset `idx` of the features, leaving the running statistics of the other ones untouched.
+    Follows `nn.modules.batchnorm._BatchNorm.forward`"""
+    momentum = 0.0 if bn.momentum is None else bn.momentum
+    if bn.training and bn.track_running_stats and bn.num_batches_tracked is not None:
+        bn.num_batches_tracked.add_(1)
+        if bn.momentum is None:
+            momentum = 1.0 / float(bn.num_batches_tracked)
+    use_batch_stats = bn.training or (bn.running_mean is None and bn.running_var is None)
+    track = not bn.training or bn.track_running_stats
+    mean = bn.running_mean if track else None
+    var = bn.running_var if track else None
+    weight, bias = bn.weight, bn.bias
+    if idx is not None:
+        mean = mean[idx] if mean is not None else None
+        var = var[idx] if var is not None else None
+        weight = weight[idx] if weight is not None else None
+        bias = bias[idx] if bias is not None else None
+    if mask is not None:
+        weight = mask if weight is None else torch.mul(weight, mask)
+        bias = torch.mul(bias, mask) if bias is not None else None
+    y = F.batch_norm(input, mean, var, weight, bias, use_batch_stats, momentum, bn.eps)
+    if idx is not None and bn.training and mean is not None and var is not None:
+        # the sub-tensors have been updated in-place
+        with torch.no_grad():
+            bn.running_mean.index_copy_(0, idx, mean)
+            bn.running_var.index_copy_(0, idx, var)
+    return y
+
+
+def _bn_affine(bn: nn.modules.batchnorm._BatchNorm, bias: Optional[torch.Tensor],
+               mask: Optional[torch.Tensor] = None) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Returns the per-feature scale and shift equivalent to a layer bias, followed by a
+    BatchNorm in inference mode (i.e., using its running statistics), and by an optional mask
+
+    :param bn: the BatchNorm layer
+    :type bn: nn.modules.batchnorm._BatchNorm
+    :param bias: the bias of the preceding layer, if any
+    :type bias: Optional[torch.Tensor]
+    :param mask: the per-feature mask applied to the BatchNorm output, if any
+    :type mask: Optional[torch.Tensor]
+    :return: the scale (to be multiplied to the layer weights) and the shift (to be used as
+    layer bias)
+    :rtype: Tuple[torch.Tensor, torch.Tensor]
+    """
+    mean = cast(torch.Tensor, bn.running_mean)
+    scale = torch.rsqrt(cast(torch.Tensor, bn.running_var) + bn.eps)
+    if bn.weight is not None:
+        scale = scale * bn.weight
+    shift = bn.bias if bn.bias is not None else torch.zeros_like(mean)
+    if mask is not None:
+        scale = scale * mask
+        shift = shift * mask
+    shift = shift - mean * scale
+    if bias is not None:
+        shift = shift + bias * scale
+    return scale, shift
+
+
+def _export_bn(n: fx.Node, mod: fx.GraphModule, submodule: nn.Module, new_submodule: nn.Module,
+               cout_mask: torch.Tensor, bn_type: type):
+    """Handles the BatchNorm carried by a non-folded PIT layer, during export. If
+    `submodule.export_bn` is True, the BatchNorm (with its trained parameters and statistics,
+    restricted to the active features) is re-added to the graph after `n`. Otherwise, it is
+    folded into the weights and bias of `new_submodule`, i.e., the exported layer
+
+    :param n: the node of the exported layer
+    :type n: fx.Node
+    :param mod: the parent module
+    :type mod: fx.GraphModule
+    :param submodule: the PIT layer being exported
+    :type submodule: nn.Module
+    :param new_submodule: the exported layer
+    :type new_submodule: nn.Module
+    :param cout_mask: the boolean mask of the active output features
+    :type cout_mask: torch.Tensor
+    :param bn_type: the BatchNorm class to be used in the exported graph
+    :type bn_type: type
+    """
+    bn = cast(nn.modules.batchnorm._BatchNorm, submodule.bn)
+    if not submodule.export_bn:
+        scale, shift = _bn_affine(bn, submodule.bias)
+        w_shape = (-1,) + (1,) * (new_submodule.weight.dim() - 1)
+        with torch.no_grad():
+            new_submodule.weight.mul_(scale[cout_mask].view(w_shape))
+            if new_submodule.bias is None:
+                new_submodule.bias = nn.Parameter(torch.empty_like(shift[cout_mask]))
+            new_submodule.bias.copy_(shift[cout_mask])
+        return
+    new_bn = bn_type(
+        int(cout_mask.sum()),
+        eps=bn.eps,
+        momentum=bn.momentum,
+        affine=bn.affine,
+        track_running_stats=bn.track_running_stats
+    )
+    with torch.no_grad():
+        for name in ('weight', 'bias', 'running_mean', 'running_var'):
+            src = getattr(bn, name)
+            if src is not None:
+                getattr(new_bn, name).copy_(src[cout_mask])
+        if bn.num_batches_tracked is not None:
+            new_bn.num_batches_tracked.copy_(bn.num_batches_tracked)
+    mod.add_submodule(str(n.target) + "_exported_bn", new_bn)
+    # add the batchnorm just after the layer in the graph
+    with mod.graph.inserting_after(n):
+        new_node = mod.graph.call_module(
+            str(n.target) + "_exported_bn",
+            args=(n,)
+        )
+        n.replace_all_uses_with(new_node)
+        # The previous line replaces also the input to the BN with the BN itself.
+        # The following line fixes it. Not sure if there's a cleaner way to do this?
+        new_node.replace_input_with(new_node, n)
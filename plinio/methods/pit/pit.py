@@ -19,12 +19,15 @@
 from typing import Any, Union, Tuple, Type, Iterable, Dict, cast, Iterator, Optional
 
 import torch
+import torch.fx as fx
 import torch.nn as nn
 
 from plinio.methods.dnas_base import DNAS
 from plinio.cost import CostFn, CostSpec, params
+from plinio.cost.batched import BatchedCostEngine
 from plinio.graph.inspection import shapes_dict
-from .graph import convert, pit_layer_map
+from plinio.graph.tracing import propagate_shapes
+from .graph import convert, pit_layer_map, _lcm
 from .nn.module import PITModule
 
 
@@ -39,7 +42,8 @@ class PIT(DNAS):
     for symbolic tracing (default: None)
     :type input_example: Optional[Any]
     :param input_shape: the shape of an input tensor, without batch size, used as an
-    alternative to input_example to generate a random input for symbolic tracing (default: None)
+    alternative to input_example for symbolic tracing. Shapes are then propagated on meta
+    tensors, i.e. without allocating activations or performing any computation (default: None)
     :type input_shape: Optional[Tuple[int, ...]]
     :param autoconvert_layers: should the constructor try to autoconvert NAS-able layers,
     defaults to True
@@ -65,6 +69,21 @@ class PIT(DNAS):
     :param train_dilation: flag to control whether dilation is optimized by PIT or not, defaults
     to True
     :type train_dilation: bool, optional
+    :param fold_bn: flag to fold the BatchNorm layers into the preceding Conv/Linear ones,
+    defaults to False
+    :type fold_bn: bool, optional
+    :param sparse_threshold: maximum fraction of active output channels for which convolutional
+    layers only compute the active channels, rather than masking a dense output. 0 disables
+    the sparse path. Defaults to 0 (disabled), since selecting the path requires a host-device
+    sync per layer and forward pass while the masks are trainable
+    :type sparse_threshold: float, optional
+    :param features_group_size: the number of output features (channels) controlled by each
+    element of the features masks, either for all layers or for specific layers (by name).
+    Layers sharing a mask use the least common multiple of their group sizes. When not
+    specified (globally or for a layer), defaults to the `features_granularity` of the cost
+    specification(s), so that PIT only explores channel counts that change the cost on the
+    target hardware
+    :type features_group_size: Optional[Union[int, Dict[str, int]]], optional
 
     :raises UserWarning: when both `input_example` and `input_shape` are NOT None,
     a warning is raised and `input_example` will be used.
@@ -84,7 +103,9 @@ class PIT(DNAS):
             train_features: bool = True,
             train_rf: bool = True,
             train_dilation: bool = True,
-            fold_bn: bool = False):
+            fold_bn: bool = False,
+            sparse_threshold: float = 0.,
+            features_group_size: Optional[Union[int, Dict[str, int]]] = None):
         super(PIT, self).__init__(model, cost, input_example, input_shape)
         self.is_training = model.training
         self.exclude_names = exclude_names
@@ -95,7 +116,8 @@ class PIT(DNAS):
             'autoimport' if autoconvert_layers else 'import',
             exclude_names,
             exclude_types,
-            fold_bn
+            fold_bn,
+            self._features_group_size(model, features_group_size)
         )
         self._cost_fn_map = self._create_cost_fn_map()
         # these are set after conversion to make sure they are applied to all layers
@@ -103,6 +125,7 @@ class PIT(DNAS):
         self.train_rf = train_rf
         self.train_dilation = train_dilation
         self.discrete_cost = discrete_cost
+        self.sparse_threshold = sparse_threshold
         self.full_cost = full_cost
         # Restore training status after forced `eval()` in convert
         if self.is_training:
@@ -128,6 +151,7 @@ class PIT(DNAS):
     def cost_specification(self, cs: Union[CostSpec, Dict[str, CostSpec]]):
         self._cost_specification = cs
         self._cost_fn_map = self._create_cost_fn_map()
+        self._invalidate_cost_cache()
 
     @property
     def discrete_cost(self) -> bool:
@@ -140,6 +164,29 @@ class PIT(DNAS):
                 layer.discrete_cost = value  # type: ignore
         self._discrete_cost = value
 
+    @property
+    def sparse_threshold(self) -> float:
+        """Returns the maximum fraction of active output channels for which convolutional
+        layers switch to the sparse forward path
+
+        :return: the sparse path threshold
+        :rtype: float
+        """
+        return self._sparse_threshold
+
+    @sparse_threshold.setter
+    def sparse_threshold(self, value: float):
+        """Set the maximum fraction of active output channels for which convolutional
+        layers switch to the sparse forward path (0 to disable it)
+
+        :param value: the sparse path threshold
+        :type value: float
+        """
+        for _, _, layer in self._unique_leaf_modules:
+            if isinstance(layer, PITModule):
+                layer.sparse_threshold = value
+        self._sparse_threshold = value
+
     @property
     def train_features(self) -> bool:
         """Returns True if PIT is training the output features masks
@@ -210,16 +257,16 @@ class PIT(DNAS):
         should be fine-tuned for optimal results.
 
         :param add_bn: determines if BatchNorm layers that have been fused with PITLayers
-        in order to make the channel masking work are re-added to the exported model. If set to
-        True, the model MUST be fine-tuned.
+        in order to make the channel masking work are re-added to the exported model (with their
+        trained parameters and statistics). If set to False, they are folded into the exported
+        layers instead.
         :type add_bn: bool
         :return: the architecture found by the NAS
         :rtype: Dict[str, Dict[str, Any]]
         """
-        if not add_bn:
-            for _, _, layer in self._leaf_modules:
-                if isinstance(layer, PITModule) and hasattr(layer, 'following_bn_args'):
-                    layer.following_bn_args = None  # type: ignore
+        for _, _, layer in self._leaf_modules:
+            if isinstance(layer, PITModule) and hasattr(layer, 'export_bn'):
+                layer.export_bn = add_bn  # type: ignore
 
         mod, _, _ = convert(self.seed, self._input_example, 'export')
 
@@ -283,27 +330,61 @@ class PIT(DNAS):
             if param not in exclude:
                 yield name, param
 
+    def _features_group_size(self, model: nn.Module,
+                             group_size: Optional[Union[int, Dict[str, int]]]
+                             ) -> Dict[str, int]:
+        """Resolves the features group size of each submodule of the seed"""
+        if isinstance(group_size, int):
+            default, per_layer = group_size, {}
+        else:
+            cs = self._cost_specification
+            specs = cs.values() if isinstance(cs, dict) else [cs]
+            default = _lcm(getattr(s, 'features_granularity', 1) for s in specs)
+            per_layer = group_size if group_size is not None else {}
+        return {name: per_layer.get(name, default) for name, _ in model.named_modules()}
+
+    def _structure_changed(self):
+        """Private method to update the shape annotations and the cost data after the layers of
+        the inner model have been physically resized (e.g., by a `PITShrinker`)"""
+        for _, _, layer in self._leaf_modules:
+            if isinstance(layer, PITModule):
+                layer.clear_mask_cache()
+        training = self.seed.training
+        # avoid updating normalization statistics if shapes are propagated on real inputs
+        self.seed.eval()
+        try:
+            with torch.no_grad():
+                propagate_shapes(cast(fx.GraphModule, self.seed), self._input_example)
+        finally:
+            self.seed.train(training)
+        self._cost_fn_map = self._create_cost_fn_map()
+        self._invalidate_cost_cache()
+
     def _get_single_cost(self, cost_spec: CostSpec,
                          cost_fn_map: Dict[str, CostFn]) -> torch.Tensor:
         """Private method to compute a single cost value"""
-        cost = torch.tensor(0, dtype=torch.float32)
+        engine = self._cached_cost_data(cost_spec, cost_fn_map, self._build_cost_engine)
+        return engine()
+
+    def _build_cost_engine(self, cost_spec: CostSpec,
+                           cost_fn_map: Dict[str, CostFn]) -> BatchedCostEngine:
+        """Private method to gather the static per-layer cost terms into a batched cost engine"""
+        entries = []
         target_list = self._unique_leaf_modules if cost_spec.shared else self._leaf_modules
         for lname, node, layer in target_list:
             if isinstance(layer, PITModule):
-                v = layer.get_modified_vars()
+                v = dict(vars(layer))
                 v.update(shapes_dict(node))
-                cost = cost + cost_fn_map[lname](v)
+                entries.append((cost_fn_map[lname], v, layer.get_modified_fields))
             elif self.full_cost:
-                # TODO: this part is constant and can be pre-computed for efficiency
-                # Should be re-computed when changing cost spec or value of full_cost
-                v = vars(layer)
+                v = dict(vars(layer))
                 v.update(shapes_dict(node))
-                cost = cost + cost_fn_map[lname](v)
-        return cost
+                entries.append((cost_fn_map[lname], v, None))
+        return BatchedCostEngine(entries)
 
     def _single_cost_fn_map(self, c: CostSpec) -> Dict[str, CostFn]:
         """PIT-specific creator of {layertype, cost_fn} maps based on a CostSpec."""
-        cost_fn_map = {}
+        names, keys = [], []
         for lname, _, layer in self._unique_leaf_modules:
             if isinstance(layer, PITModule):
                 # get original layer type from PITModule type
@@ -313,8 +394,10 @@ class PIT(DNAS):
                 # t = layer.__class__.__bases__[0]
             else:
                 t = type(layer)
-            cost_fn_map[lname] = c[(t, vars(layer))]
-        return cost_fn_map
+            names.append(lname)
+            keys.append((t, vars(layer)))
+        types = dict(zip(names, [k[0] for k in keys]))
+        return self._apply_fused_patterns(c, dict(zip(names, c.resolve_all(keys))), types)
 
     def __str__(self):
         """Prints the architecture found by the NAS to screen
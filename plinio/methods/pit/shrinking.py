@@ -0,0 +1,352 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union, cast
+import torch
+import torch.fx as fx
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.optim import Optimizer
+from .pit import PIT
+from .nn.conv1d import PITConv1d
+from .nn.conv2d import PITConv2d
+from .nn.linear import PITLinear
+from .nn.batchnorm_1d import PITBatchNorm1d
+from .nn.batchnorm_2d import PITBatchNorm2d
+from .nn.module import PITModule
+from .nn.features_masker import PITFeaturesMasker, PITFrozenFeaturesMasker
+from .nn.timestep_masker import PITFrozenTimestepMasker
+
+PITMaskedLayer = Union[PITConv1d, PITConv2d, PITLinear]
+
+# functions that mix the features of their input, so that removing (rather than zeroing) a
+# masked feature changes their output
+_FEATURES_MIXING_FUNCTIONS = (F.softmax, F.log_softmax, torch.softmax, torch.log_softmax,
+                              'softmax', 'log_softmax')
+
+
+class PITShrinker:
+    """Progressively shrinks a PIT model during the search, physically removing the output
+    features (channels), timesteps and dilation taps whose masks have been stably at 0 for a
+    given number of steps.
+
+    Removed elements are sliced away from the weights of the affected layers (and from those of
+    their successors), from the NAS masks and from the state of the optimizers, so that the
+    following training steps run on a smaller network. The forward pass of the shrunk network
+    is identical to the masked one, but removed elements can no longer be re-activated by the
+    NAS.
+
+    Features whose masks are shared with layers that cannot be resized (e.g. layers excluded
+    from the NAS, or operations that mix features such as a softmax) are never removed. Dilation
+    and timesteps are removed from `PITConv1d` layers only when the remaining taps are equally
+    spaced, and the padding mode is 'zeros'.
+
+    :param model: the PIT model to be shrunk
+    :type model: PIT
+    :param patience: the number of consecutive steps for which a mask element must be 0 for it
+    to be removed
+    :type patience: int
+    :param period: the number of steps between two consecutive shrinking attempts, defaults to 1
+    :type period: int, optional
+    :raises ValueError: for non-positive patience or period
+    """
+    def __init__(self, model: PIT, patience: int, period: int = 1):
+        if patience < 1 or period < 1:
+            raise ValueError("Shrinking patience and period must be positive")
+        self.model = model
+        self.patience = patience
+        self.period = period
+        self._steps = 0
+        self._layers = self._masked_layers()
+        self._maskers = self._prunable_maskers()
+        self._features_off = {fm: torch.zeros(fm.out_channels, dtype=torch.long,
+                                              device=fm.alpha.device)
+                              for fm in self._maskers}
+        self._time_off = {layer: torch.zeros_like(layer.timestep_masker.beta, dtype=torch.long)
+                          for layer in self._layers if self._time_prunable(layer)}
+
+    def step(self, *optimizers: Optimizer) -> bool:
+        """Updates the count of consecutive steps for which each mask element has been 0, and
+        periodically shrinks the model. Should be called after each optimizer step.
+
+        :param optimizers: the optimizers whose state refers to the model parameters
+        :type optimizers: Optimizer
+        :return: True if the model has been shrunk
+        :rtype: bool
+        """
+        with torch.no_grad():
+            for fm, cnt in self._features_off.items():
+                off = self._maskers[fm].features_mask == 0
+                self._features_off[fm] = (cnt + 1) * off.to(cnt.device)
+            for layer, cnt in self._time_off.items():
+                off = layer.time_mask == 0
+                self._time_off[layer] = (cnt + 1) * off.to(cnt.device)
+        self._steps += 1
+        if self._steps % self.period != 0:
+            return False
+        return self.shrink(*optimizers)
+
+    def shrink(self, *optimizers: Optimizer) -> bool:
+        """Removes all mask elements that have been 0 for at least `patience` steps
+
+        :param optimizers: the optimizers whose state refers to the model parameters
+        :type optimizers: Optimizer
+        :return: True if the model has been shrunk
+        :rtype: bool
+        """
+        changed = False
+        with torch.no_grad():
+            prune = {}
+            for fm, cnt in self._features_off.items():
+                p = (cnt >= self.patience) & (self._maskers[fm].features_mask == 0).to(cnt.device)
+                if torch.any(p):
+                    prune[fm] = p
+            if len(prune) > 0:
+                self._shrink_features(prune, optimizers)
+                changed = True
+            for layer, cnt in self._time_off.items():
+                keep = (cnt < self.patience) | (layer.time_mask != 0).to(cnt.device)
+                if self._shrink_time(layer, keep, optimizers):
+                    self._time_off[layer] = torch.zeros_like(layer.timestep_masker.beta,
+                                                             dtype=torch.long)
+                    changed = True
+        if changed:
+            self.model._structure_changed()
+        return changed
+
+    def _masked_layers(self) -> List[PITMaskedLayer]:
+        """Returns the (unique) PIT layers that own an output features masker"""
+        layers = []
+        for _, _, layer in self.model._unique_leaf_modules:
+            if isinstance(layer, (PITConv1d, PITConv2d, PITLinear)):
+                layers.append(layer)
+        return layers
+
+    def _prunable_maskers(self) -> Dict[PITFeaturesMasker, PITMaskedLayer]:
+        """Finds the features maskers whose features can be physically removed, i.e., those
+        whose outputs only reach layers that can be resized accordingly, and maps each of them
+        to one of the layers that use it"""
+        mod = cast(fx.GraphModule, self.model.seed)
+        # maskers that (may) have zeroed some of the features of each node output
+        reach: Dict[fx.Node, Set[PITFeaturesMasker]] = {}
+        blocked: Set[PITFeaturesMasker] = set()
+        for n in mod.graph.nodes:
+            masked = set()
+            for i in n.all_input_nodes:
+                masked |= reach.get(i, set())
+            reach[n] = masked
+            if n.op == 'call_module':
+                sub = mod.get_submodule(str(n.target))
+                if isinstance(sub, (PITConv1d, PITConv2d, PITLinear)):
+                    fm = sub.out_features_masker
+                    reach[n] = set() if isinstance(fm, PITFrozenFeaturesMasker) else {fm}
+                elif isinstance(sub, PITModule):
+                    pass
+                elif any(True for _ in sub.parameters()) or any(True for _ in sub.buffers()):
+                    blocked |= masked
+            elif n.op in ('call_function', 'call_method'):
+                if any(i.op == 'get_attr' for i in n.all_input_nodes) or \
+                        n.target in _FEATURES_MIXING_FUNCTIONS or n.meta.get('untouchable'):
+                    blocked |= masked
+            if n.meta.get('unsqueeze', False):
+                # conservatively assume that the features axis is moved, hiding the removed
+                # features from subsequent layers
+                blocked |= masked
+        maskers = {}
+        for layer in self._layers:
+            fm = layer.out_features_masker
+            if isinstance(fm, PITFrozenFeaturesMasker):
+                continue
+            if fm not in blocked and fm not in maskers:
+                maskers[fm] = layer
+        return maskers
+
+    @staticmethod
+    def _time_prunable(layer: PITMaskedLayer) -> bool:
+        """True for layers whose timesteps can be removed"""
+        return isinstance(layer, PITConv1d) and \
+            not isinstance(layer.timestep_masker, PITFrozenTimestepMasker) and \
+            layer.padding_mode == 'zeros'
+
+    def _shrink_features(self, prune: Dict[PITFeaturesMasker, torch.Tensor],
+                         optimizers: Tuple[Optimizer, ...]):
+        """Removes the given features from all maskers and layers"""
+        in_keep = self._input_keep_masks(prune)
+        for _, _, layer in self.model._unique_leaf_modules:
+            if isinstance(layer, (PITConv1d, PITConv2d, PITLinear)):
+                fm = layer.out_features_masker
+                out_keep = ~prune[fm] if fm in prune else None
+                _shrink_layer(layer, out_keep, in_keep[layer], optimizers)
+            elif isinstance(layer, (PITBatchNorm1d, PITBatchNorm2d)):
+                keep = in_keep[layer]
+                if not torch.all(keep):
+                    _shrink_bn(layer, keep, optimizers)
+                    layer.clear_mask_cache()
+        for fm, p in prune.items():
+            keep = ~p
+            # all the features of a group are pruned together
+            _slice(fm, 'alpha', 0, keep[::fm.group_size], optimizers)
+            _slice(fm, '_keep_alive', 0, keep[::fm.group_size], optimizers)
+            fm.out_channels = int(keep.sum())
+            self._features_off[fm] = self._features_off[fm][keep]
+
+    def _input_keep_masks(self, prune: Dict[PITFeaturesMasker, torch.Tensor]
+                          ) -> Dict[nn.Module, torch.Tensor]:
+        """Computes the input features kept by each layer, re-using the features calculators.
+        To this end, the maskers are temporarily overwritten with the features to keep"""
+        saved = {}
+        for layer in self._layers:
+            fm = layer.out_features_masker
+            if fm not in saved:
+                saved[fm] = fm.alpha.clone()
+                keep = ~prune[fm][::fm.group_size] if fm in prune else \
+                    torch.ones_like(fm.alpha, dtype=torch.bool)
+                fm.alpha.copy_(keep.to(fm.alpha))
+        try:
+            in_keep = {}
+            for _, _, layer in self.model._unique_leaf_modules:
+                if isinstance(layer, PITModule) and hasattr(layer, 'input_features_calculator'):
+                    calc = layer.input_features_calculator
+                    in_keep[layer] = calc.features_mask.bool().clone()
+            return in_keep
+        finally:
+            for fm, alpha in saved.items():
+                fm.alpha.copy_(alpha)
+
+    def _shrink_time(self, layer: PITConv1d, keep: torch.Tensor,
+                     optimizers: Tuple[Optimizer, ...]) -> bool:
+        """Removes the given timesteps (i.e., kernel taps) from a PITConv1d layer, re-mapping
+        the kept ones onto a smaller (and possibly dilated) kernel. The receptive field and
+        dilation masks are re-initialized so that all kept taps remain active, and so that the
+        receptive field mask preserves its previous values.
+
+        :return: True if the kernel has been shrunk
+        :rtype: bool
+        """
+        taps = keep.nonzero().flatten().tolist()
+        rf = layer.kernel_size[0]
+        if len(taps) == 0 or len(taps) == rf:
+            return False
+        # with a single tap, the dilation is irrelevant, and we keep the one found by the NAS
+        step = taps[1] - taps[0] if len(taps) > 1 else layer.dilation_opt[0] // layer.dilation[0]
+        if any(b - a != step for a, b in zip(taps[:-1], taps[1:])):
+            # kept taps cannot be mapped to a dilated kernel
+            return False
+        dil = layer.dilation[0]
+        left, right = layer.time_padding if layer.time_padding is not None else \
+            layer._explicit_padding()
+        idx = torch.tensor(taps, device=layer.weight.device)
+        theta_beta = layer.timestep_masker.theta.detach()[idx]
+        theta_gamma = layer.dilation_masker.theta.detach()[idx]
+        _resize_parameter(layer, 'weight', lambda t: t.index_select(2, idx), optimizers)
+        layer.kernel_size = (len(taps),)
+        layer.dilation = (dil * step,)
+        layer.padding = (0,)
+        layer.time_padding = (left - taps[0] * dil, right - (rf - 1 - taps[-1]) * dil)
+        # receptive field mask: cumulative values of the kept taps are preserved
+        tm = layer.timestep_masker
+        tm.rf = len(taps)
+        beta = torch.cat((theta_beta[:1], theta_beta[1:] - theta_beta[:-1]))
+        _resize_parameter(tm, 'beta', lambda _: beta, optimizers, keep_state=False)
+        tm._keep_alive = tm._generate_keep_alive_mask().to(beta.device)
+        tm._c_beta = tm._generate_c_matrix().to(beta.device)
+        # dilation mask: the first element, which affects all taps, keeps them all alive
+        dm = layer.dilation_masker
+        dm.rf = len(taps)
+        gamma = torch.ones(dm._gamma_len, dtype=theta_gamma.dtype, device=theta_gamma.device)
+        gamma[0] = theta_gamma.min()
+        _resize_parameter(dm, 'gamma', lambda _: gamma, optimizers, keep_state=False)
+        dm._keep_alive = dm._generate_keep_alive_mask().to(gamma.device)
+        dm._c_gamma = dm._generate_c_matrix().to(gamma.device)
+        beta_norm, gamma_norm = layer._generate_norm_constants()
+        layer._beta_norm = beta_norm.to(cast(torch.Tensor, layer._beta_norm).device)
+        layer._gamma_norm = gamma_norm.to(cast(torch.Tensor, layer._gamma_norm).device)
+        layer.clear_mask_cache()
+        return True
+
+
+def _shrink_layer(layer: PITMaskedLayer, out_keep: Optional[torch.Tensor],
+                  in_keep: torch.Tensor, optimizers: Tuple[Optimizer, ...]):
+    """Removes output and/or input features from a PIT Conv/Linear layer"""
+    slice_in = not torch.all(in_keep)
+    if out_keep is None and not slice_in:
+        return
+    depthwise = isinstance(layer, (PITConv1d, PITConv2d)) and layer.groups > 1
+    if out_keep is not None:
+        _slice(layer, 'weight', 0, out_keep, optimizers)
+        _slice(layer, 'bias', 0, out_keep, optimizers)
+        if layer.bn is not None:
+            _shrink_bn(cast(nn.Module, layer.bn), out_keep, optimizers)
+    if slice_in and not depthwise:
+        # for DWConv we have dimension 1 in the cin axis
+        _slice(layer, 'weight', 1, in_keep, optimizers)
+    if isinstance(layer, PITLinear):
+        layer.out_features, layer.in_features = layer.weight.shape[0], layer.weight.shape[1]
+    else:
+        layer.out_channels = layer.weight.shape[0]
+        if depthwise:
+            layer.in_channels = layer.groups = layer.out_channels
+        else:
+            layer.in_channels = layer.weight.shape[1]
+    layer.clear_mask_cache()
+
+
+def _shrink_bn(bn: nn.Module, keep: torch.Tensor, optimizers: Tuple[Optimizer, ...]):
+    """Removes features from a BatchNorm layer"""
+    for name in ('weight', 'bias', 'running_mean', 'running_var'):
+        _slice(bn, name, 0, keep, optimizers)
+    bn.num_features = int(keep.sum())
+
+
+def _slice(mod: nn.Module, name: str, dim: int, keep: torch.Tensor,
+           optimizers: Tuple[Optimizer, ...]):
+    """Slices a parameter or buffer of a module along one dimension"""
+    t = getattr(mod, name)
+    if t is None:
+        return
+
+    def fn(x: torch.Tensor) -> torch.Tensor:
+        return x.index_select(dim, keep.nonzero().flatten().to(x.device))
+
+    if name in mod._parameters:
+        _resize_parameter(mod, name, fn, optimizers)
+    else:
+        setattr(mod, name, fn(t))
+
+
+def _resize_parameter(mod: nn.Module, name: str, fn: Callable[[torch.Tensor], torch.Tensor],
+                      optimizers: Tuple[Optimizer, ...], keep_state: bool = True):
+    """Replaces a parameter of a module with a resized copy, and applies the same
+    transformation to its gradient and to the matching entries of the optimizers' state (or
+    drops them, if `keep_state` is False).
+
+    A new parameter is created, rather than resizing the old one in place, because autograd
+    graphs that are still alive (e.g., the one of the last loss) would otherwise validate
+    gradients against the old shape"""
+    p = cast(nn.Parameter, getattr(mod, name))
+    new_p = nn.Parameter(fn(p.detach()), requires_grad=p.requires_grad)
+    if keep_state and p.grad is not None:
+        new_p.grad = fn(p.grad)
+    setattr(mod, name, new_p)
+    for opt in optimizers:
+        for group in opt.param_groups:
+            group['params'] = [new_p if q is p else q for q in group['params']]
+        state = opt.state.pop(p, None)
+        if keep_state and state:
+            opt.state[new_p] = {k: fn(v) if isinstance(v, torch.Tensor) and v.shape == p.shape
+                                else v for k, v in state.items()}
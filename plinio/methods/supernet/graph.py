@@ -2,12 +2,11 @@ from typing import Any, Tuple, cast
 import torch
 import torch.nn as nn
 import torch.fx as fx
-from torch.fx.passes.shape_prop import ShapeProp
 
 from .nn import SuperNetCombiner
-from plinio.graph.utils import NamedLeafModules, fx_to_nx_graph
-from plinio.graph.inspection import is_layer, get_graph_inputs, named_leaf_modules, \
-        uniquify_leaf_modules
+from plinio.graph.tracing import trace_and_annotate
+from plinio.graph.utils import NamedLeafModules
+from plinio.graph.inspection import is_layer, named_leaf_modules, uniquify_leaf_modules
 from plinio.graph.annotation import clean_up_propagated_shapes
 
 
@@ -44,15 +43,7 @@ def convert(model: nn.Module, input_example: Any, conversion_type: str,
     if conversion_type not in ('import', 'export'):
         raise ValueError("Unsupported conversion type {}".format(conversion_type))
 
-    tracer = SuperNetTracer()
-    graph = tracer.trace(model.eval())
-    name = model.__class__.__name__
-    mod = fx.GraphModule(tracer.root, graph, name)
-    if len(get_graph_inputs(mod.graph)) > 1:
-        ShapeProp(mod).propagate(*input_example)
-    else:
-        ShapeProp(mod).propagate(input_example)
-    clean_up_propagated_shapes(mod)
+    mod = trace_and_annotate(model, input_example, SuperNetTracer, [clean_up_propagated_shapes])
     if conversion_type == 'import':
         link_combiners_to_branches(mod)
     if conversion_type == 'export':
@@ -72,8 +63,7 @@ def link_combiners_to_branches(mod: fx.GraphModule):
 
     # First finds all modules included in SuperNet branches
     sn_modules = {}
-    g = fx_to_nx_graph(mod.graph)
-    for n in g.nodes:
+    for n in mod.graph.nodes:
         path = str(n.target).split('.')
         if 'sn_branches' in str(n.target) and n.op == 'call_module':
             sub_mod = mod.get_submodule(n.target)
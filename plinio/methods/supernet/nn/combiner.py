@@ -35,27 +35,46 @@ class SuperNetCombiner(nn.Module):
             self.sample_alpha = self.sample_alpha_sm
         self._unique_leaf_modules = [[]] * self.n_branches
         self._cost_fn_map = None
+        # {id(cost_fn_map): (cost_fn_map, per-branch costs)}, dropped by clear_cost_cache()
+        # whenever the cost specification changes. The map is stored with the costs to make
+        # sure that its id() is not re-used while the entry is alive
+        self._branch_costs = {}
 
     def set_sn_branch(self, i: int, ulf: NamedLeafModules):
         """Associates the lists of all unique leaf modules in each SuperNet branch
         to the combiner
         """
         self._unique_leaf_modules[i] = ulf
+        self.clear_cost_cache()
+
+    def clear_cost_cache(self):
+        """Drops the pre-computed branch costs. Called by the SuperNet whenever the cost
+        specification changes"""
+        self._branch_costs = {}
 
     def get_cost(self, cost_spec: CostSpec, cost_fn_map: Dict[str, CostFn]) -> torch.Tensor:
         """Links the SuperNet branches to the Combiner after torch.fx tracing, which "explodes"
         nn.Sequential and nn.ModuleList.
         """
-        cost = torch.tensor(0, dtype=torch.float32)
-        for i in range(self.n_branches):
-            cost_i = torch.tensor(0, dtype=torch.float32)
-            for lname, node, layer in self._unique_leaf_modules[i]:
-                # TODO: this is constant and can be pre-computed for efficiency
-                v = vars(layer)
-                v.update(shapes_dict(node))
-                cost_i = cost_i + cost_fn_map[lname](v)
-            cost = cost + (cost_i * self.theta_alpha[i])
-        return cost
+        cached = self._branch_costs.get(id(cost_fn_map))
+        if cached is None or cached[0] is not cost_fn_map:
+            cached = (cost_fn_map, self._compute_branch_costs(cost_fn_map))
+            self._branch_costs[id(cost_fn_map)] = cached
+        branch_costs = cached[1].to(self.theta_alpha.device)
+        return torch.sum(branch_costs * self.theta_alpha)
+
+    def _compute_branch_costs(self, cost_fn_map: Dict[str, CostFn]) -> torch.Tensor:
+        """Computes the (constant) cost of each SuperNet branch"""
+        costs = []
+        with torch.no_grad():
+            for i in range(self.n_branches):
+                cost_i = torch.tensor(0, dtype=torch.float32)
+                for lname, node, layer in self._unique_leaf_modules[i]:
+                    v = dict(vars(layer))
+                    v.update(shapes_dict(node))
+                    cost_i = cost_i + cost_fn_map[lname](v)
+                costs.append(torch.as_tensor(cost_i, dtype=torch.float32))
+        return torch.stack(costs)
 
     def sample_alpha_sm(self):
         """
@@ -19,7 +19,8 @@ class SuperNet(DNAS):
     for symbolic tracing (default: None)
     :type input_example: Optional[Any]
     :param input_shape: the shape of an input tensor, without batch size, used as an
-    alternative to input_example to generate a random input for symbolic tracing (default: None)
+    alternative to input_example for symbolic tracing. Shapes are then propagated on meta
+    tensors, i.e. without allocating activations or performing any computation (default: None)
     :type input_shape: Optional[Tuple[int, ...]]
     :param full_cost: True is the cost model should be applied to the entire network, rather
     than just to the NAS-able layers, defaults to False
@@ -55,6 +56,15 @@ class SuperNet(DNAS):
     def cost_specification(self, cs: Union[CostSpec, Dict[str, CostSpec]]):
         self._cost_specification = cs
         self._cost_fn_map = self._create_cost_fn_map()
+        self._invalidate_cost_cache()
+
+    def _invalidate_cost_cache(self):
+        """Drops all pre-computed cost data, including the branch costs cached by the
+        SuperNet combiners"""
+        super(SuperNet, self)._invalidate_cost_cache()
+        for _, _, layer in getattr(self, '_named_unique_leaf_modules', []):
+            if isinstance(layer, SuperNetCombiner):
+                layer.clear_cost_cache()
 
     @property
     def train_selection(self):
@@ -173,27 +183,40 @@ class SuperNet(DNAS):
         """Private method to compute a single cost value"""
         # TODO: relies on the attribute name sn_branches. Not nice, but didn't find
         # a better solution that remains flexible.
-        cost = torch.tensor(0, dtype=torch.float32)
+        cost = self._cached_cost_data(cost_spec, cost_fn_map, self._constant_cost)
         target_list = self._unique_leaf_modules if cost_spec.shared else self._leaf_modules
         for lname, node, layer in target_list:
             if isinstance(layer, SuperNetCombiner):
                 cost = cost + layer.get_cost(cost_spec, cost_fn_map)
-            elif 'sn_branches' not in str(node.target) and self.full_cost:
-                # TODO: this is constant and can be pre-computed for efficiency
-                v = vars(layer)
-                v.update(shapes_dict(node))
-                cost = cost + cost_fn_map[lname](v)
+        return cost
+
+    def _constant_cost(self, cost_spec: CostSpec,
+                       cost_fn_map: Dict[str, CostFn]) -> torch.Tensor:
+        """Private method to compute the (constant) cost of layers that are not part of a
+        SuperNet branch, only included when full_cost is True"""
+        cost = torch.tensor(0, dtype=torch.float32)
+        if not self.full_cost:
+            return cost
+        target_list = self._unique_leaf_modules if cost_spec.shared else self._leaf_modules
+        with torch.no_grad():
+            for lname, node, layer in target_list:
+                if not isinstance(layer, SuperNetCombiner) and \
+                        'sn_branches' not in str(node.target):
+                    v = dict(vars(layer))
+                    v.update(shapes_dict(node))
+                    cost = cost + cost_fn_map[lname](v)
         return cost
 
     def _single_cost_fn_map(self, c: CostSpec) -> Dict[str, CostFn]:
         """SuperNet-specific creator of {layertype, cost_fn} maps based on a CostSpec."""
         # simply computes cost of all layers that are not Combiners
-        cost_fn_map = {}
+        names, keys = [], []
         for lname, _, layer in self._unique_leaf_modules:
             if not isinstance(layer, SuperNetCombiner):
-                t = type(layer)
-                cost_fn_map[lname] = c[(t, vars(layer))]
-        return cost_fn_map
+                names.append(lname)
+                keys.append((type(layer), vars(layer)))
+        types = dict(zip(names, [k[0] for k in keys]))
+        return self._apply_fused_patterns(c, dict(zip(names, c.resolve_all(keys))), types)
 
     def __str__(self):
         """Prints the architecture found by the NAS to screen
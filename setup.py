@@ -5,6 +5,7 @@ setuptools.setup(
     version='0.0.1',
     packages=setuptools.find_packages(),
     install_requires=['setuptools'],
+    extras_require={'networkx': ['networkx']},
     maintainer='Daniele Jahier Pagliari',
     maintainer_email='daniele.jahier@polito.it',
     description='A simple library for lightweight NAS based on PyTorch',
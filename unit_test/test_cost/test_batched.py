@@ -0,0 +1,154 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+import unittest
+import torch
+import torch.nn as nn
+from plinio.cost import CostSpec, params, ops, gap8_latency
+from plinio.cost.batched import BatchedCostEngine, PrecisionGridCost
+from plinio.cost.pattern import Conv2dGeneric
+from plinio.methods import PIT
+from plinio.methods.pit.nn.module import PITModule
+from plinio.graph.inspection import shapes_dict
+from unit_test.models import DSCNN, ToySequentialConv1d
+
+
+def _loop_cost(pit_net, cost_spec, cost_fn_map):
+    """Reference per-layer cost computation"""
+    cost = torch.tensor(0, dtype=torch.float32)
+    target_list = pit_net._unique_leaf_modules if cost_spec.shared else pit_net._leaf_modules
+    for lname, node, layer in target_list:
+        if isinstance(layer, PITModule):
+            v = layer.get_modified_vars()
+        elif pit_net.full_cost:
+            v = dict(vars(layer))
+        else:
+            continue
+        v.update(shapes_dict(node))
+        cost = cost + cost_fn_map[lname](v)
+    return cost
+
+
+class TestBatchedCost(unittest.TestCase):
+    """Verify that the batched cost engine matches the per-layer cost evaluation"""
+
+    def test_pit_batched_matches_loop(self):
+        """Check batched vs per-layer cost on Conv1d and Conv2d networks, with random masks"""
+        for net, full_cost in ((DSCNN(), False), (DSCNN(), True),
+                               (ToySequentialConv1d(), False)):
+            cost = {'params': params, 'ops': ops}
+            if isinstance(net, DSCNN):
+                cost['lat'] = gap8_latency
+            pit_net = PIT(net, input_shape=net.input_shape, cost=cost, full_cost=full_cost)
+            with torch.no_grad():
+                for p in pit_net.nas_parameters():
+                    p.copy_(torch.rand_like(p))
+            for discrete in (False, True):
+                pit_net.discrete_cost = discrete
+                for name, spec in cost.items():
+                    exp = _loop_cost(pit_net, spec, pit_net._cost_fn_map[name])
+                    self.assertTrue(torch.allclose(pit_net.get_cost(name), exp, rtol=1e-5),
+                                    f"Wrong batched {name} cost")
+            # all built-in models used above should be evaluated in batched form
+            for _, engine in pit_net._cost_cache.values():
+                self.assertTrue(all(g.batched for g in engine.groups))
+
+    def test_batched_gradient(self):
+        """Check that gradients flow to the NAS parameters through the batched engine"""
+        net = DSCNN()
+        pit_net = PIT(net, input_shape=net.input_shape, cost=ops)
+        pit_net.cost.backward()
+        for name, p in pit_net.named_nas_parameters():
+            if p.requires_grad and 'features_masker' in name:
+                self.assertIsNotNone(p.grad, f"Missing gradient for {name}")
+
+    def test_batched_fallback(self):
+        """Check that cost functions with Python branches fall back to the per-layer loop"""
+        def branching_cost(spec):
+            if spec['out_channels'] > 8:
+                return spec['out_channels'] * 2
+            return spec['out_channels']
+
+        cs = CostSpec(shared=True)
+        cs[Conv2dGeneric] = branching_cost
+        conv1, conv2 = nn.Conv2d(3, 16, 3), nn.Conv2d(16, 4, 3)
+        entries = []
+        for conv in (conv1, conv2):
+            spec = dict(vars(conv))
+            dyn_fn = (lambda c=conv: {'out_channels': c.out_channels})
+            entries.append((cs[(nn.Conv2d, spec)], spec, dyn_fn))
+        engine = BatchedCostEngine(entries)
+        self.assertFalse(engine.groups[0].batched)
+        self.assertEqual(float(engine()), 16 * 2 + 4)
+
+    def test_constant_cost(self):
+        """Check that layers without dynamic vars are pre-computed as a constant"""
+        conv1, conv2 = nn.Conv2d(3, 16, 3), nn.Conv2d(16, 4, 3)
+        entries = []
+        for conv in (conv1, conv2):
+            spec = dict(vars(conv))
+            entries.append((params[(nn.Conv2d, spec)], spec, None))
+        engine = BatchedCostEngine(entries)
+        self.assertEqual(len(engine.groups), 0)
+        self.assertEqual(float(engine()), 3 * 16 * 9 + 16 + 16 * 4 * 9 + 4)
+
+    def test_cost_cache_invalidation(self):
+        """Check that pre-computed costs are refreshed when full_cost or the spec change"""
+        # non-zero cost for ReLUs, which are not NAS-able
+        cs = CostSpec(shared=True)
+        cs[Conv2dGeneric] = lambda spec: spec['out_channels']
+        cs[(nn.ReLU, None)] = lambda spec: 1
+        net = DSCNN()
+        pit_net = PIT(net, input_shape=net.input_shape, cost=cs)
+        nas_cost = pit_net.cost
+        pit_net.full_cost = True
+        full = _loop_cost(pit_net, cs, pit_net._cost_fn_map)
+        self.assertTrue(torch.allclose(pit_net.cost, full))
+        self.assertGreater(float(full.detach()), float(nas_cost.detach()))
+        cs2 = CostSpec(shared=True)
+        cs2[Conv2dGeneric] = lambda spec: spec['out_channels']
+        cs2[(nn.ReLU, None)] = lambda spec: 2
+        pit_net.cost_specification = cs2
+        full2 = _loop_cost(pit_net, cs2, pit_net._cost_fn_map)
+        self.assertTrue(torch.allclose(pit_net.cost, full2))
+        self.assertGreater(float(full2), float(full.detach()))
+        pit_net.full_cost = False
+        self.assertTrue(torch.allclose(pit_net.cost, nas_cost))
+
+    def test_precision_grid_undefined(self):
+        """Check that undefined (NaN) costs on a precision grid are detected on the first
+        evaluation, for both broadcastable and branching cost functions"""
+        def masked_cost(spec):
+            w_prec = spec['w_precision']
+            return torch.where(w_prec == 4, torch.tensor(float('nan')), w_prec * 2)
+
+        def branching_cost(spec):
+            return torch.tensor(float('nan')) if spec['w_precision'] == 4 else 1.
+
+        grid = {'in_precision': torch.tensor([[2.], [8.]]),
+                'w_precision': torch.tensor([[2., 4., 8.]])}
+        for cost_fn in (masked_cost, branching_cost):
+            with self.assertRaisesRegex(ValueError, 'in_precision=2, w_precision=4'):
+                PrecisionGridCost()(cost_fn, {}, grid)
+        grid['w_precision'] = torch.tensor([[2., 8.]])
+        cost = PrecisionGridCost()(masked_cost, {}, grid)
+        self.assertTrue(torch.equal(cost, torch.tensor([[4., 16.], [4., 16.]])))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
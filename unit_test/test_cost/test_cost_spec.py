@@ -0,0 +1,82 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+import unittest
+import torch.nn as nn
+from plinio.cost import CostSpec, params
+from plinio.cost.pattern import Conv2dGeneric, conv_dw_constraint
+
+
+class TestCostSpec(unittest.TestCase):
+    """Verify the memoized pattern resolution of CostSpec"""
+
+    def test_memoized_resolution(self):
+        """Check that memoized resolution matches the non-memoized one"""
+        convs = [nn.Conv2d(8, 8, 3, groups=8), nn.Conv2d(8, 16, 3), nn.Conv2d(4, 4, 5, groups=4),
+                 nn.Conv2d(8, 8, 3), nn.Conv2d(8, 8, 3, groups=8), nn.Conv2d(8, 16, 1)]
+        # repeated twice to exercise cache hits
+        for conv in convs + convs:
+            exp = params._resolve(nn.Conv2d, vars(conv))
+            self.assertIs(params[(nn.Conv2d, vars(conv))], exp, "Wrong cost function")
+
+    def test_constraint_calls(self):
+        """Check that constraints are only re-evaluated for specs with different values of the
+        entries that they read"""
+        calls = []
+
+        def counting_dw_constraint(spec):
+            calls.append(1)
+            return conv_dw_constraint(spec)
+
+        cs = CostSpec()
+        cs[Conv2dGeneric] = lambda spec: 1
+        cs[(nn.Conv1d, counting_dw_constraint)] = lambda spec: 3
+        cs[(nn.Conv1d, None)] = lambda spec: 4
+        # only in_channels and groups are read by the constraint for non-DW convs
+        conv_a = nn.Conv1d(8, 16, 3)
+        conv_b = nn.Conv1d(8, 32, 5)
+        self.assertEqual(cs[(nn.Conv1d, vars(conv_a))](None), 4)
+        self.assertEqual(cs[(nn.Conv1d, vars(conv_b))](None), 4)
+        self.assertEqual(len(calls), 1)
+        # DW conv, different signature
+        conv_c = nn.Conv1d(8, 8, 3, groups=8)
+        with self.assertRaises(KeyError):
+            cs[(nn.Conv1d, vars(conv_c))]
+        self.assertEqual(len(calls), 2)
+
+    def test_invalidation(self):
+        """Check that adding new entries invalidates the resolution cache"""
+        cs = CostSpec()
+        conv = nn.Conv2d(8, 8, 3, groups=8)
+        fn_generic = cs[(nn.Conv2d, vars(conv))]
+        cs[Conv2dGeneric] = lambda spec: 1
+        fn_new = cs[(nn.Conv2d, vars(conv))]
+        self.assertIsNot(fn_generic, fn_new)
+        self.assertEqual(fn_new(None), 1)
+        del cs[nn.Conv2d]
+        self.assertIs(cs[(nn.Conv2d, vars(conv))], cs.default)
+
+    def test_resolve_all(self):
+        """Check the bulk resolution entry point"""
+        layers = [nn.Conv2d(8, 8, 3, groups=8), nn.Conv2d(8, 16, 3), nn.Linear(4, 4), nn.ReLU()]
+        keys = [(type(layer), vars(layer)) for layer in layers]
+        self.assertEqual(params.resolve_all(keys), [params[k] for k in keys])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
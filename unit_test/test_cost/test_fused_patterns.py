@@ -0,0 +1,182 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+import gc
+import pickle
+import unittest
+import weakref
+import torch
+import torch.nn as nn
+import torch.fx as fx
+from plinio.cost import CostSpec
+from plinio.cost.fusion import match_fused_patterns
+from plinio.cost.pattern import Conv2dGeneric, Conv2dReLU, Conv2dAdd, FusedPattern, \
+    conv_dw_constraint
+from plinio.methods import PIT
+from plinio.methods.mps import MPS
+from unit_test.models import DSCNN, ToyAdd_2D
+
+
+def _const(value):
+    return lambda _: torch.tensor(float(value))
+
+
+def _fused_cost(_):
+    return torch.tensor(10.)
+
+
+def _kind(nas_net):
+    def kind(n):
+        if n.op == 'call_module':
+            return type(nas_net.seed.get_submodule(str(n.target)))
+        return n.target if n.op in ('call_function', 'call_method') else None
+    return kind
+
+
+def _spec(nas_net):
+    return lambda n: vars(nas_net.seed.get_submodule(str(n.target)))
+
+
+class _Merge(nn.Module):
+    def forward(self, x, y):
+        return x + y
+
+
+class _MergeTracer(fx.Tracer):
+    def is_leaf_module(self, m: nn.Module, module_qualified_name: str) -> bool:
+        return isinstance(m, _Merge) or super().is_leaf_module(m, module_qualified_name)
+
+
+class _ConvMergeReLU(nn.Module):
+    def __init__(self):
+        super(_ConvMergeReLU, self).__init__()
+        self.conv = nn.Conv2d(3, 3, 3, padding='same')
+        self.merge = _Merge()
+        self.relu = nn.ReLU()
+
+    def forward(self, x):
+        return self.relu(self.merge(self.conv(x), x))
+
+
+def _fused_spec():
+    cs = CostSpec(shared=False)
+    cs[Conv2dGeneric] = _const(1)
+    cs[Conv2dReLU] = _const(10)
+    cs[Conv2dAdd] = _const(100)
+    cs[FusedPattern(nn.Conv2d, nn.ReLU, nn.Dropout), None] = _const(1000)
+    return cs
+
+
+class TestFusedPatterns(unittest.TestCase):
+    """Test multi-layer (fused) patterns in cost specifications"""
+
+    def test_longest_match(self):
+        """Check that the longest pattern is selected when multiple ones match"""
+        net = DSCNN()
+        cs = _fused_spec()
+        pit_net = PIT(net, input_shape=net.input_shape, cost=cs)
+        chains = {a.name: [n.name for n in c] for a, (_, c) in
+                  cs.match(pit_net.seed.graph, _kind(pit_net), _spec(pit_net)).items()}
+        self.assertEqual(chains['inputlayer'], ['inputlayer', 'relu', 'dropout1'])
+        self.assertEqual(chains['pointwise1'], ['pointwise1', 'relu11'])
+        self.assertNotIn('depthwise1', chains)
+        # 2 x Conv-ReLU-Dropout, 7 x Conv-ReLU and 4 x unfused depthwise Conv
+        self.assertEqual(pit_net.cost.item(), 2 * 1000 + 7 * 10 + 4 * 1)
+
+    def test_residual_add(self):
+        """Check that a conv followed by an add is fused, also when the add is followed by
+        a MPS quantizer"""
+        for nas in (PIT, MPS):
+            net = ToyAdd_2D()
+            nas_net = nas(net, input_shape=net.input_shape, cost=_fused_spec())
+            # conv0 is fused with the add, conv1 and conv2 are not
+            self.assertEqual(nas_net.cost.item(), 100 + 1 + 1)
+
+    def test_constraint_fallback(self):
+        """Check that fused patterns whose constraints fail fall back to shorter ones"""
+        net = DSCNN()
+        cs = CostSpec(shared=False)
+        cs[Conv2dGeneric] = _const(1)
+        cs[FusedPattern(nn.Conv2d, nn.ReLU), conv_dw_constraint] = _const(10)
+        pit_net = PIT(net, input_shape=net.input_shape, cost=cs)
+        # no DW conv is followed by a ReLU in DSCNN
+        self.assertEqual(pit_net.cost.item(), 13)
+
+    def test_multi_input_transparent(self):
+        """Check that transparent nodes with multiple inputs are not absorbed in a chain"""
+        net = _ConvMergeReLU()
+        gm = fx.GraphModule(net, _MergeTracer().trace(net))
+
+        def kind(n):
+            if n.op == 'call_module':
+                # a module with two inputs, mapped to a transparent kind
+                return nn.Identity if n.target == 'merge' else type(gm.get_submodule(n.target))
+            return n.target if n.op in ('call_function', 'call_method') else None
+        matches = match_fused_patterns(gm.graph, [Conv2dReLU[0]], kind, lambda p, n: _fused_cost)
+        self.assertEqual(matches, {})
+
+    def test_mps_quantizers(self):
+        """Check that MPS activation quantizers are transparent, while the add they follow is
+        not"""
+        net = ToyAdd_2D()
+        cs = CostSpec(shared=False)
+        cs[Conv2dGeneric] = _const(1)
+        cs[Conv2dReLU] = _const(10)
+        mps_net = MPS(net, input_shape=net.input_shape, cost=cs)
+        # conv0 -> add -> quantizer -> relu is not a Conv-ReLU chain
+        self.assertEqual(mps_net.cost.item(), 3)
+
+    def test_match_cache(self):
+        """Check that matches are cached per graph and node kinds, and invalidated on spec
+        changes"""
+        net = ToyAdd_2D()
+        cs = _fused_spec()
+        pit_net = PIT(net, input_shape=net.input_shape, cost=cs)
+        kind, spec = _kind(pit_net), _spec(pit_net)
+        m = cs.match(pit_net.seed.graph, kind, spec)
+        self.assertEqual(cs.match(pit_net.seed.graph, kind, spec), m)
+        # different node kinds are cached separately
+        self.assertEqual(cs.match(pit_net.seed.graph, lambda n: None, spec), {})
+        self.assertEqual(cs.match(pit_net.seed.graph, kind, spec), m)
+        cs[Conv2dGeneric] = _const(2)
+        self.assertNotIn(pit_net.seed.graph, cs._match_cache)
+        # specs with cached matches can still be serialized
+        cs = CostSpec(shared=False)
+        cs[Conv2dReLU] = _fused_cost
+        pit_net = PIT(net, input_shape=net.input_shape, cost=cs)
+        self.assertIn(pit_net.seed.graph, cs._match_cache)
+        cs = pickle.loads(pickle.dumps(cs))
+        self.assertEqual(cs.fused_patterns, [Conv2dReLU[0]])
+
+    def test_match_cache_release(self):
+        """Check that cached matches do not keep the matched graphs alive"""
+        cs = CostSpec(shared=False)
+        cs[Conv2dReLU] = _fused_cost
+        refs = []
+        for _ in range(3):
+            net = DSCNN()
+            pit_net = PIT(net, input_shape=net.input_shape, cost=cs)
+            refs.append(weakref.ref(pit_net.seed))
+        del net, pit_net
+        gc.collect()
+        self.assertTrue(all(r() is None for r in refs))
+        self.assertEqual(len(cs._match_cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
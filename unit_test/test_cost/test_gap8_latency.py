@@ -21,7 +21,9 @@ import torchinfo
 import torch
 import torch.nn as nn
 import random
-from plinio.cost import gap8_latency
+from plinio.cost import gap8_latency, gap8_tiled_latency
+from plinio.cost.gap8_latency import _gap8_solve_tiling, GAP8_DMA_BYTES_PER_CYCLE, \
+        GAP8_DMA_SETUP_CYCLES
 from plinio.methods.pit.nn import PITConv2d, PITLinear
 from plinio.methods.pit.nn.features_masker import PITFeaturesMasker
 
@@ -88,6 +90,53 @@ class TestGAP8Latency(unittest.TestCase):
             print("Linear MAC/cycles: " + str(MACs/est_cost))
         self.assertTrue(bool((MACs/est_cost)<=estimated_MAC_cycles[(type(layer), g)]), message)
 
+    def _conv_spec(self, cin, cout, hw, groups=1):
+        conv = nn.Conv2d(cin, cout, (3, 3), groups=groups)
+        spec = dict(vars(conv))
+        spec['output_shape'] = (1, cout, hw, hw)
+        spec['in_channels'] = torch.tensor(cin)
+        spec['out_channels'] = torch.tensor(float(cout), requires_grad=True)
+        return spec
+
+    def test_tiled_small_layer(self):
+        """A layer that fits in L1 is transferred in a single, non-overlapped, tile"""
+        spec = self._conv_spec(8, 8, 8)
+        compute = gap8_latency[nn.Conv2d, spec](spec)
+        tiled = gap8_tiled_latency[nn.Conv2d, spec](spec)
+        dma = ((10 * 10 * 8 + 8 * 8 * 9 + 8 * 8 * 8) / GAP8_DMA_BYTES_PER_CYCLE +
+               GAP8_DMA_SETUP_CYCLES)
+        self.assertAlmostEqual(tiled.item(), compute.item() + dma, places=2)
+
+    def test_tiled_large_layer(self):
+        """Large layers are tiled, their DMA cycles are (partially) overlapped with compute,
+        and the cost remains differentiable w.r.t. the output channels"""
+        spec = self._conv_spec(64, 128, 32)
+        compute = gap8_latency[nn.Conv2d, spec](spec)
+        tiled = gap8_tiled_latency[nn.Conv2d, spec](spec)
+        self.assertGreater(tiled.item(), compute.item())
+        tiled.backward()
+        self.assertGreater(spec['out_channels'].grad.item(), 0)
+        # the tile solution is memoized by shape
+        misses = _gap8_solve_tiling.cache_info().misses
+        gap8_tiled_latency[nn.Conv2d, spec](spec)
+        self.assertEqual(_gap8_solve_tiling.cache_info().misses, misses)
+        c_t, h_t = _gap8_solve_tiling(64, 128, 32, 32, 34, 3, 3, 1, 1, False)
+        self.assertLess(c_t * h_t, 128 * 32)
+        self.assertEqual(c_t % 4, 0)
+
+    def test_tiled_dw_linear(self):
+        """Check the tiled model on depthwise and linear layers"""
+        spec = self._conv_spec(32, 32, 16, groups=32)
+        compute = gap8_latency[nn.Conv2d, spec](spec)
+        self.assertGreater(gap8_tiled_latency[nn.Conv2d, spec](spec).item(), compute.item())
+        lin = nn.Linear(512, 64)
+        spec = dict(vars(lin))
+        spec['output_shape'] = (1, 64)
+        spec['in_features'] = torch.tensor(512)
+        spec['out_features'] = torch.tensor(64)
+        compute = gap8_latency[nn.Linear, spec](spec)
+        self.assertGreater(gap8_tiled_latency[nn.Linear, spec](spec).item(), compute.item())
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -0,0 +1,129 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+import gc
+import os
+import tempfile
+import unittest
+from unittest import mock
+import torch
+import torch.nn as nn
+from plinio.cost import host_latency
+from plinio.methods import PIT
+from unit_test.models import ToySequentialConv1d
+
+
+def _spec(layer: nn.Module, output_shape) -> dict:
+    spec = dict(vars(layer))
+    spec['output_shape'] = output_shape
+    return spec
+
+
+class TestHostLatency(unittest.TestCase):
+    """Verify the measurement-driven host latency cost model"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.tmp_dir.name, 'lat.json')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_conv_and_linear(self):
+        """Check that latencies are positive, and that they grow with the number of channels
+        (with fake measurements, since wall-clock timings are noisy)"""
+        conv = nn.Conv2d(8, 64, 3)
+        spec = _spec(conv, (1, 64, 30, 30))
+        with mock.patch('plinio.cost.host_latency._benchmark',
+                        side_effect=lambda layer, *args: float(layer.out_channels)):
+            cs = host_latency(None)
+            lat_high = cs[(nn.Conv2d, spec)](spec)
+            spec['out_channels'] = 8
+            lat_low = cs[(nn.Conv2d, spec)](spec)
+        self.assertGreater(lat_high, lat_low)
+        cs = host_latency(self.cache_file, num_threads=1, warmup=1, repeats=3)
+        self.assertGreater(cs[(nn.Conv2d, spec)](spec), 0)
+        dw = nn.Conv2d(16, 16, 3, groups=16)
+        spec = _spec(dw, (1, 16, 30, 30))
+        self.assertGreater(cs[(nn.Conv2d, spec)](spec), 0)
+        fc = nn.Linear(32, 10)
+        spec = _spec(fc, (1, 10))
+        self.assertGreater(cs[(nn.Linear, spec)](spec), 0)
+
+    def test_disk_cache(self):
+        """Check that measurements are persisted and re-used, and that they are keyed by the
+        host CPU and number of threads"""
+        conv = nn.Conv1d(4, 8, 3)
+        spec = _spec(conv, (1, 8, 30))
+        with mock.patch('plinio.cost.host_latency.os.replace', wraps=os.replace) as write:
+            cs = host_latency(self.cache_file, num_threads=1, warmup=1, repeats=3)
+            lat = cs[(nn.Conv1d, spec)](spec)
+            spec['out_channels'] = 12
+            cs[(nn.Conv1d, spec)](spec)
+            spec['out_channels'] = 8
+            # measurements are written all at once, when the cost spec is deleted
+            self.assertFalse(os.path.exists(self.cache_file))
+            del cs
+            gc.collect()
+            self.assertTrue(os.path.exists(self.cache_file))
+            self.assertEqual(write.call_count, 1)
+        with mock.patch('plinio.cost.host_latency._benchmark',
+                        side_effect=AssertionError("Unexpected measurement")) as bench:
+            cs = host_latency(self.cache_file, num_threads=1)
+            self.assertEqual(cs[(nn.Conv1d, spec)](spec), lat)
+            bench.assert_not_called()
+        with mock.patch('plinio.cost.host_latency._benchmark', return_value=1.) as bench:
+            cs = host_latency(self.cache_file, num_threads=2)
+            cs[(nn.Conv1d, spec)](spec)
+            bench.assert_called()
+        # measurements taken on another CPU are not re-used
+        with mock.patch('plinio.cost.host_latency._benchmark', return_value=1.) as bench, \
+                mock.patch('plinio.cost.host_latency._cpu_id', return_value='other'):
+            cs = host_latency(self.cache_file, num_threads=1)
+            self.assertEqual(cs[(nn.Conv1d, spec)](spec), 1.)
+            bench.assert_called()
+
+    def test_interpolation(self):
+        """Check the interpolation over channels and its gradient"""
+        # fake measurements proportional to the number of MACs
+        def fake_benchmark(layer, x, *args):
+            return float(layer.in_channels * layer.out_channels)
+
+        conv = nn.Conv2d(16, 16, 3)
+        spec = _spec(conv, (1, 16, 30, 30))
+        with mock.patch('plinio.cost.host_latency._benchmark', side_effect=fake_benchmark):
+            cs = host_latency(None, channel_step=8)
+            spec['out_channels'] = torch.tensor(12., requires_grad=True)
+            lat = cs[(nn.Conv2d, spec)](spec)
+            self.assertAlmostEqual(float(lat), 16 * 12)
+            lat.backward()
+            self.assertAlmostEqual(float(spec['out_channels'].grad), 16)
+
+    def test_pit_search(self):
+        """Check that the cost model can be used as a PIT search objective"""
+        net = ToySequentialConv1d()
+        with mock.patch('plinio.cost.host_latency._benchmark', return_value=1e-3):
+            pit_net = PIT(net, input_shape=net.input_shape,
+                          cost=host_latency(None, warmup=1, repeats=1))
+            cost = pit_net.cost
+            cost.backward()
+        self.assertGreater(float(cost), 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -23,6 +23,7 @@ import torch
 import torch.nn as nn
 
 from plinio.cost import ne16_latency
+from plinio.cost.ne16_latency import Ne16PerfModel, ne16_latency_batched
 
 
 class TestNE16Latency(unittest.TestCase):
@@ -152,6 +153,44 @@ class TestNE16Latency(unittest.TestCase):
             self.assertTrue(new_cost <= est_cost, msg)
             est_cost = new_cost
 
+    def test_batched_model(self):
+        """Check that the vectorized model matches the object-based one, for single layers and
+        for stacked layers/precisions, both in value and in gradient"""
+        def ref_latency(ks, dw, w_bits, layer):
+            n_3x3 = (ks[0] // 3) * (ks[1] // 3)
+            n_1x1 = (ks[0] % 3) * ks[1] + (ks[1] % 3) * ks[0] - (ks[0] % 3) * (ks[1] % 3)
+            m_3x3 = Ne16PerfModel('conv', (3, 3), depthwise=dw, weights_bitwidth=w_bits)
+            m_1x1 = Ne16PerfModel('conv', (1, 1), depthwise=dw, weights_bitwidth=w_bits)
+            return (m_3x3.set_layer(layer).latency * n_3x3 +
+                    m_1x1.set_layer(layer).latency * n_1x1)
+
+        for ks, dw in (((3, 3), False), ((1, 1), False), ((3, 3), True), ((5, 5), False)):
+            shapes = [(random.randint(1, 64), random.randint(1, 64),
+                       random.randint(1, 128) * random.choice([1., 0.37]),
+                       random.randint(1, 96)) for _ in range(8)]
+            precisions = torch.tensor([2., 4., 8.]).view(-1, 1)
+            k_out = torch.tensor([s[2] for s in shapes], requires_grad=True)
+            layer = tuple(torch.tensor([s[i] for s in shapes]) for i in (0, 1)) + \
+                (k_out, torch.tensor([s[3] for s in shapes]))
+            # all layers and precisions at once
+            lat, _ = ne16_latency_batched(ks, dw, precisions, layer)
+            lat.sum().backward()
+            for j, s in enumerate(shapes):
+                # the gradient of the batched sum w.r.t. k_out[j] accumulates all precisions
+                k = torch.tensor(s[2], requires_grad=True)
+                for i, p in enumerate((2, 4, 8)):
+                    ref = ref_latency(ks, dw, p, (s[0], s[1], k, s[3]))
+                    self.assertAlmostEqual(lat[i, j].item(), ref.item(), delta=1e-3)
+                    ref.backward()
+                self.assertAlmostEqual(k_out.grad[j].item(), k.grad.item(), delta=1e-2)
+
+        # the cost functions use the vectorized model
+        spec = {'_parameters': {'bias': None}, 'in_channels': 16, 'out_channels': 40,
+                'groups': 1, 'kernel_size': (3, 3), 'output_shape': (1, 40, 10, 12),
+                'in_precision': 8, 'w_precision': 4, 'w_theta_alpha': 1}
+        self.assertEqual(float(ne16_latency[nn.Conv2d, spec](spec)),
+                         float(ref_latency((3, 3), False, 4, (10, 12, 40, 16))))
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -0,0 +1,81 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+import unittest
+import torch
+from plinio.cost import params, peak_memory, PeakMemorySpec
+from plinio.methods import PIT
+from plinio.methods.mps import MPS, get_default_qinfo
+from plinio.graph.liveness import ActivationLiveness
+from unit_test.models import ToySequentialConv1d, ToyAdd_2D
+
+
+class TestPeakMemory(unittest.TestCase):
+    """Test the liveness-based peak activation memory cost"""
+
+    def test_sequential(self):
+        """Check the peak memory of a sequential net against a manual computation"""
+        net = ToySequentialConv1d()
+        pit_net = PIT(net, input_shape=net.input_shape,
+                      cost={'params': params, 'peak_mem': peak_memory})
+        # conv1 input (10x12) and output (20x12), 1 byte each
+        self.assertEqual(pit_net.get_cost('peak_mem').item(), 10 * 12 + 20 * 12)
+        pit_net.cost_specification = {'peak_mem': PeakMemorySpec(default_bits=32)}
+        self.assertEqual(pit_net.get_cost('peak_mem').item(), 4 * (10 * 12 + 20 * 12))
+
+    def test_residual(self):
+        """Check that the two branches of an add are considered simultaneously alive"""
+        net = ToyAdd_2D()
+        pit_net = PIT(net, input_shape=net.input_shape, cost=peak_memory)
+        # at the add: conv0, conv1 and the add output (10x15x15 each)
+        self.assertEqual(pit_net.cost.item(), 3 * 10 * 15 * 15)
+        liveness = ActivationLiveness(pit_net.seed)
+        names = [n.name for n in liveness.buffers]
+        # the flatten does not allocate a new buffer
+        self.assertNotIn('flatten', names)
+        self.assertIn('add', names)
+
+    def test_pit_gradient(self):
+        """Check that the peak memory is differentiable w.r.t. PIT masks"""
+        net = ToyAdd_2D()
+        pit_net = PIT(net, input_shape=net.input_shape, cost=peak_memory)
+        pit_net.cost.backward()
+        alpha = pit_net.seed.conv0.out_features_masker.alpha
+        self.assertIsNotNone(alpha.grad)
+        self.assertGreater(alpha.grad.abs().sum().item(), 0)
+
+    def test_mps(self):
+        """Check that the MPS activation precision determines the bytes of each buffer, and
+        that the peak memory is differentiable w.r.t. the MPS alpha"""
+        net = ToySequentialConv1d()
+        mps_net = MPS(net, input_shape=net.input_shape, cost=peak_memory,
+                      qinfo=get_default_qinfo(w_precision=(8,), a_precision=(4,)))
+        mps_net(torch.rand((1,) + net.input_shape))
+        # 4-bit conv1 input, and non-quantized (fp32) conv1 output
+        self.assertAlmostEqual(mps_net.cost.item(), 10 * 12 / 2 + 20 * 12 * 4, places=3)
+
+        mps_net = MPS(net, input_shape=net.input_shape, cost=peak_memory)
+        mps_net(torch.rand((1,) + net.input_shape))
+        mps_net.cost.backward()
+        alpha = mps_net.seed.conv0.out_mps_quantizer.alpha
+        self.assertIsNotNone(alpha.grad)
+        self.assertGreater(alpha.grad.abs().sum().item(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
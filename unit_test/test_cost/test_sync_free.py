@@ -0,0 +1,121 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+import unittest
+import torch
+import torch.nn as nn
+from plinio.cost import mpic_latency, mpic_energy, ne16_latency, diana_latency
+
+
+def _conv_spec(device, **kwargs):
+    spec = {
+        '_parameters': {'bias': None},
+        'in_channels': 16,
+        'out_channels': torch.tensor(32., device=device),
+        'groups': 1,
+        'kernel_size': (3, 3),
+        'output_shape': (1, 32, 16, 16),
+    }
+    for k, v in kwargs.items():
+        spec[k] = torch.tensor(v, device=device)
+    return spec
+
+
+class TestSyncFree(unittest.TestCase):
+    """Verify that the built-in cost models can be evaluated on device-resident specs without
+    host-device syncs. Meta tensors are used, since they raise an error on any attempt to read
+    their value from Python (e.g. with .item() or in an if statement)"""
+
+    def _check(self, cost_spec, pattern, **prec):
+        meta_spec = _conv_spec('meta', **prec)
+        cost = cost_spec[(pattern, meta_spec)](meta_spec)
+        self.assertEqual(cost.device.type, 'meta', "Cost not computed on device")
+        # returns the cost computed with CPU tensors, for comparisons with Python values
+        cpu_spec = _conv_spec('cpu', **prec)
+        return cost_spec[(pattern, cpu_spec)](cpu_spec)
+
+    def test_mpic(self):
+        """Test the MPIC latency and energy models"""
+        for cs in (mpic_latency, mpic_energy):
+            cost = self._check(cs, nn.Conv2d, in_precision=4, w_precision=2)
+            spec = _conv_spec('cpu')
+            spec['in_precision'] = 4
+            spec['w_precision'] = 2
+            self.assertTrue(torch.allclose(cost, cs[(nn.Conv2d, spec)](spec)))
+
+    def test_mpic_broadcast(self):
+        """Test the MPIC LUT on a grid of precisions"""
+        spec = _conv_spec('cpu')
+        spec['in_precision'] = torch.tensor([[2.], [4.], [8.]])
+        spec['w_precision'] = torch.tensor([[0., 2., 4., 8.]])
+        cost = mpic_latency[(nn.Conv2d, spec)](spec)
+        self.assertEqual(cost.shape, (3, 4))
+        for i, a in enumerate((2, 4, 8)):
+            for j, w in enumerate((0, 2, 4, 8)):
+                spec_ij = _conv_spec('cpu')
+                spec_ij['in_precision'] = a
+                spec_ij['w_precision'] = w
+                self.assertTrue(torch.allclose(cost[i, j],
+                                               mpic_latency[(nn.Conv2d, spec_ij)](spec_ij)))
+
+    def test_ne16(self):
+        """Test the NE16 latency model, including pruned layers"""
+        cost = self._check(ne16_latency, nn.Conv2d, in_precision=8, w_precision=4,
+                           w_theta_alpha=0.5)
+        spec = _conv_spec('cpu')
+        spec.update({'in_precision': 8, 'w_precision': 4, 'w_theta_alpha': 0.5})
+        self.assertTrue(torch.allclose(cost, torch.as_tensor(
+            ne16_latency[(nn.Conv2d, spec)](spec), dtype=torch.float32)))
+        cost = self._check(ne16_latency, nn.Conv2d, in_precision=8, w_precision=0,
+                           w_theta_alpha=0.5)
+        self.assertEqual(float(cost), 0.)
+
+    def test_diana(self):
+        """Test the Diana latency model, for both the analog and digital accelerators"""
+        for w_prec in (2, 8):
+            cost = self._check(diana_latency, nn.Conv2d, a_precision=8, w_precision=w_prec)
+            spec = _conv_spec('cpu')
+            spec.update({'a_precision': 8, 'w_precision': w_prec})
+            self.assertTrue(torch.allclose(cost, diana_latency[(nn.Conv2d, spec)](spec)))
+
+    def test_diana_unsupported(self):
+        """Test that the Diana latency model raises an error on unsupported host-resident
+        precisions, and masks them without syncs when they are device-resident"""
+        for groups in (1, 16):
+            meta_spec = _conv_spec('meta', a_precision=8)
+            meta_spec['w_precision'] = torch.tensor([2., 4., 8.], device='meta')
+            meta_spec['groups'] = groups
+            cost = diana_latency[(nn.Conv2d, meta_spec)](meta_spec)
+            self.assertEqual(cost.device.type, 'meta', "Cost not computed on device")
+        spec = _conv_spec('cpu', a_precision=8)
+        spec['w_precision'] = torch.tensor([2., 4., 8.])
+        with self.assertRaisesRegex(ValueError, '4 / 8'):
+            diana_latency[(nn.Conv2d, spec)](spec)
+        spec = _conv_spec('cpu', a_precision=8)
+        spec['w_precision'] = torch.tensor([2., 8.])
+        spec['groups'] = 16
+        with self.assertRaisesRegex(ValueError, '2 / 8 with groups=16'):
+            diana_latency[(nn.Conv2d, spec)](spec)
+        spec = _conv_spec('cpu', a_precision=8)
+        spec['w_precision'] = torch.tensor([2., 8.])
+        cost = diana_latency[(nn.Conv2d, spec)](spec)
+        self.assertFalse(torch.any(torch.isnan(cost)))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -24,6 +24,8 @@ import torch
 from plinio.methods.mps import MPS, get_default_qinfo, MPSType
 from plinio.methods.mps.quant.backends import Backend, integerize_arch
 from plinio.methods.mps.quant.backends.match import MATCHExporter
+from plinio.methods.mps.quant.backends.match.annotator import MATCHAnnotator
+from plinio.methods.mps.quant.quantizers import MixPrecWeight
 from unit_test.models import (ToySequentialFullyConv2d, ToySequentialConv2d, TutorialModel,
                               ToySequentialFullyConv2dDil)
 
@@ -286,3 +288,63 @@ class TestBackendMATCH(unittest.TestCase):
         exporter = MATCHExporter()
         exporter.export(integer_nn, dummy_inp.shape, Path('.'))
         Path(f'./{integer_nn.__class__.__name__}.onnx').unlink()
+
+    def test_single_kernel_per_channel(self):
+        """Test the integerization of a model with per-channel weight precisions, exported
+        with a single kernel per layer, and the MATCH annotation of its layers"""
+        torch.manual_seed(42)
+        nn_ut = ToySequentialConv2d()
+        mixprec_nn = MPS(nn_ut,
+                         input_shape=nn_ut.input_shape,
+                         qinfo=get_default_qinfo(w_precision=(2, 8), a_precision=(8,)),
+                         w_search_type=MPSType.PER_CHANNEL
+                         )
+        # alternate 2-bit and 8-bit output channels in each layer
+        with torch.no_grad():
+            for name in ('conv', 'lin'):
+                alpha = mixprec_nn.seed.get_submodule(name).w_mps_quantizer.alpha
+                ch = torch.arange(alpha.size(1))
+                alpha.copy_(torch.stack((ch % 2 == 0, ch % 2 == 1)).float())
+        mixprec_nn.eval()
+        dummy_inp = torch.rand((4,) + nn_ut.input_shape)
+
+        # Convert to (fake) quantized model, with a single kernel per layer
+        quantized_nn = mixprec_nn.export(single_kernel=True)
+        with torch.no_grad():
+            out_quant = quantized_nn(dummy_inp)
+
+        # Convert to integer MATCH-compliant model
+        integer_nn = integerize_arch(quantized_nn, Backend.MATCH)
+        layers = [integer_nn.get_submodule(name) for name in ('conv', 'lin')]
+        for layer in layers:
+            self.assertIsInstance(layer.w_quantizer, MixPrecWeight)
+            self.assertEqual(sorted(set(layer.w_quantizer.precision)), [2, 8])
+            # integer weights, with the number of levels of each channel precision
+            for w, prec in zip(layer.weight, layer.w_quantizer.precision):
+                self.assertTrue(torch.equal(w, w.round()), "Non-integer weights")
+                self.assertLessEqual(len(torch.unique(w)), 2 ** prec, "Wrong weights precision")
+        with torch.no_grad():
+            out_int = integer_nn(dummy_inp)
+        # the last layer is not re-quantized, and outputs the integer accumulators
+        lin = layers[1]
+        out_int = out_int * lin.s_x * lin.s_w
+        self.assertTrue(torch.allclose(out_int, out_quant, atol=1e-2),
+                        "Mismatch between fake-quantized and integer outputs")
+
+        # Annotate a hand-built onnx graph of the integer model
+        import onnx
+        from onnx import helper
+        nodes = [helper.make_node('Conv', ['x', 'conv.weight', 'conv.bias'], ['y'],
+                                  name='/conv/Conv'),
+                 helper.make_node('Gemm', ['y', 'lin.weight', 'lin.bias'], ['z'],
+                                  name='/lin/Gemm')]
+        graph = helper.make_graph(
+            nodes, 'graph', [helper.make_tensor_value_info('x', onnx.TensorProto.FLOAT, None)],
+            [helper.make_tensor_value_info('z', onnx.TensorProto.FLOAT, None)])
+        onnxproto = helper.make_model(graph)
+        MATCHAnnotator()._annotate(integer_nn, onnxproto)
+        for node, layer in zip(onnxproto.graph.node, layers):
+            attrs = {a.name: helper.get_attribute_value(a) for a in node.attribute}
+            self.assertEqual(attrs['weight_bits'], 8)
+            self.assertEqual(list(attrs['weight_bits_per_channel']),
+                             layer.w_quantizer.precision)
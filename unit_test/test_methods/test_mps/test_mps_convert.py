@@ -26,9 +26,11 @@ from plinio.methods.mps import get_default_qinfo
 from plinio.methods.mps.nn import MPSConv2d, MPSType, MPSLinear, MPSIdentity
 from plinio.methods.mps.nn.qtz import MPSBaseQtz
 import plinio.methods.mps.quant.nn as qnn
-from plinio.methods.mps.quant.quantizers import FQWeight, MinMaxWeight, DummyQuantizer, PACTAct
+from plinio.methods.mps.quant.quantizers import FQWeight, MinMaxWeight, DummyQuantizer, PACTAct, \
+    MixPrecWeight
 from unit_test.models import SimpleNN, SimpleNN2D, DSCNN, ToyMultiPath1_2D, ToyAdd_2D, \
-    SimpleMPSNN, SimpleExportedNN1D, SimpleExportedNN2D, SimpleExportedNN2D_ch, SimpleNN2D_NoBN
+    SimpleMPSNN, SimpleExportedNN1D, SimpleExportedNN2D, SimpleExportedNN2D_ch, SimpleNN2D_NoBN, \
+    ToySequentialConv2d
 from unit_test.test_methods.test_mps.utils import compare_prepared, \
         check_target_layers, check_shared_quantizers, check_add_quant_prop, \
         check_layers_exclusion, compare_exported
@@ -477,6 +479,89 @@ class TestMPSConvert(unittest.TestCase):
                 qinfo=get_default_qinfo(a_precision=repeated_prec, w_precision=prec),
                 w_search_type=MPSType.PER_LAYER)
 
+    def _single_kernel_export(self, nn_ut):
+        """Exports a per-channel MPS model with random NAS parameters as single kernels,
+        checking that the output is unchanged"""
+        torch.manual_seed(42)
+        new_nn = MPS(nn_ut,
+                     input_shape=nn_ut.input_shape,
+                     qinfo=get_default_qinfo(w_precision=(2, 4, 8), a_precision=(8,)),
+                     w_search_type=MPSType.PER_CHANNEL)
+        for p in new_nn.nas_parameters():
+            p.data.normal_()
+        new_nn.update_softmax_options(hard=True)
+        new_nn.eval()
+        x = torch.rand((4,) + nn_ut.input_shape)
+        with torch.no_grad():
+            y = new_nn(x)
+            exported_nn = new_nn.export(single_kernel=True).eval()
+            y_exp = exported_nn(x)
+        self.assertTrue(torch.allclose(y, y_exp, atol=1e-6), "Mismatch after export")
+        self.assertFalse(any(isinstance(m, qnn.QuantList) for m in exported_nn.modules()))
+        layers = {}
+        for name, m in exported_nn.named_modules():
+            if isinstance(getattr(m, 'w_quantizer', None), MixPrecWeight):
+                layers[name] = m
+                mps_layer = new_nn.seed.get_submodule(name)
+                self.assertEqual(sorted(m.w_quantizer.precision),
+                                 sorted(mps_layer.selected_w_precision), "Wrong precisions")
+        return layers
+
+    @staticmethod
+    def _grouped(precision):
+        return precision == sorted(precision)
+
+    def test_export_single_kernel_channel(self):
+        """Test the export of a sequential model with per-channel precisions as single
+        kernels, with output channels grouped by precision"""
+        layers = self._single_kernel_export(ToySequentialConv2d())
+        self.assertEqual(set(layers.keys()), {'conv', 'lin'})
+        # conv is followed by flatten and linear, which are permuted accordingly
+        self.assertTrue(self._grouped(layers['conv'].w_quantizer.precision))
+        self.assertFalse(torch.equal(layers['conv'].w_quantizer.perm,
+                                     torch.arange(layers['conv'].out_channels)))
+        # the output layer keeps its channels order
+        self.assertTrue(torch.equal(layers['lin'].w_quantizer.perm,
+                                    torch.arange(layers['lin'].out_features)))
+
+    def test_export_single_kernel_multipath(self):
+        """Test the export of models with per-channel precisions as single kernels,
+        when output channels cannot be permuted (additions and depthwise convolutions)"""
+        layers = self._single_kernel_export(ToyAdd_2D())
+        # conv0 and conv1 are summed, so they keep the same channels order
+        for name in ('conv0', 'conv1'):
+            self.assertTrue(torch.equal(layers[name].w_quantizer.perm,
+                                        torch.arange(layers[name].out_channels)))
+        self.assertTrue(self._grouped(layers['conv2'].w_quantizer.precision))
+        layers = self._single_kernel_export(DSCNN())
+        for name, layer in layers.items():
+            if name.startswith('depthwise'):
+                self.assertTrue(torch.equal(layer.w_quantizer.perm,
+                                            torch.arange(layer.out_channels)))
+            if name.startswith('pointwise'):
+                self.assertTrue(self._grouped(layer.w_quantizer.precision))
+
+    def test_mixprec_weight(self):
+        """Test the channel-wise mixed-precision weight quantizer"""
+        torch.manual_seed(42)
+        w = torch.randn(6, 3, 3, 3)
+        quantizers = [MinMaxWeight(2, 6), MinMaxWeight(4, 6), MinMaxWeight(8, 6)]
+        qtz = MixPrecWeight(quantizers, torch.tensor([2, 0, 2, 0, 0, 2]))
+        self.assertEqual(len(qtz.qtz_funcs), 2, "Unused quantizers should be dropped")
+        self.assertEqual(qtz.precision, [8, 2, 8, 2, 2, 8])
+        y = qtz(w)
+        for c, i in enumerate([2, 0, 2, 0, 0, 2]):
+            self.assertTrue(torch.equal(y[c], quantizers[i](w)[c]))
+            self.assertTrue(torch.equal(qtz.scale[c], quantizers[i].scale[c]))
+        perm = torch.tensor([1, 3, 4, 0, 2, 5])
+        qtz.permute(perm)
+        self.assertEqual(qtz.precision, [2, 2, 2, 8, 8, 8])
+        self.assertTrue(torch.equal(qtz(w[perm]), y[perm]))
+        self.assertTrue(torch.equal(qtz.scale, torch.stack(
+            [quantizers[i].scale[c] for c, i in zip(perm.tolist(), [0, 0, 0, 2, 2, 2])])))
+        qtz.dequantize = False
+        self.assertFalse(any(q.dequantize for q in qtz.qtz_funcs))
+
     def test_out_features_eff(self):
         """Check whether out_features_eff returns the correct number of not pruned channels"""
         net = ToyAdd_2D()
@@ -0,0 +1,247 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2022 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author: Matteo Risso <matteo.risso@polito.it>                              *
+# *----------------------------------------------------------------------------*
+import copy
+import itertools
+import unittest
+import unittest.mock
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from plinio.methods import MPS
+from plinio.methods.mps import get_default_qinfo
+from plinio.methods.mps.nn.qtz import MPSPerChannelQtz, MPSPerLayerQtz, MPSType
+from plinio.methods.mps.quant.quantizers import PACTAct, MinMaxWeight, FQWeight
+from unit_test.models import ToyAdd_2D
+
+
+class TestMPSQtz(unittest.TestCase):
+    """Test the fused mixed-precision quantizers"""
+
+    @staticmethod
+    def _stacked_forward(qtz, input):
+        """Reference implementation, stacking the per-precision terms"""
+        qtz.sample_alpha()
+        y = []
+        for i, quantizer in enumerate(qtz.qtz_funcs):
+            theta_alpha_i = qtz.theta_alpha[i]
+            if theta_alpha_i.dim() > 0:
+                theta_alpha_i = theta_alpha_i.view((-1,) + (1,) * len(input.shape[1:]))
+            y.append(theta_alpha_i * quantizer(input))
+        return torch.stack(y, dim=0).sum(dim=0)
+
+    def _check(self, qtz, shape):
+        torch.manual_seed(42)
+        with torch.no_grad():
+            qtz.alpha.normal_()
+        ref = copy.deepcopy(qtz)
+        x = (3 * torch.randn(shape)).requires_grad_()
+        x_ref = x.detach().clone().requires_grad_()
+        y = qtz(x)
+        y_ref = self._stacked_forward(ref, x_ref)
+        self.assertTrue(torch.equal(y, y_ref), "Different outputs")
+        grad = torch.randn(shape)
+        (y * grad).sum().backward()
+        (y_ref * grad).sum().backward()
+        self.assertTrue(torch.allclose(x.grad, x_ref.grad, atol=1e-6), "Different input grads")
+        for (name, p), p_ref in zip(qtz.named_parameters(), ref.parameters()):
+            self.assertEqual(p.grad is None, p_ref.grad is None, f"Missing grad for {name}")
+            if p.grad is not None:
+                self.assertTrue(torch.allclose(p.grad, p_ref.grad, atol=1e-5),
+                                f"Different grads for {name}")
+
+    def test_fused_per_layer(self):
+        """Test that the fused per-layer quantizer matches the stacked implementation"""
+        self._check(MPSPerLayerQtz((2, 4, 8), PACTAct), (16, 8, 32))
+        self._check(MPSPerLayerQtz((0, 2, 4, 8), MinMaxWeight, {'cout': 8}), (8, 4, 3))
+
+    def test_fused_per_channel(self):
+        """Test that the fused per-channel quantizer matches the stacked implementation"""
+        self._check(MPSPerChannelQtz((0, 2, 4, 8), MinMaxWeight, {'cout': 8}), (8, 4, 3, 3))
+        qtz = MPSPerChannelQtz((2, 4, 8), FQWeight, {'cout': 8})
+        for q in qtz.qtz_funcs:
+            torch.nn.init.constant_(q.scale_param, -2.)
+        self._check(qtz, (8, 4, 3))
+
+    def test_fused_effective_scale(self):
+        """Test that the quantizers scale factors remain differentiable"""
+        qtz = MPSPerChannelQtz((2, 4, 8), FQWeight, {'cout': 8})
+        for q in qtz.qtz_funcs:
+            torch.nn.init.constant_(q.scale_param, -2.)
+        qtz(torch.randn(8, 4, 3))
+        qtz.effective_scale.sum().backward()
+        for q in qtz.qtz_funcs:
+            self.assertIsNotNone(q.scale_param.grad, "Missing scale grad")
+        self.assertIsNotNone(qtz.alpha.grad, "Missing alpha grad")
+
+    def test_single_path_forward(self):
+        """Test that single-path sampling only runs the sampled quantizer"""
+        torch.manual_seed(42)
+        qtz = MPSPerLayerQtz((2, 4, 8), PACTAct)
+        qtz.update_softmax_options(single_path=True)
+        x = 3 * torch.randn(16, 8, 32)
+        for _ in range(10):
+            y = qtz(x)
+            self.assertEqual(len(qtz._active_qtz), 1, "Wrong number of active quantizers")
+            i = qtz._active_qtz[0]
+            self.assertEqual(qtz.sp_sample.tolist(),
+                             [1. if j == i else 0. for j in range(3)], "Wrong sampling")
+            self.assertTrue(torch.equal(y, qtz.qtz_funcs[i](x)), "Wrong output")
+            self.assertTrue(torch.allclose(qtz.theta_alpha, F.softmax(qtz.alpha, dim=0)),
+                            "Cost coefficients are not the SoftMax probabilities")
+            qtz.alpha.grad = None
+            (y ** 2).sum().backward()
+            self.assertIsNone(qtz.alpha.grad, "Alpha gradient through the sampled quantizer")
+        qtz.eval()
+        qtz(x)
+        self.assertEqual(qtz._active_qtz, [0, 1, 2], "Sampling in eval mode")
+
+    def test_single_path_log_prob(self):
+        """Test that the log-probabilities of the samples of a quantizer called more than once
+        are summed, and that samples drawn without gradients are not recorded"""
+        torch.manual_seed(42)
+        qtz = MPSPerLayerQtz((2, 4, 8), PACTAct)
+        qtz.update_softmax_options(single_path=True)
+        x = 3 * torch.randn(16, 8, 32)
+        with torch.no_grad():
+            qtz(x)
+        self.assertIsNone(qtz.sp_log_prob, "Sample recorded without gradients")
+        exp = torch.tensor(0.)
+        for _ in range(3):
+            qtz(x)
+            exp = exp + F.log_softmax(qtz.alpha, dim=0)[qtz._active_qtz[0]]
+        self.assertTrue(torch.allclose(qtz.sp_log_prob, exp), "Wrong log-probability")
+
+    def test_single_path_loss_required(self):
+        """Test that single-path training fails if the surrogate loss is not used"""
+        nn_ut = ToyAdd_2D()
+        mixprec_nn = MPS(nn_ut, input_shape=nn_ut.input_shape,
+                         qinfo=get_default_qinfo(w_precision=(2, 4, 8), a_precision=(2, 4, 8)))
+        mixprec_nn.update_softmax_options(single_path=True)
+        mixprec_nn.train()
+        x = torch.rand((2,) + nn_ut.input_shape)
+        loss = mixprec_nn(x).sum()
+        with self.assertRaises(RuntimeError):
+            mixprec_nn(x)
+        for _ in range(2):
+            (loss + mixprec_nn.single_path_loss(loss)).backward()
+            loss = mixprec_nn(x).sum()
+        # forward passes without gradients (e.g. for metrics) do not need the surrogate
+        mixprec_nn.single_path_loss(loss)
+        with torch.no_grad():
+            mixprec_nn(x)
+            mixprec_nn(x)
+
+    def test_single_path_unbiased(self):
+        """Test that the expected single-path gradient of alpha equals the gradient of the
+        expected loss, with a non-linear loss and channels sampling different precisions"""
+        torch.manual_seed(42)
+        n_prec, cout = 3, 3
+        model = MPS(nn.Sequential(nn.Conv2d(2, cout, 3)), input_shape=(2, 6, 6),
+                    w_search_type=MPSType.PER_CHANNEL,
+                    qinfo=get_default_qinfo(w_precision=(2, 4, 8), a_precision=(8,)))
+        model.update_softmax_options(single_path=True)
+        model.train()
+        qtz = [m for m in model.modules() if isinstance(m, MPSPerChannelQtz)][0]
+        with torch.no_grad():
+            qtz.alpha.normal_()
+        x = torch.randn((4, 2, 6, 6))
+        channels = torch.arange(cout)
+        expected = torch.zeros_like(qtz.alpha)
+        assignments, losses = [], []
+        for assign in itertools.product(range(n_prec), repeat=cout):
+            assign = torch.tensor(assign)
+            gumbels = torch.full((n_prec, cout), -float('inf'))
+            gumbels[assign, channels] = 0.
+            # single-precision activation quantizers also sample (their only precision)
+            with unittest.mock.patch.object(
+                    torch.Tensor, 'exponential_',
+                    lambda t: gumbels.neg().exp() if t.dim() == 2 else torch.ones_like(t)):
+                y = model(x)
+            self.assertEqual(qtz._active_qtz, sorted(set(assign.tolist())), "Wrong sampling")
+            loss = (y ** 2).sum()
+            # non-zero baseline, from a previous step
+            model._sp_loss_avg, model._sp_steps = torch.tensor(50.), 1
+            qtz.alpha.grad = None
+            model.single_path_loss(loss).backward()
+            log_p = F.log_softmax(qtz.alpha.detach(), dim=0)
+            expected += log_p[assign, channels].sum().exp() * qtz.alpha.grad
+            assignments.append(assign)
+            losses.append(loss.detach())
+        # gradient of the expected loss, sum_k P(k) * L(k)
+        alpha = qtz.alpha.detach().requires_grad_()
+        log_p = F.log_softmax(alpha, dim=0)
+        exp_loss = sum(log_p[a, channels].sum().exp() * loss
+                       for a, loss in zip(assignments, losses))
+        exp_loss.backward()
+        self.assertTrue(torch.allclose(expected, alpha.grad, rtol=1e-4, atol=1e-3),
+                        "Biased alpha gradient")
+
+    def test_single_path_option(self):
+        """Test that single-path sampling is set through update_softmax_options"""
+        nn_ut = ToyAdd_2D()
+        mixprec_nn = MPS(nn_ut, input_shape=nn_ut.input_shape,
+                         qinfo=get_default_qinfo(w_precision=(2, 4, 8), a_precision=(2, 4, 8)))
+        mixprec_nn.update_softmax_options(single_path=True)
+        quantizers = [m for m in mixprec_nn.modules() if isinstance(m, MPSPerLayerQtz)]
+        self.assertTrue(all(q.single_path for q in quantizers if len(q.qtz_funcs) > 1),
+                        "Single-path not set")
+        mixprec_nn.train()
+        mixprec_nn(torch.rand((2,) + nn_ut.input_shape)).sum().backward()
+        mixprec_nn.update_softmax_options(single_path=False)
+        self.assertFalse(any(q.single_path for q in quantizers), "Single-path not unset")
+
+    def test_weight_cache(self):
+        """Test that frozen weights are quantized only once, and re-quantized after changes"""
+        torch.manual_seed(42)
+        qtz = MPSPerChannelQtz((0, 2, 4, 8), MinMaxWeight, {'cout': 8})
+        w = torch.nn.Parameter(torch.randn(8, 4, 3), requires_grad=False)
+        calls = []
+        forward = MinMaxWeight.forward
+        with unittest.mock.patch.object(MinMaxWeight, 'forward',
+                                        lambda q, x: calls.append(q) or forward(q, x)):
+            y = qtz(w)
+            y.sum().backward()
+            self.assertEqual(len(calls), 4, "Wrong number of quantizations")
+            self.assertTrue(torch.equal(qtz(w), y), "Different cached output")
+            self.assertEqual(len(calls), 4, "Frozen weights quantized again")
+            with torch.no_grad():
+                w.mul_(2.)
+            self.assertTrue(torch.equal(qtz(w), 2 * y), "Stale cached output")
+            self.assertEqual(len(calls), 8, "Updated weights not quantized again")
+            w.requires_grad_(True)
+            qtz(w)
+            self.assertEqual(len(calls), 12, "Trainable weights not quantized")
+
+    def test_weight_cache_shared(self):
+        """Test that a quantizer shared by two frozen weights restores the scale of each one"""
+        torch.manual_seed(42)
+        qtz = MPSPerChannelQtz((2, 4, 8), MinMaxWeight, {'cout': 8})
+        weights = [torch.nn.Parameter(torch.randn(8, 4, 3) * (i + 1), requires_grad=False)
+                   for i in range(2)]
+        scales = []
+        for w in weights:
+            qtz(w)
+            scales.append(qtz.effective_scale)
+        for w, scale in zip(weights, scales):
+            qtz(w)
+            self.assertTrue(torch.equal(qtz.effective_scale, scale), "Wrong cached scale")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
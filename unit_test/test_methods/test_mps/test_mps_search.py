@@ -79,6 +79,45 @@ class TestMPSSearch(unittest.TestCase):
                          float(mixprec_net.cost),
                          "get_cost() returns wrong result")
 
+    def test_precision_grid_cost(self):
+        """Check that the broadcasted evaluation of the precision grid matches a per-precision
+        loop, both for broadcastable and for branching cost functions"""
+        def branching_cost(spec):
+            if spec['w_precision'] == 8:
+                return spec['out_channels'] * 2
+            return spec['out_channels'] * spec['in_precision']
+
+        net = SimpleNN2D()
+        mixprec_net = MPS(net, input_shape=net.input_shape,
+                          w_search_type=MPSType.PER_CHANNEL,
+                          qinfo=get_default_qinfo(w_precision=(2, 4, 8), a_precision=(2, 4, 8)))
+        conv = cast(MPSConv2d, mixprec_net.seed.conv1)
+        with torch.no_grad():
+            for p in mixprec_net.nas_parameters():
+                p.copy_(torch.rand_like(p))
+        # forward pass to update theta_alpha
+        mixprec_net(torch.rand((1,) + net.input_shape))
+        shape = {'output_shape': (1, 57, 20, 20)}
+        w_theta_alpha = conv.w_mps_quantizer.theta_alpha.mean(dim=1)
+        for cost_fn in (params_bit[(torch.nn.Conv2d, conv.get_modified_vars())],
+                        ops_bit[(torch.nn.Conv2d, conv.get_modified_vars())],
+                        branching_cost):
+            exp = torch.zeros((3, 3))
+            for i, (in_prec, in_ta) in enumerate(zip(conv.in_mps_quantizer.precision,
+                                                     conv.in_mps_quantizer.theta_alpha)):
+                for j, (w_prec, w_ta) in enumerate(zip(conv.w_mps_quantizer.precision,
+                                                       w_theta_alpha)):
+                    v = conv.get_modified_vars()
+                    v.update(shape)
+                    v.update({'in_format': int, 'w_format': int, 'in_precision': in_prec,
+                              'w_precision': w_prec, 'w_theta_alpha': w_ta})
+                    exp[i][j] = in_ta * w_ta * cost_fn(v)
+            # evaluated twice to exercise the memoized path
+            for _ in range(2):
+                cost = conv.get_cost(cost_fn, shape)
+                self.assertTrue(torch.allclose(cost, exp, rtol=1e-5), "Wrong grid cost")
+        self.assertFalse(conv._grid_cost._broadcastable[branching_cost])
+
     def test_params_trainability(self):
         """Test the effectiveness of the helpers functions `train_nas_only`, `train_net_only`
         and `train_net_and_nas`."""
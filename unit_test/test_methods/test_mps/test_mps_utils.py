@@ -0,0 +1,123 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2022 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author: Matteo Risso <matteo.risso@polito.it>                              *
+# *----------------------------------------------------------------------------*
+import itertools
+import unittest
+import torch
+import torch.nn.functional as F
+from plinio.cost import params_bit, ops_bit
+from plinio.methods import MPS
+from plinio.methods.mps import get_default_qinfo, MPSType
+from plinio.methods.mps.utils import prec_pareto_curve, optimal_prec_assignment
+from unit_test.models import ToyAdd_2D, DSCNN
+
+
+class TestMPSUtils(unittest.TestCase):
+    """Test the cost-budgeted precision assignment of MPS"""
+
+    @staticmethod
+    def _random_mps(net, w_prec, **kwargs):
+        torch.manual_seed(42)
+        mps_net = MPS(net, input_shape=net.input_shape,
+                      qinfo=get_default_qinfo(w_precision=w_prec, a_precision=(2, 4, 8)),
+                      **kwargs)
+        for p in mps_net.nas_parameters():
+            p.data.normal_()
+        return mps_net
+
+    @staticmethod
+    def _cost(mps_net, quantizers, assign, name=None):
+        """Actual cost of a binary assignment of the weights precisions"""
+        for q, idx in zip(quantizers, assign):
+            q.alpha.data = F.one_hot(torch.as_tensor(idx).reshape(-1), len(q.precision)) \
+                .t().reshape(q.alpha.shape).float()
+        mps_net.update_softmax_options(hard=True)
+        mps_net(mps_net._dummy_input())
+        return float(mps_net.get_cost(name).detach())
+
+    def test_pareto_curve_per_layer(self):
+        """Check that each point of the curve is optimal, by exhaustive search"""
+        mps_net = self._random_mps(ToyAdd_2D(), (2, 4, 8), cost=params_bit)
+        curve = prec_pareto_curve(mps_net)
+        # conv0 and conv1 share the same weights quantizer
+        self.assertEqual(curve.names, ['conv0', 'conv2', 'fc'])
+        log_p = [F.log_softmax(q.alpha.detach().double(), dim=0) for q in curve.quantizers]
+        alpha = [q.alpha.detach().clone() for q in curve.quantizers]
+        solutions = []
+        for assign in itertools.product(range(3), repeat=len(curve.quantizers)):
+            cost = self._cost(mps_net, curve.quantizers, assign)
+            score = sum(float(lp[j]) for lp, j in zip(log_p, assign))
+            solutions.append((cost, score))
+        for q, a in zip(curve.quantizers, alpha):
+            q.alpha.data = a
+        self.assertTrue(torch.all(curve.cost.diff() > 0), "Cost not increasing")
+        self.assertTrue(torch.all(curve.score.diff() > 0), "Score not increasing")
+        for cost, score in zip(curve.cost.tolist(), curve.score.tolist()):
+            best = max(s for c, s in solutions if c <= cost)
+            self.assertAlmostEqual(score, best, places=5, msg="Sub-optimal point")
+            assign = list(curve.assignment(cost).values())
+            self.assertEqual(self._cost(mps_net, curve.quantizers, assign), cost)
+            for q, a in zip(curve.quantizers, alpha):
+                q.alpha.data = a
+
+    def test_pareto_curve_per_channel(self):
+        """Check the costs of the curve with a linear cost model, on a network with shared
+        weights quantizers"""
+        for cost_spec in (params_bit, ops_bit):
+            mps_net = self._random_mps(DSCNN(), (2, 4, 8), cost=cost_spec,
+                                       w_search_type=MPSType.PER_CHANNEL)
+            mps_net(mps_net._dummy_input())
+            theta = [q.theta_alpha for q in mps_net.modules() if hasattr(q, 'theta_alpha')]
+            curve = prec_pareto_curve(mps_net)
+            # the sampled NAS parameters are restored
+            self.assertTrue(all(t is q.theta_alpha for t, q in zip(
+                theta, [q for q in mps_net.modules() if hasattr(q, 'theta_alpha')])))
+            alpha = [q.alpha.detach().clone() for q in curve.quantizers]
+            # the last point is the argmax assignment
+            max_score = sum(float(F.log_softmax(a.double(), dim=0).max(dim=0)[0].sum())
+                            for a in alpha)
+            self.assertAlmostEqual(float(curve.score[-1]), max_score, places=5)
+            for k in torch.linspace(0, len(curve) - 1, 5).long().tolist():
+                budget = float(curve.cost[k])
+                assign = curve.assignment(budget)
+                self.assertEqual(tuple(assign['conv1'].shape), (64,))
+                cost = self._cost(mps_net, curve.quantizers, list(assign.values()))
+                self.assertAlmostEqual(cost / budget, 1., places=4, msg="Wrong cost estimate")
+                for q, a in zip(curve.quantizers, alpha):
+                    q.alpha.data = a.clone()
+
+    def test_optimal_prec_assignment(self):
+        """Check that the actual cost fits in the budget, also with a non-linear cost model
+        (0-bit pruning)"""
+        for budget in (2000, 20000, 60000):
+            mps_net = self._random_mps(DSCNN(), (0, 2, 4, 8), cost=params_bit,
+                                       w_search_type=MPSType.PER_CHANNEL)
+            prec = optimal_prec_assignment(mps_net, budget)
+            cost = float(mps_net.get_cost().detach())
+            self.assertLessEqual(cost, budget)
+            self.assertGreater(cost, 0.9 * budget, "Budget under-used")
+            for lname, p in prec.items():
+                layer = mps_net.seed.get_submodule(lname)
+                q = layer.w_mps_quantizer
+                self.assertTrue(torch.equal(q.precision[q.theta_alpha.argmax(dim=0)], p))
+        with self.assertRaises(ValueError):
+            optimal_prec_assignment(mps_net, 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -16,10 +16,13 @@
 # *                                                                            *
 # * Author: Matteo Risso <matteo.risso@polito.it>                              *
 # *----------------------------------------------------------------------------*
+import copy
 import unittest
 import torch
+import torch.nn as nn
 from torch.nn import BatchNorm1d, BatchNorm2d
-from plinio.methods.pit.nn import PITBatchNorm1d, PITBatchNorm2d
+from plinio.methods import PIT
+from plinio.methods.pit.nn import PITBatchNorm1d, PITBatchNorm2d, PITConv1d
 
 
 class TestPITBatchNorm(unittest.TestCase):
@@ -58,6 +61,66 @@ class TestPITBatchNorm(unittest.TestCase):
 
         self.assertTrue(torch.all(bn_ut_out == pitbn_ut_out), "Different outputs")
 
+    @staticmethod
+    def _conv1d_bn_model():
+        """A PIT model whose first Conv1d carries a non-folded BatchNorm, with some channels
+        masked"""
+        torch.manual_seed(42)
+        nn_ut = nn.Sequential(
+            nn.Conv1d(3, 16, 5, padding='same'), nn.BatchNorm1d(16), nn.ReLU(),
+            nn.Conv1d(16, 8, 3, padding='same'))
+        pit_net = PIT(nn_ut, input_shape=(3, 32), fold_bn=False)
+        pit_net.sparse_threshold = 0
+        conv = [m for m in pit_net.seed.modules() if isinstance(m, PITConv1d)][0]
+        with torch.no_grad():
+            conv.out_features_masker.alpha[:6] = 0.
+        return pit_net, conv
+
+    def test_pitconv1d_bn_forward(self):
+        """Test that a PITConv1d with a non-folded BatchNorm is equivalent to a conv, followed by
+        the BatchNorm and by the channels mask, both in training and inference mode"""
+        _, conv = self._conv1d_bn_model()
+        conv.out_features_masker.alpha.data[8] = 0.3
+        ref = copy.deepcopy(conv)
+        dummy_inp = torch.randn(8, 3, 32)
+        for training in (True, False):
+            conv.train(training)
+            ref.train(training)
+            out = conv(dummy_inp)
+            cout_mask = ref._features_mask(discrete=True)
+            time_mask = ref._time_mask(discrete=True)
+            ref_out = ref.bn(ref._conv_forward(dummy_inp, time_mask * ref.weight, ref.bias))
+            ref_out = ref_out * cout_mask.view(1, -1, 1)
+            self.assertTrue(torch.allclose(out, ref_out, atol=1e-5), "Different outputs")
+            out.square().sum().backward()
+            ref_out.square().sum().backward()
+            for (name, p), p_ref in zip(conv.named_parameters(), ref.parameters()):
+                if p.grad is not None:
+                    self.assertTrue(torch.allclose(p.grad, p_ref.grad, atol=1e-4),
+                                    f"Different gradients for {name}")
+            self.assertTrue(torch.allclose(conv.bn.running_mean, ref.bn.running_mean),
+                            "Different running statistics")
+
+    def test_pitconv1d_bn_export(self):
+        """Test that the BatchNorm carried by a PITConv1d is either re-added with its trained
+        parameters, or folded into the exported Conv1d"""
+        pit_net, _ = self._conv1d_bn_model()
+        dummy_inp = torch.randn(8, 3, 32)
+        for _ in range(3):
+            pit_net(dummy_inp)
+        pit_net.eval()
+        with torch.no_grad():
+            out = pit_net(dummy_inp)
+        for add_bn in (True, False):
+            exported_nn = pit_net.export(add_bn=add_bn).eval()
+            n_bn = len([m for m in exported_nn.modules() if isinstance(m, BatchNorm1d)])
+            self.assertEqual(n_bn, 1 if add_bn else 0, "Wrong number of BatchNorm layers")
+            self.assertEqual(exported_nn.get_submodule('0').out_channels, 10,
+                             "Wrong number of output channels")
+            with torch.no_grad():
+                exp_out = exported_nn(dummy_inp)
+            self.assertTrue(torch.allclose(out, exp_out, atol=1e-5), "Different outputs")
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
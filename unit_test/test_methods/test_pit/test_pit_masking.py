@@ -20,14 +20,15 @@ from typing import cast
 import unittest
 import torch
 from plinio.methods import PIT
-from plinio.methods.pit.nn import PITConv1d
+from plinio.methods.pit.nn import PITConv1d, PITConv2d
 from plinio.methods.pit.nn.binarizer import PITBinarizer
-from unit_test.models import SimpleNN, TCResNet14
+from plinio.cost import params, gap8_latency, ne16_latency
+from unit_test.models import SimpleNN, TCResNet14, DSCNN
 from unit_test.models import ToyAdd, ToyChannelsCat
 from unit_test.models.toy_models import ToySequentialConv1d, ToySequentialSeparated
 from unit_test.test_methods.test_pit.utils import check_channel_mask_init, write_channel_mask, \
-        read_channel_mask, rand_binary_channel_mask, check_input_features, check_rf_mask_init, \
-        write_rf_mask, check_dilation_mask_init, write_dilation_mask
+    read_channel_mask, rand_binary_channel_mask, check_input_features, check_rf_mask_init, \
+    write_rf_mask, check_dilation_mask_init, write_dilation_mask
 
 
 class TestPITMasking(unittest.TestCase):
@@ -296,6 +297,88 @@ class TestPITMasking(unittest.TestCase):
         self.assertEqual(summ['in_features'], cout1,
                          "Wrong number of opt input channels retured by summary")
 
+    def test_frozen_mask_cache(self):
+        """Test that masks are re-used while the NAS parameters are frozen, and re-computed
+        when they change"""
+        nn_ut = ToySequentialConv1d()
+        pit_net = PIT(nn_ut, input_shape=nn_ut.input_shape)
+        conv0 = cast(PITConv1d, pit_net.seed.conv0)
+        x = torch.rand((4,) + nn_ut.input_shape)
+        # trainable NAS parameters: the masks are never cached
+        pit_net(x)
+        self.assertFalse(conv0.__dict__.get('_mask_cache'), "Masks cached while training")
+        pit_net.train_net_only()
+        out = pit_net(x)
+        cached = conv0.__dict__['_mask_cache']['features'][2]
+        self.assertTrue(torch.equal(pit_net(x), out), "Different outputs with cached masks")
+        self.assertIs(conv0.__dict__['_mask_cache']['features'][2], cached,
+                      "Mask not re-used")
+        # in-place update of a frozen parameter
+        with torch.no_grad():
+            conv0.out_features_masker.alpha[0] = 0.
+            conv0.out_features_masker.alpha[1] = 0.
+        pit_net(x)
+        new_mask = conv0.__dict__['_mask_cache']['features'][2]
+        self.assertIsNot(new_mask, cached, "Mask not re-computed after in-place update")
+        self.assertEqual(int(new_mask.sum()), int(cached.sum()) - 2, "Wrong re-computed mask")
+        # re-assignment of a parameter
+        mask0 = torch.ones_like(conv0.out_features_masker.alpha)
+        write_channel_mask(pit_net, 'conv0', mask0)
+        conv0.out_features_masker.alpha.requires_grad = False
+        pit_net(x)
+        self.assertTrue(torch.equal(conv0.__dict__['_mask_cache']['features'][2], mask0),
+                        "Mask not re-computed after re-assignment")
+        # back to NAS training
+        pit_net.train_net_and_nas()
+        write_channel_mask(pit_net, 'conv0', torch.zeros_like(mask0))
+        out = conv0(x)
+        # only the keep-alive channel is active
+        self.assertTrue(torch.all(out[:, :-1] == 0), "Stale mask after re-enabling NAS training")
+
+    def test_grouped_channel_masks(self):
+        """Test that channels are masked in groups, with per-layer sizes and shared masks"""
+        nn_ut = ToyAdd()
+        # conv0 and conv1 share their masker, which uses lcm(2, 3) = 6 channels per group
+        pit_net = PIT(nn_ut, input_shape=nn_ut.input_shape,
+                      features_group_size={'conv0': 2, 'conv1': 3})
+        conv0 = cast(PITConv1d, pit_net.seed.conv0)
+        conv2 = cast(PITConv1d, pit_net.seed.conv2)
+        self.assertEqual(conv0.out_features_masker.alpha.numel(), 2, "Wrong n. of groups")
+        self.assertEqual(conv2.out_features_masker.alpha.numel(), 20, "Wrong n. of groups")
+        with torch.no_grad():
+            conv0.out_features_masker.alpha[0] = 0.
+            # the last group (4 channels) is kept alive
+            conv0.out_features_masker.alpha[1] = 0.
+        mask = conv0.features_mask
+        self.assertTrue(torch.equal(mask, torch.tensor([0.] * 6 + [1.] * 4)), "Wrong mask")
+        self.assertEqual(pit_net.summary()['conv1']['out_features'], 4, "Wrong summary")
+        self.assertEqual(conv2.in_features_opt, 4, "Wrong input features")
+        x = torch.rand((8,) + nn_ut.input_shape)
+        pit_net.eval()
+        with torch.no_grad():
+            out = pit_net(x)
+        exported = pit_net.export()
+        self.assertEqual(exported.conv0.out_channels, 4, "Wrong exported channels")
+        self.assertEqual(exported.conv2.in_channels, 4, "Wrong exported channels")
+        with torch.no_grad():
+            self.assertTrue(torch.allclose(exported(x), out, atol=1e-5), "Wrong exported model")
+
+    def test_grouped_channel_masks_from_cost(self):
+        """Test that the channels group size is derived from the cost specification"""
+        nn_ut = DSCNN()
+        pit_net = PIT(nn_ut, input_shape=(1, 49, 10), cost=gap8_latency)
+        conv = cast(PITConv2d, pit_net.seed.get_submodule('conv1'))
+        self.assertEqual(conv.out_features_masker.group_size, 4, "Wrong group size")
+        self.assertEqual(conv.out_features_masker.alpha.numel(), 16, "Wrong n. of groups")
+        # the largest granularity among multiple cost specifications, unless overridden
+        pit_net = PIT(nn_ut, input_shape=(1, 49, 10),
+                      cost={'params': params, 'latency': ne16_latency})
+        conv = cast(PITConv2d, pit_net.seed.get_submodule('conv1'))
+        self.assertEqual(conv.out_features_masker.group_size, 16, "Wrong group size")
+        pit_net = PIT(nn_ut, input_shape=(1, 49, 10), cost=ne16_latency, features_group_size=1)
+        conv = cast(PITConv2d, pit_net.seed.get_submodule('conv1'))
+        self.assertEqual(conv.out_features_masker.alpha.numel(), 64, "Wrong n. of groups")
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
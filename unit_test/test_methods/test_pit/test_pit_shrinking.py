@@ -0,0 +1,207 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2022 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Fabio Eterno <fabio.eterno@polito.it>                             *
+# *----------------------------------------------------------------------------*
+from typing import cast
+import unittest
+import torch
+import torch.nn as nn
+from plinio.methods import PIT
+from plinio.methods.pit import PITShrinker
+from plinio.methods.pit.nn import PITConv1d
+from unit_test.models import SimpleNN, TCResNet14, DSCNN, ToySequentialConv1d
+
+
+class TestPITShrinking(unittest.TestCase):
+    """Test the progressive physical shrinking of PIT models"""
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.tc_resnet_config = {
+            "input_channels": 6,
+            "output_size": 12,
+            "num_channels": [24, 36, 36, 48, 48, 72, 72],
+            "kernel_size": 9,
+            "dropout": 0.5,
+            "grad_clip": -1,
+            "use_bias": True,
+            "use_dilation": True,
+            "avg_pool": True,
+        }
+
+    @staticmethod
+    def _mask_randomly(pit_net: PIT, names=('alpha', 'beta', 'gamma'), p: float = 0.4):
+        """Zeroes a random fraction of the selected NAS parameters"""
+        with torch.no_grad():
+            for name, param in pit_net.named_nas_parameters():
+                if any(n in name for n in names):
+                    param.mul_((torch.rand_like(param) > p).float())
+
+    def _check_equivalence(self, pit_net: PIT, x: torch.Tensor, **kwargs) -> PITShrinker:
+        """Shrinks a model and checks that its outputs, summary and (discrete) cost are
+        unchanged"""
+        pit_net.eval()
+        with torch.no_grad():
+            ref = pit_net(x)
+        summary = pit_net.summary()
+        cost = pit_net.cost
+        n_params = sum(p.numel() for p in pit_net.parameters())
+        shrinker = PITShrinker(pit_net, patience=1)
+        self.assertTrue(shrinker.step(**kwargs), "Model not shrunk")
+        with torch.no_grad():
+            out = pit_net(x)
+        self.assertTrue(torch.allclose(out, ref, atol=1e-5), "Different outputs after shrink")
+        self.assertEqual(pit_net.summary(), summary, "Different architecture after shrink")
+        if pit_net.discrete_cost:
+            # the continuous relaxation of the time masks is re-initialized on shrunk kernels
+            self.assertTrue(torch.allclose(pit_net.cost, cost), "Different cost after shrink")
+        self.assertLess(sum(p.numel() for p in pit_net.parameters()), n_params,
+                        "Parameters not removed")
+        return shrinker
+
+    def test_shrink_channels(self):
+        """Test that masked channels are removed, also with shared masks and flatten"""
+        for nn_ut, shape in ((TCResNet14(self.tc_resnet_config), (6, 50)),
+                             (SimpleNN(), (3, 40))):
+            pit_net = PIT(nn_ut, input_shape=shape)
+            self._mask_randomly(pit_net, ('alpha',))
+            self._check_equivalence(pit_net, torch.rand((8,) + shape))
+            for _, _, layer in pit_net._unique_leaf_modules:
+                if isinstance(layer, PITConv1d):
+                    self.assertEqual(layer.out_channels, layer.out_features_opt,
+                                     "Masked channels not removed")
+                    self.assertEqual(layer.in_channels, layer.in_features_opt,
+                                     "Masked input channels not removed")
+
+    def test_shrink_channels_depthwise(self):
+        """Test that masked channels are removed from depthwise convolutions"""
+        nn_ut = DSCNN()
+        pit_net = PIT(nn_ut, input_shape=nn_ut.input_shape)
+        self._mask_randomly(pit_net, ('alpha',))
+        self._check_equivalence(pit_net, torch.rand((4,) + nn_ut.input_shape))
+        dw = cast(nn.Conv2d, pit_net.seed.depthwise1)
+        self.assertEqual(dw.groups, dw.out_channels, "Wrong groups after shrink")
+        self.assertEqual(dw.weight.shape[1], 1, "Wrong weights shape after shrink")
+
+    def test_shrink_channel_groups(self):
+        """Test that grouped channel masks are shrunk by whole groups"""
+        nn_ut = TCResNet14(self.tc_resnet_config)
+        pit_net = PIT(nn_ut, input_shape=(6, 50), features_group_size=4)
+        self._mask_randomly(pit_net, ('alpha',))
+        self._check_equivalence(pit_net, torch.rand((8, 6, 50)))
+        for _, _, layer in pit_net._unique_leaf_modules:
+            if isinstance(layer, PITConv1d):
+                fm = layer.out_features_masker
+                self.assertEqual(fm.out_channels, layer.out_channels, "Wrong masker size")
+                self.assertEqual(fm.alpha.numel(), fm.n_groups, "Wrong n. of groups")
+                self.assertEqual(fm.theta.numel(), layer.out_channels, "Wrong mask size")
+                self.assertEqual(layer.out_channels % 4, 0, "Partial group removed")
+
+    def test_shrink_time(self):
+        """Test that masked timesteps and dilation taps are removed from Conv1d layers"""
+        pit_net = PIT(TCResNet14(self.tc_resnet_config), input_shape=(6, 50), discrete_cost=True)
+        self._mask_randomly(pit_net, ('beta', 'gamma'))
+        self._check_equivalence(pit_net, torch.rand((8, 6, 50)))
+        shrunk = 0
+        for _, _, layer in pit_net._unique_leaf_modules:
+            # kernels whose kept taps are not equally spaced are not shrunk
+            if isinstance(layer, PITConv1d) and layer.time_padding is not None:
+                self.assertEqual(layer.kernel_size, layer.kernel_size_opt,
+                                 "Wrong kernel size after shrink")
+                self.assertEqual(layer.timestep_masker.beta.numel(), layer.kernel_size[0],
+                                 "Wrong receptive field mask size after shrink")
+                shrunk += 1
+        self.assertGreater(shrunk, 0, "No kernel shrunk")
+
+    def test_patience(self):
+        """Test that only elements masked for `patience` consecutive steps are removed"""
+        nn_ut = ToySequentialConv1d()
+        pit_net = PIT(nn_ut, input_shape=nn_ut.input_shape)
+        conv0 = cast(PITConv1d, pit_net.seed.conv0)
+        shrinker = PITShrinker(pit_net, patience=3)
+        with torch.no_grad():
+            conv0.out_features_masker.alpha[:2] = 0.
+        self.assertFalse(shrinker.step())
+        with torch.no_grad():
+            # reactivating a channel resets its count
+            conv0.out_features_masker.alpha[1] = 1.
+        self.assertFalse(shrinker.step())
+        with torch.no_grad():
+            conv0.out_features_masker.alpha[1] = 0.
+        self.assertTrue(shrinker.step())
+        self.assertEqual(conv0.out_channels, 9, "Wrong number of channels removed")
+        self.assertFalse(shrinker.step())
+        self.assertTrue(shrinker.step())
+        self.assertEqual(conv0.out_channels, 8, "Wrong number of channels removed")
+
+    def test_blocked_masks(self):
+        """Test that channels feeding a layer excluded from the NAS are never removed"""
+        nn_ut = SimpleNN()
+        pit_net = PIT(nn_ut, input_shape=nn_ut.input_shape, exclude_names=('fc',))
+        self._mask_randomly(pit_net, ('alpha',))
+        conv0 = cast(PITConv1d, pit_net.seed.conv0)
+        conv1 = cast(PITConv1d, pit_net.seed.conv1)
+        PITShrinker(pit_net, patience=1).step()
+        self.assertLess(conv0.out_channels, 32, "Channels not removed")
+        self.assertEqual(conv1.out_channels, 57, "Channels removed before an excluded layer")
+
+    def test_optimizer_state(self):
+        """Test that the optimizer state is resized consistently, and training can continue"""
+        pit_net = PIT(TCResNet14(self.tc_resnet_config), input_shape=(6, 50))
+        optimizer = torch.optim.Adam(pit_net.parameters())
+        x = torch.rand((8, 6, 50))
+        loss = pit_net(x).sum() + 1e-6 * pit_net.cost
+        loss.backward()
+        optimizer.step()
+        self._mask_randomly(pit_net)
+        PITShrinker(pit_net, patience=1).step(optimizer)
+        params = set(pit_net.parameters())
+        opt_params = set(p for g in optimizer.param_groups for p in g['params'])
+        self.assertEqual(params, opt_params, "Optimizer not updated")
+        for p, state in optimizer.state.items():
+            self.assertIn(p, params)
+            self.assertEqual(state['exp_avg'].shape, p.shape, "Wrong optimizer state shape")
+        # the old loss graph is still alive here
+        pit_net.train()
+        loss = pit_net(x).sum() + 1e-6 * pit_net.cost
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+    def test_export_after_shrink(self):
+        """Test that shrunk Conv1d layers are exported with an equivalent padding"""
+        nn_ut = ToySequentialConv1d()
+        pit_net = PIT(nn_ut, input_shape=nn_ut.input_shape, discrete_cost=True)
+        conv1 = cast(PITConv1d, pit_net.seed.conv1)
+        with torch.no_grad():
+            # receptive field 7, dilation 2
+            conv1.timestep_masker.beta[:2] = 0.
+            conv1.dilation_masker.gamma[0] = 0.
+        x = torch.rand((4,) + nn_ut.input_shape)
+        self._check_equivalence(pit_net, x)
+        self.assertEqual(conv1.kernel_size, (4,))
+        self.assertEqual(conv1.dilation, (2,))
+        # further mask the new receptive field
+        with torch.no_grad():
+            conv1.timestep_masker.beta[0] = 0.
+        exported = pit_net.export()
+        self.assertTrue(torch.allclose(exported(x), pit_net(x), atol=1e-5),
+                        "Different outputs after export")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,131 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2022 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Fabio Eterno <fabio.eterno@polito.it>                             *
+# *----------------------------------------------------------------------------*
+import copy
+import unittest
+import torch
+from plinio.methods import PIT
+from plinio.methods.pit.nn import PITConv1d, PITConv2d
+from unit_test.models import TCResNet14, DSCNN
+
+
+class TestPITSparse(unittest.TestCase):
+    """Test the sparse forward path of PIT convolutional layers"""
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.tc_resnet_config = {
+            "input_channels": 6,
+            "output_size": 12,
+            "num_channels": [24, 36, 36, 48, 48, 72, 72],
+            "kernel_size": 9,
+            "dropout": 0.,
+            "grad_clip": -1,
+            "use_bias": True,
+            "use_dilation": True,
+            "avg_pool": True,
+        }
+
+    @staticmethod
+    def _mask_randomly(pit_net: PIT, names=('alpha',), p: float = 0.7):
+        """Zeroes a random fraction of the selected NAS parameters"""
+        with torch.no_grad():
+            for name, param in pit_net.named_nas_parameters():
+                if any(n in name for n in names):
+                    param.mul_((torch.rand_like(param) > p).float())
+
+    def _run_both(self, pit_net: PIT, x: torch.Tensor):
+        """Runs a forward and backward step with the dense and sparse paths, returning the
+        outputs, the gradients and the buffers obtained with each of them"""
+        res = []
+        for threshold in (0., 1.):
+            net = copy.deepcopy(pit_net)
+            net.sparse_threshold = threshold
+            torch.manual_seed(1)
+            y = net(x)
+            loss = torch.sum(y ** 2) + net.cost
+            loss.backward()
+            grads = {n: p.grad for n, p in net.named_parameters() if p.grad is not None}
+            buffers = dict(net.named_buffers())
+            res.append((y, grads, buffers))
+        return res
+
+    def test_sparse_search(self):
+        """Test that the sparse path matches the dense one, also in gradients to the masks"""
+        for fold_bn in (False, True):
+            for nn_ut, shape in ((TCResNet14(self.tc_resnet_config), (6, 50)),
+                                 (DSCNN(), (1, 49, 10))):
+                pit_net = PIT(nn_ut, input_shape=shape, fold_bn=fold_bn)
+                self._mask_randomly(pit_net)
+                pit_net.train()
+                (y0, g0, b0), (y1, g1, b1) = self._run_both(pit_net, torch.rand((8,) + shape))
+                self.assertTrue(torch.allclose(y0, y1, atol=1e-5), "Different outputs")
+                for n in g0:
+                    self.assertTrue(torch.allclose(g0[n], g1[n], atol=1e-4),
+                                    f"Different gradient for {n}")
+                for n in b0:
+                    self.assertTrue(torch.allclose(b0[n].float(), b1[n].float(), atol=1e-5),
+                                    f"Different buffer {n}")
+
+    def test_sparse_frozen(self):
+        """Test the sparse path with frozen masks, where also time-steps are skipped and the
+        running statistics of masked channels are not updated"""
+        pit_net = PIT(TCResNet14(self.tc_resnet_config), input_shape=(6, 50))
+        self._mask_randomly(pit_net)
+        with torch.no_grad():
+            for name, param in pit_net.named_nas_parameters():
+                if 'beta' in name:
+                    # keep the most recent half of the receptive field
+                    param[:param.numel() // 2] = 0.
+        pit_net.train_net_only()
+        pit_net.train()
+        conv = pit_net.seed.get_submodule('tcn.network.0.tcn1')
+        self.assertIsInstance(conv, PITConv1d)
+        self.assertIsNotNone(conv._active_taps(conv.time_mask), "Time-steps not skipped")
+        (y0, g0, b0), (y1, g1, b1) = self._run_both(pit_net, torch.rand((8, 6, 50)))
+        self.assertTrue(torch.allclose(y0, y1, atol=1e-5), "Different outputs")
+        for n in g0:
+            self.assertTrue(torch.allclose(g0[n], g1[n], atol=1e-4), f"Different gradient for {n}")
+        ref = dict(pit_net.named_buffers())
+        active = conv.features_mask.bool()
+        for n in ('running_mean', 'running_var'):
+            name = 'seed.tcn.network.0.tcn1.bn.' + n
+            self.assertTrue(torch.allclose(b0[name][active], b1[name][active], atol=1e-5),
+                            "Different statistics for active channels")
+            self.assertTrue(torch.equal(b1[name][~active], ref[name][~active]),
+                            "Statistics of masked channels updated")
+
+    def test_sparse_threshold(self):
+        """Test that the sparse path is selected based on the fraction of active channels"""
+        pit_net = PIT(DSCNN(), input_shape=(1, 49, 10))
+        conv = pit_net.seed.get_submodule('conv1')
+        self.assertIsInstance(conv, PITConv2d)
+        with torch.no_grad():
+            conv.out_features_masker.alpha[:-conv.out_channels // 4] = 0.
+        self.assertFalse(conv._use_sparse(conv.features_mask), "Sparse path enabled by default")
+        pit_net.sparse_threshold = 0.5
+        self.assertTrue(conv._use_sparse(conv.features_mask), "Dense path with sparse mask")
+        with torch.no_grad():
+            conv.out_features_masker.alpha.fill_(1.)
+        self.assertFalse(conv._use_sparse(conv.features_mask), "Sparse path with dense mask")
+        pit_net.sparse_threshold = 0.
+        self.assertFalse(conv._use_sparse(conv.features_mask), "Sparse path not disabled")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -99,6 +99,22 @@ class TestSuperNet(unittest.TestCase):
         exp_cost = exp_cost * 64 * 64
         self.assertEqual(cost, exp_cost)
 
+    def test_pitsn_cost_spec_swap(self):
+        """Test that the branch costs cached by the combiners are dropped when the cost
+        specification changes
+        """
+        model = StandardSNModule()
+        sn_model = SuperNet(model, cost=params, input_shape=(32, 64, 64))
+        combiners = [layer for _, _, layer in sn_model._unique_leaf_modules
+                     if isinstance(layer, SuperNetCombiner)]
+        for i in range(5):
+            sn_model.cost_specification = ops if i % 2 else params
+            cost = sn_model.get_cost()
+            for c in combiners:
+                self.assertLessEqual(len(c._branch_costs), 1)
+        exp_cost = ((1+2) * (3*3*32+1)*32 + (5*5*32+1)*32 + 0) / 4
+        self.assertEqual(cost, exp_cost)
+
     def test_kws_pitsn_target_modules(self):
         """Test that the number of SNModules found is correct
         """
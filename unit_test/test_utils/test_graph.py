@@ -17,8 +17,11 @@
 # * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
 # *----------------------------------------------------------------------------*
 import unittest
+import torch
 from torch.fx import symbolic_trace
-from unit_test.models import SimpleNN
+from plinio.graph.annotation import propagate_annotation
+from plinio.graph.index import GraphIndex
+from unit_test.models import SimpleNN, ToyMultiPath1
 
 
 class TestGraph(unittest.TestCase):
@@ -30,6 +33,61 @@ class TestGraph(unittest.TestCase):
         fx_graph = symbolic_trace(nn_ut).graph
         pass
 
+    def test_graph_index(self):
+        """checks that the adjacency index matches the fx graph edges"""
+        g = symbolic_trace(ToyMultiPath1()).graph
+        index = GraphIndex(g)
+        self.assertEqual(len(index), len(g.nodes))
+        for n in g.nodes:
+            self.assertEqual(index.predecessors(n), n.all_input_nodes)
+            self.assertEqual(set(index.successors(n)), set(n.users))
+            for p in n.all_input_nodes:
+                self.assertLess(index.position[p], index.position[n])
+
+    def test_graph_index_traversals(self):
+        """checks the BFS and weakly connected components traversals of the adjacency index"""
+        def forward(x):
+            a = torch.relu(x)
+            b = torch.sigmoid(x)
+            c = a + b
+            return torch.tanh(c)
+
+        g = symbolic_trace(forward).graph
+        index = GraphIndex(g)
+        nodes = {n.name: n for n in g.nodes}
+        self.assertEqual([n.name for n in index.bfs([nodes['x']])],
+                         ['x', 'relu', 'sigmoid', 'add', 'tanh', 'output'])
+        self.assertEqual([n.name for n in index.bfs([nodes['output']], reverse=True)],
+                         ['output', 'tanh', 'add', 'relu', 'sigmoid', 'x'])
+        self.assertEqual(len(index.weakly_connected_components()), 1)
+        comps = index.weakly_connected_components(lambda n: n.name == 'add',
+                                                  exclude=[nodes['output']])
+        self.assertEqual([[n.name for n in c] for c in comps],
+                         [['x', 'relu', 'sigmoid'], ['add', 'tanh']])
+
+    def test_propagate_annotation(self):
+        """checks that the topological annotation pass visits all nodes reachable from the
+        inputs, after their predecessors, and stops at nodes with no annotation"""
+        def forward(x):
+            y = torch.relu(x)
+            s = y.size(1)
+            z = y + x
+            return z * s
+
+        g = symbolic_trace(forward).graph
+        depth = {}
+
+        def rule(n):
+            if n.target == 'size':
+                return None
+            depth[n.name] = 1 + max([depth[i.name] for i in n.all_input_nodes], default=-1)
+            return depth[n.name]
+
+        propagate_annotation(g, 'depth', rule)
+        res = {n.name: n.meta.get('depth') for n in g.nodes}
+        self.assertEqual(res, {'x': 0, 'relu': 1, 'size': None, 'add': 2, 'mul': None,
+                               'output': None})
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,57 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+import subprocess
+import sys
+import unittest
+from plinio.cost import CostSpec
+
+
+class TestLazy(unittest.TestCase):
+    """Class to test the lazy loading of plinio sub-packages"""
+
+    def _run(self, code: str) -> str:
+        return subprocess.run([sys.executable, '-c', code], check=True, capture_output=True,
+                              text=True).stdout.strip()
+
+    def test_lazy_package_import(self):
+        """Checks that importing the sub-packages does not load their heavy dependencies"""
+        out = self._run("import sys, plinio, plinio.methods, plinio.cost; "
+                        "print('torch' in sys.modules)")
+        self.assertEqual(out, 'False')
+        # exporters need torch, but onnx only when actually exporting
+        out = self._run("import sys; "
+                        "from plinio.methods.mps.quant.backends.match import MATCHExporter; "
+                        "print('onnx' in sys.modules)")
+        self.assertEqual(out, 'False')
+
+    def test_lazy_attributes(self):
+        """Checks that lazily loaded objects shadow the homonymous sub-modules, as with
+        eager imports"""
+        import plinio.cost.params_bit  # noqa: F401
+        self.assertIsInstance(plinio.cost.params_bit, CostSpec)
+        from plinio.cost import ops, params_bit
+        self.assertIsInstance(ops, CostSpec)
+        self.assertIsInstance(params_bit, CostSpec)
+        self.assertIn('peak_memory', dir(plinio.cost))
+        with self.assertRaises(AttributeError):
+            plinio.cost.not_a_cost_model
+
+
+if __name__ == '__main__':
+    unittest.main()
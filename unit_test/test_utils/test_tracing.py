@@ -0,0 +1,135 @@
+# *----------------------------------------------------------------------------*
+# * Copyright (C) 2024 Politecnico di Torino, Italy                            *
+# * SPDX-License-Identifier: Apache-2.0                                        *
+# *                                                                            *
+# * Licensed under the Apache License, Version 2.0 (the "License");            *
+# * you may not use this file except in compliance with the License.           *
+# * You may obtain a copy of the License at                                    *
+# *                                                                            *
+# * http://www.apache.org/licenses/LICENSE-2.0                                 *
+# *                                                                            *
+# * Unless required by applicable law or agreed to in writing, software        *
+# * distributed under the License is distributed on an "AS IS" BASIS,          *
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.   *
+# * See the License for the specific language governing permissions and        *
+# * limitations under the License.                                             *
+# *                                                                            *
+# * Author:  Daniele Jahier Pagliari <daniele.jahier@polito.it>                *
+# *----------------------------------------------------------------------------*
+import unittest
+import torch
+import torch.fx as fx
+from plinio.graph import tracing
+from plinio.graph.tracing import trace_and_annotate, clear_trace_cache, materialize_input
+from plinio.methods import PIT
+from unit_test.models import SimpleNN, SimpleNN2D, DSCNN
+
+
+class _ActBlock(torch.nn.Module):
+    """Module whose structure differs only in a function-valued attribute"""
+    def __init__(self, act):
+        super().__init__()
+        self.conv = torch.nn.Conv1d(3, 8, (3,))
+        self.act = act
+        self.input_shape = (3, 16)
+
+    def forward(self, x):
+        return self.act(self.conv(x))
+
+
+class TestTracing(unittest.TestCase):
+    """Class to test the cached tracing and shape annotation utility"""
+
+    def setUp(self):
+        clear_trace_cache()
+
+    def test_cache_hit(self):
+        """Checks that tracing the same architecture twice returns equivalent graphs, each
+        owned by a different GraphModule"""
+        x = torch.rand((1,) + tuple(SimpleNN().input_shape))
+        m1 = trace_and_annotate(SimpleNN(), x, fx.Tracer)
+        self.assertEqual(len(tracing._trace_cache), 1)
+        m2 = trace_and_annotate(SimpleNN(), x, fx.Tracer)
+        self.assertEqual(len(tracing._trace_cache), 1)
+        self.assertIsNot(m1.graph, m2.graph)
+        self.assertEqual(m1.code, m2.code)
+        for n1, n2 in zip(m1.graph.nodes, m2.graph.nodes):
+            self.assertEqual(n1.meta['tensor_meta'].shape, n2.meta['tensor_meta'].shape)
+
+    def test_cache_miss(self):
+        """Checks that changing the input shape or the model structure invalidates the key"""
+        nn_ut = SimpleNN()
+        x = torch.rand((1,) + tuple(nn_ut.input_shape))
+        trace_and_annotate(nn_ut, x, fx.Tracer)
+        trace_and_annotate(nn_ut, torch.rand((2,) + tuple(nn_ut.input_shape)), fx.Tracer)
+        self.assertEqual(len(tracing._trace_cache), 2)
+        nn_ut.conv0 = torch.nn.Conv1d(3, 32, (5,), padding='same')
+        trace_and_annotate(nn_ut, x, fx.Tracer)
+        self.assertEqual(len(tracing._trace_cache), 3)
+        clear_trace_cache()
+        self.assertEqual(len(tracing._trace_cache), 0)
+
+    def test_function_attribute(self):
+        """Checks that models differing only in a function-valued attribute do not share the
+        same cached graph"""
+        x = torch.rand((1, 3, 16))
+        m_relu = trace_and_annotate(_ActBlock(torch.relu), x, fx.Tracer)
+        m_sigm = trace_and_annotate(_ActBlock(torch.sigmoid), x, fx.Tracer)
+        self.assertEqual(len(tracing._trace_cache), 2)
+        self.assertNotEqual(m_relu.code, m_sigm.code)
+        torch.manual_seed(0)
+        nn_ut = _ActBlock(torch.sigmoid)
+        pit_net = PIT(nn_ut, input_example=x)
+        self.assertTrue(torch.allclose(pit_net(x), nn_ut(x)))
+        # unhashable attributes disable caching
+        clear_trace_cache()
+        nn_ut.extra = {'x': [{}]}
+        nn_ut.extra_set = {1, 2}
+        trace_and_annotate(nn_ut, x, fx.Tracer)
+        self.assertEqual(len(tracing._trace_cache), 1)
+        nn_ut.unhashable = bytearray(2)
+        trace_and_annotate(nn_ut, x, fx.Tracer)
+        self.assertEqual(len(tracing._trace_cache), 1)
+
+    def test_repeated_export(self):
+        """Checks that repeated exports of a PIT model hit the cache and are identical"""
+        nn_ut = DSCNN()
+        pit_net = PIT(nn_ut, input_shape=nn_ut.input_shape)
+        exp1 = pit_net.export()
+        n_cached = len(tracing._trace_cache)
+        exp2 = pit_net.export()
+        self.assertEqual(len(tracing._trace_cache), n_cached)
+        self.assertEqual(exp1.code, exp2.code)
+        x = torch.rand((1,) + tuple(nn_ut.input_shape))
+        self.assertTrue(torch.allclose(exp1(x), exp2(x)))
+
+    def test_meta_shape_propagation(self):
+        """Checks that shape propagation on meta tensors produces the same annotations
+        obtained with real inputs"""
+        for nn_ut in (SimpleNN(), SimpleNN2D(), DSCNN()):
+            shape = (1,) + tuple(nn_ut.input_shape)
+            real = trace_and_annotate(nn_ut, torch.rand(shape), fx.Tracer)
+            clear_trace_cache()
+            meta = trace_and_annotate(nn_ut, torch.empty(shape, device='meta'), fx.Tracer)
+            for n1, n2 in zip(real.graph.nodes, meta.graph.nodes):
+                self.assertEqual(n1.meta.get('tensor_meta'), n2.meta.get('tensor_meta'))
+            for t in meta.parameters():
+                self.assertFalse(t.is_meta)
+
+    def test_input_shape_is_meta(self):
+        """Checks that DNAS models built from an input shape use meta tensors for tracing,
+        and materialize them only when an actual forward pass is needed"""
+        nn_ut = DSCNN()
+        pit_net = PIT(nn_ut, input_shape=nn_ut.input_shape)
+        self.assertTrue(pit_net._input_example.is_meta)
+        x = pit_net._dummy_input()
+        self.assertFalse(x.is_meta)
+        self.assertEqual(x.shape, (1,) + tuple(nn_ut.input_shape))
+        self.assertEqual(pit_net(x).shape, (1, 12))
+        y = materialize_input((x, torch.empty(3, device='meta')))
+        self.assertIs(y[0], x)
+        self.assertFalse(y[1].is_meta)
+
+
+if __name__ == '__main__':
+    unittest.main()